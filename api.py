@@ -1,39 +1,118 @@
-from flask import Flask, jsonify, send_from_directory, request, abort
-from database import get_connection, init_db, get_dishes, get_user_role, add_order, get_new_orders, update_order_status, validate_promo, use_promo, get_all_promocodes, create_promo, add_user, set_user_role_by_username
-from config import WEB_APP_URL, CRYPTOBOT_TOKEN, BOT_TOKEN
+from flask import Flask, Blueprint, current_app, g, jsonify, send_from_directory, request, abort, Response, stream_with_context, redirect
+from database import get_connection, get_dishes, get_user_role, get_new_orders, update_order_status, validate_promo, use_promo, get_all_promocodes, create_promo, add_user, set_user_role_by_username, get_user_orders, get_promotions, mark_write, get_orders_table_stats, mark_order_paid, get_sales_stats, export_orders, export_dishes, export_promocodes, create_broadcast, get_broadcasts, get_broadcast, set_broadcast_status, BROADCAST_ACTIONS, update_orders_status, get_admin_orders, get_order_changes, save_order_delivery, shard_restaurant_ids, restaurants_in_shard, warm_up_pools, check_database, get_replica_status, get_admin_restaurants, SCHEMA_VERSION, OutOfStock
+from config import WEB_APP_URL, ORDER_STREAM_URL, RESTAURANTS, DEFAULT_RESTAURANT_ID, API_WARM_UP, GEOCODE_PRELOAD
+from webapp_auth import verify_init_data
 from werkzeug.utils import secure_filename
-import os, json
+import os, json, csv, io
 import logging
-import requests
-import hmac
-import hashlib
-from datetime import datetime
-from aiogram import Bot
+import threading
+import time
+from functools import wraps
+from rate_limit import limiter
+from menu_sync import parse_catalogue, process_images, sync_menu, MenuSyncError
+from order_ingest import add_order
+from search import search_dishes, dish_index, invalidate as invalidate_search
+from inventory import annotate_menu, unavailable_items, stock_levels, set_stock, invalidate as invalidate_stock
+from logs import setup_logging, set_log_context, new_request_id, log_event
+from geo import delivery_quote, DELIVERY_ERRORS, geocode_cache, courier_grid, courier_grid_status
+from tenants import current_restaurant_id, set_current_restaurant, use_restaurant, parse_restaurant_id, public_restaurant
+from datetime import datetime, date
+from decimal import Decimal
+
+# Запуск: gunicorn 'api:create_app()' (воркеры — gunicorn.conf.py). Импорт модуля ничего не делает
+# с базой и не тянет aiogram: схему создаёт `python manage.py migrate` перед выкладкой, а соединения и кеши воркер
+# прогревает в фоне после старта. Балансировщик проверяет /readyz (200 — воркер прогрет,
+# базы доступны и схема актуальна), /healthz — только что процесс жив.
+# С gunicorn --preload фоновый прогрев не переживёт fork: create_app должен вызываться в воркере.
 
 # config
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXT = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Пауза перед повторным прогревом, если база ещё недоступна, сек
+WARM_UP_RETRY = 5
 
-app = Flask(__name__, static_folder='web_app', static_url_path='/web_app')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-app.logger.setLevel(logging.INFO)
-
-init_db()
+bp = Blueprint('api', __name__)
 
 # Crypto Pay API endpoint (оставляем для будущего, но не используем)
 CRYPTO_PAY_API_URL = "https://pay.crypto.bot/createInvoice"
 
-# Инициализация бота для уведомлений (только для доступа к токену, уведомления через bot.py)
-bot = Bot(token=BOT_TOKEN)
-
-@app.route('/api/dishes', methods=['GET', 'POST'])
+@bp.before_request
+def start_request():
+    # Id запроса для логов: от балансировщика или новый; возвращается в X-Request-Id
+    g.request_id = (request.headers.get('X-Request-Id') or new_request_id())[:64]
+    set_log_context(request_id=g.request_id)
+
+@bp.after_request
+def add_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-Id'] = g.request_id
+    return response
+
+@bp.before_request
+def resolve_restaurant():
+    """Филиал запроса: заголовок X-Restaurant-Id или параметр restaurant_id, по умолчанию — основной."""
+    value = request.headers.get('X-Restaurant-Id') or request.args.get('restaurant_id')
+    restaurant_id = parse_restaurant_id(value) if value else DEFAULT_RESTAURANT_ID
+    if restaurant_id is None:
+        return jsonify({'status': 'error', 'error': 'Unknown restaurant'}), 400
+    # Выставляем на каждый запрос: поток воркера обслуживает запросы разных филиалов
+    set_current_restaurant(restaurant_id)
+
+def admin_required(view):
+    """Пускает только администраторов филиала запроса. Пользователь берётся из подписанного initData
+    мини-аппа (заголовок X-Telegram-Init-Data) и доступен во view как g.admin_id.
+    Админ, закреплённый за филиалами (manage.py admin_branch), в чужой филиал не попадёт."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = verify_init_data(request.headers.get('X-Telegram-Init-Data'))
+        if user is None:
+            return jsonify({'status': 'error', 'error': 'Unauthorized'}), 401
+        telegram_id = user['id']
+        if 'admin' not in get_user_role(telegram_id):
+            return jsonify({'status': 'error', 'error': 'Admins only'}), 403
+        restaurants = get_admin_restaurants(telegram_id)
+        if restaurants is None:
+            return jsonify({'status': 'error', 'error': 'Database error'}), 500
+        if restaurants and current_restaurant_id() not in restaurants:
+            return jsonify({'status': 'error', 'error': 'No access to this restaurant'}), 403
+        g.admin_id = telegram_id
+        return view(*args, **kwargs)
+    return wrapper
+
+def client_ip():
+    return f"ip:{request.remote_addr}"
+
+def payment_user():
+    user_id = ((request.get_json(silent=True) or {}).get('orderData') or {}).get('user', {}).get('id')
+    return f"tg:{user_id}" if user_id else None
+
+def rate_limited(scope, *key_funcs):
+    """429 с Retry-After, если по любому из ключей (IP, пользователь) исчерпан лимит scope."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            for key_func in key_funcs:
+                key = key_func()
+                retry_after = limiter.hit(scope, key) if key else 0
+                if retry_after:
+                    log_event(current_app.logger, 'rate_limit.exceeded', logging.WARNING, scope=scope, key=key)
+                    response = jsonify({'status': 'error', 'error': 'Too many requests'})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(int(retry_after) + 1)
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@bp.route('/api/restaurants', methods=['GET'])
+def api_restaurants():
+    return jsonify([public_restaurant(restaurant_id) for restaurant_id in RESTAURANTS])
+
+@bp.route('/api/dishes', methods=['GET', 'POST'])
 def api_dishes():
     if request.method == 'GET':
         cat = request.args.get('category')
-        dishes = get_dishes(cat)
+        dishes = annotate_menu(get_dishes(cat))
         return jsonify(dishes)
 
     # POST: add dish with multipart/form-data (image optional)
@@ -59,26 +138,37 @@ def api_dishes():
                 return jsonify({"status": "error", "error": "invalid image extension"}), 400
             base, ext = os.path.splitext(filename)
             fname = f"{base}_{int(os.times().system)}{ext}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], fname)
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], fname)
             image.save(filepath)
             image_path = f"/uploads/{fname}"
 
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO dishes (name, price, description, image_url, category)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (name, price_val, description, image_path, category))
+            INSERT INTO dishes (name, price, description, image_url, category, restaurant_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (name, price_val, description, image_path, category, current_restaurant_id()))
         conn.commit()
         cursor.close()
         conn.close()
+        mark_write('menu')
+        invalidate_search(current_restaurant_id())
         return jsonify({"status": "success"})
 
-@app.route('/api/dishes/<int:dish_id>', methods=['DELETE'])
+@bp.route('/api/dishes/search', methods=['GET'])
+def api_dishes_search():
+    """Поиск по меню: ?q=<запрос>&category=&limit= — по префиксам слов и с опечатками."""
+    query = request.args.get('q', '').strip()[:100]
+    if not query:
+        return jsonify({'status': 'error', 'error': 'q required'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify(annotate_menu(search_dishes(query, limit, request.args.get('category') or None)))
+
+@bp.route('/api/dishes/<int:dish_id>', methods=['DELETE'])
 def api_dish_delete(dish_id):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT image_url FROM dishes WHERE id = %s", (dish_id,))
+    cursor.execute("SELECT image_url FROM dishes WHERE id = %s AND restaurant_id = %s", (dish_id, current_restaurant_id()))
     r = cursor.fetchone()
     if r and r[0]:
         img_path = r[0]
@@ -88,19 +178,58 @@ def api_dish_delete(dish_id):
                 try:
                     os.remove(fs_path)
                 except Exception as e:
-                    app.logger.warning(f"Failed to remove file {fs_path}: {e}")
-    cursor.execute("DELETE FROM dishes WHERE id = %s", (dish_id,))
+                    current_app.logger.warning(f"Failed to remove file {fs_path}: {e}")
+    cursor.execute("DELETE FROM dishes WHERE id = %s AND restaurant_id = %s", (dish_id, current_restaurant_id()))
     conn.commit()
     cursor.close()
     conn.close()
+    mark_write('menu')
+    invalidate_search(current_restaurant_id())
     return jsonify({"status": "success"})
 
-@app.route('/api/user/<int:telegram_id>', methods=['GET'])
+@bp.route('/api/admin/menu/sync', methods=['POST'])
+@admin_required
+def api_menu_sync():
+    """Меню филиала из каталога: multipart (catalogue — CSV/JSON, images — картинки, на которые
+    он ссылается по имени файла) или JSON {"dishes": [...]}. Флаги delete_missing и dry_run."""
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        content, fmt, images = json.dumps(data.get('dishes', data)), 'json', {}
+        flags = data
+    else:
+        catalogue = request.files.get('catalogue')
+        if not catalogue or not catalogue.filename:
+            return jsonify({'status': 'error', 'error': 'catalogue file required'}), 400
+        content = catalogue.read()
+        fmt = request.form.get('format') or catalogue.filename.rsplit('.', 1)[-1].lower()
+        images = {secure_filename(f.filename): f for f in request.files.getlist('images') if f.filename}
+        flags = request.form
+    flag = lambda name: str(flags.get(name, '')).lower() in ('1', 'true', 'on')
+
+    def read_image(ref):
+        image = images.get(secure_filename(os.path.basename(ref)))
+        return image.read() if image else None
+
+    try:
+        rows = parse_catalogue(content, fmt)
+        process_images(rows, read_image, current_app.config['UPLOAD_FOLDER'], write=not flag('dry_run'))
+    except MenuSyncError as e:
+        return jsonify({'status': 'error', 'error': 'Invalid catalogue', 'errors': e.errors}), 400
+    summary = sync_menu(rows, delete_missing=flag('delete_missing'), dry_run=flag('dry_run'))
+    if summary is None:
+        return jsonify({'status': 'error', 'error': 'Menu sync failed'}), 500
+    if not summary['dry_run']:
+        invalidate_search(current_restaurant_id())
+        current_app.logger.info(f"Menu synced by admin {g.admin_id}: "
+                                f"+{len(summary['inserted'])} ~{len(summary['updated'])} -{len(summary['deleted'])}")
+    return jsonify({'status': 'success', **summary})
+
+@bp.route('/api/user/<int:telegram_id>', methods=['GET'])
 def api_user(telegram_id):
     role = get_user_role(telegram_id)
     return jsonify({"telegram_id": telegram_id, "role": role})
 
-@app.route('/api/add_admin', methods=['POST'])
+@bp.route('/api/add_admin', methods=['POST'])
 def add_admin():
     data = request.json or {}
     username = data.get('username')
@@ -122,7 +251,8 @@ def add_admin():
     conn.close()
     return jsonify({"status": "success"})
 
-@app.route('/api/create_payment', methods=['POST'])
+@bp.route('/api/create_payment', methods=['POST'])
+@rate_limited('payment', client_ip, payment_user)
 def create_payment():
     data = request.json or {}
     payment_data = data.get('payment', {})
@@ -132,7 +262,7 @@ def create_payment():
     order_id = payment_data.get('order_id', str(int(datetime.now().timestamp())))
     description = payment_data.get('description', 'Заказ в La Tavola')
     user_id = order_data.get('user', {}).get('id', 0)
-    dishes = json.dumps(order_data.get('dishes', []))
+    dishes = order_data.get('dishes', [])
     address = order_data.get('address', '')
     total = float(order_data.get('total', 0.0))  # Получаем total из orderData
     order_type = order_data.get('orderType', 'delivery')  # Получаем orderType из orderData
@@ -145,136 +275,143 @@ def create_payment():
     except (ValueError, TypeError):
         return jsonify({"status": "error", "error": "amount must be a valid number"}), 400
 
+    quote = delivery_quote(address) if order_type == 'delivery' else None
+    if quote and quote['result'] in DELIVERY_ERRORS:
+        return jsonify({"status": "error", "error": DELIVERY_ERRORS[quote['result']]}), 400
+
+    # Стоп-лист по снимку остатков — до счёта; окончательно остаток проверит add_order
+    short = unavailable_items(dishes)
+    if short:
+        return jsonify({"status": "error", "error": "Out of stock", "items": short}), 409
+
     # Заглушка: эмуляция успешного ответа от Crypto Pay
-    app.logger.info(f"Processing payment (stub) with payload: {data}")
     response = {
         'status': 'success',
         'payment_url': f'https://example.com/pay/{order_id}',  # Фиктивный URL
         'invoice_id': f'invoice_{order_id}'
     }
-    app.logger.info(f"Crypto Pay API response (stub): {response}")
 
     # Сохраняем заказ в базе данных
-    order_id = add_order(user_id, dishes, address, total, order_type, payment_provider='stub_payment', payment_id=response['invoice_id'])
+    try:
+        order_id = add_order(user_id, dishes, address, total, order_type, payment_provider='stub_payment', payment_id=response['invoice_id'])
+    except OutOfStock as e:
+        # Снимок устарел: другой процесс успел продать остаток
+        invalidate_stock(current_restaurant_id())
+        return jsonify({"status": "error", "error": "Out of stock", "items": e.items}), 409
     if order_id:
-        app.logger.info(f"Order {order_id} created successfully")
+        log_event(current_app.logger, 'payment.created', order_id=order_id, invoice_id=response['invoice_id'],
+                  user_id=user_id, amount=amount_fiat, total=total, order_type=order_type, items=len(dishes),
+                  payment_url=response['payment_url'])
+        if quote and quote['result'] == 'ok':
+            save_order_delivery(order_id, quote)
     else:
         return jsonify({"status": "error", "error": "Failed to create order"}), 500
 
     return jsonify(response), 200
 
-@app.route('/api/callback', methods=['POST'])
+@bp.route('/api/callback', methods=['POST'])
 def crypto_callback():
     data = request.get_json()
-    app.logger.info(f"Received callback (stub): {data}")
-
-    # Проверка подписи (для совместимости, но без реальной проверки)
+    # Проверка подписи (для совместимости, но без реальной проверки); платёжные поля маскируются в логе
     signature = request.headers.get('crypto-pay-api-signature')
-    if signature:
-        app.logger.info("Signature received, skipping validation in stub mode")
-    else:
-        app.logger.info("No signature in callback, proceeding in stub mode")
+    log_event(current_app.logger, 'payment.callback', signed=bool(signature), payload=data)
 
     if not data or 'update_type' not in data or data['update_type'] != 'invoice_paid':
-        app.logger.warning("Invalid callback data (stub mode)")
+        current_app.logger.warning("Invalid callback data (stub mode)")
         return jsonify({"status": "error", "error": "Invalid callback data"}), 400
 
     invoice = data.get('payload')
     if not invoice or 'invoice_id' not in invoice or 'status' not in invoice:
-        app.logger.warning("Missing invoice details (stub mode)")
+        current_app.logger.warning("Missing invoice details (stub mode)")
         return jsonify({"status": "error", "error": "Missing invoice details"}), 400
 
     invoice_id = invoice['invoice_id']
     status = invoice['status']
 
     if status == 'paid':
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE orders SET status = 'paid' WHERE payment_id = %s", (invoice_id,))
-        if cursor.rowcount > 0:
-            # Получаем user_id из заказа для уведомления (записываем в лог, уведомление через bot.py)
-            cursor.execute("SELECT user_id FROM orders WHERE payment_id = %s", (invoice_id,))
-            user_id = cursor.fetchone()
+        # Статус меняется вместе с агрегатами продаж (user_id — для уведомления через bot.py).
+        # Платёжка не знает филиал: ищем счёт во всех филиалах
+        user_id = None
+        for restaurant_id in RESTAURANTS:
+            with use_restaurant(restaurant_id):
+                user_id = mark_order_paid(invoice_id)
             if user_id:
-                app.logger.info(f"Order {invoice_id} marked as paid (stub), user {user_id[0]} should be notified via bot.py")
-            else:
-                app.logger.warning(f"No user_id found for invoice_id: {invoice_id}")
+                break
+        if user_id:
+            current_app.logger.info(f"Order {invoice_id} marked as paid (stub), user {user_id} should be notified via bot.py")
         else:
-            app.logger.warning(f"No order found for invoice_id: {invoice_id}")
-        conn.commit()
-        cursor.close()
-        conn.close()
-        app.logger.info(f"Order {invoice_id} marked as paid (stub)")
+            current_app.logger.warning(f"No unpaid order found for invoice_id: {invoice_id}")
+        current_app.logger.info(f"Order {invoice_id} marked as paid (stub)")
         return jsonify({"status": "success"})
     else:
-        app.logger.warning(f"Order {invoice_id} status: {status} (stub)")
+        current_app.logger.warning(f"Order {invoice_id} status: {status} (stub)")
         return jsonify({"status": "pending"})
 
-@app.route('/api/promotions', methods=['GET', 'POST', 'DELETE'])
+@bp.route('/api/promotions', methods=['GET', 'POST', 'DELETE'])
 def api_promotions():
+    if request.method == 'GET':
+        return jsonify(get_promotions())
     conn = get_connection()
     cursor = conn.cursor()
-    if request.method == 'GET':
-        cursor.execute("SELECT id, text, image_url FROM promotions")
-        rows = cursor.fetchall()
-        promotions = [{'id': r[0], 'text': r[1], 'image_url': r[2]} for r in rows]
-        cursor.close()
-        conn.close()
-        return jsonify(promotions)
-    elif request.method == 'POST':
+    if request.method == 'POST':
         data = request.json
-        cursor.execute("INSERT INTO promotions (text, image_url) VALUES (%s, %s)", (data.get('text'), data.get('image_url', '')))
+        cursor.execute("INSERT INTO promotions (text, image_url, restaurant_id) VALUES (%s, %s, %s)",
+                       (data.get('text'), data.get('image_url', ''), current_restaurant_id()))
         conn.commit()
         cursor.close()
         conn.close()
+        mark_write('promotions')
         return jsonify({"status": "success"})
     elif request.method == 'DELETE':
         data = request.json
-        cursor.execute("DELETE FROM promotions WHERE id = %s", (data.get('id'),))
+        cursor.execute("DELETE FROM promotions WHERE id = %s AND restaurant_id = %s", (data.get('id'), current_restaurant_id()))
         conn.commit()
         cursor.close()
         conn.close()
+        mark_write('promotions')
         return jsonify({"status": "success"})
 
-@app.route('/api/user/<int:telegram_id>/orders', methods=['GET'])
+@bp.route('/api/user/<int:telegram_id>/orders', methods=['GET'])
 def api_user_orders(telegram_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, created_at, total, status FROM orders WHERE user_id = %s", (telegram_id,))
-    rows = cursor.fetchall()
-    orders = [
-        {
-            'id': r[0],
-            'created_at': r[1].isoformat() if r[1] else None,
-            'total': float(r[2]) if r[2] is not None else 0.0,
-            'status': r[3] if r[3] else 'unknown'
-        } for r in rows
-    ]
-    cursor.close()
-    conn.close()
-    return jsonify(orders)
-
-@app.route('/api/validate_promo', methods=['POST'])
+    return jsonify(get_user_orders(telegram_id))
+
+@bp.route('/api/user/<int:telegram_id>/orders/stream', methods=['GET'])
+def api_user_orders_stream(telegram_id):
+    # Поток держит order_stream.py (aiohttp), а не воркер Flask; обычно прокси отправляет
+    # этот путь прямо туда, а без прокси перенаправляем на ORDER_STREAM_URL
+    if not ORDER_STREAM_URL:
+        return jsonify({'status': 'error', 'error': 'Order stream is not configured'}), 503
+    return redirect(f"{ORDER_STREAM_URL.rstrip('/')}{request.full_path.rstrip('?')}", code=307)
+
+@bp.route('/api/delivery/quote', methods=['POST'])
+@rate_limited('geo', client_ip)
+def api_delivery_quote():
+    address = ((request.json or {}).get('address') or '').strip()
+    if not address:
+        return jsonify({'status': 'error', 'error': 'address is required'}), 400
+    quote = delivery_quote(address)
+    quote.pop('courier_id', None)
+    return jsonify({'status': 'success', 'quote': quote})
+
+@bp.route('/api/validate_promo', methods=['POST'])
+@rate_limited('promo', client_ip)
 def validate_promo_api():
     data = request.json or {}
     code = data.get('code', '')
-    app.logger.info(f"Validating promo code: {code}")
     result = validate_promo(code)
     if result['valid']:
-        app.logger.info(f"Promo code {code} is valid, attempting to use")
         if use_promo(code):
-            app.logger.info(f"Promo code {code} applied successfully")
+            log_event(current_app.logger, 'promo.validate', code=code, result='applied', discount=result['discount'])
             return jsonify({'status': 'success', 'discount': result['discount']})
         else:
-            app.logger.warning(f"Failed to use promo code {code}")
+            log_event(current_app.logger, 'promo.use_failed', logging.WARNING, code=code)
             return jsonify({'status': "error", "error": 'Не удалось применить промокод'}), 400
-    app.logger.warning(f"Invalid promo code: {code}")
+    # Перебор промокодов не должен забивать лог: неверные коды пишутся выборочно
+    log_event(current_app.logger, 'promo.validate', code=code, result='invalid')
     return jsonify({'status': "error", "error": 'Неверный или истёкший промокод'}), 400
 
-@app.route('/api/promocodes', methods=['GET', 'POST', 'DELETE'])
+@bp.route('/api/promocodes', methods=['GET', 'POST', 'DELETE'])
 def api_promocodes():
-    conn = get_connection()
-    cursor = conn.cursor()
     if request.method == 'GET':
         promocodes = get_all_promocodes()
         return jsonify(promocodes)
@@ -290,52 +427,299 @@ def api_promocodes():
     elif request.method == 'DELETE':
         data = request.json
         promo_id = data.get('id')
-        cursor.execute("DELETE FROM promo_codes WHERE id = %s", (promo_id,))
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM promo_codes WHERE id = %s AND restaurant_id = %s", (promo_id, current_restaurant_id()))
         conn.commit()
         cursor.close()
         conn.close()
+        mark_write('promocodes')
         return jsonify({'status': 'success'})
-    cursor.close()
-    conn.close()
 
 # Новый эндпоинт для обновления статуса заказа
-@app.route('/api/order/<int:order_id>/status', methods=['POST'])
+ORDER_STATUSES = ['pending', 'accepted', 'cooking', 'on_delivery', 'delivered', 'failed']
+
+@bp.route('/api/order/<int:order_id>/status', methods=['POST'])
+@admin_required
 def update_order_status_endpoint(order_id):
     data = request.json or {}
     new_status = data.get('status')
-    valid_statuses = ['pending', 'accepted', 'cooking', 'on_delivery', 'delivered', 'failed']
-
-    if not new_status or new_status not in valid_statuses:
+    if not new_status or new_status not in ORDER_STATUSES:
         return jsonify({'status': 'error', 'error': 'Invalid or missing status'}), 400
 
-    # Проверка роли пользователя (простая проверка по Telegram ID, можно улучшить с авторизацией)
-    telegram_id = request.headers.get('X-Telegram-Id')  # Предполагаем, что ID передаётся в заголовке
-    if not telegram_id:
-        return jsonify({'status': 'error', 'error': 'Unauthorized'}), 401
-
-    role = get_user_role(int(telegram_id))
-    if 'admin' not in role:
-        return jsonify({'status': 'error', 'error': 'Only admins can update order status'}), 403
-
     if update_order_status(order_id, new_status):
-        app.logger.info(f"Order {order_id} status updated to {new_status} by admin {telegram_id}")
+        current_app.logger.info(f"Order {order_id} status updated to {new_status} by admin {g.admin_id}")
         return jsonify({'status': 'success'})
     return jsonify({'status': 'error', 'error': 'Order not found'}), 404
 
+# Метрики для мониторинга (размер горячей/архивной таблиц заказов)
+@bp.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    return jsonify(get_orders_table_stats())
+
+@bp.route('/api/admin/stats', methods=['GET'])
+@admin_required
+def api_admin_stats():
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 7)
+    stats = get_sales_stats(days, hours)
+    if stats is None:
+        return jsonify({'status': 'error', 'error': 'Stats unavailable'}), 500
+    return jsonify(stats)
+
+@bp.route('/api/admin/orders', methods=['GET'])
+@admin_required
+def api_admin_orders():
+    """Активные заказы с фильтрами: ?status=a,b&type=&courier=&max_age=<мин>&before=<id>&limit="""
+    statuses = [s for s in request.args.get('status', '').split(',') if s] or None
+    if statuses and any(s not in ORDER_STATUSES + ['paid'] for s in statuses):
+        return jsonify({'status': 'error', 'error': 'Invalid status'}), 400
+    result = get_admin_orders(
+        statuses,
+        request.args.get('type') or None,
+        request.args.get('courier', type=int),
+        request.args.get('max_age', type=int),
+        request.args.get('before', type=int),
+        min(max(request.args.get('limit', 50, type=int), 1), 200))
+    if result is None:
+        return jsonify({'status': 'error', 'error': 'Database error'}), 500
+    return jsonify(result)
+
+@bp.route('/api/admin/orders/changes', methods=['GET'])
+@admin_required
+def api_admin_order_changes():
+    """Изменения после курсора из /api/admin/orders (или прошлого ответа): ?since=<cursor>"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'status': 'error', 'error': 'since required'}), 400
+    changes = get_order_changes(since)
+    if changes is None:
+        return jsonify({'status': 'error', 'error': 'Database error'}), 500
+    return jsonify(changes)
+
+@bp.route('/api/admin/orders/status', methods=['POST'])
+@admin_required
+def api_admin_orders_status():
+    """Массовая смена статуса: {"ids": [...], "status": "...", "courier_id": optional}"""
+    data = request.json or {}
+    status = data.get('status')
+    ids = data.get('ids') or []
+    if status not in ORDER_STATUSES:
+        return jsonify({'status': 'error', 'error': 'Invalid or missing status'}), 400
+    if not isinstance(ids, list) or not ids or len(ids) > 500 or not all(isinstance(i, int) for i in ids):
+        return jsonify({'status': 'error', 'error': 'ids must be a list of 1-500 order ids'}), 400
+    updated = update_orders_status(ids, status, data.get('courier_id'))
+    if updated is None:
+        return jsonify({'status': 'error', 'error': 'Database error'}), 500
+    current_app.logger.info(f"Orders {updated} set to {status} by admin {g.admin_id}")
+    updated_set = set(updated)
+    return jsonify({'status': 'success', 'updated': updated, 'skipped': [i for i in ids if i not in updated_set]})
+
+@bp.route('/api/admin/stock', methods=['GET', 'POST'])
+@admin_required
+def api_admin_stock():
+    """GET — остатки отслеживаемых блюд; POST {"items": [{"dish_id", "size", "available"}]}:
+    available — сколько можно продать (0 — стоп-лист, null — снять учёт)."""
+    if request.method == 'GET':
+        invalidate_stock(current_restaurant_id())
+        levels = stock_levels()
+        names = {d['id']: d['name'] for d in get_dishes()}
+        return jsonify([{'dish_id': dish_id, 'size': size or None, 'name': names.get(dish_id), 'available': max(value, 0)}
+                        for (dish_id, size), value in sorted(levels.items())])
+
+    items = (request.json or {}).get('items')
+    if not isinstance(items, list) or not items or len(items) > 1000:
+        return jsonify({'status': 'error', 'error': 'items must be a list of 1-1000 entries'}), 400
+    try:
+        parsed = [(int(i['dish_id']), str(i.get('size') or ''),
+                   None if i.get('available') is None else int(i['available'])) for i in items]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'error': 'each item needs dish_id and integer available'}), 400
+    applied = set_stock(parsed)
+    if applied is None:
+        return jsonify({'status': 'error', 'error': 'Database error'}), 500
+    current_app.logger.info(f"Stock of {applied} items set by admin {g.admin_id}")
+    return jsonify({'status': 'success', 'updated': applied})
+
+@bp.route('/api/admin/broadcasts', methods=['GET', 'POST'])
+@admin_required
+def api_broadcasts():
+    if request.method == 'GET':
+        return jsonify(get_broadcasts())
+    data = request.json or {}
+    text = (data.get('text') or '').strip()
+    image_url = data.get('image_url')
+    if data.get('promotion_id'):
+        # Рассылка существующей акции из баннера WebApp
+        promo = next((p for p in get_promotions() if p['id'] == int(data['promotion_id'])), None)
+        if not promo:
+            return jsonify({'status': 'error', 'error': 'Promotion not found'}), 404
+        text = text or promo['text']
+        image_url = image_url or promo['image_url']
+    if not text:
+        return jsonify({'status': 'error', 'error': 'Text required'}), 400
+    broadcast_id = create_broadcast(text, image_url, g.admin_id)
+    if not broadcast_id:
+        return jsonify({'status': 'error', 'error': 'Failed to create broadcast'}), 500
+    current_app.logger.info(f"Broadcast {broadcast_id} queued by admin {g.admin_id}")
+    return jsonify({'status': 'success', 'id': broadcast_id})
+
+@bp.route('/api/admin/broadcasts/<int:broadcast_id>', methods=['GET'])
+@admin_required
+def api_broadcast(broadcast_id):
+    broadcast = get_broadcast(broadcast_id)
+    if not broadcast:
+        return jsonify({'status': 'error', 'error': 'Broadcast not found'}), 404
+    return jsonify(broadcast)
+
+@bp.route('/api/admin/broadcasts/<int:broadcast_id>/<action>', methods=['POST'])
+@admin_required
+def api_broadcast_action(broadcast_id, action):
+    if action not in BROADCAST_ACTIONS:
+        return jsonify({'status': 'error', 'error': 'Unknown action'}), 400
+    if set_broadcast_status(broadcast_id, action):
+        return jsonify({'status': 'success'})
+    return jsonify({'status': 'error', 'error': 'Broadcast not found or action not allowed in its status'}), 409
+
+# Выгрузки: строки идут из серверного курсора прямо в ответ кусками, память не зависит от объёма
+EXPORT_CHUNK_ROWS = 500
+
+def _export_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _csv_chunks(columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_export_value(v) for v in row])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def _jsonl_chunks(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({c: _export_value(v) for c, v in zip(columns, row)}, ensure_ascii=False))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export_response(name, export):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'status': 'error', 'error': 'format must be csv or jsonl'}), 400
+    columns, rows = export
+    chunks = _csv_chunks(columns, rows) if fmt == 'csv' else _jsonl_chunks(columns, rows)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"{name}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.route('/api/admin/export/orders', methods=['GET'])
+@admin_required
+def api_export_orders():
+    try:
+        date_from = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        date_to = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'from/to must be YYYY-MM-DD'}), 400
+    status = request.args.get('status') or None
+    return export_response('orders', export_orders(date_from, date_to, status))
+
+@bp.route('/api/admin/export/dishes', methods=['GET'])
+@admin_required
+def api_export_dishes():
+    return export_response('dishes', export_dishes())
+
+@bp.route('/api/admin/export/promocodes', methods=['GET'])
+@admin_required
+def api_export_promocodes():
+    return export_response('promocodes', export_promocodes())
+
 # serve uploaded files
-@app.route('/uploads/<path:filename>')
+@bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
 # Serve web app files (index.html, assets etc.)
-@app.route('/web_app/<path:filename>')
+@bp.route('/web_app/<path:filename>')
 def serve_webapp(filename):
     return send_from_directory('web_app', filename)
 
-@app.route('/')
+@bp.route('/')
 def index():
     return "API for Restaurant WebApp"
 
+def warm_up(app):
+    """Прогрев воркера: соединения со всеми базами, сетки курьеров и поисковые индексы меню
+    филиалов, свежие адреса геокодера. Пока база недоступна, повторяется каждые WARM_UP_RETRY секунд."""
+    state = app.extensions['readiness']
+    while True:
+        try:
+            warm_up_pools()
+            for restaurant_id in RESTAURANTS:
+                with use_restaurant(restaurant_id):
+                    courier_grid()
+                    dish_index()
+            preloaded = geocode_cache.preload(GEOCODE_PRELOAD)
+            break
+        except Exception as e:
+            state['error'] = str(e)
+            app.logger.warning(f"Прогрев воркера не удался, повтор через {WARM_UP_RETRY} с: {e}")
+            time.sleep(WARM_UP_RETRY)
+    state.update(warm=True, error=None, warm_up_seconds=round(time.monotonic() - state['started_at'], 3))
+    app.logger.info(f"Воркер прогрет за {state['warm_up_seconds']} с, адресов в кеше: {preloaded}")
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    state = current_app.extensions['readiness']
+    return jsonify({'status': 'ok', 'warm': state['warm'], 'uptime': round(time.monotonic() - state['started_at'], 1)})
+
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    state = current_app.extensions['readiness']
+    databases = []
+    for restaurant_id in shard_restaurant_ids():
+        with use_restaurant(restaurant_id):
+            databases.append({'restaurants': restaurants_in_shard(restaurant_id), **check_database()})
+    ready = state['warm'] and all(db['ok'] for db in databases)
+    response = jsonify({
+        'status': 'ready' if ready else ('starting' if not state['warm'] else 'unavailable'),
+        'warm': state['warm'],
+        'warm_up_seconds': state['warm_up_seconds'],
+        'error': state['error'],
+        'schema_version': SCHEMA_VERSION,
+        'databases': databases,
+        'replica': get_replica_status(),
+        'caches': {'geocode': geocode_cache.status(), 'courier_grids': courier_grid_status()},
+    })
+    response.status_code = 200 if ready else 503
+    return response
+
+def create_app(warm=API_WARM_UP):
+    # До создания Flask: иначе app.logger получит свой обработчик, пишущий в stderr синхронно
+    setup_logging()
+    app = Flask(__name__, static_folder='web_app', static_url_path='/web_app')
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.logger.setLevel(logging.INFO)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    app.register_blueprint(bp)
+    app.extensions['readiness'] = {'warm': not warm, 'started_at': time.monotonic(), 'warm_up_seconds': None, 'error': None}
+    if warm:
+        threading.Thread(target=warm_up, args=(app,), name='warm-up', daemon=True).start()
+    return app
+
 if __name__ == '__main__':
-    # production: use gunicorn/uvicorn
-    app.run(host='0.0.0.0', port=5000, debug=True)  # Включили debug для лучшей отладки
\ No newline at end of file
+    # production: gunicorn 'api:create_app()' (после python manage.py migrate)
+    from database import init_db
+    init_db()
+    create_app().run(host='0.0.0.0', port=5000, debug=True)  # Включили debug для лучшей отладки
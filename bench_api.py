@@ -0,0 +1,361 @@
+# Нагрузочный бенчмарк HTTP API (api.py).
+#
+# Поднимает api.py в этом же процессе (или бьёт по уже запущенному серверу через --url),
+# наполняет базу реалистичными данными и гоняет конкурентную нагрузку по эндпоинтам
+# /api/dishes, /api/create_payment, /api/validate_promo и /api/user/<id>/orders.
+# База берётся из config.py (MYSQL_*), поэтому запускайте против отдельной тестовой БД,
+# например MySQL в контейнере:
+#
+#   docker run -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=bench -e MYSQL_DATABASE=restaurant_db mysql:8
+#   MYSQL_USER=root MYSQL_PASSWORD=bench python bench_api.py --orders 1000000 --output bench.json
+#   python bench_api.py --no-seed --compare bench.json
+#
+# Без сервера MySQL можно гонять на встроенной базе: DB_BACKEND=sqlite SQLITE_PATH=bench.db
+#
+# Результат — таблица с пропускной способностью и перцентилями задержки по каждому эндпоинту
+# и JSON (--output), который удобно сравнивать между коммитами (--compare).
+import argparse
+import json
+import logging
+import math
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+logger = logging.getLogger('bench_api')
+
+BENCH_PROVIDER = 'bench'          # payment_provider у сидированных заказов
+BENCH_PROMO_PREFIX = 'BENCH'      # префикс сидированных промокодов
+BENCH_USER_BASE = 9_000_000_000   # telegram_id сидированных пользователей
+CATEGORIES = ['burgers', 'pizza', 'drinks', 'sushi', 'salads', 'desserts', 'coffee']
+STATUSES = ['pending', 'accepted', 'cooking', 'on_delivery', 'delivered', 'failed']
+
+DEFAULT_MIX = 'dishes=50,user_orders=30,validate_promo=15,create_payment=5'
+
+
+# ---------- Наполнение базы ----------
+
+def seed(args):
+    from database import get_connection, init_db
+    init_db()
+    conn = get_connection()
+    cursor = conn.cursor()
+    rnd = random.Random(args.seed_value)
+    try:
+        if args.reset:
+            logger.info("Удаляем данные предыдущего прогона")
+            cursor.execute("DELETE FROM orders WHERE payment_provider = %s", (BENCH_PROVIDER,))
+            cursor.execute("DELETE FROM promo_codes WHERE code LIKE %s", (BENCH_PROMO_PREFIX + '%',))
+            cursor.execute("DELETE FROM dishes WHERE description = %s", ('bench',))
+            cursor.execute("DELETE FROM users WHERE telegram_id >= %s", (BENCH_USER_BASE,))
+            conn.commit()
+        else:
+            cursor.execute("SELECT COUNT(*) FROM dishes WHERE description = %s", ('bench',))
+            if cursor.fetchone()[0]:
+                logger.info("Данные бенчмарка уже есть — сидирование пропущено (используйте --reset)")
+                return
+
+        logger.info(f"Сидируем {args.users} пользователей, {args.dishes} блюд, {args.promos} промокодов")
+        _insert_batched(conn, cursor,
+                        "INSERT INTO users (telegram_id, username, role) VALUES (%s, %s, %s)",
+                        ((BENCH_USER_BASE + i, f"bench_user_{i}", 'user') for i in range(args.users)),
+                        args.batch_size)
+        _insert_batched(conn, cursor,
+                        "INSERT INTO dishes (name, price, description, image_url, category, sizes) VALUES (%s, %s, %s, %s, %s, %s)",
+                        ((f"Блюдо {i}", round(rnd.uniform(3, 60), 2), 'bench', '', rnd.choice(CATEGORIES), None)
+                         for i in range(args.dishes)),
+                        args.batch_size)
+        expires = (datetime.now() + timedelta(days=365)).date()
+        _insert_batched(conn, cursor,
+                        "INSERT INTO promo_codes (code, discount, max_uses, expires_at) VALUES (%s, %s, %s, %s)",
+                        ((f"{BENCH_PROMO_PREFIX}{i:06d}", rnd.choice([5, 10, 15, 20]), 10 ** 9, expires)
+                         for i in range(args.promos)),
+                        args.batch_size)
+
+        cursor.execute("SELECT id, name, price FROM dishes WHERE description = %s", ('bench',))
+        menu = cursor.fetchall()
+        logger.info(f"Сидируем {args.orders} заказов")
+        started = time.perf_counter()
+        _insert_batched(conn, cursor,
+                        """INSERT INTO orders (user_id, dishes, address, total, status, order_type, payment_provider, payment_id, created_at)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                        (_random_order(rnd, menu, args.users) for _ in range(args.orders)),
+                        args.batch_size)
+        logger.info(f"Заказы записаны за {time.perf_counter() - started:.1f} c")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _random_order(rnd, menu, users):
+    items = []
+    for dish_id, name, price in rnd.sample(menu, k=min(len(menu), rnd.randint(1, 4))):
+        items.append({'id': dish_id, 'name': name, 'qty': rnd.randint(1, 3), 'price': float(price)})
+    total = round(sum(i['price'] * i['qty'] for i in items), 2)
+    created_at = datetime.now() - timedelta(minutes=rnd.randint(0, 60 * 24 * 365))
+    return (BENCH_USER_BASE + rnd.randrange(users), json.dumps(items, ensure_ascii=False),
+            'ул. Советская, 1, Гомель', total, rnd.choice(STATUSES), rnd.choice(['delivery', 'restaurant']),
+            BENCH_PROVIDER, None, created_at)
+
+
+def _insert_batched(conn, cursor, sql, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            conn.commit()
+            batch = []
+    if batch:
+        cursor.executemany(sql, batch)
+        conn.commit()
+
+
+# ---------- Сервер ----------
+
+def start_server(host, port):
+    from werkzeug.serving import make_server
+    import api
+    # Логи запросов werkzeug сильно искажают результаты
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server(host, port, api.create_app(warm=False), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# ---------- Нагрузка ----------
+
+class Workload:
+    def __init__(self, base_url, users, promos, menu, rnd):
+        self.base_url = base_url.rstrip('/')
+        self.users = users
+        self.promos = promos
+        self.menu = menu
+        self.rnd = rnd
+
+    def dishes(self, session):
+        params = {'category': self.rnd.choice(CATEGORIES)} if self.rnd.random() < 0.5 else None
+        return session.get(f"{self.base_url}/api/dishes", params=params)
+
+    def user_orders(self, session):
+        user_id = BENCH_USER_BASE + self.rnd.randrange(self.users)
+        return session.get(f"{self.base_url}/api/user/{user_id}/orders")
+
+    def validate_promo(self, session):
+        # Четверть запросов — несуществующие коды (перебор)
+        if self.promos and self.rnd.random() < 0.75:
+            code = f"{BENCH_PROMO_PREFIX}{self.rnd.randrange(self.promos):06d}"
+        else:
+            code = f"NOPE{self.rnd.randrange(10 ** 6)}"
+        return session.post(f"{self.base_url}/api/validate_promo", json={'code': code})
+
+    def create_payment(self, session):
+        items = [{'id': d[0], 'name': d[1], 'qty': self.rnd.randint(1, 3), 'price': float(d[2])}
+                 for d in self.rnd.sample(self.menu, k=min(len(self.menu), self.rnd.randint(1, 4)))]
+        total = round(sum(i['price'] * i['qty'] for i in items), 2) or 1.0
+        user_id = BENCH_USER_BASE + self.rnd.randrange(self.users)
+        payload = {
+            'payment': {'amount': f"{total:.2f}", 'order_id': str(time.time_ns()), 'description': 'bench'},
+            'orderData': {'dishes': items, 'address': 'ул. Советская, 1, Гомель', 'total': f"{total:.2f}",
+                          'orderType': 'delivery', 'user': {'id': user_id}},
+        }
+        return session.post(f"{self.base_url}/api/create_payment", json=payload)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if not hasattr(Workload, name):
+            raise SystemExit(f"Неизвестный эндпоинт в --mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run_load(args, menu):
+    weights = parse_mix(args.mix)
+    names = list(weights)
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    warmup_until = time.perf_counter() + args.warmup
+    deadline = warmup_until + args.duration
+
+    def worker(worker_id):
+        rnd = random.Random(args.seed_value + worker_id)
+        workload = Workload(args.url, args.users, args.promos, menu, rnd)
+        session = requests.Session()
+        local_samples = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            name = rnd.choices(names, weights=[weights[n] for n in names])[0]
+            started = time.perf_counter()
+            try:
+                resp = getattr(workload, name)(session)
+                ok = resp.status_code < 500
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if started < warmup_until:
+                continue
+            local_samples[name].append(elapsed)
+            if not ok:
+                local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(local_samples[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {name: summarize(samples[name], errors[name], args.duration) for name in names}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(values, errors, duration):
+    values = sorted(values)
+    ms = [v * 1000 for v in values]
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / duration, 2) if duration else 0.0,
+        'latency_ms': {
+            'mean': round(sum(ms) / len(ms), 3) if ms else 0.0,
+            'p50': round(percentile(ms, 50), 3),
+            'p90': round(percentile(ms, 90), 3),
+            'p95': round(percentile(ms, 95), 3),
+            'p99': round(percentile(ms, 99), 3),
+            'max': round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+
+# ---------- Отчёт ----------
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    header = f"{'endpoint':<16}{'req':>9}{'err':>7}{'rps':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        lat = r['latency_ms']
+        print(f"{name:<16}{r['requests']:>9}{r['errors']:>7}{r['throughput_rps']:>10.1f}"
+              f"{lat['p50']:>10.2f}{lat['p90']:>10.2f}{lat['p99']:>10.2f}{lat['max']:>10.2f}")
+        if baseline and name in baseline:
+            base = baseline[name]
+            print(f"{'  vs baseline':<32}{_delta(r['throughput_rps'], base['throughput_rps']):>10}"
+                  f"{_delta(lat['p50'], base['latency_ms']['p50']):>10}"
+                  f"{_delta(lat['p90'], base['latency_ms']['p90']):>10}"
+                  f"{_delta(lat['p99'], base['latency_ms']['p99']):>10}")
+
+
+def _delta(current, base):
+    if not base:
+        return '—'
+    return f"{(current - base) / base * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк api.py")
+    parser.add_argument('--url', help="Бить по уже запущенному серверу вместо встроенного")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--no-seed', dest='do_seed', action='store_false', help="Не наполнять базу")
+    parser.add_argument('--reset', action='store_true', help="Удалить данные прошлого прогона перед сидированием")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--dishes', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--promos', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help="Длительность замера, сек")
+    parser.add_argument('--warmup', type=float, default=3.0, help="Прогрев без учёта в статистике, сек")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Веса эндпоинтов, например dishes=50,user_orders=30")
+    parser.add_argument('--seed-value', type=int, default=42, help="Seed генератора случайных чисел")
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="Не отключать ограничение частоты встроенного сервера (все запросы идут с одного IP)")
+    parser.add_argument('--output', help="Записать результаты в JSON")
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.do_seed:
+        seed(args)
+
+    if not args.rate_limits:
+        from rate_limit import limiter
+        limiter.limits = {scope: (10 ** 9, 1) for scope in limiter.limits}
+
+    server = None
+    if not args.url:
+        server = start_server(args.host, args.port)
+        args.url = f"http://{args.host}:{args.port}"
+
+    from database import get_connection
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name, price FROM dishes LIMIT 500")
+    menu = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    if not menu:
+        raise SystemExit("В базе нет блюд — запустите без --no-seed")
+
+    logger.info(f"Нагрузка: {args.concurrency} потоков, {args.duration} c, mix={args.mix}, url={args.url}")
+    results = run_load(args, menu)
+    if server:
+        server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f).get('results')
+    print_report(results, baseline)
+
+    if args.output:
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'url': args.url,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'mix': args.mix,
+                'dataset': {'users': args.users, 'dishes': args.dishes, 'orders': args.orders, 'promos': args.promos},
+            },
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
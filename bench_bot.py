@@ -0,0 +1,381 @@
+# Бенчмарк пропускной способности бота (bot.py).
+#
+# Синтетические Update (заказы из WebApp, команды курьеров, шторм /start, мусорные сообщения)
+# подаются в Dispatcher через feed_update. Вместо настоящей сессии Telegram подставляется
+# FakeSession: она записывает все отправки, имитирует сетевую задержку и ответы 429.
+# База берётся из config.py — запускайте против отдельной тестовой БД.
+#
+#   python bench_bot.py --scenario order --couriers 1,10,100 --updates 500 --output bench_bot.json
+#
+# Отчёт: updates/sec, перцентили задержки обработчика, обращения к БД и отправки на один update.
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage
+
+from bench_api import git_commit, percentile
+
+logger = logging.getLogger('bench_bot')
+
+BENCH_USER_BASE = 8_000_000_000   # telegram_id клиентов
+BENCH_COURIER_BASE = 8_100_000_000  # telegram_id курьеров
+BENCH_USER_LIMIT = 8_200_000_000
+SCENARIOS = ['start', 'order', 'courier', 'unknown']
+
+
+# ---------- Фейковая сессия Telegram ----------
+
+class FakeSession(BaseSession):
+    """Сессия без сети: считает вызовы API, имитирует задержку и flood-control (429)."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, retry_after=1, seed=0):
+        super().__init__()
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = 0
+        self.recipients = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        delay = self.latency + (self.rnd.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.rate_429 and self.rnd.random() < self.rate_429:
+            self.throttled += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests: retry later",
+                                     retry_after=self.retry_after)
+        self.calls[type(method).__name__] += 1
+        if isinstance(method, (SendMessage, EditMessageText)):
+            chat_id = getattr(method, 'chat_id', None) or 0
+            self.recipients[chat_id] += 1
+            self._message_id += 1
+            return types.Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=types.Chat(id=int(chat_id), type='private'),
+                text=method.text,
+            )
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    @property
+    def sends(self):
+        return sum(self.calls.values())
+
+
+# ---------- Подсчёт обращений к БД ----------
+
+class DBCounter:
+    def __init__(self):
+        self.connections = 0
+        self.queries = 0
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.queries += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter.queries += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class _CountingConnection:
+    def __init__(self, conn, counter):
+        self._conn = conn
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._conn.cursor(*args, **kwargs), self._counter)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def install_db_counter(bot_module):
+    import database
+    counter = DBCounter()
+    original = database.get_connection
+
+    def counting_get_connection(*args, **kwargs):
+        conn = original(*args, **kwargs)
+        if conn is None:
+            return None
+        counter.connections += 1
+        return _CountingConnection(conn, counter)
+
+    # bot.py импортирует get_connection по имени, поэтому подменяем в обоих модулях
+    database.get_connection = counting_get_connection
+    if hasattr(bot_module, 'get_connection'):
+        bot_module.get_connection = counting_get_connection
+    return counter
+
+
+# ---------- Данные ----------
+
+def seed(couriers):
+    from database import get_connection, init_db
+    init_db()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM users WHERE telegram_id >= %s AND telegram_id < %s",
+                       (BENCH_COURIER_BASE, BENCH_USER_LIMIT))
+        cursor.executemany(
+            "INSERT INTO users (telegram_id, username, role) VALUES (%s, %s, %s)",
+            [(BENCH_COURIER_BASE + i, f"bench_courier_{i}", json.dumps(['user', 'courier'])) for i in range(couriers)])
+        conn.commit()
+        cursor.execute("SELECT id, name, price FROM dishes LIMIT 50")
+        menu = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    return menu or [(1, 'Маргарита', 15.0), (2, 'Цезарь', 12.5), (3, 'Капучино', 4.0)]
+
+
+def cleanup():
+    from database import get_connection
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM orders WHERE user_id >= %s AND user_id < %s", (BENCH_USER_BASE, BENCH_USER_LIMIT))
+        cursor.execute("DELETE FROM users WHERE telegram_id >= %s AND telegram_id < %s", (BENCH_USER_BASE, BENCH_USER_LIMIT))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# ---------- Синтетические Update ----------
+
+class UpdateFactory:
+    def __init__(self, menu, couriers, users, rnd):
+        self.menu = menu
+        self.couriers = couriers
+        self.users = users
+        self.rnd = rnd
+        self.update_id = 0
+        self.order_ids = []
+
+    def _message(self, user_id, text=None, web_app_data=None):
+        self.update_id += 1
+        return types.Update(
+            update_id=self.update_id,
+            message=types.Message(
+                message_id=self.update_id,
+                date=datetime.now(),
+                chat=types.Chat(id=user_id, type='private'),
+                from_user=types.User(id=user_id, is_bot=False, first_name='Bench', username=f"bench_{user_id}"),
+                text=text,
+                web_app_data=web_app_data,
+            ),
+        )
+
+    def start(self):
+        return self._message(BENCH_USER_BASE + self.rnd.randrange(self.users), text='/start')
+
+    def unknown(self):
+        return self._message(BENCH_USER_BASE + self.rnd.randrange(self.users), text='привет')
+
+    def order(self):
+        items = [{'id': d[0], 'name': d[1], 'qty': self.rnd.randint(1, 3), 'price': float(d[2])}
+                 for d in self.rnd.sample(self.menu, k=min(len(self.menu), self.rnd.randint(1, 4)))]
+        data = {
+            'dishes': items,
+            'address': 'ул. Советская, 1, Гомель',
+            'total': round(sum(i['price'] * i['qty'] for i in items), 2),
+            'orderType': self.rnd.choice(['delivery', 'restaurant']),
+        }
+        return self._message(BENCH_USER_BASE + self.rnd.randrange(self.users),
+                             web_app_data=types.WebAppData(data=json.dumps(data, ensure_ascii=False),
+                                                           button_text='Заказать'))
+
+    def courier(self):
+        courier_id = BENCH_COURIER_BASE + self.rnd.randrange(max(self.couriers, 1))
+        if not self.order_ids or self.rnd.random() < 0.2:
+            return self._message(courier_id, text='/courier_orders')
+        order_id = self.rnd.choice(self.order_ids)
+        command = self.rnd.choice(['/accept_order', '/start_cooking', '/start_delivery', '/complete_order'])
+        return self._message(courier_id, text=f"{command} {order_id}")
+
+
+def load_order_ids(limit=1000):
+    from database import get_connection
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM orders WHERE user_id >= %s AND user_id < %s ORDER BY id DESC LIMIT %s",
+                       (BENCH_USER_BASE, BENCH_USER_LIMIT, limit))
+        return [r[0] for r in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# ---------- Прогон ----------
+
+async def run_scenario(bot_module, session, db, scenario, args, couriers, menu):
+    rnd = random.Random(args.seed_value)
+    factory = UpdateFactory(menu, couriers, args.users, rnd)
+    if scenario == 'courier':
+        factory.order_ids = load_order_ids()
+    updates = [getattr(factory, scenario)() for _ in range(args.updates)]
+
+    session.calls.clear()
+    session.recipients.clear()
+    session.throttled = 0
+    db.connections = db.queries = 0
+    latencies = []
+    failures = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def feed(update):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await bot_module.dp.feed_update(bot_module.bot, update)
+            except Exception as e:
+                failures[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(u) for u in updates))
+    elapsed = time.perf_counter() - started
+
+    ms = sorted(v * 1000 for v in latencies)
+    n = len(updates)
+    return {
+        'scenario': scenario,
+        'couriers': couriers,
+        'updates': n,
+        'failed': sum(failures.values()),
+        'failures': dict(failures),
+        'updates_per_sec': round(n / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': round(sum(ms) / n, 3) if n else 0.0,
+            'p50': round(percentile(ms, 50), 3),
+            'p90': round(percentile(ms, 90), 3),
+            'p99': round(percentile(ms, 99), 3),
+            'max': round(ms[-1], 3) if ms else 0.0,
+        },
+        'db_connections_per_update': round(db.connections / n, 2) if n else 0.0,
+        'db_queries_per_update': round(db.queries / n, 2) if n else 0.0,
+        'sends_per_update': round(session.sends / n, 2) if n else 0.0,
+        'throttled_429': session.throttled,
+        'api_calls': dict(session.calls),
+    }
+
+
+def print_report(results):
+    header = (f"{'scenario':<10}{'couriers':>9}{'upd/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+              f"{'db conn':>9}{'db q':>7}{'sends':>7}{'429':>6}{'failed':>8}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        lat = r['latency_ms']
+        print(f"{r['scenario']:<10}{r['couriers']:>9}{r['updates_per_sec']:>10.1f}{lat['p50']:>10.2f}{lat['p99']:>10.2f}"
+              f"{r['db_connections_per_update']:>9.2f}{r['db_queries_per_update']:>7.2f}{r['sends_per_update']:>7.2f}"
+              f"{r['throttled_429']:>6}{r['failed']:>8}")
+
+
+async def main_async(args):
+    import bot as bot_module
+
+    if not args.rate_limits:
+        from rate_limit import limiter
+        limiter.limits = {scope: (10 ** 9, 1) for scope in limiter.limits}
+
+    session = FakeSession(args.latency_ms, args.jitter_ms, args.rate_429, seed=args.seed_value)
+    bot_module.bot.session = session
+    db = install_db_counter(bot_module)
+
+    scenarios = args.scenario or SCENARIOS
+    results = []
+    for couriers in args.couriers:
+        menu = seed(couriers)
+        for scenario in scenarios:
+            logger.info(f"Сценарий {scenario}: {args.updates} updates, курьеров {couriers}")
+            results.append(await run_scenario(bot_module, session, db, scenario, args, couriers, menu))
+    if not args.keep_data:
+        cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков bot.py на синтетических Update")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help="Сценарий (можно несколько раз); по умолчанию все")
+    parser.add_argument('--couriers', default='10', help="Число курьеров через запятую, например 1,10,100")
+    parser.add_argument('--users', type=int, default=1000, help="Число различных клиентов")
+    parser.add_argument('--updates', type=int, default=300, help="Update на сценарий")
+    parser.add_argument('--concurrency', type=int, default=32, help="Одновременно обрабатываемых update")
+    parser.add_argument('--latency-ms', type=float, default=30.0, help="Имитируемая задержка Telegram API")
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Доля запросов, получающих 429")
+    parser.add_argument('--seed-value', type=int, default=42)
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="Не отключать анти-флуд (курьеры шлют больше лимита и будут отсекаться)")
+    parser.add_argument('--keep-data', action='store_true', help="Не удалять созданные заказы и пользователей")
+    parser.add_argument('--output', help="Записать результаты в JSON")
+    args = parser.parse_args()
+    args.couriers = [int(c) for c in args.couriers.split(',') if c.strip()]
+
+    logging.basicConfig(level=logging.INFO)
+    # Логи обработчиков на каждый update искажают замер
+    logging.getLogger('bot').setLevel(logging.WARNING)
+    logging.getLogger('database').setLevel(logging.WARNING)
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+
+    results = asyncio.run(main_async(args))
+    print_report(results)
+
+    if args.output:
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'updates': args.updates,
+                'concurrency': args.concurrency,
+                'latency_ms': args.latency_ms,
+                'rate_429': args.rate_429,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
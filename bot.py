@@ -1,20 +1,45 @@
 import asyncio
 import json
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
-from database import init_db, add_user, get_user_role, add_order, get_connection, get_admin_username, add_dish, set_user_username, set_user_role_by_username, create_promo, get_new_orders, get_user_id_by_order_id, update_order_status
-from config import BOT_TOKEN, WEB_APP_URL
+from database import init_db, add_user, get_user_role, get_connection, get_admin_username, add_dish, set_user_username, set_user_role_by_username, create_promo, get_user_id_by_order_id, update_order_status, get_user_by_username, get_courier_ids, get_order_type, get_orders_to_notify, mark_order_notified, get_pickup_orders_to_notify, mark_pickup_notified, mark_write, archive_orders_batch, get_orders_table_stats, mark_user_reachable, get_order_events_cursor, prune_order_events, prune_recent_writes, save_courier_location, save_order_delivery, shard_restaurant_ids, get_order_by_payment_id, expire_unpaid_orders, OutOfStock
+from broadcast import broadcast_worker
+import courier_board
+from middlewares import ThrottlingMiddleware, TenantMiddleware, LogContextMiddleware, InFlightMiddleware
+from logs import setup_logging, log_event
+from geo import delivery_quote, DELIVERY_ERRORS
+from order_ingest import add_order, stop_writers
+from supervisor import runtime
+from inventory import unavailable_items, invalidate as invalidate_stock
+from tenants import use_restaurant, current_restaurant_id, get_restaurant
+from courier_board import COURIER_ACTIONS
+from config import BOT_TOKEN, WEB_APP_URL, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_BATCH_PAUSE, ARCHIVE_INTERVAL, COURIER_BOARD_REFRESH_INTERVAL, RESTAURANTS, CHECKOUT_TTL_MINUTES
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Инициализация бота
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
 dp = Dispatcher()
+# id апдейта — во всех записях лога, сделанных при его обработке
+dp.update.outer_middleware(LogContextMiddleware())
+# При остановке бота начатые обработчики дорабатывают (см. supervisor.py)
+dp.update.outer_middleware(InFlightMiddleware(runtime))
+# Флуд отсекается до хендлеров (и до запросов роли в БД)
+dp.message.outer_middleware(ThrottlingMiddleware())
+dp.callback_query.outer_middleware(ThrottlingMiddleware())
+# Филиал апдейта определяется после отсечения флуда
+tenant_middleware = TenantMiddleware()
+dp.message.outer_middleware(tenant_middleware)
+dp.edited_message.outer_middleware(tenant_middleware)
+dp.callback_query.outer_middleware(tenant_middleware)
+
+def web_app_url():
+    """WebApp открывается сразу в филиале пользователя."""
+    return f"{WEB_APP_URL}{'&' if '?' in WEB_APP_URL else '?'}restaurant_id={current_restaurant_id()}"
 
 # Статусы заказа
 ORDER_STATUSES = ['pending', 'accepted', 'cooking', 'on_delivery', 'delivered', 'failed']
@@ -25,14 +50,17 @@ async def start(message: types.Message):
     username = message.from_user.username or ''
     add_user(message.from_user.id, 'user', username)
     set_user_username(message.from_user.id, username)
+    mark_user_reachable(message.from_user.id)
     role = get_user_role(message.from_user.id)
-    logger.info(f"User {message.from_user.id} logged in with role: {role}")
+    log_event(logger, 'bot.start', user_id=message.from_user.id, role=role)
     if "user" in role:
         keyboard = ReplyKeyboardMarkup(
             resize_keyboard=True,
-            keyboard=[[KeyboardButton(text="Открыть меню", web_app=WebAppInfo(url=WEB_APP_URL))]]
+            keyboard=[[KeyboardButton(text="Открыть меню", web_app=WebAppInfo(url=web_app_url()))]]
         )
-        await message.answer("Добро пожаловать! Откройте меню:", reply_markup=keyboard)
+        restaurant = get_restaurant()
+        await message.answer(f"Добро пожаловать в {restaurant['name']} ({restaurant['address']})! Откройте меню:",
+                             reply_markup=keyboard, parse_mode=None)
     if "courier" in role:
         await message.answer("Привет, курьер! Используй /courier_orders, /accept_order [id], /start_cooking [id], /start_delivery [id], /complete_order [id]")
     if "admin" in role:
@@ -95,6 +123,7 @@ async def add_courier_role(message: types.Message):
         try:
             cursor.execute("UPDATE users SET role = %s WHERE telegram_id = %s", (new_role, telegram_id))
             conn.commit()
+            mark_write(telegram_id)
             await message.answer(f"Роль 'courier' добавлена для пользователя {telegram_id}.")
         except Exception as e:
             logger.error(f"Ошибка обновления роли: {e}")
@@ -115,21 +144,151 @@ async def help_command(message: types.Message):
 
     help_text = (
         "📋 Список команд для курьеров:\n\n"
-        "/courier_orders — Показать список новых заказов с их статусами, адресами и суммами.\n"
+        "/courier_orders — Доска заказов: новые заказы и ваши текущие, с кнопками для смены статуса.\n"
         "/accept_order [id] — Принять заказ с указанным ID. Статус изменится на 'accepted'.\n"
         "/start_cooking [id] — Указать, что заказ с ID начал готовиться. Статус изменится на 'cooking'.\n"
         "/start_delivery [id] — Начать доставку заказа с ID. Статус изменится на 'on_delivery' (только для доставки).\n"
-        "/complete_order [id] — Завершить заказ с ID. Статус изменится на 'delivered'.\n\n"
+        "/complete_order [id] — Завершить заказ с ID. Статус изменится на 'delivered'.\n"
+        "📍 Геопозиция (лучше live location) — по ней клиентам считается время доставки.\n\n"
         "Пример: /accept_order 123\n"
         "Используйте ID из списка заказов для управления."
     )
     await message.answer(help_text)
 
+# Доска курьера
+async def show_board(courier_id, chat_id):
+    """Отправляет новое сообщение с доской; старая доска курьера больше не обновляется."""
+    board = courier_board.Board(chat_id, None)
+    text, markup, _ = courier_board.render_board(courier_id, board)
+    sent = await bot.send_message(chat_id, text, reply_markup=markup, parse_mode=None)
+    board.message_id = sent.message_id
+    board.text = text
+    courier_board.boards[courier_id] = board
+
+async def update_board(courier_id, board):
+    """Перерисовывает доску на месте, если текст изменился."""
+    text, markup, _ = courier_board.render_board(courier_id, board)
+    if text == board.text:
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=board.chat_id, message_id=board.message_id,
+                                    reply_markup=markup, parse_mode=None)
+        board.text = text
+    except TelegramBadRequest as e:
+        if 'not modified' in e.message:
+            board.text = text
+        else:
+            # Сообщение удалено — забываем доску
+            logger.warning(f"Доска курьера {courier_id} недоступна: {e.message}")
+            courier_board.boards.pop(courier_id, None)
+
+async def refresh_boards(restaurant_id=None):
+    """Перерисовывает доски филиала (без restaurant_id — все)."""
+    courier_board.invalidate(restaurant_id)
+    for courier_id, board in list(courier_board.boards.items()):
+        if restaurant_id is None or board.restaurant_id == restaurant_id:
+            with use_restaurant(board.restaurant_id):
+                await update_board(courier_id, board)
+
+async def notify_couriers(text):
+    """Открытые доски филиала обновляются на месте, остальным его курьерам уходит сообщение."""
+    await refresh_boards(current_restaurant_id())
+    for courier_id in get_courier_ids():
+        if courier_id in courier_board.boards:
+            continue
+        try:
+            await bot.send_message(courier_id, text)
+        except Exception as e:
+            logger.error(f"Ошибка отправки курьеру {courier_id}: {e}")
+
+# Команды курьера -> действие доски
+COURIER_COMMANDS = {
+    '/accept_order': 'accept',
+    '/start_cooking': 'cook',
+    '/start_delivery': 'deliver',
+    '/complete_order': 'complete',
+}
+
+async def apply_courier_action(courier_id, order_id, action):
+    """Меняет статус заказа по действию курьера, уведомляет клиента, курьеров и админа.
+    Возвращает ответ курьеру."""
+    status = COURIER_ACTIONS[action][0]
+    order_type = get_order_type(order_id)
+    if action == 'deliver' and order_type != 'delivery':
+        return f"Заказ #{order_id} не является доставкой или уже обработан."
+    if not order_type or not update_order_status(order_id, status, courier_id):
+        return f"Заказ #{order_id} не найден или уже обработан."
+
+    done = 'доставлен' if order_type == 'delivery' else 'готов к самовывозу'
+    client_text = {
+        'accept': f"✅ Ваш заказ #{order_id} принят курьером!",
+        'cook': f"🍳 Ваш заказ #{order_id} готовится!",
+        'deliver': f"🚚 Ваш заказ #{order_id} в доставке!",
+        'complete': f"🎉 Ваш заказ #{order_id} {done}! Спасибо!",
+    }[action]
+    staff_text = {
+        'accept': f"Заказ #{order_id} принят.",
+        'cook': f"Заказ #{order_id} готовится.",
+        'deliver': f"Заказ #{order_id} в доставке.",
+        'complete': f"Заказ #{order_id} {done}.",
+    }[action] + f"\nСтатус: {status}"
+
+    user_id = get_user_id_by_order_id(order_id)
+    if user_id:
+        await bot.send_message(user_id, client_text)
+    await notify_couriers(staff_text)
+    admin_username = get_admin_username()
+    if admin_username:
+        admin = get_user_by_username(admin_username)
+        if admin:
+            await bot.send_message(admin['telegram_id'], staff_text)
+    return staff_text
+
+@dp.callback_query(F.data.startswith('cb:'))
+async def courier_board_callback(callback: types.CallbackQuery):
+    courier_id = callback.from_user.id
+    if "courier" not in get_user_role(courier_id):
+        await callback.answer("Только для курьеров.", show_alert=True)
+        return
+    board = courier_board.boards.get(courier_id)
+    if not board or board.message_id != callback.message.message_id or board.restaurant_id != current_restaurant_id():
+        # Бот перезапускался или нажали на старую доску — делаем её текущей
+        board = courier_board.Board(callback.message.chat.id, callback.message.message_id)
+        courier_board.boards[courier_id] = board
+
+    parts = callback.data.split(':')
+    if parts[1] == 'act':
+        answer = await apply_courier_action(courier_id, int(parts[3]), parts[2])
+        await callback.answer(answer.split('\n')[0])
+        return  # доска уже обновлена в notify_couriers
+    if parts[1] == 'next':
+        _, _, last_id = courier_board.render_board(courier_id, board)
+        board.starts.append(last_id)
+    elif parts[1] == 'prev' and len(board.starts) > 1:
+        board.starts.pop()
+    elif parts[1] == 'refresh':
+        courier_board.invalidate()
+    await update_board(courier_id, board)
+    await callback.answer()
+
+# Live location курьера приходит правками исходного сообщения
+@dp.edited_message(F.location)
+async def courier_live_location(message: types.Message):
+    if "courier" in get_user_role(message.from_user.id):
+        save_courier_location(message.from_user.id, message.location.latitude, message.location.longitude)
+
 # Обработка сообщений
 @dp.message()
 async def handle_message(message: types.Message):
     role = get_user_role(message.from_user.id)
-    logger.info(f"Received message from {message.from_user.id} with role {role}: {message.text}")
+    log_event(logger, 'bot.message', user_id=message.from_user.id, role=role, content_type=message.content_type,
+              text=(message.text or '')[:200])
+
+    # Геопозиция курьера: по ней ищется ближайший свободный курьер для расчёта ETA
+    if message.location and "courier" in role:
+        save_courier_location(message.from_user.id, message.location.latitude, message.location.longitude)
+        await message.answer("📍 Геопозиция обновлена. Для точного ETA можно отправить live location.")
+        return
 
     # Заказы из WebApp
     if message.web_app_data:
@@ -139,37 +298,50 @@ async def handle_message(message: types.Message):
             address = data.get('address', '')
             total = data.get('total', 0.0)
             order_type = data.get('orderType', 'delivery')  # Получаем тип заказа
-            order_id = add_order(message.from_user.id, json.dumps(dishes), address, total, order_type)
+            # Геокодер на промахе кеша ходит в сеть — не блокируем цикл событий
+            quote = await asyncio.to_thread(delivery_quote, address) if order_type == 'delivery' else None
+            if quote and quote['result'] in DELIVERY_ERRORS:
+                await message.answer(f"{DELIVERY_ERRORS[quote['result']]}: {address}", parse_mode=None)
+                return
+            # WebApp уже создал заказ через /api/create_payment (счёт invoice_<order_id>) и зарезервировал
+            # блюда — здесь только подхватываем его. Без order_id (старый клиент) заказ создаёт бот.
+            payment_id = f"invoice_{data['order_id']}" if data.get('order_id') else None
+            short = None
+            if payment_id:
+                existing = await asyncio.to_thread(get_order_by_payment_id, payment_id, message.from_user.id)
+                if not existing:
+                    await message.answer("Заказ не найден: оформите его в приложении ещё раз.")
+                    return
+                order_id = existing[0]
+            else:
+                short = await asyncio.to_thread(unavailable_items, dishes)
+                if not short:
+                    try:
+                        order_id = await asyncio.to_thread(add_order, message.from_user.id, dishes, address, total, order_type)
+                    except OutOfStock as e:
+                        invalidate_stock(current_restaurant_id())
+                        short = e.items
+            if short:
+                names = ", ".join(f"{item['name'] or item['dish_id']} (осталось {item['available']})" for item in short)
+                await message.answer(f"Нет в наличии: {names}. Измените корзину и оформите заказ снова.", parse_mode=None)
+                return
             if order_id:
-                await message.answer(f"Заказ #{order_id} получен! Ожидайте подтверждения.")
+                delivery_info = ""
+                if quote and quote['result'] == 'ok':
+                    save_order_delivery(order_id, quote)
+                    delivery_info = f"\nДоставка: {quote['fee']} {get_restaurant()['currency']}, ~{quote['eta_minutes']} мин"
+                await message.answer(f"Заказ #{order_id} получен! Ожидайте подтверждения.{delivery_info}")
                 # Извлекаем названия блюд с количеством
-                decoded_dishes = json.loads(json.dumps(dishes, ensure_ascii=False))
-                dish_names = [f"{dish['name']} x{dish['qty']}" for dish in decoded_dishes]
+                dish_names = [f"{dish['name']} x{dish['qty']}" for dish in dishes]
                 dishes_str = ", ".join(dish_names)
                 # Уведомление админу
                 admin_username = get_admin_username()
                 if admin_username:
-                    conn = get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT telegram_id FROM users WHERE username = %s", (admin_username,))
-                    admin_id = cursor.fetchone()
-                    cursor.close()
-                    conn.close()
-                    if admin_id:
-                        await bot.send_message(admin_id[0], f"Новый заказ #{order_id}\nТип: {order_type}\nПользователь: {message.from_user.id}\nАдрес: {address}\nБлюда: {dishes_str}\nСумма: {total} BYN\nСтатус: pending")
+                    admin = get_user_by_username(admin_username)
+                    if admin:
+                        await bot.send_message(admin['telegram_id'], f"Новый заказ #{order_id} ({get_restaurant()['name']})\nТип: {order_type}\nПользователь: {message.from_user.id}\nАдрес: {address}{delivery_info}\nБлюда: {dishes_str}\nСумма: {total} {get_restaurant()['currency']}\nСтатус: pending")
                 # Уведомление курьерам
-                conn = get_connection()
-                if conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT telegram_id FROM users WHERE JSON_CONTAINS(role, '\"courier\"')")
-                    couriers = cursor.fetchall()
-                    cursor.close()
-                    conn.close()
-                    for courier in couriers:
-                        try:
-                            await bot.send_message(courier[0], f"Новый заказ #{order_id}! Используй /courier_orders\nТип: {order_type}\nСтатус: pending")
-                        except Exception as e:
-                            logger.error(f"Ошибка отправки курьеру {courier[0]}: {e}")
+                await notify_couriers(f"Новый заказ #{order_id}! Используй /courier_orders\nТип: {order_type}\nСтатус: pending")
             else:
                 await message.answer("Ошибка создания заказа.")
             return
@@ -181,232 +353,142 @@ async def handle_message(message: types.Message):
     # Заказы курьерам
     if "courier" in role:
         if message.text == '/courier_orders':
-            orders = get_new_orders()
-            logger.info(f"Orders retrieved for courier: {orders}")
-            if not orders:
-                await message.answer("Нет новых заказов.")
-                return
-            for order in orders:
-                order_id, user_id, dishes, address, total, status, order_type = order  # Добавили order_type
-                decoded_dishes = json.loads(dishes) if dishes else []
-                dish_names = [f"{dish['name']} x{dish['qty']}" for dish in decoded_dishes]
-                dishes_str = ", ".join(dish_names)
-                await message.answer(f"Заказ #{order_id}\nОт: {user_id}\nТип: {order_type}\nАдрес: {address}\nБлюда: {dishes_str}\nСумма: {total} BYN\nСтатус: {status}")
+            await show_board(message.from_user.id, message.chat.id)
             return
 
-        elif message.text.startswith('/accept_order'):
-            try:
-                order_id = int(message.text.split()[1])
-                if update_order_status(order_id, 'accepted', message.from_user.id):
-                    user_id = get_user_id_by_order_id(order_id)
-                    if user_id:
-                        await bot.send_message(user_id, f"✅ Ваш заказ #{order_id} принят курьером!")
-                    await message.answer(f"Заказ #{order_id} принят.\nСтатус обновлён: accepted")
-                    # Уведомление курьерам и админу
-                    conn = get_connection()
-                    if conn:
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT telegram_id FROM users WHERE JSON_CONTAINS(role, '\"courier\"')")
-                        couriers = cursor.fetchall()
-                        cursor.close()
-                        conn.close()
-                        for courier in couriers:
-                            await bot.send_message(courier[0], f"Заказ #{order_id} принят.\nСтатус: accepted")
-                        # Уведомление админу
-                        admin_username = get_admin_username()
-                        if admin_username:
-                            cursor = conn.cursor()
-                            cursor.execute("SELECT telegram_id FROM users WHERE username = %s", (admin_username,))
-                            admin_id = cursor.fetchone()
-                            cursor.close()
-                            if admin_id:
-                                await bot.send_message(admin_id[0], f"Заказ #{order_id} принят.\nСтатус: accepted")
-                else:
-                    await message.answer(f"Заказ #{order_id} не найден или уже обработан.")
-            except (IndexError, ValueError):
-                await message.answer("Формат: /accept_order [id]")
-
-        elif message.text.startswith('/start_cooking'):
-            try:
-                order_id = int(message.text.split()[1])
-                if update_order_status(order_id, 'cooking', message.from_user.id):
-                    user_id = get_user_id_by_order_id(order_id)
-                    if user_id:
-                        await bot.send_message(user_id, f"🍳 Ваш заказ #{order_id} готовится!")
-                    await message.answer(f"Заказ #{order_id} переведён в статус: cooking")
-                    # Уведомление курьерам и админу
-                    conn = get_connection()
-                    if conn:
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT telegram_id FROM users WHERE JSON_CONTAINS(role, '\"courier\"')")
-                        couriers = cursor.fetchall()
-                        cursor.close()
-                        conn.close()
-                        for courier in couriers:
-                            await bot.send_message(courier[0], f"Заказ #{order_id} готовится.\nСтатус: cooking")
-                        # Уведомление админу
-                        admin_username = get_admin_username()
-                        if admin_username:
-                            cursor = conn.cursor()
-                            cursor.execute("SELECT telegram_id FROM users WHERE username = %s", (admin_username,))
-                            admin_id = cursor.fetchone()
-                            cursor.close()
-                            if admin_id:
-                                await bot.send_message(admin_id[0], f"Заказ #{order_id} готовится.\nСтатус: cooking")
-                else:
-                    await message.answer(f"Заказ #{order_id} не найден или уже обработан.")
-            except (IndexError, ValueError):
-                await message.answer("Формат: /start_cooking [id]")
-
-        elif message.text.startswith('/start_delivery'):
-            try:
-                order_id = int(message.text.split()[1])
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT order_type FROM orders WHERE id = %s", (order_id,))
-                order_type = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                if order_type and order_type[0] == 'delivery' and update_order_status(order_id, 'on_delivery', message.from_user.id):
-                    user_id = get_user_id_by_order_id(order_id)
-                    if user_id:
-                        await bot.send_message(user_id, f"🚚 Ваш заказ #{order_id} в доставке!")
-                    await message.answer(f"Заказ #{order_id} переведён в статус: on_delivery")
-                    # Уведомление курьерам и админу
-                    conn = get_connection()
-                    if conn:
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT telegram_id FROM users WHERE JSON_CONTAINS(role, '\"courier\"')")
-                        couriers = cursor.fetchall()
-                        cursor.close()
-                        conn.close()
-                        for courier in couriers:
-                            await bot.send_message(courier[0], f"Заказ #{order_id} в доставке.\nСтатус: on_delivery")
-                        # Уведомление админу
-                        admin_username = get_admin_username()
-                        if admin_username:
-                            cursor = conn.cursor()
-                            cursor.execute("SELECT telegram_id FROM users WHERE username = %s", (admin_username,))
-                            admin_id = cursor.fetchone()
-                            cursor.close()
-                            if admin_id:
-                                await bot.send_message(admin_id[0], f"Заказ #{order_id} в доставке.\nСтатус: on_delivery")
-                else:
-                    await message.answer(f"Заказ #{order_id} не является доставкой или уже обработан.")
-            except (IndexError, ValueError):
-                await message.answer("Формат: /start_delivery [id]")
-
-        elif message.text.startswith('/complete_order'):
-            try:
-                order_id = int(message.text.split()[1])
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT order_type FROM orders WHERE id = %s", (order_id,))
-                order_type = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                if order_type and update_order_status(order_id, 'delivered', message.from_user.id):
-                    user_id = get_user_id_by_order_id(order_id)
-                    if user_id:
-                        await bot.send_message(user_id, f"🎉 Ваш заказ #{order_id} {order_type[0] == 'delivery' and 'доставлен' or 'готов к самовывозу'}! Спасибо!")
-                    await message.answer(f"Заказ #{order_id} отмечен как {order_type[0] == 'delivery' and 'доставлен' or 'готов к самовывозу'}.\nСтатус: delivered")
-                    # Уведомление курьерам и админу
-                    conn = get_connection()
-                    if conn:
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT telegram_id FROM users WHERE JSON_CONTAINS(role, '\"courier\"')")
-                        couriers = cursor.fetchall()
-                        cursor.close()
-                        conn.close()
-                        for courier in couriers:
-                            await bot.send_message(courier[0], f"Заказ #{order_id} {order_type[0] == 'delivery' and 'доставлен' or 'готов к самовывозу'}.\nСтатус: delivered")
-                        # Уведомление админу
-                        admin_username = get_admin_username()
-                        if admin_username:
-                            cursor = conn.cursor()
-                            cursor.execute("SELECT telegram_id FROM users WHERE username = %s", (admin_username,))
-                            admin_id = cursor.fetchone()
-                            cursor.close()
-                            if admin_id:
-                                await bot.send_message(admin_id[0], f"Заказ #{order_id} {order_type[0] == 'delivery' and 'доставлен' or 'готов к самовывозу'}.\nСтатус: delivered")
-                else:
-                    await message.answer(f"Заказ #{order_id} не найден или уже обработан.")
-            except (IndexError, ValueError):
-                await message.answer("Формат: /complete_order [id]")
+        for command, action in COURIER_COMMANDS.items():
+            if message.text.startswith(command):
+                try:
+                    order_id = int(message.text.split()[1])
+                except (IndexError, ValueError):
+                    await message.answer(f"Формат: {command} [id]")
+                    return
+                await message.answer(await apply_courier_action(message.from_user.id, order_id, action))
+                return
 
     # Fallback
     await message.answer("Команда не распознана. Для курьера: /courier_orders, /accept_order [id], /start_cooking [id], /start_delivery [id], /complete_order [id], /help", parse_mode=None)
 
 # Фоновое задание для проверки статуса заказов с уникальными уведомлениями
+# При остановке бота выходит между заказами: отправка и флаг notified не разрываются
 async def check_orders_periodically():
-    while True:
-        conn = get_connection()
-        if conn:
-            cursor = conn.cursor()
-            try:
-                # Проверяем заказы со всеми статусами с учётом флага notified
-                cursor.execute("""
-                    SELECT id, user_id, status, order_type 
-                    FROM orders 
-                    WHERE status IN ('accepted', 'cooking', 'on_delivery', 'delivered') 
-                    AND (notified IS NULL OR notified < NOW() - INTERVAL 1 DAY)
-                """)
-                orders = cursor.fetchall()
-                for order_id, user_id, status, order_type in orders:
-                    if status == 'accepted':
-                        await bot.send_message(user_id, f"✅ Ваш заказ #{order_id} принят курьером!")
-                    elif status == 'cooking':
-                        await bot.send_message(user_id, f"🍳 Ваш заказ #{order_id} готовится!")
-                    elif status == 'on_delivery' and order_type == 'delivery':
-                        await bot.send_message(user_id, f"🚚 Ваш заказ #{order_id} в доставке!")
-                    elif status == 'delivered':
-                        await bot.send_message(user_id, f"🎉 Ваш заказ #{order_id} {order_type == 'delivery' and 'доставлен' or 'готов к самовывозу'}! Спасибо!")
-                    # Обновляем флаг notified
-                    cursor.execute("UPDATE orders SET notified = NOW() WHERE id = %s", (order_id,))
-                conn.commit()
-            except Exception as e:
-                logger.error(f"Ошибка проверки заказов: {e}")
-            finally:
-                cursor.close()
-                conn.close()
-        await asyncio.sleep(60)  # Проверка каждую минуту
+    while not runtime.stopping:
+        try:
+            for restaurant_id in RESTAURANTS:
+                with use_restaurant(restaurant_id):
+                    # Проверяем заказы со всеми статусами с учётом флага notified
+                    orders = get_orders_to_notify()
+                    for order_id, user_id, status, order_type in orders:
+                        if runtime.stopping:
+                            return
+                        try:
+                            if status == 'accepted':
+                                await bot.send_message(user_id, f"✅ Ваш заказ #{order_id} принят курьером!")
+                            elif status == 'cooking':
+                                await bot.send_message(user_id, f"🍳 Ваш заказ #{order_id} готовится!")
+                            elif status == 'on_delivery' and order_type == 'delivery':
+                                await bot.send_message(user_id, f"🚚 Ваш заказ #{order_id} в доставке!")
+                            elif status == 'delivered':
+                                await bot.send_message(user_id, f"🎉 Ваш заказ #{order_id} {order_type == 'delivery' and 'доставлен' or 'готов к самовывозу'}! Спасибо!")
+                        except TelegramForbiddenError:
+                            pass  # Бот заблокирован — сообщение не доставить, повторять незачем
+                        except TelegramAPIError as e:
+                            # Не отмечаем: повторим на следующем круге, остальные заказы не ждут
+                            logger.warning(f"Не удалось уведомить о заказе #{order_id}: {e}")
+                            continue
+                        # Обновляем флаг notified
+                        mark_order_notified(order_id)
+        except Exception as e:
+            logger.error(f"Ошибка проверки заказов: {e}")
+        await runtime.sleep(60)  # Проверка каждую минуту
 
 # Обработка готовности заказов на самовывоз
 async def check_pickup_readiness():
-    while True:
-        conn = get_connection()
-        if conn:
-            cursor = conn.cursor()
-            try:
-                # Проверяем заказы со статусом 'cooking' и типом 'restaurant'
-                cursor.execute("""
-                    SELECT id, user_id 
-                    FROM orders 
-                    WHERE status = 'cooking' 
-                    AND order_type = 'restaurant' 
-                    AND (pickup_notified IS NULL OR pickup_notified < NOW() - INTERVAL 1 HOUR)
-                """)
-                orders = cursor.fetchall()
-                for order_id, user_id in orders:
-                    # Симулируем задержку в 30 минут (в реальности можно использовать timestamp)
-                    await asyncio.sleep(1800)  # 30 минут = 1800 секунд
-                    if update_order_status(order_id, 'delivered', None):  # Автоматически завершаем как готовый к самовывозу
-                        await bot.send_message(user_id, f"🍽 Ваш заказ #{order_id} готов к самовывозу! Среднее время ожидания истекло (~30 минут). Приезжайте в ресторан.")
-                        cursor.execute("UPDATE orders SET pickup_notified = NOW() WHERE id = %s", (order_id,))
-                        conn.commit()
-            except Exception as e:
-                logger.error(f"Ошибка проверки готовности самовывоза: {e}")
-            finally:
-                cursor.close()
-                conn.close()
-        await asyncio.sleep(60)  # Проверка каждую минуту
+    while not runtime.stopping:
+        try:
+            for restaurant_id in RESTAURANTS:
+                with use_restaurant(restaurant_id):
+                    # Проверяем заказы со статусом 'cooking' и типом 'restaurant'
+                    orders = get_pickup_orders_to_notify()
+                    for order_id, user_id in orders:
+                        # Симулируем задержку в 30 минут (в реальности можно использовать timestamp)
+                        if await runtime.sleep(1800):  # 30 минут = 1800 секунд
+                            return  # Заказ остался cooking — его подхватит новый процесс
+                        if update_order_status(order_id, 'delivered', None):  # Автоматически завершаем как готовый к самовывозу
+                            await bot.send_message(user_id, f"🍽 Ваш заказ #{order_id} готов к самовывозу! Среднее время ожидания истекло (~30 минут). Приезжайте в ресторан.")
+                            mark_pickup_notified(order_id)
+                            await refresh_boards(restaurant_id)
+        except Exception as e:
+            logger.error(f"Ошибка проверки готовности самовывоза: {e}")
+        await runtime.sleep(60)  # Проверка каждую минуту
+
+# Перенос старых завершённых заказов в архив небольшими пачками
+async def archive_orders_periodically():
+    while not runtime.stopping:
+        try:
+            # Архивируем каждую базу филиалов
+            for restaurant_id in shard_restaurant_ids():
+                with use_restaurant(restaurant_id):
+                    moved = 0
+                    # Каждая пачка — своя транзакция, поэтому остановиться можно между пачками
+                    while not runtime.stopping:
+                        n = archive_orders_batch(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+                        if not n:
+                            break
+                        moved += n
+                        await runtime.sleep(ARCHIVE_BATCH_PAUSE)  # Не держим orders занятой подряд
+                    prune_order_events(ARCHIVE_AFTER_DAYS)
+                    logger.info(f"Архивация (база филиала {restaurant_id}): перенесено {moved} заказов, {get_orders_table_stats()}")
+            prune_recent_writes()
+        except Exception as e:
+            logger.error(f"Ошибка архивации заказов: {e}")
+        await runtime.sleep(ARCHIVE_INTERVAL)
+
+# Брошенная оплата не держит остатки: неоплаченные дольше CHECKOUT_TTL_MINUTES заказы отменяются
+async def expire_unpaid_orders_periodically():
+    while not await runtime.sleep(60):
+        for restaurant_id in RESTAURANTS:
+            with use_restaurant(restaurant_id):
+                expired = await asyncio.to_thread(expire_unpaid_orders, CHECKOUT_TTL_MINUTES)
+            if expired:
+                invalidate_stock(restaurant_id)
+
+# Заказы меняются и через API (админка, оплата) — перерисовываем доски, когда в order_events что-то появилось
+async def refresh_boards_periodically():
+    last_cursors = {}  # филиал -> позиция в order_events
+    while not await runtime.sleep(COURIER_BOARD_REFRESH_INTERVAL):
+        try:
+            if not courier_board.boards:
+                continue
+            for restaurant_id in RESTAURANTS:
+                with use_restaurant(restaurant_id):
+                    events_cursor = get_order_events_cursor()
+                if events_cursor != last_cursors.get(restaurant_id):
+                    await refresh_boards(restaurant_id)
+                    last_cursors[restaurant_id] = events_cursor
+        except Exception as e:
+            logger.error(f"Ошибка обновления досок курьеров: {e}")
+
+# Поллинг уже остановлен (SIGTERM/SIGINT), а сессия бота ещё открыта: дожидаемся обработчиков
+# и фоновых задач, затем дописываем заказы из очереди групповой записи
+async def drain(**kwargs):
+    await runtime.shutdown()
+    await asyncio.to_thread(stop_writers)
+    logger.info(f"Фоновые задачи: {runtime.status()}")
 
 # Основная функция запуска
 async def main():
+    setup_logging()
     init_db()
     print("Бот запущен")
-    asyncio.create_task(check_orders_periodically())
-    asyncio.create_task(check_pickup_readiness())  # Добавляем задачу для проверки самовывоза
+    runtime.start('check_orders', check_orders_periodically)
+    runtime.start('check_pickup', check_pickup_readiness)  # Добавляем задачу для проверки самовывоза
+    runtime.start('archive_orders', archive_orders_periodically)
+    runtime.start('broadcast', lambda: broadcast_worker(bot))
+    runtime.start('refresh_boards', refresh_boards_periodically)
+    if CHECKOUT_TTL_MINUTES:
+        runtime.start('expire_checkouts', expire_unpaid_orders_periodically)
+    dp.shutdown.register(drain)
     try:
         await dp.start_polling(bot)
     except Exception as e:
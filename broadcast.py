@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urljoin
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import WEB_APP_URL, RESTAURANTS, BROADCAST_RATE, BROADCAST_BATCH_SIZE, BROADCAST_FLUSH_EVERY, BROADCAST_POLL_INTERVAL
+from database import claim_broadcast, get_broadcast_recipients, save_broadcast_progress, finish_broadcast
+from supervisor import runtime
+from tenants import use_restaurant
+
+# Рассылки акций всем пользователям бота.
+# Админ создаёт рассылку через /api/admin/broadcasts, бот забирает её фоновой задачей
+# broadcast_worker и отправляет с ограничением скорости, сохраняя прогресс каждые
+# BROADCAST_FLUSH_EVERY отправок. После падения повторно могут уйти только сообщения
+# из последней несохранённой пачки; при штатной остановке (деплой) пачка досылается
+# и сохраняется, а рассылка остаётся running и продолжается новым процессом.
+# Рассылки и получатели хранятся в базе филиала, а рассылка относится к своему филиалу
+# (получают её пользователи, выбравшие этот филиал), поэтому воркер по очереди забирает
+# рассылки каждого филиала.
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Не больше rate событий в секунду, всплеск до capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Telegram попросил подождать (429): обнуляем запас, чтобы остальные отправки тоже притормозили."""
+        self.tokens = -seconds * self.rate
+
+
+def _photo_url(image_url):
+    # В promotions лежат и абсолютные ссылки, и пути вида /uploads/...
+    if not image_url:
+        return None
+    return image_url if image_url.startswith('http') else urljoin(WEB_APP_URL, image_url)
+
+
+async def send_one(bot, bucket, user_id, text, image_url=None):
+    """Отправляет одно сообщение. Возвращает (status, error): sent, blocked, gone или failed."""
+    while True:
+        await bucket.acquire()
+        try:
+            if image_url:
+                await bot.send_photo(user_id, image_url, caption=text, parse_mode=None)
+            else:
+                await bot.send_message(user_id, text, parse_mode=None)
+            return 'sent', None
+        except TelegramRetryAfter as e:
+            logger.warning(f"Рассылка: flood control, ждём {e.retry_after} с")
+            bucket.pause(e.retry_after)
+        except TelegramForbiddenError as e:
+            # Бот заблокирован или аккаунт удалён
+            return 'blocked', e.message[:255]
+        except TelegramBadRequest as e:
+            if 'chat not found' in e.message.lower():
+                return 'gone', e.message[:255]
+            return 'failed', e.message[:255]
+        except (TelegramAPIError, asyncio.TimeoutError) as e:
+            return 'failed', str(e)[:255]
+
+
+async def run_broadcast(bot, broadcast, bucket):
+    """Отправляет рассылку с сохранённого места до конца, паузы или отмены. Запросы к БД идут
+    в потоке (asyncio.to_thread), чтобы не задерживать цикл событий бота. False — прервались из-за ошибки БД."""
+    broadcast_id = broadcast['id']
+    image_url = _photo_url(broadcast['image_url'])
+    last_user_id = broadcast['last_user_id']
+    logger.info(f"Рассылка #{broadcast_id}: старт с user_id > {last_user_id}, всего {broadcast['total']}")
+    while True:
+        recipients = await asyncio.to_thread(get_broadcast_recipients, last_user_id, BROADCAST_BATCH_SIZE)
+        if recipients is None:
+            return False
+        if not recipients:
+            await asyncio.to_thread(finish_broadcast, broadcast_id)
+            logger.info(f"Рассылка #{broadcast_id} завершена")
+            return True
+        for i in range(0, len(recipients), BROADCAST_FLUSH_EVERY):
+            chunk = recipients[i:i + BROADCAST_FLUSH_EVERY]
+            started = time.monotonic()
+            # Параллельно внутри пачки, скорость держит bucket
+            results = await asyncio.gather(*(send_one(bot, bucket, user_id, broadcast['text'], image_url)
+                                             for user_id in chunk))
+            rate = len(chunk) / max(time.monotonic() - started, 1e-6)
+            outcomes = [(user_id, status, error) for user_id, (status, error) in zip(chunk, results)]
+            status = await asyncio.to_thread(save_broadcast_progress, broadcast_id, outcomes, chunk[-1], round(rate, 2))
+            if status is None:
+                return False
+            last_user_id = chunk[-1]
+            if status != 'running':
+                logger.info(f"Рассылка #{broadcast_id}: остановлена ({status})")
+                return True
+            if runtime.stopping:
+                logger.info(f"Рассылка #{broadcast_id}: бот останавливается, продолжим с user_id > {last_user_id}")
+                return True
+
+
+async def broadcast_worker(bot):
+    # Без всплесков: сообщения идут равномерно, не больше BROADCAST_RATE в секунду
+    bucket = TokenBucket(BROADCAST_RATE, capacity=1)
+    while not runtime.stopping:
+        sent = False
+        for restaurant_id in RESTAURANTS:
+            if runtime.stopping:
+                return
+            try:
+                with use_restaurant(restaurant_id):
+                    broadcast = await asyncio.to_thread(claim_broadcast)
+                    if broadcast and await run_broadcast(bot, broadcast, bucket):
+                        sent = True
+            except Exception as e:
+                logger.error(f"Ошибка рассылки: {e}")
+        # Следующую рассылку берём сразу, если что-то отправили; иначе (нет рассылок или ошибка) — ждём
+        if not sent:
+            await runtime.sleep(BROADCAST_POLL_INTERVAL)
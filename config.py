@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Загружаем .env (если есть)
@@ -11,6 +12,13 @@ if not BOT_TOKEN or ":" not in BOT_TOKEN:
     raise ValueError("❌ Ошибка: BOT_TOKEN не найден или неверный. Проверь .env или config.py")
 
 WEB_APP_URL = "https://pliable-unpunctuating-stacey.ngrok-free.dev"
+# Сколько секунд действительна подпись initData мини-аппа для запросов админки
+WEBAPP_INIT_DATA_MAX_AGE = int(os.getenv("WEBAPP_INIT_DATA_MAX_AGE", "86400"))
+# ================== DATABASE ==================
+# mysql — основной сервер; sqlite — встроенная БД (WAL) для одиночных инсталляций и тестов
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "restaurant.db")
+
 # ================== DATABASE (MySQL) ==================
 MYSQL_CONFIG = {
     'host': os.getenv("MYSQL_HOST", "localhost"),
@@ -19,6 +27,68 @@ MYSQL_CONFIG = {
     'database': os.getenv("MYSQL_DB", "restaurant_db"),
 }
 
+# Размер пула соединений на процесс (0 — без пула, новое соединение на каждый запрос)
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+
+# ================== DATABASE REPLICA (MySQL, только чтение) ==================
+# Если MYSQL_REPLICA_HOST не задан, все запросы идут на основной сервер
+MYSQL_REPLICA_CONFIG = {
+    'host': os.getenv("MYSQL_REPLICA_HOST"),
+    'user': os.getenv("MYSQL_REPLICA_USER", MYSQL_CONFIG['user']),
+    'password': os.getenv("MYSQL_REPLICA_PASSWORD", MYSQL_CONFIG['password']),
+    'database': os.getenv("MYSQL_REPLICA_DB", MYSQL_CONFIG['database']),
+} if os.getenv("MYSQL_REPLICA_HOST") else None
+REPLICA_MAX_LAG_SECONDS = int(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))      # больше — читаем с основного
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "2"))  # как часто проверять отставание
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "15"))       # read-your-writes после записи
+REPLICA_SHARED_CHECK_SECONDS = float(os.getenv("REPLICA_SHARED_CHECK_SECONDS", "2"))  # заказы из других процессов
+
+# ================== АРХИВ ЗАКАЗОВ ==================
+# Завершённые (delivered/failed) заказы старше ARCHIVE_AFTER_DAYS переносятся в orders_archive
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))          # строк за одну транзакцию
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.5"))      # пауза между пачками, сек
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))             # как часто бот запускает архивацию, сек
+
+# ================== ВЫГРУЗКИ ==================
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))           # строк за один fetchmany
+
+# ================== РАССЫЛКИ ==================
+# Глобальный лимит Telegram ~30 сообщений/сек на бота, держимся ниже
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))                 # сообщений в секунду
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))      # получателей за один запрос к users
+BROADCAST_FLUSH_EVERY = int(os.getenv("BROADCAST_FLUSH_EVERY", "50"))     # отправок между сохранениями прогресса
+BROADCAST_POLL_INTERVAL = int(os.getenv("BROADCAST_POLL_INTERVAL", "10")) # как часто бот ищет новые рассылки, сек
+
+# ================== ДОСКА КУРЬЕРА ==================
+COURIER_BOARD_PAGE_SIZE = int(os.getenv("COURIER_BOARD_PAGE_SIZE", "5"))                 # заказов на странице
+COURIER_BOARD_REFRESH_INTERVAL = int(os.getenv("COURIER_BOARD_REFRESH_INTERVAL", "30"))   # подхватываем изменения из API, сек
+
+# ================== ЖИВОЙ СТАТУС ЗАКАЗОВ (SSE) ==================
+# Отдельный aiohttp-сервер: python order_stream.py; /api/user/<id>/orders/stream проксируется на него
+ORDER_STREAM_HOST = os.getenv("ORDER_STREAM_HOST", "0.0.0.0")
+ORDER_STREAM_PORT = int(os.getenv("ORDER_STREAM_PORT", "8081"))
+ORDER_STREAM_URL = os.getenv("ORDER_STREAM_URL", "")                              # публичный адрес, если нет прокси
+ORDER_STREAM_POLL_INTERVAL = float(os.getenv("ORDER_STREAM_POLL_INTERVAL", "1"))  # опрос order_events, сек
+ORDER_STREAM_HEARTBEAT = int(os.getenv("ORDER_STREAM_HEARTBEAT", "15"))           # пинг простаивающим клиентам, сек
+ORDER_STREAM_QUEUE_SIZE = int(os.getenv("ORDER_STREAM_QUEUE_SIZE", "100"))        # событий в очереди клиента
+
+# ================== ОГРАНИЧЕНИЕ ЧАСТОТЫ ==================
+# memory — счётчики в памяти процесса; db — дополнительно общий счётчик в БД (несколько инстансов)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+def _rate_limit(name, default):
+    """Лимит вида "N/секунд" -> (N, секунд)."""
+    count, seconds = os.getenv(name, default).split('/')
+    return int(count), float(seconds)
+
+RATE_LIMITS = {
+    'bot_message': _rate_limit("RATE_LIMIT_BOT_MESSAGES", "20/60"),   # сообщений и нажатий от одного telegram_id
+    'promo': _rate_limit("RATE_LIMIT_PROMO", "5/60"),                 # проверок промокода с одного IP
+    'payment': _rate_limit("RATE_LIMIT_PAYMENT", "5/60"),             # созданий оплаты на пользователя и на IP
+    'geo': _rate_limit("RATE_LIMIT_GEO", "30/60"),                    # расчётов доставки по адресу с одного IP
+}
+
 # ================== Crypto BOT ===================
 # config.py
 CRYPTOBOT_TOKEN = os.getenv("CRYPTOBOT_TOKEN", "465695:AAmnhDHAI79JLCEYAUcjQBYwio8wJjW0DA0")
@@ -26,4 +96,83 @@ CRYPTOBOT_TOKEN = os.getenv("CRYPTOBOT_TOKEN", "465695:AAmnhDHAI79JLCEYAUcjQBYwi
 # ================== LOCALIZATION ==================
 CURRENCY = os.getenv("CURRENCY", "BYN")
 RESTAURANT_ADDRESS = os.getenv("RESTAURANT_ADDRESS", "ул. Советская, 1, Гомель, 246000")
-YANDEX_MAPS_API_KEY = os.getenv("YANDEX_MAPS_API_KEY", "09b5ff38-21a8-4d1d-a0a2-a08e12528dcc")  # Твой ключ
\ No newline at end of file
+YANDEX_MAPS_API_KEY = os.getenv("YANDEX_MAPS_API_KEY", "09b5ff38-21a8-4d1d-a0a2-a08e12528dcc")  # Твой ключ
+
+# ================== ДОСТАВКА: ЗОНЫ И ETA ==================
+RESTAURANT_LAT = float(os.getenv("RESTAURANT_LAT", "52.4414"))
+RESTAURANT_LON = float(os.getenv("RESTAURANT_LON", "30.9829"))
+GEOCODER = os.getenv("GEOCODER", "yandex")                                  # yandex | stub (без сети, для тестов)
+GEOCODE_MEMORY_CACHE = int(os.getenv("GEOCODE_MEMORY_CACHE", "50000"))      # адресов в памяти процесса
+# Зоны проверяются по порядку, первая подходящая выигрывает: polygon — [[lat, lon], ...],
+# стоимость доставки = base_fee + per_km * км по дороге (по прямой × ROAD_FACTOR)
+DELIVERY_ZONES = json.loads(os.getenv("DELIVERY_ZONES", "null")) or [
+    {'name': 'center', 'base_fee': 0, 'per_km': 0,
+     'polygon': [[52.414, 30.939], [52.414, 31.027], [52.468, 31.027], [52.468, 30.939]]},
+    {'name': 'city', 'base_fee': 3, 'per_km': 0.5,
+     'polygon': [[52.369, 30.865], [52.369, 31.101], [52.513, 31.101], [52.513, 30.865]]},
+]
+ROAD_FACTOR = float(os.getenv("ROAD_FACTOR", "1.3"))                        # дорога длиннее прямой
+COURIER_SPEED_KMH = float(os.getenv("COURIER_SPEED_KMH", "20"))
+COOKING_MINUTES = int(os.getenv("COOKING_MINUTES", "20"))
+COURIER_GRID_CELL_KM = float(os.getenv("COURIER_GRID_CELL_KM", "1"))
+COURIER_LOCATION_TTL = int(os.getenv("COURIER_LOCATION_TTL", "900"))         # старше — курьер не учитывается, сек
+COURIER_GRID_REFRESH = int(os.getenv("COURIER_GRID_REFRESH", "15"))          # как часто перечитывать позиции, сек
+
+# ================== ФИЛИАЛЫ ==================
+# RESTAURANTS — JSON {"<id>": {...}}: name, address, currency, lat, lon, zones (по умолчанию DELIVERY_ZONES)
+# и db — отдельная база филиала: для MySQL параметры поверх MYSQL_CONFIG ({"database": "branch2"}
+# или другой host), для SQLite {"path": "branch2.db"}. Филиалы без db делят основную базу
+# и разделяются колонкой restaurant_id.
+DEFAULT_RESTAURANT_ID = int(os.getenv("DEFAULT_RESTAURANT_ID", "1"))
+RESTAURANTS = {int(k): v for k, v in (json.loads(os.getenv("RESTAURANTS", "null")) or {}).items()}
+RESTAURANTS.setdefault(DEFAULT_RESTAURANT_ID, {})
+for _restaurant in RESTAURANTS.values():
+    _restaurant.setdefault('name', 'La Tavola')
+    _restaurant.setdefault('address', RESTAURANT_ADDRESS)
+    _restaurant.setdefault('currency', CURRENCY)
+    _restaurant.setdefault('lat', RESTAURANT_LAT)
+    _restaurant.setdefault('lon', RESTAURANT_LON)
+    _restaurant.setdefault('zones', DELIVERY_ZONES)
+    _restaurant.setdefault('db', None)
+
+# ================== ВОРКЕРЫ API ==================
+# gunicorn 'api:create_app()': импорт api.py не трогает базу, схему создаёт `python manage.py migrate`.
+# После старта воркер в фоне открывает соединения и прогревает кеши; до конца прогрева /readyz отвечает 503.
+API_WARM_UP = os.getenv("API_WARM_UP", "1") == "1"
+GEOCODE_PRELOAD = int(os.getenv("GEOCODE_PRELOAD", "5000"))                  # адресов из geocode_cache в память при старте
+
+# ================== ЛОГИ ==================
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                                  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))                    # записей в очереди до фонового потока
+LOG_RATE_LIMIT = _rate_limit("LOG_RATE_LIMIT", "200/1")                       # записей ниже WARNING на логгер
+# Доля записываемых частых событий: {"событие": 0.01}
+LOG_SAMPLING = json.loads(os.getenv("LOG_SAMPLING", "null")) or {
+    'bot.message': 0.05,
+    'promo.validate': 0.1,
+    'orders.added': 0.1,           # пачка заказов записана (сами заказы видны в order_events)
+    'rate_limit.exceeded': 0.05,   # при переборе/флуде каждый отказ не пишется
+}
+
+# ================== ЗАГРУЗКА МЕНЮ ==================
+MENU_IMAGE_WORKERS = int(os.getenv("MENU_IMAGE_WORKERS", "8"))               # потоков копирования картинок
+MENU_IMAGE_MAX_BYTES = int(os.getenv("MENU_IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# ================== ОСТАТКИ ==================
+INVENTORY_REFRESH = float(os.getenv("INVENTORY_REFRESH", "3"))              # как часто перечитывать остатки в память, сек
+# Неоплаченный заказ (pending с платёжкой) старше стольких минут отменяется (failed), резерв возвращается; 0 — не отменять
+CHECKOUT_TTL_MINUTES = int(os.getenv("CHECKOUT_TTL_MINUTES", "30"))
+
+# ================== ЗАПИСЬ ЗАКАЗОВ ==================
+# Групповая запись (order_ingest.py): заказы, пришедшие почти одновременно, пишутся одной транзакцией
+ORDER_GROUP_COMMIT = os.getenv("ORDER_GROUP_COMMIT", "1") == "1"
+ORDER_BATCH_MAX = int(os.getenv("ORDER_BATCH_MAX", "100"))                    # заказов в одной транзакции
+ORDER_BATCH_WAIT = float(os.getenv("ORDER_BATCH_WAIT", "0.005"))              # сколько ждать попутных заказов, сек
+
+# ================== ПОИСК ПО МЕНЮ ==================
+SEARCH_REFRESH = float(os.getenv("SEARCH_REFRESH", "10"))                    # как часто сверять индекс с меню, сек
+
+# ================== ОСТАНОВКА БОТА ==================
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))                # сколько ждать обработчики и фоновые задачи, сек
+TASK_RESTART_BACKOFF = float(os.getenv("TASK_RESTART_BACKOFF", "1"))          # пауза перед перезапуском упавшей задачи, сек
+TASK_RESTART_BACKOFF_MAX = float(os.getenv("TASK_RESTART_BACKOFF_MAX", "60"))
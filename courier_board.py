@@ -0,0 +1,103 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import COURIER_BOARD_PAGE_SIZE
+from database import get_courier_board_page, get_items_for_orders
+from tenants import current_restaurant_id, get_restaurant
+
+# Доска курьера: одно сообщение со страницами активных заказов и inline-кнопками
+# вместо отдельного сообщения на каждый заказ. Страницы листаются по id (keyset),
+# отрисованные страницы кешируются до следующего изменения заказов (invalidate()).
+# Доска, кеш и выборка заказов — в рамках филиала, к которому относится курьер.
+
+# Действия курьера: новый статус и подпись кнопки
+COURIER_ACTIONS = {
+    'accept': ('accepted', "✅ Принять"),
+    'cook': ('cooking', "🍳 Готовится"),
+    'deliver': ('on_delivery', "🚚 В доставку"),
+    'complete': ('delivered', "🎉 Готов"),
+}
+
+
+def next_action(status, order_type):
+    """Следующий шаг для заказа на доске."""
+    if status == 'pending':
+        return 'accept'
+    if status == 'accepted':
+        return 'cook'
+    if status == 'cooking':
+        return 'deliver' if order_type == 'delivery' else 'complete'
+    if status == 'on_delivery':
+        return 'complete'
+    return None
+
+
+class Board:
+    """Сообщение с доской у курьера. starts — id, после которых начинаются открытые страницы."""
+
+    def __init__(self, chat_id, message_id, restaurant_id=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.restaurant_id = restaurant_id or current_restaurant_id()
+        self.starts = [0]
+        self.text = None
+
+
+# courier_id -> Board; живёт в памяти бота, после перезапуска доска пересоздаётся по первому нажатию
+boards = {}
+# (restaurant_id, courier_id, after_id, page_no) -> (text, markup, last_id)
+_cache = {}
+
+
+def invalidate(restaurant_id=None):
+    """Сбрасывает страницы филиала (без restaurant_id — все)."""
+    if restaurant_id is None:
+        _cache.clear()
+        return
+    for key in [k for k in _cache if k[0] == restaurant_id]:
+        del _cache[key]
+
+
+def render_page(courier_id, after_id, page_no=1):
+    key = (current_restaurant_id(), courier_id, after_id, page_no)
+    if key in _cache:
+        return _cache[key]
+    rows = get_courier_board_page(courier_id, after_id, COURIER_BOARD_PAGE_SIZE + 1)
+    has_next = len(rows) > COURIER_BOARD_PAGE_SIZE
+    rows = rows[:COURIER_BOARD_PAGE_SIZE]
+    items = get_items_for_orders([r[0] for r in rows])
+
+    currency = get_restaurant()['currency']
+    lines = [f"📋 Заказы — стр. {page_no}"]
+    keyboard = []
+    for order_id, user_id, address, total, status, order_type in rows:
+        dishes = ", ".join(f"{i['name']} x{i['qty']}" for i in items.get(order_id, []))
+        if len(dishes) > 60:
+            dishes = dishes[:57] + "..."
+        lines.append(f"\n#{order_id} · {order_type} · {total} {currency} · {status}\n{address or '—'}\n{dishes}")
+        action = next_action(status, order_type)
+        if action:
+            keyboard.append([InlineKeyboardButton(text=f"#{order_id} {COURIER_ACTIONS[action][1]}",
+                                                  callback_data=f"cb:act:{action}:{order_id}")])
+    if not rows:
+        lines.append("\nНет активных заказов.")
+
+    nav = []
+    if page_no > 1:
+        nav.append(InlineKeyboardButton(text="◀", callback_data="cb:prev"))
+    nav.append(InlineKeyboardButton(text="🔄", callback_data="cb:refresh"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶", callback_data="cb:next"))
+    keyboard.append(nav)
+
+    page = ("\n".join(lines), InlineKeyboardMarkup(inline_keyboard=keyboard), rows[-1][0] if rows else after_id)
+    _cache[key] = page
+    return page
+
+
+def render_board(courier_id, board):
+    """Текущая страница доски; если она опустела (заказы ушли дальше), откатываемся назад."""
+    while True:
+        text, markup, last_id = render_page(courier_id, board.starts[-1], len(board.starts))
+        if last_id != board.starts[-1] or len(board.starts) == 1:
+            return text, markup, last_id
+        board.starts.pop()
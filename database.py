@@ -1,24 +1,272 @@
-import mysql.connector
-from mysql.connector import Error
-from config import MYSQL_CONFIG
+from config import (MYSQL_CONFIG, DB_BACKEND, SQLITE_PATH, MYSQL_POOL_SIZE, MYSQL_REPLICA_CONFIG,
+                    REPLICA_MAX_LAG_SECONDS, REPLICA_LAG_CHECK_INTERVAL, REPLICA_STICKY_SECONDS,
+                    REPLICA_SHARED_CHECK_SECONDS,
+                    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_BATCH_PAUSE, EXPORT_FETCH_SIZE,
+                    RESTAURANTS, DEFAULT_RESTAURANT_ID, CHECKOUT_TTL_MINUTES)
+from db_backends import create_backend
+from tenants import current_restaurant_id, use_restaurant
+from logs import log_event
 import json
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 import logging
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Бэкенд хранения (MySQL или SQLite) выбирается в config.py
+backend = create_backend(DB_BACKEND, MYSQL_CONFIG, SQLITE_PATH, pool_name='primary', pool_size=MYSQL_POOL_SIZE)
+Error = backend.Error
+
+# Базы филиалов (config.RESTAURANTS[...]['db']). get_connection() ведёт в базу филиала из
+# tenants.current_restaurant_id(); филиалы без своей базы и общие таблицы (кеш геокодера,
+# счётчики лимитов, выбор филиала пользователем) — в основной базе. Диалект у всех баз один,
+# поэтому фрагменты SQL берутся из backend.
+shards = {None: backend}        # ключ базы -> бэкенд
+restaurant_shards = {}          # restaurant_id -> ключ базы
+for _restaurant_id, _restaurant in RESTAURANTS.items():
+    _db = _restaurant['db']
+    _key = json.dumps(_db, sort_keys=True) if _db else None
+    if _key not in shards:
+        shards[_key] = create_backend(DB_BACKEND, {**MYSQL_CONFIG, **{k: v for k, v in _db.items() if k != 'path'}},
+                                      _db.get('path', SQLITE_PATH), pool_name=f"shard{len(shards)}",
+                                      pool_size=MYSQL_POOL_SIZE)
+    restaurant_shards[_restaurant_id] = _key
+
+def shard_restaurant_ids():
+    """По одному филиалу на каждую базу: фоновые задачи обходят базы через use_restaurant(id)."""
+    first = {}
+    for restaurant_id, key in restaurant_shards.items():
+        first.setdefault(key, restaurant_id)
+    return list(first.values())
+
+def restaurants_in_shard(restaurant_id=None):
+    """Филиалы, которые живут в той же базе, что и данный."""
+    key = restaurant_shards[restaurant_id or current_restaurant_id()]
+    return [rid for rid, k in restaurant_shards.items() if k == key]
+
+# Реплика для чтения (только MySQL). Функции чтения, которым не критична свежесть данных
+# (меню, роли, промоакции, история заказов, список промокодов), берут соединение через
+# get_read_connection(); всё, что пишет или принимает решения по свежему состоянию
+# (создание заказов, статусы, проверка и списание промокодов, фоновые рассылки), — через get_connection().
+# Read-your-writes: после записи mark_write(key) чтения по этому ключу REPLICA_STICKY_SECONDS идут
+# на основной сервер. Отметка хранится в памяти процесса. Заказ же создаёт один процесс (бот), а историю
+# читает другой (воркер API): поэтому заказ в той же транзакции отмечает пользователя ещё и в таблице
+# recent_writes основной базы, а чтения по ключу пользователя без своей отметки сверяются с ней —
+# не чаще раза в REPLICA_SHARED_CHECK_SECONDS на пользователя.
+replica_backend = (create_backend('mysql', MYSQL_REPLICA_CONFIG, pool_name='replica', pool_size=MYSQL_POOL_SIZE)
+                   if DB_BACKEND == 'mysql' and MYSQL_REPLICA_CONFIG else None)
+
+_recent_writes = {}  # ключ пользователя -> time.monotonic() последней записи (отметки этого процесса)
+_recent_writes_lock = threading.Lock()
+_shared_checked = {}  # ключ пользователя -> time.monotonic() последней проверки recent_writes без отметки
+_replica_state = {'checked_at': 0.0, 'healthy': False, 'lag': None}
+_replica_lock = threading.Lock()
+
+def _current_backend():
+    return shards[restaurant_shards[current_restaurant_id()]]
+
 def get_connection():
     try:
-        conn = mysql.connector.connect(**MYSQL_CONFIG)
+        conn = _current_backend().connect()
+        if conn.is_connected():
+            return conn
+    except Error as e:
+        logger.error(f"Ошибка подключения: {e}")
+        return None
+
+def get_main_connection():
+    """Соединение с основной базой — для таблиц, общих для всех филиалов."""
+    try:
+        conn = backend.connect()
         if conn.is_connected():
             return conn
     except Error as e:
         logger.error(f"Ошибка подключения: {e}")
         return None
 
-def init_db():
+RECENT_WRITE_UPSERT = backend.upsert_add('recent_writes', ('write_key',), (), ('written_at',))
+
+def _write_key(key, restaurant_id=None):
+    """Ключ отметки в recent_writes: '<филиал>:<ключ>' (('username', 'bob') -> '1:username:bob')."""
+    parts = key if isinstance(key, tuple) else (key,)
+    return ':'.join(str(p) for p in (restaurant_id or current_restaurant_id(),) + parts)[:191]
+
+def mark_write(key):
+    """Запоминает запись по ключу (telegram_id, ('username', ...), 'menu' ...):
+    чтения с этим ключом в этом процессе какое-то время идут на основной сервер (read-your-writes)."""
+    # Реплика есть только у основной базы — филиалам со своей базой отмечать нечего
+    if replica_backend is None or key is None or restaurant_shards[current_restaurant_id()] is not None:
+        return
+    _remember_write((current_restaurant_id(), key), time.monotonic())
+
+def _remember_write(marker, at):
+    with _recent_writes_lock:
+        _recent_writes[marker] = at
+        _shared_checked.pop(marker, None)
+        # Чистим устаревшие ключи, чтобы словарь не рос бесконечно
+        if len(_recent_writes) > 10000:
+            for k, t in list(_recent_writes.items()):
+                if at - t > REPLICA_STICKY_SECONDS:
+                    del _recent_writes[k]
+
+def _mark_shared_writes(cursor, writes):
+    """Отметки заказов в recent_writes в открытой транзакции заказа; writes — [(restaurant_id, user_id)].
+    Отмечаются только филиалы основной базы: у неё одной есть реплика."""
+    if replica_backend is None:
+        return
+    written_at = datetime.now()
+    rows = {(_write_key(user_id, restaurant_id), written_at) for restaurant_id, user_id in writes
+            if user_id is not None and restaurant_shards[restaurant_id] is None}
+    if rows:
+        cursor.executemany(RECENT_WRITE_UPSERT, sorted(rows))
+
+def prune_recent_writes():
+    """Удаляет устаревшие отметки recent_writes (периодическая задача бота)."""
+    if replica_backend is None:
+        return 0
+    conn = get_main_connection()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM recent_writes WHERE written_at < %s",
+                       (datetime.now() - timedelta(seconds=REPLICA_STICKY_SECONDS),))
+        conn.commit()
+        return cursor.rowcount
+    except Error as e:
+        logger.error(f"Ошибка очистки recent_writes: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def _shared_write_age(key):
+    """Сколько секунд назад заказ пользователя отметил другой процесс (None — отметки нет
+    или основной сервер недоступен: тогда читаем с реплики, а не нагружаем основной)."""
+    conn = get_main_connection()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT written_at FROM recent_writes WHERE write_key = %s", (_write_key(key),))
+        row = cursor.fetchone()
+        return (datetime.now() - row[0]).total_seconds() if row else None
+    except Error as e:
+        logger.warning(f"Ошибка проверки отметки записи {key}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def _is_sticky(key):
+    marker = (current_restaurant_id(), key)
+    now = time.monotonic()
+    with _recent_writes_lock:
+        t = _recent_writes.get(marker)
+        checked = _shared_checked.get(marker)
+    if t is not None and now - t < REPLICA_STICKY_SECONDS:
+        return True
+    # Общие отметки есть только у пользователей (заказы); проверенный недавно ключ не перепроверяем
+    if not isinstance(key, int) or (checked is not None and now - checked < REPLICA_SHARED_CHECK_SECONDS):
+        return False
+    age = _shared_write_age(key)
+    if age is not None and age < REPLICA_STICKY_SECONDS:
+        _remember_write(marker, now - max(age, 0))
+        return True
+    with _recent_writes_lock:
+        _shared_checked[marker] = now
+        if len(_shared_checked) > 10000:
+            for k, c in list(_shared_checked.items()):
+                if now - c > REPLICA_SHARED_CHECK_SECONDS:
+                    del _shared_checked[k]
+    return False
+
+def _replica_is_fresh():
+    """Проверяет отставание реплики не чаще раза в REPLICA_LAG_CHECK_INTERVAL секунд."""
+    now = time.monotonic()
+    if now - _replica_state['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_state['healthy']
+    with _replica_lock:
+        if now - _replica_state['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+            return _replica_state['healthy']
+        lag = None
+        try:
+            conn = replica_backend.connect()
+            try:
+                lag = replica_backend.replica_lag(conn)
+            finally:
+                conn.close()
+        except Error as e:
+            logger.warning(f"Реплика недоступна: {e}")
+        healthy = lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        if healthy != _replica_state['healthy']:
+            logger.warning(f"Реплика {'снова используется' if healthy else 'отключена'}: lag={lag}")
+        _replica_state.update(checked_at=time.monotonic(), healthy=healthy, lag=lag)
+        return healthy
+
+def get_read_connection(key=None):
+    """Соединение для чтения: реплика, если она не отстаёт и по ключу ничего не писали только что.
+    Реплика есть только у основной базы."""
+    if (replica_backend is None or restaurant_shards[current_restaurant_id()] is not None
+            or (key is not None and _is_sticky(key)) or not _replica_is_fresh()):
+        return get_connection()
+    try:
+        conn = replica_backend.connect()
+        if conn.is_connected():
+            return conn
+    except Error as e:
+        logger.warning(f"Ошибка подключения к реплике, читаем с основного: {e}")
+    return get_connection()
+
+def get_replica_status():
+    return {'configured': replica_backend is not None, 'healthy': _replica_state['healthy'], 'lag': _replica_state['lag']}
+
+# Версия схемы: увеличивается при каждом изменении _init_schema. Схему создаёт и обновляет
+# `python manage.py migrate` (бот — при старте); воркеры API её только сверяют в /readyz.
+SCHEMA_VERSION = 5
+SCHEMA_VERSION_UPSERT = backend.upsert_add('schema_version', ('id',), (), ('version', 'applied_at'))
+
+def init_db(all_shards=True):
+    """Создаёт и обновляет схему в каждой базе филиалов (all_shards=False — только в базе текущего)."""
+    for restaurant_id in (shard_restaurant_ids() if all_shards else [current_restaurant_id()]):
+        with use_restaurant(restaurant_id):
+            if _init_schema():
+                # Агрегаты без restaurant_id пересозданы — заполняем их заново по истории заказов
+                rebuild_sales_rollups()
+
+def warm_up_pools():
+    """Заранее открывает соединения со всеми базами, чтобы первый запрос не ждал подключения."""
+    for shard in shards.values():
+        shard.warm_up()
+    if replica_backend is not None:
+        replica_backend.warm_up()
+        _replica_is_fresh()
+
+def check_database():
+    """Состояние базы текущего филиала: ok — база доступна и схема актуальна."""
+    started = time.monotonic()
+    status = {'ok': False, 'schema_version': None, 'pool': _current_backend().pool_status()}
+    conn = get_connection()
+    if conn is None:
+        return status
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version FROM schema_version WHERE id = 1")
+        row = cursor.fetchone()
+        status['schema_version'] = row[0] if row else None
+        status['ok'] = status['schema_version'] == SCHEMA_VERSION
+    except Error as e:
+        # Таблицы нет — migrate ещё не запускали
+        logger.warning(f"Ошибка проверки версии схемы: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    status['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return status
+
+def _init_schema():
+    """Создаёт и обновляет таблицы базы текущего филиала. True — агрегаты продаж нужно пересобрать."""
     conn = get_connection()
     cursor = conn.cursor()
     # users: telegram_id, username, role (user/admin/courier/delivery)
@@ -29,11 +277,13 @@ def init_db():
         role VARCHAR(20) DEFAULT 'user'
     )
     ''')
+    # Когда бот получил от Telegram «заблокирован / аккаунт удалён»; такие пользователи не попадают в рассылки
+    backend.ensure_column(cursor, 'users', 'blocked_at', 'DATETIME NULL')
 
     # dishes: supports image_url, category and sizes (JSON)
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE IF NOT EXISTS dishes (
-        id INT AUTO_INCREMENT PRIMARY KEY,
+        id {backend.AUTO_ID},
         name VARCHAR(200),
         price DECIMAL(10,2),
         description TEXT,
@@ -44,9 +294,9 @@ def init_db():
     ''')
 
     # orders (обновлено поле status и добавлено courier_id, order_type, pickup_notified)
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE IF NOT EXISTS orders (
-        id INT AUTO_INCREMENT PRIMARY KEY,
+        id {backend.AUTO_ID},
         user_id BIGINT NOT NULL,
         dishes JSON NOT NULL,
         address TEXT NOT NULL,
@@ -56,38 +306,296 @@ def init_db():
         order_type VARCHAR(20) DEFAULT 'delivery',  -- Новый параметр для типа заказа
         payment_provider VARCHAR(100),
         payment_id VARCHAR(255),
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        created_at DATETIME DEFAULT {backend.CURRENT_TIMESTAMP},
         notified DATETIME NULL,
         pickup_notified DATETIME NULL  -- Новый параметр для уведомлений о готовности самовывоза
     )
     ''')
+    # order_items: позиции заказа со снимком названия и цены на момент заказа
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS order_items (
+        id {backend.AUTO_ID},
+        order_id INT NOT NULL,
+        dish_id INT NULL,
+        size VARCHAR(50) NULL,
+        qty INT NOT NULL DEFAULT 1,
+        unit_price DECIMAL(10,2) NOT NULL DEFAULT 0,
+        name VARCHAR(200),
+        created_at DATETIME  -- копия orders.created_at для отчётов без JOIN (заказ может быть в архиве)
+    )
+    ''')
+    backend.ensure_index(cursor, 'order_items', 'idx_order_items_order', 'order_id')
+    backend.ensure_index(cursor, 'order_items', 'idx_order_items_dish_created', 'dish_id, created_at')
+    backend.ensure_index(cursor, 'order_items', 'idx_order_items_created', 'created_at')
 
-    # promotions
+    # Агрегаты продаж для админ-статистики по филиалам, обновляются инкрементально вместе с заказами
+    # (см. _bump_order_rollups); пересобрать с нуля: python manage.py backfill_stats.
+    # Таблицы старой схемы (без restaurant_id в ключе) пересоздаются и заполняются заново
+    rebuild_rollups = False
+    for table in SALES_ROLLUP_TABLES:
+        if not backend.has_column(cursor, table, 'restaurant_id'):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            rebuild_rollups = True
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        restaurant_id INT NOT NULL,
+        sales_date DATE NOT NULL,
+        order_type VARCHAR(20) NOT NULL,
+        status VARCHAR(30) NOT NULL,
+        order_count INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, sales_date, order_type, status)
+    )
+    ''')
     cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_hourly (
+        restaurant_id INT NOT NULL,
+        sales_hour DATETIME NOT NULL,
+        order_type VARCHAR(20) NOT NULL,
+        status VARCHAR(30) NOT NULL,
+        order_count INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, sales_hour, order_type, status)
+    )
+    ''')
+    # Продажи блюд без учёта заказов в статусе failed; dish_id = 0 — позиция без id
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS dish_sales_daily (
+        restaurant_id INT NOT NULL,
+        sales_date DATE NOT NULL,
+        dish_id INT NOT NULL,
+        name VARCHAR(200),
+        qty INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, sales_date, dish_id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS promo_redemptions_daily (
+        restaurant_id INT NOT NULL,
+        sales_date DATE NOT NULL,
+        code VARCHAR(50) NOT NULL,
+        uses INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, sales_date, code)
+    )
+    ''')
+
+    # Сканы по статусу (курьеры, фоновые уведомления, архивация) и история пользователя
+    backend.ensure_index(cursor, 'orders', 'idx_orders_status_created', 'status, created_at')
+    backend.ensure_index(cursor, 'orders', 'idx_orders_user', 'user_id')
+    backend.ensure_index(cursor, 'orders', 'idx_orders_courier_status', 'courier_id, status')
+
+    # Лента изменений заказов: id события служит курсором, по которому админка и доски
+    # курьеров забирают только изменившиеся заказы
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS order_events (
+        id {backend.AUTO_ID},
+        order_id INT NOT NULL,
+        status VARCHAR(30),
+        courier_id BIGINT,
+        created_at DATETIME DEFAULT {backend.CURRENT_TIMESTAMP}
+    )
+    ''')
+    backend.ensure_index(cursor, 'order_events', 'idx_order_events_created', 'created_at')
+    backend.ensure_index(cursor, 'order_events', 'idx_order_events_order', 'order_id')
+
+    # orders_archive: завершённые заказы, перенесённые из orders (см. archive_orders_batch)
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        id INT PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        dishes JSON NOT NULL,
+        address TEXT NOT NULL,
+        total DECIMAL(10,2) DEFAULT 0,
+        status VARCHAR(30),
+        courier_id BIGINT DEFAULT NULL,
+        order_type VARCHAR(20),
+        payment_provider VARCHAR(100),
+        payment_id VARCHAR(255),
+        created_at DATETIME,
+        notified DATETIME NULL,
+        pickup_notified DATETIME NULL,
+        archived_at DATETIME DEFAULT {backend.CURRENT_TIMESTAMP}
+    )
+    ''')
+    backend.ensure_index(cursor, 'orders_archive', 'idx_orders_archive_user', 'user_id')
+    backend.ensure_index(cursor, 'orders_archive', 'idx_orders_archive_created', 'created_at')
+
+    # promotions
+    cursor.execute(f'''
     CREATE TABLE IF NOT EXISTS promotions (
-        id INT AUTO_INCREMENT PRIMARY KEY,
+        id {backend.AUTO_ID},
         text VARCHAR(255),
         image_url TEXT
     )
     ''')
 
-    # promo_codes
+    # Рассылки: прогресс (last_user_id — курсор по users.telegram_id) сохраняется пачками,
+    # поэтому после перезапуска бот продолжает с места остановки
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id {backend.AUTO_ID},
+        text TEXT NOT NULL,
+        image_url TEXT,
+        status VARCHAR(20) DEFAULT 'queued',  -- queued, running, paused, done, cancelled
+        created_by BIGINT,
+        created_at DATETIME DEFAULT {backend.CURRENT_TIMESTAMP},
+        started_at DATETIME NULL,
+        finished_at DATETIME NULL,
+        last_user_id BIGINT DEFAULT 0,
+        total INT NULL,
+        sent INT DEFAULT 0,
+        blocked INT DEFAULT 0,
+        failed INT DEFAULT 0,
+        rate FLOAT DEFAULT 0                  -- сообщений в секунду за последнюю пачку
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INT NOT NULL,
+        user_id BIGINT NOT NULL,
+        status VARCHAR(20) NOT NULL,          -- sent, blocked, gone, failed
+        error VARCHAR(255),
+        sent_at DATETIME,
+        PRIMARY KEY (broadcast_id, user_id)
+    )
+    ''')
+
+    # Общие счётчики ограничения частоты (RATE_LIMIT_BACKEND=db): окно фиксированной длины
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limit_counters (
+        bucket_key VARCHAR(191) NOT NULL,
+        window_start BIGINT NOT NULL,
+        hits INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket_key, window_start)
+    )
+    ''')
+
+    # Доставка (geo.py): кеш геокодера по нормализованному адресу (lat/lon NULL — адрес не найден),
+    # последние координаты курьеров и рассчитанные зона/стоимость/ETA заказа
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        address_key VARCHAR(191) PRIMARY KEY,
+        address VARCHAR(255),
+        lat DOUBLE,
+        lon DOUBLE,
+        created_at DATETIME DEFAULT {backend.CURRENT_TIMESTAMP}
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS courier_locations (
+        courier_id BIGINT PRIMARY KEY,
+        lat DOUBLE NOT NULL,
+        lon DOUBLE NOT NULL,
+        updated_at DATETIME NOT NULL
+    )
+    ''')
     cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_delivery (
+        order_id INT PRIMARY KEY,
+        lat DOUBLE,
+        lon DOUBLE,
+        zone VARCHAR(50),
+        distance_km DECIMAL(6,2),
+        fee DECIMAL(10,2),
+        eta_minutes INT
+    )
+    ''')
+
+    # promo_codes
+    cursor.execute(f'''
     CREATE TABLE IF NOT EXISTS promo_codes (
-        id INT AUTO_INCREMENT PRIMARY KEY,
+        id {backend.AUTO_ID},
         code VARCHAR(50) UNIQUE NOT NULL,
         discount DECIMAL(5,2) NOT NULL,  -- процент скидки (например, 20.00)
         max_uses INT DEFAULT 1,          -- максимум использований
         uses INT DEFAULT 0,              -- текущее количество использований
         expires_at DATE,                 -- дата истечения (YYYY-MM-DD)
         is_active BOOLEAN DEFAULT TRUE,  -- активен ли
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        created_at DATETIME DEFAULT {backend.CURRENT_TIMESTAMP}
+    )
+    ''')
+
+    # Филиал, который пользователь выбрал последним (deep link /start r<id> или WebApp); читается из основной базы
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_restaurants (
+        telegram_id BIGINT PRIMARY KEY,
+        restaurant_id INT NOT NULL,
+        updated_at DATETIME
+    )
+    ''')
+
+    # Отметки последних заказов пользователей для read-your-writes между процессами (основная база, см. _is_sticky)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS recent_writes (
+        write_key VARCHAR(191) PRIMARY KEY,
+        written_at DATETIME(3) NOT NULL
+    )
+    ''')
+
+    # Админы филиалов (основная база): у админа без строк здесь — доступ ко всем филиалам
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS admin_restaurants (
+        telegram_id BIGINT NOT NULL,
+        restaurant_id INT NOT NULL,
+        PRIMARY KEY (telegram_id, restaurant_id)
+    )
+    ''')
+
+    # Данные филиалов в общей базе разделяются по restaurant_id
+    for table in ('dishes', 'orders', 'orders_archive', 'promotions', 'promo_codes', 'broadcasts'):
+        backend.ensure_column(cursor, table, 'restaurant_id', f'INT NOT NULL DEFAULT {DEFAULT_RESTAURANT_ID}')
+    if backend.ensure_column(cursor, 'order_events', 'restaurant_id', f'INT NOT NULL DEFAULT {DEFAULT_RESTAURANT_ID}'):
+        cursor.execute("""
+            UPDATE order_events SET restaurant_id = (SELECT o.restaurant_id FROM orders o WHERE o.id = order_events.order_id)
+            WHERE order_id IN (SELECT id FROM orders)
+        """)
+    backend.ensure_index(cursor, 'dishes', 'idx_dishes_restaurant', 'restaurant_id, category')
+    backend.ensure_index(cursor, 'orders', 'idx_orders_restaurant_status', 'restaurant_id, status')
+    backend.ensure_index(cursor, 'order_events', 'idx_order_events_restaurant', 'restaurant_id, id')
+    # Свежие адреса подгружаются в память воркера API при старте
+    backend.ensure_index(cursor, 'geocode_cache', 'idx_geocode_created', 'created_at')
+
+    # Остатки блюд: строка есть только у блюд, остаток которых отслеживается (нет строки — без ограничений).
+    # size '' — остаток блюда целиком, иначе — конкретного размера. reserved — в заказах, которые кухня
+    # ещё не взяла; доступно quantity - reserved, 0 — блюдо в стоп-листе
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS dish_stock (
+        dish_id INT NOT NULL,
+        size VARCHAR(50) NOT NULL DEFAULT '',
+        quantity INT NOT NULL DEFAULT 0,
+        reserved INT NOT NULL DEFAULT 0,
+        updated_at DATETIME,
+        PRIMARY KEY (dish_id, size)
+    )
+    ''')
+    # Что именно зарезервировано под заказ: списывается или возвращается при смене его статуса
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_reservations (
+        order_id INT NOT NULL,
+        dish_id INT NOT NULL,
+        size VARCHAR(50) NOT NULL DEFAULT '',
+        qty INT NOT NULL
+    )
+    ''')
+    backend.ensure_index(cursor, 'stock_reservations', 'idx_stock_reservations_order', 'order_id')
+    # Заказ ушёл в failed из pending/paid и его резерв вернулся на остаток: при выходе из failed
+    # блюда резервируются заново. Уже списанные (кухня взяла заказ) повторно не трогаются
+    backend.ensure_column(cursor, 'orders', 'stock_released', 'BOOLEAN NOT NULL DEFAULT 0')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        id INT PRIMARY KEY,
+        version INT NOT NULL,
+        applied_at DATETIME
     )
     ''')
+    cursor.execute(SCHEMA_VERSION_UPSERT, (1, SCHEMA_VERSION, datetime.now().replace(microsecond=0)))
 
     conn.commit()
     cursor.close()
     conn.close()
+    return rebuild_rollups
 
 # user helpers
 def add_user(telegram_id, role='user', username=None):
@@ -96,9 +604,12 @@ def add_user(telegram_id, role='user', username=None):
     # Если telegram_id отсутствует, используем 0 как временный идентификатор
     telegram_id = telegram_id if telegram_id is not None else 0
     try:
-        cursor.execute("INSERT IGNORE INTO users (telegram_id, username, role) VALUES (%s, %s, %s)",
+        cursor.execute(f"{backend.INSERT_IGNORE} INTO users (telegram_id, username, role) VALUES (%s, %s, %s)",
                        (telegram_id, username, role))
         conn.commit()
+        mark_write(telegram_id)
+        if username:
+            mark_write(('username', username))
         return True
     except Error as e:
         logger.error(f"Ошибка добавления пользователя: {e}")
@@ -113,6 +624,7 @@ def set_user_role_by_username(username, role):
     try:
         cursor.execute("UPDATE users SET role = %s WHERE username = %s", (role, username))
         conn.commit()
+        mark_write(('username', username))
         return cursor.rowcount > 0
     except Error as e:
         logger.error(f"Ошибка установки роли: {e}")
@@ -127,6 +639,7 @@ def set_user_username(telegram_id, username):
     try:
         cursor.execute("UPDATE users SET username = %s WHERE telegram_id = %s", (username, telegram_id))
         conn.commit()
+        mark_write(telegram_id)
         return cursor.rowcount > 0
     except Error as e:
         logger.error(f"Ошибка обновления username: {e}")
@@ -135,9 +648,22 @@ def set_user_username(telegram_id, username):
         cursor.close()
         conn.close()
 
-def get_user_role(telegram_id=None, username=None):
+def mark_user_reachable(telegram_id):
+    """Пользователь снова пишет боту — возвращаем его в рассылки."""
     conn = get_connection()
     cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE users SET blocked_at = NULL WHERE telegram_id = %s AND blocked_at IS NOT NULL", (telegram_id,))
+        conn.commit()
+    except Error as e:
+        logger.error(f"Ошибка сброса blocked_at: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_user_role(telegram_id=None, username=None):
+    conn = get_read_connection(telegram_id or ('username', username))
+    cursor = conn.cursor()
     try:
         if telegram_id:
             cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (telegram_id,))
@@ -157,7 +683,7 @@ def get_user_role(telegram_id=None, username=None):
         conn.close()
 
 def get_user_by_username(username):
-    conn = get_connection()
+    conn = get_read_connection(('username', username))
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT telegram_id, role FROM users WHERE username = %s", (username,))
@@ -171,7 +697,7 @@ def get_user_by_username(username):
         conn.close()
 
 def get_admin_username():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT username FROM users WHERE role = 'admin' LIMIT 1")
@@ -184,204 +710,1720 @@ def get_admin_username():
         cursor.close()
         conn.close()
 
-# dishes
-def add_dish(name, price, description=None, image_url=None, category='other', sizes=None):
-    conn = get_connection()
+def get_courier_ids():
+    conn = get_read_connection()
     cursor = conn.cursor()
-    sizes_json = json.dumps(sizes) if sizes else None
     try:
-        cursor.execute("INSERT INTO dishes (name, price, description, image_url, category, sizes) VALUES (%s, %s, %s, %s, %s, %s)",
-                       (name, price, description, image_url, category, sizes_json))
-        conn.commit()
-        return True
+        cursor.execute(f"SELECT telegram_id FROM users WHERE {backend.json_contains('role', 'courier')}")
+        return filter_restaurant_users([r[0] for r in cursor.fetchall()])
     except Error as e:
-        logger.error(f"Ошибка добавления блюда: {e}")
-        return False
+        logger.error(f"Ошибка получения курьеров: {e}")
+        return []
     finally:
         cursor.close()
         conn.close()
 
-def remove_dish(dish_id):
-    conn = get_connection()
+# выбор филиала пользователем (основная база)
+USER_RESTAURANT_UPSERT = backend.upsert_add('user_restaurants', ('telegram_id',), (), ('restaurant_id', 'updated_at'))
+
+def set_user_restaurant(telegram_id, restaurant_id):
+    conn = get_main_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM dishes WHERE id = %s", (dish_id,))
+        cursor.execute(USER_RESTAURANT_UPSERT, (telegram_id, restaurant_id, datetime.now().replace(microsecond=0)))
         conn.commit()
-        return cursor.rowcount > 0
+        return True
     except Error as e:
-        logger.error(f"Ошибка удаления блюда: {e}")
+        conn.rollback()
+        logger.error(f"Ошибка сохранения филиала пользователя {telegram_id}: {e}")
         return False
     finally:
         cursor.close()
         conn.close()
 
-def get_dishes(category=None):
-    conn = get_connection()
+def get_user_restaurants(telegram_ids):
+    """{telegram_id: restaurant_id} для пользователей, которые выбирали филиал."""
+    if not telegram_ids:
+        return {}
+    conn = get_main_connection()
     cursor = conn.cursor()
     try:
-        if category:
-            cursor.execute("SELECT id, name, price, description, image_url, category, sizes FROM dishes WHERE category = %s", (category,))
-        else:
-            cursor.execute("SELECT id, name, price, description, image_url, category, sizes FROM dishes")
-        rows = cursor.fetchall()
-        dishes = []
-        for r in rows:
-            sizes = None
-            try:
-                sizes = json.loads(r[6]) if r[6] else None
-            except:
-                sizes = None
-            dishes.append({
-                "id": r[0],
-                "name": r[1],
-                "price": float(r[2]),
-                "description": r[3],
-                "image_url": r[4],
-                "category": r[5],
-                "sizes": sizes
-            })
-        return dishes
+        ids = list(telegram_ids)
+        cursor.execute(f"SELECT telegram_id, restaurant_id FROM user_restaurants WHERE telegram_id IN "
+                       f"({', '.join(['%s'] * len(ids))})", ids)
+        return dict(cursor.fetchall())
     except Error as e:
-        logger.error(f"Ошибка получения блюд: {e}")
-        return []
+        logger.error(f"Ошибка получения филиалов пользователей: {e}")
+        return {}
     finally:
         cursor.close()
         conn.close()
 
-# orders
-def add_order(user_id, dishes_json, address, total, order_type='delivery', payment_provider=None, payment_id=None):
-    conn = get_connection()
+def get_admin_restaurants(telegram_id):
+    """Филиалы, которыми управляет админ; пустой список — все филиалы."""
+    conn = get_main_connection()
     cursor = conn.cursor()
     try:
-        # Проверяем total, если он передан как 0 или None, рассчитываем из dishes_json
-        if total <= 0:
-            dishes = json.loads(dishes_json)
-            total = sum(float(d.get('price', 0)) * (d.get('qty', 1) or 1) for d in dishes)
-        cursor.execute("""
-            INSERT INTO orders (user_id, dishes, address, total, status, order_type, payment_provider, payment_id)
-            VALUES (%s, %s, %s, %s, 'pending', %s, %s, %s)
-        """, (user_id, dishes_json, address, total, order_type, payment_provider, payment_id))
-        conn.commit()
-        cursor.execute("SELECT LAST_INSERT_ID()")
-        order_id = cursor.fetchone()[0]
-        logger.info(f"Added order {order_id} for user {user_id} with type {order_type}")
-        return order_id  # Возвращаем order_id
+        cursor.execute("SELECT restaurant_id FROM admin_restaurants WHERE telegram_id = %s", (telegram_id,))
+        return [r[0] for r in cursor.fetchall()]
     except Error as e:
-        logger.error(f"Ошибка добавления заказа: {e}")
+        logger.error(f"Ошибка получения филиалов админа {telegram_id}: {e}")
         return None
     finally:
         cursor.close()
         conn.close()
 
-def get_new_orders():
-    conn = get_connection()
+def set_admin_restaurant(telegram_id, restaurant_id, allowed=True):
+    """Даёт (allowed=True) или забирает у админа доступ к филиалу."""
+    conn = get_main_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, user_id, dishes, address, total, status, order_type FROM orders WHERE status = 'pending'")
-        rows = cursor.fetchall()
-        return [(r[0], r[1], r[2], r[3], r[4], r[5], r[6]) for r in rows]  # Добавили order_type
+        if allowed:
+            cursor.execute(f"{backend.INSERT_IGNORE} INTO admin_restaurants (telegram_id, restaurant_id) VALUES (%s, %s)",
+                           (telegram_id, restaurant_id))
+        else:
+            cursor.execute("DELETE FROM admin_restaurants WHERE telegram_id = %s AND restaurant_id = %s",
+                           (telegram_id, restaurant_id))
+        conn.commit()
+        return True
     except Error as e:
-        logger.error(f"Ошибка получения новых заказов: {e}")
-        return []
+        conn.rollback()
+        logger.error(f"Ошибка изменения филиалов админа {telegram_id}: {e}")
+        return False
     finally:
         cursor.close()
         conn.close()
 
-def update_order_status(order_id, status, courier_id=None):
+def filter_restaurant_users(telegram_ids):
+    """Оставляет пользователей текущего филиала (без выбора — филиала по умолчанию).
+    В базе одного филиала фильтровать нечего."""
+    if len(restaurants_in_shard()) == 1 or not telegram_ids:
+        return telegram_ids
+    chosen = get_user_restaurants(telegram_ids)
+    restaurant_id = current_restaurant_id()
+    return [i for i in telegram_ids if chosen.get(i, DEFAULT_RESTAURANT_ID) == restaurant_id]
+
+# dishes
+def add_dish(name, price, description=None, image_url=None, category='other', sizes=None):
     conn = get_connection()
     cursor = conn.cursor()
+    sizes_json = json.dumps(sizes) if sizes else None
     try:
-        if courier_id:
-            cursor.execute("UPDATE orders SET status = %s, courier_id = %s WHERE id = %s", (status, courier_id, order_id))
-        else:
-            cursor.execute("UPDATE orders SET status = %s WHERE id = %s", (status, order_id))
+        cursor.execute("INSERT INTO dishes (name, price, description, image_url, category, sizes, restaurant_id) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                       (name, price, description, image_url, category, sizes_json, current_restaurant_id()))
         conn.commit()
-        return cursor.rowcount > 0
+        mark_write('menu')
+        return True
     except Error as e:
-        logger.error(f"Ошибка обновления статуса заказа: {e}")
+        logger.error(f"Ошибка добавления блюда: {e}")
         return False
     finally:
         cursor.close()
         conn.close()
 
-def get_user_id_by_order_id(order_id):
-    """Получает user_id по order_id."""
+def remove_dish(dish_id):
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT user_id FROM orders WHERE id = %s", (order_id,))
-        row = cursor.fetchone()
-        return row[0] if row else None
+        cursor.execute("DELETE FROM dishes WHERE id = %s AND restaurant_id = %s", (dish_id, current_restaurant_id()))
+        conn.commit()
+        mark_write('menu')
+        return cursor.rowcount > 0
     except Error as e:
-        logger.error(f"Ошибка получения user_id для заказа {order_id}: {e}")
-        return None
+        logger.error(f"Ошибка удаления блюда: {e}")
+        return False
     finally:
         cursor.close()
         conn.close()
 
-# promo_codes
-def create_promo(code, discount, max_uses=1, expires_at=None):
-    conn = get_connection()
-    if not conn:
-        return False
+def get_dishes(category=None):
+    conn = get_read_connection('menu')
     cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO promo_codes (code, discount, max_uses, expires_at)
-            VALUES (%s, %s, %s, %s)
-        """, (code.upper(), discount, max_uses, expires_at))
-        conn.commit()
-        return True
+        if category:
+            cursor.execute("SELECT id, name, price, description, image_url, category, sizes FROM dishes WHERE restaurant_id = %s AND category = %s",
+                           (current_restaurant_id(), category))
+        else:
+            cursor.execute("SELECT id, name, price, description, image_url, category, sizes FROM dishes WHERE restaurant_id = %s",
+                           (current_restaurant_id(),))
+        return [_dish_dict(r) for r in cursor.fetchall()]
     except Error as e:
-        logger.error(f"Ошибка создания промокода: {e}")
-        return False
+        logger.error(f"Ошибка получения блюд: {e}")
+        return []
     finally:
         cursor.close()
         conn.close()
 
-def validate_promo(code):
+def _dish_dict(r):
+    sizes = None
+    try:
+        sizes = json.loads(r[6]) if r[6] else None
+    except:
+        sizes = None
+    return {
+        "id": r[0],
+        "name": r[1],
+        "price": float(r[2]),
+        "description": r[3],
+        "image_url": r[4],
+        "category": r[5],
+        "sizes": sizes
+    }
+
+def get_menu_for_sync():
+    """Меню филиала с основного сервера (для сравнения с загружаемым каталогом и поискового индекса);
+    None — ошибка БД."""
     conn = get_connection()
-    if not conn:
-        logger.error("No database connection")
-        return {'valid': False}
     cursor = conn.cursor()
     try:
-        cursor.execute("""
-            SELECT discount, uses, max_uses, expires_at, is_active
-            FROM promo_codes
-            WHERE code = %s AND is_active = TRUE
-        """, (code.upper(),))
-        row = cursor.fetchone()
-        if row:
-            discount, uses, max_uses, expires_at, is_active = row
-            current_date = datetime.now().date()
-            valid = (uses < max_uses and (expires_at is None or current_date <= expires_at))
-            logger.info(f"Validating promo {code}: uses={uses}, max_uses={max_uses}, expires_at={expires_at}, valid={valid}")
-            return {'discount': float(discount), 'valid': valid}
-        logger.info(f"Promo code {code} not found or inactive")
-        return {'valid': False}
+        cursor.execute("SELECT id, name, price, description, image_url, category, sizes FROM dishes WHERE restaurant_id = %s",
+                       (current_restaurant_id(),))
+        return [_dish_dict(r) for r in cursor.fetchall()]
     except Error as e:
-        logger.error(f"Ошибка валидации промокода: {e}")
-        return {'valid': False}
+        logger.error(f"Ошибка получения блюд: {e}")
+        return None
     finally:
         cursor.close()
         conn.close()
 
-def use_promo(code):
+def apply_menu_changes(inserts, updates, deletes):
+    """Новые, изменённые (с id) и удаляемые (id) блюда филиала — одной транзакцией."""
+    restaurant_id = current_restaurant_id()
+    def values(d):
+        return (d['name'], d['price'], d['description'], d['image_url'], d['category'],
+                json.dumps(d['sizes'], ensure_ascii=False) if d['sizes'] else None)
     conn = get_connection()
-    if not conn:
-        logger.error("No database connection")
-        return False
     cursor = conn.cursor()
     try:
+        if inserts:
+            cursor.executemany("INSERT INTO dishes (name, price, description, image_url, category, sizes, restaurant_id) "
+                               "VALUES (%s, %s, %s, %s, %s, %s, %s)", [values(d) + (restaurant_id,) for d in inserts])
+        if updates:
+            cursor.executemany("UPDATE dishes SET name = %s, price = %s, description = %s, image_url = %s, category = %s, sizes = %s "
+                               "WHERE id = %s AND restaurant_id = %s", [values(d) + (d['id'], restaurant_id) for d in updates])
+        for i in range(0, len(deletes), 500):
+            chunk = deletes[i:i + 500]
+            cursor.execute(f"DELETE FROM dishes WHERE restaurant_id = %s AND id IN ({', '.join(['%s'] * len(chunk))})",
+                           [restaurant_id] + list(chunk))
+        conn.commit()
+        mark_write('menu')
+        return True
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка синхронизации меню: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+# orders
+# sales rollups
+SALES_ROLLUP_TABLES = ('sales_daily', 'sales_hourly', 'dish_sales_daily', 'promo_redemptions_daily')
+SALES_DAILY_UPSERT = backend.upsert_add('sales_daily', ('restaurant_id', 'sales_date', 'order_type', 'status'), ('order_count', 'revenue'))
+SALES_HOURLY_UPSERT = backend.upsert_add('sales_hourly', ('restaurant_id', 'sales_hour', 'order_type', 'status'), ('order_count', 'revenue'))
+DISH_SALES_UPSERT = backend.upsert_add('dish_sales_daily', ('restaurant_id', 'sales_date', 'dish_id'), ('qty', 'revenue'), ('name',))
+PROMO_REDEMPTIONS_UPSERT = backend.upsert_add('promo_redemptions_daily', ('restaurant_id', 'sales_date', 'code'), ('uses',))
+
+def _bump_order_rollups(cursor, restaurant_id, created_at, order_type, status, total, sign=1):
+    """Прибавляет (sign=1) или вычитает (sign=-1) заказ из дневных и часовых агрегатов филиала."""
+    order_type = order_type or 'delivery'
+    total = float(total or 0)
+    hour = created_at.replace(minute=0, second=0, microsecond=0)
+    cursor.execute(SALES_DAILY_UPSERT, (restaurant_id, created_at.date(), order_type, status, sign, sign * total))
+    cursor.execute(SALES_HOURLY_UPSERT, (restaurant_id, hour, order_type, status, sign, sign * total))
+
+def _bump_dish_rollups(cursor, restaurant_id, created_at, items, sign=1):
+    """items — кортежи (dish_id, name, qty, unit_price)."""
+    day = created_at.date()
+    rows = [(restaurant_id, day, dish_id or 0, sign * int(qty), sign * int(qty) * float(unit_price), name)
+            for dish_id, name, qty, unit_price in items]
+    if rows:
+        cursor.executemany(DISH_SALES_UPSERT, rows)
+
+ORDER_EVENT_INSERT = "INSERT INTO order_events (order_id, status, courier_id, restaurant_id) VALUES (%s, %s, %s, %s)"
+
+def _change_status(cursor, rows, status, courier_id=None):
+    """Меняет статус заказов текущего филиала и поддерживает агрегаты. rows — строки
+    (id, status, order_type, total, created_at, courier_id), прочитанные в этой же транзакции.
+    Возвращает id заказов, которые действительно изменились."""
+    restaurant_id = current_restaurant_id()
+    changed = [r for r in rows if r[1] != status or (courier_id and r[5] != courier_id)]
+    # Выход из failed: если резерв заказа был возвращён на остаток, резервируем блюда заново, а если
+    # их уже не хватает, переход отклоняется (заказ остаётся failed). Заказ, блюда которого уже
+    # списаны, остаток не трогает
+    revived = []
+    leaving_failed = [r[0] for r in changed if r[1] == 'failed' and status != 'failed']
+    if leaving_failed:
+        cursor.execute(f"SELECT id FROM orders WHERE id IN ({', '.join(['%s'] * len(leaving_failed))}) "
+                       f"AND stock_released = 1", leaving_failed)
+        revived = [r[0] for r in cursor.fetchall()]
+    if revived:
+        rejected = _rereserve_stock(cursor, revived)
+        if rejected:
+            logger.warning(f"Заказы {sorted(rejected)} не переведены из failed в {status}: нет в наличии "
+                           + "; ".join(f"#{i}: {', '.join(str(x['name'] or x['dish_id']) for x in items)}"
+                                       for i, items in rejected.items()))
+            changed = [r for r in changed if r[0] not in rejected]
+    if not changed:
+        return []
+    ids = [r[0] for r in changed]
+    placeholders = ', '.join(['%s'] * len(ids))
+    if courier_id:
+        cursor.execute(f"UPDATE orders SET status = %s, courier_id = %s WHERE id IN ({placeholders})", [status, courier_id] + ids)
+    else:
+        cursor.execute(f"UPDATE orders SET status = %s WHERE id IN ({placeholders})", [status] + ids)
+    cursor.executemany(ORDER_EVENT_INSERT, [(order_id, status, courier_id or r_courier, restaurant_id)
+                                           for order_id, _, _, _, _, r_courier in changed])
+    # Резерв остатков: кухня взяла заказ — списываем, отмена до этого — возвращаем на остаток
+    reserved = [r[0] for r in changed if (r[1] in STOCK_RESERVED_STATUSES or r[0] in revived)
+                and status not in STOCK_RESERVED_STATUSES]
+    if reserved:
+        _settle_stock(cursor, reserved, consume=status != 'failed')
+    released = [r[0] for r in changed if r[1] in STOCK_RESERVED_STATUSES and status == 'failed']
+    flags = [(1, order_id) for order_id in released] + [(0, order_id) for order_id in revived if order_id in ids]
+    if flags:
+        cursor.executemany("UPDATE orders SET stock_released = %s WHERE id = %s", flags)
+    # Переход в failed убирает блюда заказа из продаж, выход из failed — возвращает
+    failed_moves = {r[0]: (1 if r[1] == 'failed' else -1) for r in changed
+                    if (r[1] == 'failed') != (status == 'failed')}
+    items = {}
+    if failed_moves:
+        fm_placeholders = ', '.join(['%s'] * len(failed_moves))
+        cursor.execute(f"SELECT order_id, dish_id, name, qty, unit_price FROM order_items WHERE order_id IN ({fm_placeholders})",
+                       list(failed_moves))
+        for order_id, dish_id, name, qty, unit_price in cursor.fetchall():
+            items.setdefault(order_id, []).append((dish_id, name, qty, unit_price))
+    for order_id, old_status, order_type, total, created_at, _ in changed:
+        if old_status == status:
+            continue
+        _bump_order_rollups(cursor, restaurant_id, created_at, order_type, old_status, total, -1)
+        _bump_order_rollups(cursor, restaurant_id, created_at, order_type, status, total, 1)
+        if order_id in failed_moves:
+            _bump_dish_rollups(cursor, restaurant_id, created_at, items.get(order_id, []), failed_moves[order_id])
+    return ids
+
+def _order_item_rows(order_id, dishes, created_at):
+    """Строки order_items из позиций корзины WebApp: {id, name, qty, price[, size]}."""
+    rows = []
+    for d in dishes:
+        rows.append((order_id, d.get('id'), d.get('size'), int(d.get('qty', 1) or 1),
+                     float(d.get('price', 0) or 0), d.get('name'), created_at))
+    return rows
+
+ORDER_ITEMS_INSERT = """
+    INSERT INTO order_items (order_id, dish_id, size, qty, unit_price, name, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+class OutOfStock(Exception):
+    """Блюд из корзины не хватает; items — [{'dish_id', 'size', 'name', 'available'}]."""
+
+    def __init__(self, items):
+        super().__init__(', '.join(i['name'] or str(i['dish_id']) for i in items))
+        self.items = items
+
+# Статусы, в которых блюда заказа зарезервированы, но ещё не списаны с остатка
+STOCK_RESERVED_STATUSES = ('pending', 'paid')
+
+def _stock_case(amounts, default='NULL'):
+    """CASE по (dish_id, size) -> число для одного UPDATE сразу по всем строкам dish_stock."""
+    whens, params = [], []
+    for (dish_id, size), amount in amounts.items():
+        whens.append("WHEN dish_id = %s AND size = %s THEN %s")
+        params += [dish_id, size, amount]
+    return f"CASE {' '.join(whens)} ELSE {default} END", params
+
+def cart_stock_need(dishes):
+    """{(dish_id, size): qty} и названия позиций корзины."""
+    need, names = {}, {}
+    for d in dishes:
+        try:
+            key = (int(d.get('id')), str(d.get('size') or ''))
+        except (TypeError, ValueError):
+            continue
+        need[key] = need.get(key, 0) + max(int(d.get('qty', 1) or 1), 1)
+        names[key] = d.get('name')
+    return need, names
+
+def _reserve_stock(cursor, order_id, dishes):
+    """Резервирует отслеживаемые блюда корзины одним условным UPDATE: строка меняется, только
+    если доступного хватает, поэтому параллельные заказы из бота и API не уходят в минус.
+    Не хватает хотя бы одного — OutOfStock (транзакцию откатывает вызывающий)."""
+    need, names = cart_stock_need(dishes)
+    if not need:
+        return
+    dish_ids = sorted({dish_id for dish_id, _ in need})
+    in_ids = ', '.join(['%s'] * len(dish_ids))
+    cursor.execute(f"SELECT dish_id, size, quantity - reserved FROM dish_stock WHERE dish_id IN ({in_ids})", dish_ids)
+    stock = {(r[0], r[1]): r[2] for r in cursor.fetchall()}
+    if not stock:
+        return
+    # Размер без своей строки берётся из остатка блюда целиком
+    wanted, wanted_names = {}, {}
+    for (dish_id, size), qty in need.items():
+        key = (dish_id, size) if (dish_id, size) in stock else (dish_id, '')
+        if key in stock:
+            wanted[key] = wanted.get(key, 0) + qty
+            wanted_names[key] = names[(dish_id, size)]
+    if not wanted:
+        return
+    short = [key for key, qty in wanted.items() if stock[key] < qty]
+    if not short:
+        case, params = _stock_case(wanted)
+        ids = sorted({dish_id for dish_id, _ in wanted})
+        cursor.execute(f"UPDATE dish_stock SET reserved = reserved + {case} "
+                       f"WHERE dish_id IN ({', '.join(['%s'] * len(ids))}) AND quantity - reserved >= {case}",
+                       params + ids + params)
+        if cursor.rowcount == len(wanted):
+            cursor.executemany("INSERT INTO stock_reservations (order_id, dish_id, size, qty) VALUES (%s, %s, %s, %s)",
+                               [(order_id, dish_id, size, qty) for (dish_id, size), qty in wanted.items()])
+            return
+        # Остаток успел уменьшить параллельный заказ — перечитываем, чтобы назвать недостающее
+        cursor.execute(f"SELECT dish_id, size, quantity - reserved FROM dish_stock WHERE dish_id IN ({in_ids})", dish_ids)
+        stock = {(r[0], r[1]): r[2] for r in cursor.fetchall()}
+        short = [key for key, qty in wanted.items() if stock.get(key, 0) < qty] or list(wanted)
+    raise OutOfStock([{'dish_id': dish_id, 'size': size or None, 'name': wanted_names[(dish_id, size)],
+                       'available': max(stock.get((dish_id, size), 0), 0)} for dish_id, size in short])
+
+def _settle_stock(cursor, order_ids, consume):
+    """Закрывает резерв заказов: consume — списывает с остатка, иначе возвращает в доступное."""
+    placeholders = ', '.join(['%s'] * len(order_ids))
+    cursor.execute(f"SELECT dish_id, size, SUM(qty) FROM stock_reservations WHERE order_id IN ({placeholders}) "
+                   f"GROUP BY dish_id, size", list(order_ids))
+    amounts = {(r[0], r[1]): int(r[2]) for r in cursor.fetchall()}
+    if not amounts:
+        return
+    case, params = _stock_case(amounts, default='0')
+    ids = sorted({dish_id for dish_id, _ in amounts})
+    quantity = f", quantity = quantity - {case}" if consume else ""
+    cursor.execute(f"UPDATE dish_stock SET reserved = reserved - {case}{quantity} "
+                   f"WHERE dish_id IN ({', '.join(['%s'] * len(ids))})",
+                   params + (params if consume else []) + ids)
+    cursor.execute(f"DELETE FROM stock_reservations WHERE order_id IN ({placeholders})", list(order_ids))
+
+def _rereserve_stock(cursor, order_ids):
+    """Снова резервирует блюда заказов по order_items, каждый заказ — под своей точкой сохранения.
+    Возвращает {order_id: недостающие позиции} для заказов, которым не хватило остатков."""
+    placeholders = ', '.join(['%s'] * len(order_ids))
+    cursor.execute(f"SELECT order_id, dish_id, size, qty, name FROM order_items WHERE order_id IN ({placeholders})",
+                   list(order_ids))
+    dishes = {}
+    for order_id, dish_id, size, qty, name in cursor.fetchall():
+        dishes.setdefault(order_id, []).append({'id': dish_id, 'size': size, 'qty': qty, 'name': name})
+    rejected = {}
+    for order_id in order_ids:
+        if not dishes.get(order_id):
+            continue
+        cursor.execute(f"SAVEPOINT revive_{order_id}")
+        try:
+            _reserve_stock(cursor, order_id, dishes[order_id])
+        except OutOfStock as e:
+            cursor.execute(f"ROLLBACK TO SAVEPOINT revive_{order_id}")
+            rejected[order_id] = e.items
+            continue
+        cursor.execute(f"RELEASE SAVEPOINT revive_{order_id}")
+    return rejected
+
+def get_stock_levels():
+    """[(dish_id, size, quantity, reserved)] отслеживаемых блюд текущего филиала."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT s.dish_id, s.size, s.quantity, s.reserved FROM dish_stock s
+            JOIN dishes d ON d.id = s.dish_id
+            WHERE d.restaurant_id = %s
+        """, (current_restaurant_id(),))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error(f"Ошибка чтения остатков: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+DISH_STOCK_UPSERT = backend.upsert_add('dish_stock', ('dish_id', 'size'), (), ('quantity', 'reserved', 'updated_at'))
+
+def set_dish_stock(items):
+    """items — [(dish_id, size, available)]: сколько можно продать сверх уже зарезервированного;
+    0 — стоп-лист, None — снять учёт (без ограничений). Блюда чужого филиала пропускаются.
+    Возвращает число применённых строк или None при ошибке."""
+    dish_ids = sorted({int(dish_id) for dish_id, _, _ in items})
+    if not dish_ids:
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        in_ids = ', '.join(['%s'] * len(dish_ids))
+        cursor.execute(f"SELECT id FROM dishes WHERE restaurant_id = %s AND id IN ({in_ids})",
+                       [current_restaurant_id()] + dish_ids)
+        own = {r[0] for r in cursor.fetchall()}
+        cursor.execute(f"SELECT dish_id, size, reserved FROM dish_stock WHERE dish_id IN ({in_ids}){backend.FOR_UPDATE}", dish_ids)
+        reserved = {(r[0], r[1]): r[2] for r in cursor.fetchall()}
+        now = datetime.now().replace(microsecond=0)
+        upserts, removed = [], []
+        for dish_id, size, available in items:
+            key = (int(dish_id), size or '')
+            if key[0] not in own:
+                continue
+            if available is None:
+                removed.append(key)
+            else:
+                upserts.append(key + (reserved.get(key, 0) + max(int(available), 0), reserved.get(key, 0), now))
+        if upserts:
+            cursor.executemany(DISH_STOCK_UPSERT, upserts)
+        for dish_id, size in removed:
+            # Вместе с учётом снимаем и резервы: списывать их больше не с чего
+            cursor.execute("DELETE FROM dish_stock WHERE dish_id = %s AND size = %s", (dish_id, size))
+            cursor.execute("DELETE FROM stock_reservations WHERE dish_id = %s AND size = %s", (dish_id, size))
+        conn.commit()
+        return len(upserts) + len(removed)
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка изменения остатков: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+ORDER_INSERT = """
+    INSERT INTO orders (user_id, dishes, address, total, status, order_type, payment_provider, payment_id, created_at, restaurant_id)
+    VALUES (%s, %s, %s, %s, 'pending', %s, %s, %s, %s, %s)
+"""
+
+def prepare_order(user_id, dishes, address, total, order_type='delivery', payment_provider=None, payment_id=None):
+    """Заказ для add_orders: корзина разобрана, total посчитан. ValueError/TypeError — битая корзина."""
+    if isinstance(dishes, str):
+        dishes = json.loads(dishes)
+    # Проверяем total, если он передан как 0 или None, рассчитываем из позиций
+    total = float(total or 0)
+    if total <= 0:
+        total = sum(float(d.get('price', 0)) * (d.get('qty', 1) or 1) for d in dishes)
+    created_at = datetime.now().replace(microsecond=0)
+    return {
+        'user_id': user_id, 'dishes': dishes, 'dishes_json': json.dumps(dishes, ensure_ascii=False),
+        'address': address, 'total': total, 'order_type': order_type or 'delivery',
+        'payment_provider': payment_provider, 'payment_id': payment_id, 'created_at': created_at,
+        'item_rows': _order_item_rows(None, dishes, created_at),
+        'restaurant_id': current_restaurant_id(),
+    }
+
+def _insert_orders(cursor, orders):
+    """Вставляет подготовленные заказы в открытой транзакции. Каждый — под своей точкой сохранения:
+    если не хватило остатков, откатывается только он. Позиции, события и агрегаты всех заказов
+    пишутся общими executemany. Возвращает по заказу order_id или OutOfStock."""
+    results, items, events, daily, hourly, dish_rollups = [], [], [], {}, {}, {}
+    for i, order in enumerate(orders):
+        cursor.execute(f"SAVEPOINT order_{i}")
+        cursor.execute(ORDER_INSERT, (order['user_id'], order['dishes_json'], order['address'], order['total'],
+                                      order['order_type'], order['payment_provider'], order['payment_id'],
+                                      order['created_at'], order['restaurant_id']))
+        order_id = cursor.lastrowid
+        try:
+            if order['dishes']:
+                _reserve_stock(cursor, order_id, order['dishes'])
+        except OutOfStock as e:
+            cursor.execute(f"ROLLBACK TO SAVEPOINT order_{i}")
+            results.append(e)
+            continue
+        cursor.execute(f"RELEASE SAVEPOINT order_{i}")
+        results.append(order_id)
+        created_at, restaurant_id = order['created_at'], order['restaurant_id']
+        item_rows = [(order_id,) + r[1:] for r in order['item_rows']]
+        items += item_rows
+        dish_rollups.setdefault((restaurant_id, created_at), []).extend((r[1], r[5], r[3], r[4]) for r in item_rows)
+        events.append((order_id, 'pending', None, restaurant_id))
+        for rollup, period in ((daily, created_at.date()), (hourly, created_at.replace(minute=0, second=0))):
+            key = (restaurant_id, period, order['order_type'])
+            count, revenue = rollup.get(key, (0, 0.0))
+            rollup[key] = (count + 1, revenue + order['total'])
+    if items:
+        cursor.executemany(ORDER_ITEMS_INSERT, items)
+    for (restaurant_id, created_at), dish_items in dish_rollups.items():
+        _bump_dish_rollups(cursor, restaurant_id, created_at, dish_items)
+    for upsert, rollup in ((SALES_DAILY_UPSERT, daily), (SALES_HOURLY_UPSERT, hourly)):
+        if rollup:
+            cursor.executemany(upsert, [(restaurant_id, period, order_type, 'pending', count, revenue)
+                                        for (restaurant_id, period, order_type), (count, revenue) in rollup.items()])
+    if events:
+        cursor.executemany(ORDER_EVENT_INSERT, events)
+    _mark_shared_writes(cursor, [(order['restaurant_id'], order['user_id'])
+                                 for order, result in zip(orders, results) if not isinstance(result, OutOfStock)])
+    return results
+
+def add_orders(orders):
+    """Пишет подготовленные заказы (prepare_order) одной транзакцией — один commit на всю пачку.
+    Возвращает по заказу: order_id, OutOfStock или None (ошибка БД). Если транзакция пачки
+    не прошла, заказы пишутся по одному, чтобы ошибка одного не отменяла остальные."""
+    conn = get_connection()
+    if conn is None:
+        return [None] * len(orders)
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        results = _insert_orders(cursor, orders)
+        conn.commit()
+    except Error as e:
+        conn.rollback()
+        if len(orders) == 1:
+            logger.error(f"Ошибка добавления заказа: {e}")
+            return [None]
+        logger.warning(f"Ошибка записи пачки из {len(orders)} заказов, пишем по одному: {e}")
+        results = None
+    finally:
+        cursor.close()
+        conn.close()
+    if results is None:
+        return [add_orders([order])[0] for order in orders]
+    for order, result in zip(orders, results):
+        if not isinstance(result, OutOfStock):
+            with use_restaurant(order['restaurant_id']):
+                mark_write(order['user_id'])
+    added = [r for r in results if not isinstance(r, OutOfStock)]
+    if added:
+        log_event(logger, 'orders.added', order_ids=added, batch=len(orders))
+    return results
+
+def add_order(user_id, dishes, address, total, order_type='delivery', payment_provider=None, payment_id=None):
+    """Создаёт заказ и его позиции в order_items одной транзакцией, резервируя остатки блюд.
+    dishes — список позиций корзины (или JSON-строка с ним). OutOfStock — каких-то блюд не хватает.
+    API и бот пишут заказы через order_ingest.add_order (групповая запись)."""
+    try:
+        order = prepare_order(user_id, dishes, address, total, order_type, payment_provider, payment_id)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ошибка добавления заказа: {e}")
+        return None
+    result = add_orders([order])[0]
+    if isinstance(result, OutOfStock):
+        raise result
+    return result
+
+def get_new_orders():
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, user_id, dishes, address, total, status, order_type FROM orders WHERE restaurant_id = %s AND status = 'pending'",
+                       (current_restaurant_id(),))
+        rows = cursor.fetchall()
+        return [(r[0], r[1], r[2], r[3], r[4], r[5], r[6]) for r in rows]  # Добавили order_type
+    except Error as e:
+        logger.error(f"Ошибка получения новых заказов: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_courier_board_page(courier_id, after_id=0, limit=10):
+    """Страница доски курьера: новые заказы и заказы, которые он ведёт, по возрастанию id после after_id."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, user_id, address, total, status, order_type FROM orders
+            WHERE restaurant_id = %s AND id > %s
+              AND (status = 'pending' OR (courier_id = %s AND status IN ('accepted', 'cooking', 'on_delivery')))
+            ORDER BY id LIMIT %s
+        """, (current_restaurant_id(), after_id, courier_id, limit))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error(f"Ошибка получения доски курьера: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+ORDER_STATUS_COLUMNS = "id, status, order_type, total, created_at, courier_id"
+
+def update_order_status(order_id, status, courier_id=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        cursor.execute(f"SELECT {ORDER_STATUS_COLUMNS} FROM orders WHERE id = %s AND restaurant_id = %s{backend.FOR_UPDATE}",
+                       (order_id, current_restaurant_id()))
+        changed = _change_status(cursor, cursor.fetchall(), status, courier_id)
+        conn.commit()
+        return bool(changed)
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка обновления статуса заказа: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def mark_order_paid(payment_id):
+    """Отмечает заказ текущего филиала с данным payment_id оплаченным. Возвращает user_id заказа или None."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        # Оплата может прийти и после отмены по таймауту (failed): тогда блюда резервируются заново
+        cursor.execute(f"SELECT {ORDER_STATUS_COLUMNS}, user_id FROM orders WHERE payment_id = %s AND restaurant_id = %s"
+                       f" AND status IN ('pending', 'failed'){backend.FOR_UPDATE}", (payment_id, current_restaurant_id()))
+        rows = cursor.fetchall()
+        changed = _change_status(cursor, [r[:6] for r in rows], 'paid')
+        conn.commit()
+        if rows and not changed:
+            logger.warning(f"Счёт {payment_id} оплачен, но заказ #{rows[0][0]} отменён и блюд уже нет — нужен возврат")
+        return rows[0][6] if changed else None
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка отметки оплаты {payment_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def update_orders_status(order_ids, status, courier_id=None):
+    """Переводит сразу много заказов в status одной транзакцией и одним UPDATE.
+    Возвращает id изменённых заказов (None — ошибка); уже стоящие в этом статусе пропускаются."""
+    if not order_ids:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        cursor.execute(f"SELECT {ORDER_STATUS_COLUMNS} FROM orders WHERE id IN ({placeholders}) AND restaurant_id = %s"
+                       f"{backend.FOR_UPDATE}", list(order_ids) + [current_restaurant_id()])
+        changed = _change_status(cursor, cursor.fetchall(), status, courier_id)
+        conn.commit()
+        return changed
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка массового обновления статуса: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def expire_unpaid_orders(ttl_minutes=CHECKOUT_TTL_MINUTES):
+    """Заказы, ждущие оплаты (pending с платёжкой) дольше ttl_minutes, переводит в failed —
+    брошенная оплата не держит остатки блюд. Возвращает id отменённых заказов (None — ошибка)."""
+    if not ttl_minutes:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        cursor.execute(f"""
+            SELECT {ORDER_STATUS_COLUMNS} FROM orders
+            WHERE restaurant_id = %s AND status = 'pending' AND payment_provider IS NOT NULL
+              AND created_at < {backend.interval_ago(ttl_minutes, 'MINUTE')}{backend.FOR_UPDATE}
+        """, (current_restaurant_id(),))
+        expired = _change_status(cursor, cursor.fetchall(), 'failed')
+        conn.commit()
+        if expired:
+            logger.info(f"Не оплачены за {ttl_minutes} мин и отменены: {expired}")
+        return expired
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка отмены неоплаченных заказов: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_order_by_payment_id(payment_id, user_id):
+    """(id, status) заказа пользователя с данным счётом в текущем филиале или None."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, status FROM orders WHERE payment_id = %s AND user_id = %s AND restaurant_id = %s",
+                       (payment_id, user_id, current_restaurant_id()))
+        return cursor.fetchone()
+    except Error as e:
+        logger.error(f"Ошибка поиска заказа по счёту {payment_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+ACTIVE_ORDER_STATUSES = ('pending', 'paid', 'accepted', 'cooking', 'on_delivery')
+ADMIN_ORDER_COLUMNS = 'id, user_id, address, total, status, order_type, courier_id, created_at'
+
+def _admin_order_dict(r):
+    return {'id': r[0], 'user_id': r[1], 'address': r[2], 'total': float(r[3]), 'status': r[4],
+            'order_type': r[5], 'courier_id': r[6], 'created_at': r[7].isoformat() if r[7] else None}
+
+def _order_events_cursor(cursor):
+    cursor.execute("SELECT MAX(id) FROM order_events WHERE restaurant_id = %s", (current_restaurant_id(),))
+    return cursor.fetchone()[0] or 0
+
+def get_order_events_cursor():
+    """Последнее событие заказов текущего филиала (0 — событий нет, None — ошибка)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        return _order_events_cursor(cursor)
+    except Error as e:
+        logger.error(f"Ошибка получения курсора событий заказов: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_admin_orders(statuses=None, order_type=None, courier_id=None, max_age_minutes=None, before_id=None, limit=50):
+    """Страница заказов для админки, новые сверху (keyset по id).
+    Возвращает {'orders', 'next_before_id', 'cursor'}; cursor — позиция в order_events для get_order_changes."""
+    conditions = ["restaurant_id = %s", f"status IN ({', '.join(['%s'] * len(statuses or ACTIVE_ORDER_STATUSES))})"]
+    params = [current_restaurant_id()] + list(statuses or ACTIVE_ORDER_STATUSES)
+    if order_type:
+        conditions.append("order_type = %s")
+        params.append(order_type)
+    if courier_id:
+        conditions.append("courier_id = %s")
+        params.append(courier_id)
+    if max_age_minutes:
+        conditions.append("created_at >= %s")
+        params.append(datetime.now().replace(microsecond=0) - timedelta(minutes=max_age_minutes))
+    if before_id:
+        conditions.append("id < %s")
+        params.append(before_id)
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # Курсор берём до выборки: изменения, случившиеся между запросами, придут в ленте
+        events_cursor = _order_events_cursor(cursor)
+        cursor.execute(f"""
+            SELECT {ADMIN_ORDER_COLUMNS} FROM orders
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id DESC LIMIT %s
+        """, params + [limit])
+        orders = [_admin_order_dict(r) for r in cursor.fetchall()]
+        return {
+            'orders': orders,
+            'next_before_id': orders[-1]['id'] if len(orders) == limit else None,
+            'cursor': events_cursor
+        }
+    except Error as e:
+        logger.error(f"Ошибка получения заказов для админки: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_order_changes(since, limit=500):
+    """Заказы филиала, изменившиеся после события since, в текущем состоянии.
+    removed — заказы, которых уже нет в orders (ушли в архив)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, order_id FROM order_events WHERE restaurant_id = %s AND id > %s ORDER BY id LIMIT %s",
+                       (current_restaurant_id(), since, limit))
+        events = cursor.fetchall()
+        if not events:
+            return {'cursor': since, 'orders': [], 'removed': [], 'more': False}
+        ids = list({order_id for _, order_id in events})
+        cursor.execute(f"SELECT {ADMIN_ORDER_COLUMNS} FROM orders WHERE restaurant_id = %s AND id IN ({', '.join(['%s'] * len(ids))})",
+                       [current_restaurant_id()] + ids)
+        orders = [_admin_order_dict(r) for r in cursor.fetchall()]
+        found = {o['id'] for o in orders}
+        return {
+            'cursor': events[-1][0],
+            'orders': orders,
+            'removed': [i for i in ids if i not in found],
+            'more': len(events) == limit
+        }
+    except Error as e:
+        logger.error(f"Ошибка получения ленты изменений заказов: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_order_events_since(since, limit=500, user_id=None):
+    """События смены статуса заказов филиала после since вместе с владельцем заказа (для SSE-трансляции).
+    С user_id — только заказы этого пользователя (досылка по Last-Event-ID)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        user_filter = "AND o.user_id = %s" if user_id is not None else ""
+        params = (current_restaurant_id(), since) + ((user_id,) if user_id is not None else ()) + (limit,)
+        cursor.execute(f"""
+            SELECT e.id, e.order_id, e.status, o.user_id, o.order_type, o.total, o.created_at
+            FROM order_events e JOIN orders o ON o.id = e.order_id
+            WHERE e.restaurant_id = %s AND e.id > %s {user_filter}
+            ORDER BY e.id LIMIT %s
+        """, params)
+        return [{'id': r[0], 'order_id': r[1], 'status': r[2], 'user_id': r[3], 'order_type': r[4],
+                 'total': float(r[5]), 'created_at': r[6].isoformat() if r[6] else None}
+                for r in cursor.fetchall()]
+    except Error as e:
+        logger.error(f"Ошибка получения событий заказов: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def prune_order_events(older_than_days=ARCHIVE_AFTER_DAYS):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM order_events WHERE created_at < %s",
+                       (datetime.now().replace(microsecond=0) - timedelta(days=older_than_days),))
+        conn.commit()
+        return cursor.rowcount
+    except Error as e:
+        logger.error(f"Ошибка очистки order_events: {e}")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_user_id_by_order_id(order_id):
+    """Получает user_id по order_id (заказ текущего филиала)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id FROM orders WHERE id = %s AND restaurant_id = %s", (order_id, current_restaurant_id()))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except Error as e:
+        logger.error(f"Ошибка получения user_id для заказа {order_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_user_orders(telegram_id):
+    """История заказов пользователя из orders и orders_archive
+    (с реплики, кроме случая, когда он только что сделал заказ)."""
+    conn = get_read_connection(telegram_id)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, created_at, total, status FROM orders WHERE user_id = %s AND restaurant_id = %s
+            UNION ALL
+            SELECT id, created_at, total, status FROM orders_archive WHERE user_id = %s AND restaurant_id = %s
+            ORDER BY id
+        """, (telegram_id, current_restaurant_id(), telegram_id, current_restaurant_id()))
+        return [
+            {
+                'id': r[0],
+                'created_at': r[1].isoformat() if r[1] else None,
+                'total': float(r[2]) if r[2] is not None else 0.0,
+                'status': r[3] if r[3] else 'unknown'
+            } for r in cursor.fetchall()
+        ]
+    except Error as e:
+        logger.error(f"Ошибка получения заказов пользователя {telegram_id}: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+def get_order_type(order_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT order_type FROM orders WHERE id = %s AND restaurant_id = %s", (order_id, current_restaurant_id()))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except Error as e:
+        logger.error(f"Ошибка получения типа заказа {order_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_orders_to_notify():
+    """Заказы, о статусе которых клиенту ещё не сообщали (или сообщали больше суток назад)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT id, user_id, status, order_type
+            FROM orders
+            WHERE restaurant_id = %s AND status IN ('accepted', 'cooking', 'on_delivery', 'delivered')
+            AND (notified IS NULL OR notified < {backend.interval_ago(1, 'DAY')})
+        """, (current_restaurant_id(),))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error(f"Ошибка получения заказов для уведомления: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def mark_order_notified(order_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE orders SET notified = {backend.NOW} WHERE id = %s", (order_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Error as e:
+        logger.error(f"Ошибка обновления notified для заказа {order_id}: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_pickup_orders_to_notify():
+    """Заказы на самовывоз в статусе 'cooking', о готовности которых ещё не сообщали."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT id, user_id
+            FROM orders
+            WHERE restaurant_id = %s AND status = 'cooking'
+            AND order_type = 'restaurant'
+            AND (pickup_notified IS NULL OR pickup_notified < {backend.interval_ago(1, 'HOUR')})
+        """, (current_restaurant_id(),))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error(f"Ошибка получения заказов на самовывоз: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def mark_pickup_notified(order_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE orders SET pickup_notified = {backend.NOW} WHERE id = %s", (order_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Error as e:
+        logger.error(f"Ошибка обновления pickup_notified для заказа {order_id}: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+# order_items
+def get_items_for_orders(order_ids):
+    """Позиции нескольких заказов одним запросом: {order_id: [item, ...]}."""
+    if not order_ids:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        cursor.execute(f"""
+            SELECT order_id, dish_id, size, qty, unit_price, name
+            FROM order_items WHERE order_id IN ({placeholders})
+            ORDER BY order_id, id
+        """, list(order_ids))
+        items = {}
+        for r in cursor.fetchall():
+            items.setdefault(r[0], []).append({
+                'dish_id': r[1],
+                'size': r[2],
+                'qty': r[3],
+                'unit_price': float(r[4]),
+                'name': r[5]
+            })
+        return items
+    except Error as e:
+        logger.error(f"Ошибка получения позиций заказов: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+def backfill_order_items(batch_size=1000):
+    """Заполняет order_items для старых заказов (из orders и orders_archive), у которых позиций ещё нет."""
+    total = 0
+    for table in ('orders', 'orders_archive'):
+        last_id = 0
+        while True:
+            conn = get_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"""
+                    SELECT o.id, o.dishes, o.created_at FROM {table} o
+                    WHERE o.id > %s AND NOT EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id)
+                    ORDER BY o.id
+                    LIMIT %s
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                items = []
+                for order_id, dishes_json, created_at in rows:
+                    try:
+                        items.extend(_order_item_rows(order_id, json.loads(dishes_json or '[]'), created_at))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        logger.warning(f"Заказ {order_id}: не удалось разобрать dishes: {e}")
+                if items:
+                    cursor.executemany(ORDER_ITEMS_INSERT, items)
+                conn.commit()
+                last_id = rows[-1][0]
+                total += len(rows)
+            finally:
+                cursor.close()
+                conn.close()
+    logger.info(f"order_items заполнены для {total} заказов")
+    return total
+
+# sales stats
+def _iso(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def get_sales_stats(days=30, hours=24, top=10):
+    """Статистика филиала для админки из агрегатов: время ответа не зависит от размера истории заказов."""
+    restaurant_id = current_restaurant_id()
+    since_day = (datetime.now() - timedelta(days=days - 1)).date()
+    since_hour = (datetime.now() - timedelta(hours=hours - 1)).replace(minute=0, second=0, microsecond=0)
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT sales_date, SUM(order_count), SUM(revenue) FROM sales_daily
+            WHERE restaurant_id = %s AND sales_date >= %s AND status <> 'failed'
+            GROUP BY sales_date HAVING SUM(order_count) > 0 ORDER BY sales_date
+        """, (restaurant_id, since_day))
+        daily = [{'date': _iso(r[0]), 'orders': int(r[1]), 'revenue': float(r[2])} for r in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT sales_hour, SUM(order_count), SUM(revenue) FROM sales_hourly
+            WHERE restaurant_id = %s AND sales_hour >= %s AND status <> 'failed'
+            GROUP BY sales_hour HAVING SUM(order_count) > 0 ORDER BY sales_hour
+        """, (restaurant_id, since_hour))
+        hourly = [{'hour': _iso(r[0]), 'orders': int(r[1]), 'revenue': float(r[2])} for r in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT order_type, status, SUM(order_count), SUM(revenue) FROM sales_daily
+            WHERE restaurant_id = %s AND sales_date >= %s GROUP BY order_type, status HAVING SUM(order_count) > 0
+        """, (restaurant_id, since_day))
+        by_type, by_status = {}, {}
+        for order_type, status, count, revenue in cursor.fetchall():
+            by_status[status] = by_status.get(status, 0) + int(count)
+            if status != 'failed':
+                t = by_type.setdefault(order_type, {'orders': 0, 'revenue': 0.0})
+                t['orders'] += int(count)
+                t['revenue'] += float(revenue)
+
+        cursor.execute("""
+            SELECT dish_id, MAX(name), SUM(qty), SUM(revenue) FROM dish_sales_daily
+            WHERE restaurant_id = %s AND sales_date >= %s GROUP BY dish_id HAVING SUM(qty) > 0 ORDER BY SUM(qty) DESC LIMIT %s
+        """, (restaurant_id, since_day, top))
+        top_dishes = [{'dish_id': r[0], 'name': r[1], 'qty': int(r[2]), 'revenue': float(r[3])} for r in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT code, SUM(uses) FROM promo_redemptions_daily
+            WHERE restaurant_id = %s AND sales_date >= %s GROUP BY code ORDER BY SUM(uses) DESC
+        """, (restaurant_id, since_day))
+        promo_usage = [{'code': r[0], 'uses': int(r[1])} for r in cursor.fetchall()]
+
+        orders = sum(d['orders'] for d in daily)
+        revenue = sum(d['revenue'] for d in daily)
+        return {
+            'days': days,
+            'orders': orders,
+            'revenue': round(revenue, 2),
+            'avg_ticket': round(revenue / orders, 2) if orders else 0.0,
+            'daily': daily,
+            'hourly': hourly,
+            'by_type': by_type,
+            'by_status': by_status,
+            'top_dishes': top_dishes,
+            'promo_usage': promo_usage
+        }
+    except Error as e:
+        logger.error(f"Ошибка получения статистики продаж: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def rebuild_sales_rollups():
+    """Пересобирает агрегаты продаж по orders, orders_archive и order_items (бэкфилл).
+    Запускать в спокойное время: заказы, изменённые во время пересборки, могут учесться неточно.
+    У промокодов нет истории применений, поэтому накопленные uses относятся к дате создания кода."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    all_orders = """
+        (SELECT restaurant_id, created_at, order_type, status, total, id FROM orders
+         UNION ALL
+         SELECT restaurant_id, created_at, order_type, status, total, id FROM orders_archive) o
+    """
+    try:
+        for table in SALES_ROLLUP_TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO sales_daily (restaurant_id, sales_date, order_type, status, order_count, revenue)
+            SELECT restaurant_id, DATE(created_at), COALESCE(order_type, 'delivery'), COALESCE(status, 'pending'), COUNT(*), SUM(total)
+            FROM {all_orders}
+            GROUP BY restaurant_id, DATE(created_at), COALESCE(order_type, 'delivery'), COALESCE(status, 'pending')
+        """)
+        cursor.execute(f"""
+            INSERT INTO sales_hourly (restaurant_id, sales_hour, order_type, status, order_count, revenue)
+            SELECT restaurant_id, {backend.hour_bucket('created_at')}, COALESCE(order_type, 'delivery'), COALESCE(status, 'pending'), COUNT(*), SUM(total)
+            FROM {all_orders}
+            GROUP BY restaurant_id, {backend.hour_bucket('created_at')}, COALESCE(order_type, 'delivery'), COALESCE(status, 'pending')
+        """)
+        cursor.execute(f"""
+            INSERT INTO dish_sales_daily (restaurant_id, sales_date, dish_id, name, qty, revenue)
+            SELECT o.restaurant_id, DATE(i.created_at), COALESCE(i.dish_id, 0), MAX(i.name), SUM(i.qty), SUM(i.qty * i.unit_price)
+            FROM order_items i
+            JOIN {all_orders} ON o.id = i.order_id
+            WHERE o.status <> 'failed'
+            GROUP BY o.restaurant_id, DATE(i.created_at), COALESCE(i.dish_id, 0)
+        """)
         cursor.execute("""
-            UPDATE promo_codes SET uses = uses + 1
-            WHERE code = %s AND is_active = TRUE
-        """, (code.upper(),))
+            INSERT INTO promo_redemptions_daily (restaurant_id, sales_date, code, uses)
+            SELECT restaurant_id, DATE(created_at), code, uses FROM promo_codes WHERE uses > 0
+        """)
+        conn.commit()
+        logger.info("Агрегаты продаж пересобраны")
+        return True
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка пересборки агрегатов продаж: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+# archive
+# Колонки orders, которые переносятся в orders_archive
+ORDER_COLUMNS = ('id, user_id, dishes, address, total, status, courier_id, order_type, '
+                 'payment_provider, payment_id, created_at, notified, pickup_notified, restaurant_id')
+
+def archive_orders_batch(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Переносит одну пачку завершённых заказов старше older_than_days в orders_archive.
+    Возвращает число перенесённых строк (0 — переносить больше нечего, None — ошибка)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT id FROM orders
+            WHERE status IN ('delivered', 'failed') AND created_at < {backend.interval_ago(older_than_days, 'DAY')}
+            ORDER BY id
+            LIMIT %s
+        """, (batch_size,))
+        ids = [r[0] for r in cursor.fetchall()]
+        if not ids:
+            return 0
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            {backend.INSERT_IGNORE} INTO orders_archive ({ORDER_COLUMNS})
+            SELECT {ORDER_COLUMNS} FROM orders WHERE id IN ({placeholders})
+        """, ids)
+        cursor.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", ids)
+        conn.commit()
+        return len(ids)
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка архивации заказов: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def archive_orders(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_BATCH_PAUSE, max_batches=None):
+    """Архивирует пачками с паузой между ними, чтобы не держать долгих блокировок на orders."""
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        n = archive_orders_batch(older_than_days, batch_size)
+        if not n:
+            break
+        moved += n
+        batches += 1
+        time.sleep(pause)
+    prune_order_events(older_than_days)
+    logger.info(f"Архивировано заказов: {moved}, {get_orders_table_stats()}")
+    return moved
+
+def get_orders_table_stats():
+    """Размер горячей и архивной таблиц заказов (метрика для мониторинга)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # Горячая таблица маленькая — считаем точно, архив — оценкой
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        hot = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE status NOT IN ('delivered', 'failed')")
+        active = cursor.fetchone()[0]
+        archived = backend.estimate_rows(cursor, 'orders_archive')
+        return {'orders_hot_rows': hot, 'orders_active_rows': active, 'orders_archive_rows': archived}
+    except Error as e:
+        logger.error(f"Ошибка получения размера таблиц заказов: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+# export
+def _stream_connection():
+    """Соединение для выгрузки и бэкенд, которому оно принадлежит (реплика, если она не отстаёт)."""
+    shard = _current_backend()
+    if replica_backend is not None and shard is backend and _replica_is_fresh():
+        try:
+            return replica_backend.connect_stream(), replica_backend
+        except Error as e:
+            logger.warning(f"Ошибка подключения к реплике, выгружаем с основного: {e}")
+    return shard.connect_stream(), shard
+
+def iter_rows(queries, fetch_size=EXPORT_FETCH_SIZE):
+    """Генератор строк по очереди для каждого (sql, params) из queries.
+    Серверный курсор и fetchmany: в памяти не больше fetch_size строк при любом объёме выгрузки."""
+    conn, source = _stream_connection()
+    try:
+        for sql, params in queries:
+            cursor = source.stream_cursor(conn)
+            try:
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            except Error as e:
+                logger.error(f"Ошибка выгрузки: {e}")
+                raise
+            finally:
+                try:
+                    cursor.close()
+                except Error:
+                    # Выгрузку прервали, недочитанный результат закроется вместе с соединением
+                    pass
+    finally:
+        conn.close()
+
+def export_orders(date_from=None, date_to=None, status=None):
+    """Колонки и генератор строк заказов (сначала архив, затем горячая таблица).
+    date_from/date_to — date, обе границы включительно."""
+    conditions, params = ["restaurant_id = %s"], [current_restaurant_id()]
+    if date_from:
+        conditions.append("created_at >= %s")
+        params.append(datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        conditions.append("created_at < %s")
+        params.append(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}"
+    # Порядок по первичному ключу — без сортировки всей выборки на сервере
+    queries = [(f"SELECT {ORDER_COLUMNS} FROM {table} {where} ORDER BY id", tuple(params))
+               for table in ('orders_archive', 'orders')]
+    return ORDER_COLUMNS.split(', '), iter_rows(queries)
+
+DISH_EXPORT_COLUMNS = ['id', 'name', 'price', 'description', 'image_url', 'category', 'sizes']
+PROMO_EXPORT_COLUMNS = ['id', 'code', 'discount', 'max_uses', 'uses', 'expires_at', 'is_active', 'created_at']
+
+def export_dishes():
+    return DISH_EXPORT_COLUMNS, iter_rows([(f"SELECT {', '.join(DISH_EXPORT_COLUMNS)} FROM dishes WHERE restaurant_id = %s ORDER BY id",
+                                           (current_restaurant_id(),))])
+
+def export_promocodes():
+    return PROMO_EXPORT_COLUMNS, iter_rows([(f"SELECT {', '.join(PROMO_EXPORT_COLUMNS)} FROM promo_codes WHERE restaurant_id = %s ORDER BY id",
+                                            (current_restaurant_id(),))])
+
+# rate limits
+RATE_COUNTER_UPSERT = backend.upsert_add('rate_limit_counters', ('bucket_key', 'window_start'), ('hits',))
+
+def incr_rate_counter(bucket_key, window_start):
+    """Увеличивает счётчик окна и возвращает число попаданий в нём (None — ошибка БД)."""
+    conn = get_main_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(RATE_COUNTER_UPSERT, (bucket_key, window_start, 1))
+        cursor.execute("SELECT hits FROM rate_limit_counters WHERE bucket_key = %s AND window_start = %s",
+                       (bucket_key, window_start))
+        hits = cursor.fetchone()[0]
+        conn.commit()
+        return hits
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка счётчика ограничения частоты: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def prune_rate_counters(before_window_start):
+    conn = get_main_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM rate_limit_counters WHERE window_start < %s", (before_window_start,))
+        conn.commit()
+    except Error as e:
+        logger.error(f"Ошибка очистки счётчиков ограничения частоты: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+# геокодирование и доставка (geo.py)
+GEOCODE_UPSERT = backend.upsert_add('geocode_cache', ('address_key',), (), ('address', 'lat', 'lon', 'created_at'))
+COURIER_LOCATION_UPSERT = backend.upsert_add('courier_locations', ('courier_id',), (), ('lat', 'lon', 'updated_at'))
+ORDER_DELIVERY_UPSERT = backend.upsert_add('order_delivery', ('order_id',), (),
+                                           ('lat', 'lon', 'zone', 'distance_km', 'fee', 'eta_minutes'))
+
+def get_recent_geocodes(limit):
+    """[(address_key, (lat, lon) или None)] — последние limit адресов кеша геокодера."""
+    conn = get_main_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT address_key, lat, lon FROM geocode_cache ORDER BY created_at DESC LIMIT %s", (limit,))
+        return [(key, (lat, lon) if lat is not None else None) for key, lat, lon in cursor.fetchall()]
+    except Error as e:
+        logger.error(f"Ошибка чтения кеша геокодера: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_cached_geocodes(address_keys):
+    """{address_key: (lat, lon) или None} для найденных в кеше ключей."""
+    if not address_keys:
+        return {}
+    conn = get_main_connection()
+    cursor = conn.cursor()
+    try:
+        result = {}
+        keys = list(address_keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            cursor.execute(f"SELECT address_key, lat, lon FROM geocode_cache WHERE address_key IN "
+                           f"({', '.join(['%s'] * len(chunk))})", chunk)
+            for key, lat, lon in cursor.fetchall():
+                result[key] = (lat, lon) if lat is not None else None
+        return result
+    except Error as e:
+        logger.error(f"Ошибка чтения кеша геокодера: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_geocodes(rows):
+    """rows: (address_key, address, lat, lon); lat/lon None — адрес не найден."""
+    if not rows:
+        return
+    conn = get_main_connection()
+    cursor = conn.cursor()
+    try:
+        now = datetime.now().replace(microsecond=0)
+        cursor.executemany(GEOCODE_UPSERT, [(key, address[:255], lat, lon, now) for key, address, lat, lon in rows])
+        conn.commit()
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка записи кеша геокодера: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_courier_location(courier_id, lat, lon):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(COURIER_LOCATION_UPSERT, (courier_id, lat, lon, datetime.now().replace(microsecond=0)))
+        conn.commit()
+        return True
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка сохранения координат курьера {courier_id}: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_free_courier_locations(max_age_seconds):
+    """Свежие координаты свободных курьеров текущего филиала: [(courier_id, lat, lon)]."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT cl.courier_id, cl.lat, cl.lon FROM courier_locations cl
+            WHERE cl.updated_at >= %s AND NOT EXISTS (
+                SELECT 1 FROM orders o
+                WHERE o.courier_id = cl.courier_id AND o.status IN ('accepted', 'cooking', 'on_delivery'))
+        """, (datetime.now().replace(microsecond=0) - timedelta(seconds=max_age_seconds),))
+        rows = cursor.fetchall()
+        ids = set(filter_restaurant_users([r[0] for r in rows]))
+        return [r for r in rows if r[0] in ids]
+    except Error as e:
+        logger.error(f"Ошибка получения координат курьеров: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_order_delivery(order_id, quote):
+    """Сохраняет расчёт доставки (geo.delivery_quote) для заказа."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(ORDER_DELIVERY_UPSERT, (order_id, quote['lat'], quote['lon'], quote['zone'],
+                                               quote['distance_km'], quote['fee'], quote['eta_minutes']))
+        conn.commit()
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка сохранения доставки заказа {order_id}: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+# broadcasts
+BROADCAST_COLUMNS = ('id, text, image_url, status, created_by, created_at, started_at, finished_at, '
+                     'last_user_id, total, sent, blocked, failed, rate')
+
+def _broadcast_dict(r):
+    b = dict(zip(BROADCAST_COLUMNS.split(', '), r))
+    processed = b['sent'] + b['blocked'] + b['failed']
+    remaining = max((b['total'] or 0) - processed, 0)
+    b['processed'] = processed
+    b['progress'] = round(processed / b['total'], 4) if b['total'] else 0.0
+    b['eta_seconds'] = round(remaining / b['rate']) if b['status'] == 'running' and b['rate'] else None
+    for key in ('created_at', 'started_at', 'finished_at'):
+        b[key] = b[key].isoformat() if b[key] else None
+    return b
+
+def create_broadcast(text, image_url=None, created_by=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO broadcasts (text, image_url, created_by, restaurant_id) VALUES (%s, %s, %s, %s)",
+                       (text, image_url or None, created_by, current_restaurant_id()))
+        conn.commit()
+        return cursor.lastrowid
+    except Error as e:
+        logger.error(f"Ошибка создания рассылки: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_broadcasts(limit=20):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE restaurant_id = %s ORDER BY id DESC LIMIT %s",
+                       (current_restaurant_id(), limit))
+        return [_broadcast_dict(r) for r in cursor.fetchall()]
+    except Error as e:
+        logger.error(f"Ошибка получения рассылок: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_broadcast(broadcast_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE id = %s AND restaurant_id = %s",
+                       (broadcast_id, current_restaurant_id()))
+        r = cursor.fetchone()
+        return _broadcast_dict(r) if r else None
+    except Error as e:
+        logger.error(f"Ошибка получения рассылки {broadcast_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+# Допустимые переходы по командам админа
+BROADCAST_ACTIONS = {
+    'pause': (('queued', 'running'), 'paused'),
+    'resume': (('paused',), 'queued'),
+    'cancel': (('queued', 'running', 'paused'), 'cancelled'),
+}
+
+def set_broadcast_status(broadcast_id, action):
+    """pause/resume/cancel; бот замечает смену статуса при ближайшем сохранении прогресса."""
+    from_statuses, status = BROADCAST_ACTIONS[action]
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE broadcasts SET status = %s WHERE id = %s AND restaurant_id = %s "
+                       f"AND status IN ({', '.join(['%s'] * len(from_statuses))})",
+                       (status, broadcast_id, current_restaurant_id()) + from_statuses)
+        conn.commit()
+        return cursor.rowcount > 0
+    except Error as e:
+        logger.error(f"Ошибка смены статуса рассылки {broadcast_id}: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def claim_broadcast():
+    """Берёт прерванную (running) или самую старую queued рассылку филиала и переводит её в running."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        backend.begin_write(cursor)
+        cursor.execute(f"""
+            SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE restaurant_id = %s AND status IN ('running', 'queued')
+            ORDER BY status = 'running' DESC, id LIMIT 1{backend.FOR_UPDATE}
+        """, (current_restaurant_id(),))
+        r = cursor.fetchone()
+        if not r:
+            conn.commit()
+            return None
+        b = _broadcast_dict(r)
+        if b['total'] is None:
+            if len(restaurants_in_shard()) == 1:
+                cursor.execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL")
+                b['total'] = cursor.fetchone()[0]
+            else:
+                cursor.execute("SELECT telegram_id FROM users WHERE blocked_at IS NULL")
+                b['total'] = len(filter_restaurant_users([r[0] for r in cursor.fetchall()]))
+        cursor.execute(f"""
+            UPDATE broadcasts SET status = 'running', total = %s, started_at = COALESCE(started_at, {backend.NOW})
+            WHERE id = %s
+        """, (b['total'], b['id']))
+        conn.commit()
+        b['status'] = 'running'
+        return b
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка выбора рассылки: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_broadcast_recipients(after_user_id, limit):
+    """Следующая страница получателей филиала по telegram_id (keyset, без OFFSET).
+    Пользователи других филиалов общей базы пропускаются; пустой список — получателей больше нет."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute("""
+                SELECT telegram_id FROM users
+                WHERE telegram_id > %s AND blocked_at IS NULL
+                ORDER BY telegram_id LIMIT %s
+            """, (after_user_id, limit))
+            page = [r[0] for r in cursor.fetchall()]
+            recipients = filter_restaurant_users(page)
+            if recipients or len(page) < limit:
+                return recipients
+            after_user_id = page[-1]
+    except Error as e:
+        logger.error(f"Ошибка получения получателей рассылки: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_broadcast_progress(broadcast_id, outcomes, last_user_id, rate):
+    """Одной транзакцией пишет исходы отправок (user_id, status, error), сдвигает курсор
+    и помечает недоступных пользователей. Возвращает текущий статус рассылки (None — ошибка)."""
+    counts = {'sent': 0, 'blocked': 0, 'failed': 0}
+    for _, status, _ in outcomes:
+        counts['blocked' if status in ('blocked', 'gone') else status] += 1
+    now = datetime.now().replace(microsecond=0)
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if outcomes:
+            cursor.executemany(f"""
+                {backend.INSERT_IGNORE} INTO broadcast_recipients (broadcast_id, user_id, status, error, sent_at)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(broadcast_id, user_id, status, error, now) for user_id, status, error in outcomes])
+        cursor.execute("""
+            UPDATE broadcasts SET last_user_id = %s, sent = sent + %s, blocked = blocked + %s, failed = failed + %s, rate = %s
+            WHERE id = %s
+        """, (last_user_id, counts['sent'], counts['blocked'], counts['failed'], rate, broadcast_id))
+        unreachable = [user_id for user_id, status, _ in outcomes if status in ('blocked', 'gone')]
+        if unreachable:
+            cursor.execute(f"UPDATE users SET blocked_at = %s WHERE telegram_id IN ({', '.join(['%s'] * len(unreachable))})",
+                           [now] + unreachable)
+        cursor.execute("SELECT status FROM broadcasts WHERE id = %s", (broadcast_id,))
+        status = cursor.fetchone()[0]
+        conn.commit()
+        return status
+    except Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка сохранения прогресса рассылки {broadcast_id}: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def finish_broadcast(broadcast_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE broadcasts SET status = 'done', rate = 0, finished_at = {backend.NOW} WHERE id = %s AND status = 'running'",
+                       (broadcast_id,))
+        conn.commit()
+    except Error as e:
+        logger.error(f"Ошибка завершения рассылки {broadcast_id}: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+# promo_codes
+def create_promo(code, discount, max_uses=1, expires_at=None):
+    conn = get_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO promo_codes (code, discount, max_uses, expires_at, restaurant_id)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (code.upper(), discount, max_uses, expires_at, current_restaurant_id()))
         conn.commit()
+        mark_write('promocodes')
+        return True
+    except Error as e:
+        logger.error(f"Ошибка создания промокода: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def validate_promo(code):
+    conn = get_connection()
+    if not conn:
+        logger.error("No database connection")
+        return {'valid': False}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT discount, uses, max_uses, expires_at, is_active
+            FROM promo_codes
+            WHERE code = %s AND restaurant_id = %s AND is_active = TRUE
+        """, (code.upper(), current_restaurant_id()))
+        row = cursor.fetchone()
+        if row:
+            discount, uses, max_uses, expires_at, is_active = row
+            current_date = datetime.now().date()
+            valid = (uses < max_uses and (expires_at is None or current_date <= expires_at))
+            # Горячий путь (каждое применение в корзине): итог пишет API событием promo.validate
+            logger.debug("Validating promo %s: uses=%s, max_uses=%s, expires_at=%s, valid=%s",
+                         code, uses, max_uses, expires_at, valid)
+            return {'discount': float(discount), 'valid': valid}
+        logger.debug("Promo code %s not found or inactive", code)
+        return {'valid': False}
+    except Error as e:
+        logger.error(f"Ошибка валидации промокода: {e}")
+        return {'valid': False}
+    finally:
+        cursor.close()
+        conn.close()
+
+def use_promo(code):
+    conn = get_connection()
+    if not conn:
+        logger.error("No database connection")
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE promo_codes SET uses = uses + 1
+            WHERE code = %s AND restaurant_id = %s AND is_active = TRUE
+        """, (code.upper(), current_restaurant_id()))
         success = cursor.rowcount > 0
         if success:
-            logger.info(f"Promo code {code} used successfully")
+            cursor.execute(PROMO_REDEMPTIONS_UPSERT, (current_restaurant_id(), datetime.now().date(), code.upper(), 1))
+        conn.commit()
+        if success:
+            logger.debug("Promo code %s used successfully", code)
         else:
             logger.warning(f"Failed to use promo code {code}")
         return success
@@ -393,13 +2435,14 @@ def use_promo(code):
         conn.close()
 
 def get_all_promocodes():
-    conn = get_connection()
+    conn = get_read_connection('promocodes')
     if not conn:
         logger.error("No database connection")
         return []
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT code, discount, max_uses, uses, expires_at, is_active FROM promo_codes ORDER BY created_at DESC")
+        cursor.execute("SELECT code, discount, max_uses, uses, expires_at, is_active FROM promo_codes WHERE restaurant_id = %s ORDER BY created_at DESC",
+                       (current_restaurant_id(),))
         rows = cursor.fetchall()
         return [{'code': r[0], 'discount': float(r[1]), 'max_uses': r[2], 'uses': r[3], 'expires_at': r[4], 'is_active': bool(r[5])} for r in rows]
     except Error as e:
@@ -407,4 +2450,18 @@ def get_all_promocodes():
         return []
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# promotions
+def get_promotions():
+    conn = get_read_connection('promotions')
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, text, image_url FROM promotions WHERE restaurant_id = %s", (current_restaurant_id(),))
+        return [{'id': r[0], 'text': r[1], 'image_url': r[2]} for r in cursor.fetchall()]
+    except Error as e:
+        logger.error(f"Ошибка получения акций: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,310 @@
+import logging
+import sqlite3
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+# Бэкенды хранения для database.py.
+# Бэкенд отвечает за подключение и за SQL, который отличается между MySQL и SQLite;
+# остальной SQL в database.py общий (плейсхолдеры %s, SQLite-обёртка переводит их в ?).
+
+logger = logging.getLogger(__name__)
+
+
+class MySQLBackend:
+    name = 'mysql'
+
+    # Фрагменты DDL/DML, зависящие от диалекта
+    AUTO_ID = 'INT AUTO_INCREMENT PRIMARY KEY'
+    CURRENT_TIMESTAMP = 'CURRENT_TIMESTAMP'
+    INSERT_IGNORE = 'INSERT IGNORE'
+    NOW = 'NOW()'
+
+    def __init__(self, config, pool_name=None, pool_size=0):
+        import mysql.connector
+        import mysql.connector.pooling
+        self._connector = mysql.connector
+        self.config = config
+        self.Error = mysql.connector.Error
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # Пул создаётся при первом обращении: импорт database.py не ходит в сеть
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = self._connector.pooling.MySQLConnectionPool(
+                        pool_name=self.pool_name, pool_size=self.pool_size, **self.config)
+        return self._pool
+
+    def connect(self):
+        if not self.pool_size:
+            return self._connector.connect(**self.config)
+        try:
+            # close() у соединения из пула возвращает его обратно в пул
+            return self._get_pool().get_connection()
+        except self._connector.errors.PoolError as e:
+            # Пул исчерпан — не блокируем запрос, открываем отдельное соединение
+            logger.warning(f"Пул {self.pool_name} исчерпан, открываем прямое соединение: {e}")
+            return self._connector.connect(**self.config)
+
+    def warm_up(self):
+        """Открывает соединения заранее (пул MySQL создаёт все pool_size соединений сразу)."""
+        if self.pool_size:
+            self._get_pool()
+        else:
+            self._connector.connect(**self.config).close()
+
+    def pool_status(self):
+        return {'size': self.pool_size, 'open': self._pool is not None}
+
+    def connect_stream(self):
+        """Отдельное соединение для длинной выгрузки: не занимает слот пула,
+        а при обрыве выгрузки недочитанный результат уходит вместе с ним."""
+        return self._connector.connect(**self.config)
+
+    def stream_cursor(self, conn):
+        # Небуферизованный курсор: строки читаются с сервера по мере fetchmany
+        return conn.cursor(buffered=False)
+
+    def replica_lag(self, conn):
+        """Отставание реплики в секундах; None — репликация остановлена или это не реплика."""
+        cursor = conn.cursor(dictionary=True)
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except self.Error:
+                # MySQL < 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if not row:
+                return None
+            lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+            return int(lag) if lag is not None else None
+        finally:
+            cursor.close()
+
+    # Блокировка строк для read-modify-write внутри транзакции
+    FOR_UPDATE = ' FOR UPDATE'
+
+    def begin_write(self, cursor):
+        """Начало транзакции, в которой строки читаются и затем меняются (в MySQL хватает FOR UPDATE)."""
+
+    def upsert_add(self, table, keys, increments, replace=()):
+        """INSERT, который при конфликте по keys прибавляет increments и перезаписывает replace."""
+        cols = tuple(keys) + tuple(increments) + tuple(replace)
+        updates = [f"{c} = {c} + VALUES({c})" for c in increments] + [f"{c} = VALUES({c})" for c in replace]
+        return (f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(['%s'] * len(cols))}) "
+                f"ON DUPLICATE KEY UPDATE {', '.join(updates)}")
+
+    def hour_bucket(self, column):
+        """Начало часа для DATETIME-колонки (для GROUP BY)."""
+        return f"DATE_FORMAT({column}, '%Y-%m-%d %H:00:00')"
+
+    def ensure_index(self, cursor, table, name, columns):
+        # В MySQL нет CREATE INDEX IF NOT EXISTS
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, name))
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+
+    def has_column(self, cursor, table, name):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, name))
+        return bool(cursor.fetchone()[0])
+
+    def ensure_column(self, cursor, table, name, definition):
+        """Добавляет колонку, если её нет. True — колонка только что добавлена."""
+        if self.has_column(cursor, table, name):
+            return False
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        return True
+
+    def estimate_rows(self, cursor, table):
+        """Оценка числа строк без полного COUNT(*) по InnoDB."""
+        cursor.execute("""
+            SELECT TABLE_ROWS FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table,))
+        row = cursor.fetchone()
+        return int(row[0] or 0) if row else 0
+
+    def interval_ago(self, amount, unit):
+        """NOW() минус интервал, unit: SECOND/MINUTE/HOUR/DAY."""
+        return f"NOW() - INTERVAL {int(amount)} {unit.upper()}"
+
+    def json_contains(self, column, value):
+        """Условие «JSON-массив в column содержит строку value»."""
+        return f"JSON_CONTAINS({column}, '\"{value}\"')"
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    AUTO_ID = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+    # Локальное время, как NOW()/CURRENT_TIMESTAMP в MySQL
+    CURRENT_TIMESTAMP = "(datetime('now', 'localtime'))"
+    INSERT_IGNORE = 'INSERT OR IGNORE'
+    NOW = "datetime('now', 'localtime')"
+
+    Error = sqlite3.Error
+
+    def __init__(self, path):
+        self.path = path
+        _register_sqlite_types()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False)
+        # WAL: читатели не блокируют писателя (бот и API работают с одним файлом)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return SQLiteConnection(conn)
+
+    def warm_up(self):
+        self.connect().close()
+
+    def pool_status(self):
+        # Пула нет: соединение с файлом открывается на каждый запрос
+        return {'size': 0, 'open': True}
+
+    def connect_stream(self):
+        return self.connect()
+
+    def stream_cursor(self, conn):
+        # sqlite3 и так отдаёт строки лениво
+        return conn.cursor()
+
+    FOR_UPDATE = ''
+
+    def begin_write(self, cursor):
+        # Сразу берём блокировку записи, иначе параллельный писатель может изменить прочитанные строки
+        cursor.execute("BEGIN IMMEDIATE")
+
+    def upsert_add(self, table, keys, increments, replace=()):
+        cols = tuple(keys) + tuple(increments) + tuple(replace)
+        updates = [f"{c} = {c} + excluded.{c}" for c in increments] + [f"{c} = excluded.{c}" for c in replace]
+        return (f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(['%s'] * len(cols))}) "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(updates)}")
+
+    def hour_bucket(self, column):
+        return f"strftime('%Y-%m-%d %H:00:00', {column})"
+
+    def ensure_index(self, cursor, table, name, columns):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    def has_column(self, cursor, table, name):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return name in [r[1] for r in cursor.fetchall()]
+
+    def ensure_column(self, cursor, table, name, definition):
+        if self.has_column(cursor, table, name):
+            return False
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        return True
+
+    def estimate_rows(self, cursor, table):
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+    def interval_ago(self, amount, unit):
+        return f"datetime('now', 'localtime', '-{int(amount)} {unit.lower()}')"
+
+    def json_contains(self, column, value):
+        # role бывает как JSON-массивом, так и простой строкой ('user')
+        return (f"EXISTS (SELECT 1 FROM json_each(CASE WHEN json_valid({column}) THEN {column} "
+                f"ELSE json_array({column}) END) WHERE value = '{value}')")
+
+
+@lru_cache(maxsize=512)
+def _translate(sql):
+    return sql.replace('%s', '?')
+
+
+class SQLiteCursor:
+    """Курсор с интерфейсом mysql.connector: плейсхолдеры %s, rowcount, lastrowid."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_translate(sql), params or ())
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(_translate(sql), seq_of_params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size) if size else self._cursor.fetchmany()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return SQLiteCursor(self._conn.cursor())
+
+    def is_connected(self):
+        return True
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+_types_registered = False
+
+
+def _register_sqlite_types():
+    global _types_registered
+    if _types_registered:
+        return
+    sqlite3.register_adapter(datetime, lambda v: v.isoformat(' ', 'seconds'))
+    sqlite3.register_adapter(date, lambda v: v.isoformat())
+    sqlite3.register_adapter(Decimal, float)
+    sqlite3.register_converter('DATETIME', lambda v: datetime.fromisoformat(v.decode()))
+    sqlite3.register_converter('DATE', lambda v: date.fromisoformat(v.decode()[:10]))
+    _types_registered = True
+
+
+def create_backend(name, mysql_config=None, sqlite_path=None, pool_name=None, pool_size=0):
+    if name == 'mysql':
+        return MySQLBackend(mysql_config, pool_name, pool_size)
+    if name == 'sqlite':
+        return SQLiteBackend(sqlite_path)
+    raise ValueError(f"❌ Неизвестный DB_BACKEND: {name} (ожидается mysql или sqlite)")
@@ -0,0 +1,375 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from config import (YANDEX_MAPS_API_KEY, RESTAURANT_LAT, RESTAURANT_LON, GEOCODER, GEOCODE_MEMORY_CACHE,
+                    RESTAURANTS, ROAD_FACTOR, COURIER_SPEED_KMH, COOKING_MINUTES,
+                    COURIER_GRID_CELL_KM, COURIER_LOCATION_TTL, COURIER_GRID_REFRESH)
+from database import get_cached_geocodes, get_recent_geocodes, save_geocodes, get_free_courier_locations
+from tenants import current_restaurant_id, get_restaurant
+
+# Доставка: адрес -> координаты -> зона, стоимость и ETA.
+# Координаты адреса ищутся в памяти процесса (LRU), затем в таблице geocode_cache и только
+# потом у геокодера; ненайденные адреса тоже кешируются. Повторная проверка адреса не ходит
+# ни в сеть, ни (после первого раза в процессе) в БД. Кеш адресов общий, а зоны
+# (многоугольники из настроек филиала) и сетка свободных курьеров CourierGrid — свои у каждого филиала.
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEG_LAT = 111.32
+EARTH_RADIUS_KM = 6371.0
+
+_ABBREVIATIONS = {
+    'улица': 'ул', 'проспект': 'пр', 'пр-т': 'пр', 'переулок': 'пер', 'площадь': 'пл',
+    'бульвар': 'б-р', 'город': 'г', 'дом': 'д', 'корпус': 'к', 'квартира': 'кв',
+}
+
+
+def normalize_address(address):
+    """Ключ кеша: регистр, ё/е, пунктуация и типовые сокращения не влияют на результат."""
+    words = re.findall(r'[\w-]+', (address or '').lower().replace('ё', 'е'))
+    return ' '.join(_ABBREVIATIONS.get(w, w) for w in words)[:191]
+
+
+class GeocoderError(Exception):
+    """Геокодер недоступен (сеть, ключ, лимиты) — результат неизвестен и не кешируется."""
+
+
+class YandexGeocoder:
+    URL = 'https://geocode-maps.yandex.ru/1.x/'
+
+    def __init__(self, api_key=YANDEX_MAPS_API_KEY, bbox=None, timeout=3):
+        self.api_key = api_key
+        self.bbox = bbox  # (min_lat, min_lon, max_lat, max_lon) — ищем только в этой области
+        self.timeout = timeout
+        self.session = None
+
+    def geocode(self, address):
+        """(lat, lon) или None, если адрес не найден."""
+        # requests импортируется при первом обращении к геокодеру, а не при импорте модуля
+        import requests
+        if self.session is None:
+            self.session = requests.Session()
+        params = {'apikey': self.api_key, 'geocode': address, 'format': 'json', 'results': 1}
+        if self.bbox:
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            params.update(bbox=f"{min_lon},{min_lat}~{max_lon},{max_lat}", rspn=1)
+        try:
+            response = self.session.get(self.URL, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            members = response.json()['response']['GeoObjectCollection']['featureMember']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise GeocoderError(str(e)) from e
+        if not members:
+            return None
+        lon, lat = map(float, members[0]['GeoObject']['Point']['pos'].split())
+        return lat, lon
+
+
+class StubGeocoder:
+    """Геокодер без сети для тестов и локального запуска: адрес -> (lat, lon) из mapping,
+    остальные адреса — default (None — «не найден»)."""
+
+    def __init__(self, mapping=None, default=None):
+        self.mapping = {normalize_address(a): point for a, point in (mapping or {}).items()}
+        self.default = default
+        self.calls = 0
+
+    def geocode(self, address):
+        self.calls += 1
+        return self.mapping.get(normalize_address(address), self.default)
+
+
+class GeocodeCache:
+    def __init__(self, geocoder, max_size=GEOCODE_MEMORY_CACHE):
+        self.geocoder = geocoder
+        self.max_size = max_size
+        self._memory = OrderedDict()  # address_key -> (lat, lon) или None
+        self._lock = threading.Lock()
+        self.stats = {'memory': 0, 'db': 0, 'geocoder': 0}
+
+    def _remember(self, key, point):
+        with self._lock:
+            self._memory[key] = point
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def preload(self, limit):
+        """Загружает в память последние limit адресов из geocode_cache."""
+        rows = get_recent_geocodes(min(limit, self.max_size))
+        for key, point in reversed(rows):
+            self._remember(key, point)
+        return len(rows)
+
+    def status(self):
+        return {'size': len(self._memory), 'max_size': self.max_size, **self.stats}
+
+    def lookup_many(self, addresses):
+        """{address: (lat, lon) или None}. Адреса, которые не удалось проверить из-за
+        недоступности геокодера, в результат не попадают."""
+        result, misses = {}, {}
+        with self._lock:
+            for address in addresses:
+                key = normalize_address(address)
+                if not key:
+                    result[address] = None
+                elif key in self._memory:
+                    self._memory.move_to_end(key)
+                    result[address] = self._memory[key]
+                    self.stats['memory'] += 1
+                else:
+                    misses.setdefault(key, []).append(address)
+        if not misses:
+            return result
+
+        for key, point in get_cached_geocodes(misses).items():
+            self._remember(key, point)
+            for address in misses.pop(key):
+                result[address] = point
+            self.stats['db'] += 1
+
+        fresh = []
+        for key, same in misses.items():
+            try:
+                point = self.geocoder.geocode(same[0])
+            except GeocoderError as e:
+                logger.warning(f"Геокодер недоступен для '{same[0]}': {e}")
+                continue
+            self.stats['geocoder'] += 1
+            self._remember(key, point)
+            fresh.append((key, same[0], *(point or (None, None))))
+            for address in same:
+                result[address] = point
+        save_geocodes(fresh)
+        return result
+
+    def lookup(self, address):
+        result = self.lookup_many([address])
+        if address not in result:
+            raise GeocoderError(f"не удалось геокодировать '{address}'")
+        return result[address]
+
+
+class Zone:
+    def __init__(self, name, polygon, base_fee=0, per_km=0):
+        self.name = name
+        self.base_fee = float(base_fee)
+        self.per_km = float(per_km)
+        self.polygon = [(float(lat), float(lon)) for lat, lon in polygon]
+        lats = [p[0] for p in self.polygon]
+        lons = [p[1] for p in self.polygon]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        # Рёбра (lat1, lon1, lat2, lon2) без горизонтальных: они не пересекают луч
+        self._edges = [(a[0], a[1], b[0], b[1]) for a, b in zip(self.polygon, self.polygon[1:] + self.polygon[:1])
+                       if a[0] != b[0]]
+
+    def contains_many(self, points):
+        """Маска «точка внутри» для списка (lat, lon): bbox отсекает большую часть точек,
+        для остальных считается чётность пересечений луча с рёбрами (ребро за ребром по всей пачке)."""
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        candidates = [(i, lat, lon) for i, (lat, lon) in enumerate(points)
+                      if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon]
+        inside = [False] * len(points)
+        for lat1, lon1, lat2, lon2 in self._edges:
+            slope = (lon2 - lon1) / (lat2 - lat1)
+            for i, lat, lon in candidates:
+                if (lat1 > lat) != (lat2 > lat) and lon < lon1 + (lat - lat1) * slope:
+                    inside[i] = not inside[i]
+        return inside
+
+
+# restaurant_id -> зоны филиала
+ZONES = {restaurant_id: [Zone(**zone) for zone in r['zones']] for restaurant_id, r in RESTAURANTS.items()}
+
+
+def zones_for_points(points, zones=None):
+    """Первая подходящая зона текущего филиала (или None) для каждой точки."""
+    zones = ZONES[current_restaurant_id()] if zones is None else zones
+    result = [None] * len(points)
+    pending = list(range(len(points)))
+    for zone in zones:
+        if not pending:
+            break
+        mask = zone.contains_many([points[i] for i in pending])
+        for i, hit in zip(pending, mask):
+            if hit:
+                result[i] = zone
+        pending = [i for i, hit in zip(pending, mask) if not hit]
+    return result
+
+
+def find_zone(lat, lon):
+    return zones_for_points([(lat, lon)])[0]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def travel_minutes(distance_km):
+    return distance_km / COURIER_SPEED_KMH * 60
+
+
+class CourierGrid:
+    """Курьеры в ячейках cell_km x cell_km. Ближайший ищется по расширяющимся кольцам ячеек
+    вокруг точки, пока следующее кольцо не окажется дальше уже найденного курьера."""
+
+    def __init__(self, cell_km=COURIER_GRID_CELL_KM, origin_lat=RESTAURANT_LAT):
+        self.cell_km = cell_km
+        self.cell_lat = cell_km / KM_PER_DEG_LAT
+        self.cell_lon = cell_km / (KM_PER_DEG_LAT * math.cos(math.radians(origin_lat)))
+        self.cells = {}      # (row, col) -> {courier_id: (lat, lon)}
+        self.positions = {}  # courier_id -> (row, col)
+        self._bounds = None  # (min_row, min_col, max_row, max_col) занятых когда-либо ячеек
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_lat), math.floor(lon / self.cell_lon)
+
+    def update(self, courier_id, lat, lon):
+        self.remove(courier_id)
+        cell = self._cell(lat, lon)
+        self.cells.setdefault(cell, {})[courier_id] = (lat, lon)
+        self.positions[courier_id] = cell
+        if self._bounds is None:
+            self._bounds = cell + cell
+        else:
+            b = self._bounds
+            self._bounds = (min(b[0], cell[0]), min(b[1], cell[1]), max(b[2], cell[0]), max(b[3], cell[1]))
+
+    def remove(self, courier_id):
+        cell = self.positions.pop(courier_id, None)
+        if cell is not None:
+            self.cells[cell].pop(courier_id, None)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _ring(self, row, col, r):
+        if r == 0:
+            yield row, col
+            return
+        for dr in range(-r, r + 1):
+            for dc in (range(-r, r + 1) if abs(dr) == r else (-r, r)):
+                yield row + dr, col + dc
+
+    def nearest(self, lat, lon, max_km=None):
+        """(courier_id, расстояние по прямой, км) или None."""
+        if not self.positions:
+            return None
+        row, col = self._cell(lat, lon)
+        min_row, min_col, max_row, max_col = self._bounds
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col)
+        if max_km is not None:
+            last_ring = min(last_ring, math.ceil(max_km / self.cell_km) + 1)
+        best = None
+        for r in range(last_ring + 1):
+            # Любая точка кольца r не ближе (r - 1) ячеек
+            if best and best[1] <= (r - 1) * self.cell_km:
+                break
+            for cell in self._ring(row, col, r):
+                for courier_id, (c_lat, c_lon) in self.cells.get(cell, {}).items():
+                    distance = haversine_km(lat, lon, c_lat, c_lon)
+                    if best is None or distance < best[1]:
+                        best = (courier_id, distance)
+        if best and max_km is not None and best[1] > max_km:
+            return None
+        return best
+
+
+# restaurant_id -> (сетка, когда загружена)
+_grids = {}
+_grid_lock = threading.Lock()
+
+
+def courier_grid():
+    """Сетка свободных курьеров текущего филиала, перечитывается из БД не чаще раза
+    в COURIER_GRID_REFRESH секунд."""
+    restaurant_id = current_restaurant_id()
+    grid, loaded_at = _grids.get(restaurant_id, (None, float('-inf')))
+    if time.monotonic() - loaded_at < COURIER_GRID_REFRESH:
+        return grid
+    with _grid_lock:
+        grid, loaded_at = _grids.get(restaurant_id, (None, float('-inf')))
+        if time.monotonic() - loaded_at >= COURIER_GRID_REFRESH:
+            grid = CourierGrid(origin_lat=get_restaurant()['lat'])
+            for courier_id, lat, lon in get_free_courier_locations(COURIER_LOCATION_TTL):
+                grid.update(courier_id, lat, lon)
+            _grids[restaurant_id] = (grid, time.monotonic())
+    return grid
+
+
+def courier_grid_status():
+    """{restaurant_id: число курьеров и возраст сетки, сек} для загруженных сеток."""
+    now = time.monotonic()
+    return {restaurant_id: {'couriers': len(grid.positions), 'age': round(now - loaded_at, 1)}
+            for restaurant_id, (grid, loaded_at) in list(_grids.items())}
+
+
+def quote_point(lat, lon, grid=None):
+    """Зона, стоимость и ETA доставки в точку; None — точка вне всех зон."""
+    zone = find_zone(lat, lon)
+    if zone is None:
+        return None
+    restaurant = get_restaurant()
+    distance = haversine_km(restaurant['lat'], restaurant['lon'], lat, lon) * ROAD_FACTOR
+    # Заказ уходит, когда он готов и курьер доехал до ресторана (если свободных нет —
+    # считаем, что кто-то освободится к концу готовки)
+    ready = COOKING_MINUTES
+    nearest = (grid or courier_grid()).nearest(restaurant['lat'], restaurant['lon'])
+    if nearest:
+        ready = max(ready, travel_minutes(nearest[1] * ROAD_FACTOR))
+    return {
+        'zone': zone.name,
+        'distance_km': round(distance, 2),
+        'fee': round(zone.base_fee + zone.per_km * distance, 2),
+        'eta_minutes': math.ceil(ready + travel_minutes(distance)),
+        'courier_id': nearest[0] if nearest else None,
+    }
+
+
+def create_geocoder(name=GEOCODER):
+    if name == 'yandex':
+        # Ищем только внутри зон доставки филиалов, чтобы «Советская, 1» не уехала в другой город
+        zones = [z for restaurant_zones in ZONES.values() for z in restaurant_zones]
+        bbox = (min(z.bbox[0] for z in zones), min(z.bbox[1] for z in zones),
+                max(z.bbox[2] for z in zones), max(z.bbox[3] for z in zones)) if zones else None
+        return YandexGeocoder(bbox=bbox)
+    if name == 'stub':
+        # Без сети любой адрес «находится» у ресторана
+        return StubGeocoder(default=(RESTAURANT_LAT, RESTAURANT_LON))
+    raise ValueError(f"❌ Неизвестный GEOCODER: {name} (ожидается yandex или stub)")
+
+
+geocode_cache = GeocodeCache(create_geocoder())
+
+
+def delivery_quote(address, cache=None):
+    """Расчёт доставки по адресу. result: ok, outside (вне зон), not_found (адрес не найден)
+    или unavailable (геокодер недоступен — проверить адрес не удалось)."""
+    try:
+        point = (cache or geocode_cache).lookup(address)
+    except GeocoderError:
+        return {'result': 'unavailable'}
+    if point is None:
+        return {'result': 'not_found'}
+    lat, lon = point
+    quote = quote_point(lat, lon)
+    if quote is None:
+        return {'result': 'outside', 'lat': lat, 'lon': lon}
+    return {'result': 'ok', 'lat': lat, 'lon': lon, **quote}
+
+
+# Отказ в заказе: при недоступном геокодере заказы принимаем, чтобы не останавливать доставку
+DELIVERY_ERRORS = {
+    'outside': "Адрес вне зоны доставки",
+    'not_found': "Адрес не найден, уточните его",
+}
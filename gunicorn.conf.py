@@ -0,0 +1,14 @@
+import os
+
+# gunicorn 'api:create_app()' читает этот файл сам (из текущего каталога).
+# Воркеры — потоковые (gthread): заказы из потоков одного воркера попадают к одному писателю
+# групповой записи (order_ingest), и на всплеске пачки собираются. С sync-воркерами каждый
+# процесс обслуживает один запрос за раз, и писать пачками было бы нечего.
+# Процессов немного (по ядрам), параллельность — потоками; соединений с базой на процесс
+# нужно примерно API_THREADS, остальное пул добирает прямыми соединениями (MYSQL_POOL_SIZE).
+
+bind = os.getenv("API_BIND", "0.0.0.0:5000")
+worker_class = "gthread"
+workers = int(os.getenv("API_WORKERS", "2"))
+threads = int(os.getenv("API_THREADS", "16"))
+timeout = int(os.getenv("API_TIMEOUT", "30"))
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from config import INVENTORY_REFRESH
+from database import get_stock_levels, set_dish_stock, cart_stock_need
+from tenants import current_restaurant_id
+
+# Остатки и стоп-лист блюд.
+# Источник правды — dish_stock в БД: add_order резервирует блюда корзины условным UPDATE в той же
+# транзакции, что и заказ, смена статуса списывает или возвращает резерв (database._settle_stock).
+# Поэтому бот и API в разных процессах не продадут больше остатка. Здесь — снимок остатков
+# в памяти процесса (свой у каждого филиала, перечитывается раз в INVENTORY_REFRESH секунд и сразу
+# после изменений из этого процесса): по нему меню получает флаги available, а корзина с блюдом
+# из стоп-листа отклоняется без похода в БД.
+
+_snapshots = {}  # restaurant_id -> ({(dish_id, size): доступно}, loaded_at)
+_lock = threading.Lock()
+
+
+def stock_levels():
+    """{(dish_id, size): доступно} текущего филиала; блюд без учёта остатков в словаре нет."""
+    restaurant_id = current_restaurant_id()
+    levels, loaded_at = _snapshots.get(restaurant_id, (None, float('-inf')))
+    if time.monotonic() - loaded_at < INVENTORY_REFRESH:
+        return levels
+    with _lock:
+        levels, loaded_at = _snapshots.get(restaurant_id, (None, float('-inf')))
+        if time.monotonic() - loaded_at >= INVENTORY_REFRESH:
+            rows = get_stock_levels()
+            if rows is None:
+                # БД недоступна — живём со старым снимком (или без ограничений), заказ всё равно проверит БД
+                return levels or {}
+            levels = {(dish_id, size): quantity - reserved for dish_id, size, quantity, reserved in rows}
+            _snapshots[restaurant_id] = (levels, time.monotonic())
+    return levels
+
+
+def invalidate(restaurant_id=None):
+    """Следующее обращение перечитает остатки (restaurant_id=None — всех филиалов)."""
+    if restaurant_id is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(restaurant_id, None)
+
+
+def available(dish_id, size=None, levels=None):
+    """Сколько можно заказать; None — без ограничений. Размер без своей строки — по остатку блюда."""
+    levels = stock_levels() if levels is None else levels
+    value = levels.get((dish_id, size or ''))
+    if value is None and size:
+        value = levels.get((dish_id, ''))
+    return None if value is None else max(value, 0)
+
+
+def annotate_menu(dishes):
+    """Добавляет к блюдам меню available (можно заказать) и stock (остаток, None — без ограничений),
+    к размерам — их available."""
+    levels = stock_levels()
+    for dish in dishes:
+        stock = available(dish['id'], levels=levels)
+        dish['stock'] = stock
+        dish['available'] = stock is None or stock > 0
+        if dish.get('sizes'):
+            for size in dish['sizes']:
+                size_stock = available(dish['id'], size.get('name'), levels)
+                size['available'] = size_stock is None or size_stock > 0
+            dish['available'] = any(size['available'] for size in dish['sizes'])
+    return dishes
+
+
+def unavailable_items(dishes):
+    """Позиции корзины, которых заведомо не хватает по снимку (окончательно проверяет add_order)."""
+    levels = stock_levels()
+    if not levels:
+        return []
+    need, names = cart_stock_need(dishes)
+    # Размеры без своей строки делят остаток блюда целиком
+    totals = {}
+    for (dish_id, size), qty in need.items():
+        key = (dish_id, size) if (dish_id, size) in levels else (dish_id, '')
+        totals[key] = totals.get(key, 0) + qty
+    short = []
+    for (dish_id, size), qty in need.items():
+        key = (dish_id, size) if (dish_id, size) in levels else (dish_id, '')
+        if key in levels and levels[key] < totals[key]:
+            short.append({'dish_id': dish_id, 'size': size or None, 'name': names[(dish_id, size)],
+                          'available': max(levels[key], 0)})
+    return short
+
+
+def set_stock(items):
+    """Задаёт остатки ([(dish_id, size, available)], см. database.set_dish_stock) и сбрасывает снимок."""
+    applied = set_dish_stock(items)
+    invalidate(current_restaurant_id())
+    return applied
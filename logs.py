@@ -0,0 +1,217 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_SAMPLING
+from rate_limit import RateLimiter
+from tenants import current_restaurant_id
+
+# Логирование бота, API и фоновых процессов: setup_logging() в точке входа.
+# Вызов logger.* в обработчике только кладёт запись в очередь; JSON, маскирование платёжных
+# данных и запись в stderr делает фоновый поток (QueueListener). Если очередь переполнена,
+# запись отбрасывается, а не блокирует запрос (число потерянных приходит полем dropped).
+# Записи ниже WARNING ограничиваются по частоте на каждый логгер (LOG_RATE_LIMIT, поле
+# suppressed — сколько пропущено), а частые события log_event() пишутся выборочно (LOG_SAMPLING).
+
+REDACTED = '***'
+# Поля с платёжными данными и секретами: значения не попадают в лог
+REDACT_KEYS = {'payment', 'payment_url', 'signature', 'crypto-pay-api-signature', 'token', 'apikey',
+               'card', 'card_number', 'pan', 'cvv', 'cvc'}
+_CARD_NUMBER = re.compile(r'\b\d(?:[ -]?\d){12,18}\b')
+
+_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def set_log_context(**fields):
+    """Поля (request_id, update_id, ...) для всех записей до конца текущего запроса или задачи."""
+    _context.set(fields)
+
+
+@contextmanager
+def bind(**fields):
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _luhn_ok(digits):
+    total = 0
+    for i, d in enumerate(map(int, reversed(digits))):
+        if i % 2:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+    return total % 10 == 0
+
+
+def _mask_card(match):
+    digits = re.sub(r'\D', '', match.group())
+    return f"{REDACTED}{digits[-4:]}" if _luhn_ok(digits) else match.group()
+
+
+def redact_text(text):
+    """Номера карт (проходящие проверку Луна) в тексте заменяются на ***1234."""
+    return _CARD_NUMBER.sub(_mask_card, text) if any(c.isdigit() for c in text) else text
+
+
+def redact(value):
+    """Копия значения без платёжных полей (REDACT_KEYS) и номеров карт."""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in REDACT_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+def log_event(logger, event, level=logging.INFO, sample=None, **fields):
+    """Структурированное событие: fields пишутся отдельными ключами JSON и маскируются
+    в фоновом потоке. sample — доля записываемых событий (по умолчанию из LOG_SAMPLING)."""
+    if not logger.isEnabledFor(level):
+        return
+    sample = LOG_SAMPLING.get(event, 1.0) if sample is None else sample
+    if sample < 1.0:
+        if random.random() >= sample:
+            return
+        fields['sample'] = sample
+    logger.log(level, event, extra={'event': event, 'fields': fields})
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи id запроса/апдейта и филиал — в потоке, где вызван логгер."""
+
+    def filter(self, record):
+        record.context = {**_context.get(), 'restaurant_id': current_restaurant_id()}
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше LOG_RATE_LIMIT записей ниже WARNING на логгер; WARNING и выше проходят всегда."""
+
+    def __init__(self, limit=LOG_RATE_LIMIT):
+        super().__init__()
+        self.limiter = RateLimiter({'log': limit}, shared=False, max_keys=1000)
+        self.suppressed = {}  # имя логгера -> сколько записей отброшено с последней пропущенной
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.limiter.hit('log', record.name):
+            self.suppressed[record.name] = self.suppressed.get(record.name, 0) + 1
+            return False
+        suppressed = self.suppressed.pop(record.name, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при полной очереди теряет запись вместо ожидания."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Аргументы могут измениться после вызова — сообщение собираем сразу; traceback,
+        # JSON и маскирование — уже в фоновом потоке
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if self.dropped:
+            record.dropped = self.dropped
+        return record
+
+    def enqueue(self, record):
+        # Счётчик обнуляется, только когда запись с ним попала в очередь
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+
+def _extra_fields(record):
+    data = dict(getattr(record, 'context', None) or {})
+    data.update(redact(getattr(record, 'fields', None) or {}))
+    for key in ('suppressed', 'dropped'):
+        if hasattr(record, key):
+            data[key] = getattr(record, key)
+    return data
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact_text(record.getMessage()),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Формат для локального запуска: обычная строка и поля key=value."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = redact_text(super().format(record))
+        fields = ' '.join(f"{k}={v}" for k, v in _extra_fields(record).items() if v is not None)
+        return f"{line} {fields}" if fields else line
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # При остановке дожидаемся места в очереди, чтобы дописать всё, что уже в ней
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Настраивает корневой логгер на очередь и запускает фоновый поток записи (повторный вызов ничего не делает)."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(RateLimitFilter())
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = _QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает очередь и останавливает фоновый поток (при выходе из процесса вызывается сам)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,141 @@
+# Служебные команды для обслуживания базы.
+#
+#   python manage.py migrate
+#   python manage.py archive [--days 30] [--batch-size 500] [--pause 0.5] [--max-batches N]
+#   python manage.py stats
+#   python manage.py backfill_items [--batch-size 1000]
+#   python manage.py backfill_stats
+#   python manage.py sync_menu menu.csv [--images-dir DIR] [--delete-missing] [--dry-run]
+#   python manage.py --restaurant ID admin_branch TELEGRAM_ID [--remove]
+#
+# По умолчанию команда выполняется в каждой базе филиалов; --restaurant ID — только в базе этого филиала
+# (sync_menu и admin_branch работают с одним филиалом: --restaurant, по умолчанию основной).
+import argparse
+import json
+
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_BATCH_PAUSE, RESTAURANTS, DEFAULT_RESTAURANT_ID
+
+
+def cmd_migrate(args):
+    from database import init_db, SCHEMA_VERSION
+    init_db(all_shards=False)
+    print(f"Схема обновлена до версии {SCHEMA_VERSION}")
+
+
+def cmd_archive(args):
+    from database import archive_orders
+    moved = archive_orders(args.days, args.batch_size, args.pause, args.max_batches)
+    print(f"Перенесено в архив: {moved}")
+
+
+def cmd_stats(args):
+    from database import get_orders_table_stats
+    print(json.dumps(get_orders_table_stats(), ensure_ascii=False, indent=2))
+
+
+def cmd_backfill_items(args):
+    from database import backfill_order_items, init_db
+    init_db(all_shards=False)
+    print(f"Обработано заказов: {backfill_order_items(args.batch_size)}")
+
+
+def cmd_backfill_stats(args):
+    from database import init_db, rebuild_sales_rollups
+    init_db(all_shards=False)
+    print("Готово" if rebuild_sales_rollups() else "Ошибка, см. лог")
+
+
+def cmd_sync_menu(args):
+    import os
+    from menu_sync import parse_catalogue, process_images, sync_menu, MenuSyncError
+    from api import UPLOAD_FOLDER
+    images_dir = os.path.realpath(args.images_dir or os.path.dirname(os.path.abspath(args.file)))
+
+    def read_image(ref):
+        path = os.path.realpath(os.path.join(images_dir, ref))
+        if not path.startswith(images_dir + os.sep) or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    with open(args.file, 'rb') as f:
+        content = f.read()
+    try:
+        rows = parse_catalogue(content, args.format or args.file.rsplit('.', 1)[-1].lower())
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        process_images(rows, read_image, UPLOAD_FOLDER, write=not args.dry_run)
+    except MenuSyncError as e:
+        print("Каталог не загружен:\n" + "\n".join(e.errors))
+        raise SystemExit(1)
+    summary = sync_menu(rows, delete_missing=args.delete_missing, dry_run=args.dry_run)
+    if summary is None:
+        print("Ошибка, см. лог")
+        raise SystemExit(1)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+def cmd_admin_branch(args):
+    from database import set_admin_restaurant, get_admin_restaurants
+    from tenants import current_restaurant_id
+    if not set_admin_restaurant(args.telegram_id, current_restaurant_id(), allowed=not args.remove):
+        print("Ошибка, см. лог")
+        raise SystemExit(1)
+    restaurants = get_admin_restaurants(args.telegram_id)
+    print(f"Филиалы админа {args.telegram_id}: {restaurants or 'все'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы ресторана")
+    parser.add_argument('--restaurant', type=int, choices=list(RESTAURANTS), default=None, help="Филиал, в базе которого выполнить команду")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('migrate', help="Создать и обновить схему (запускать перед выкладкой API)")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser('archive', help="Перенести старые завершённые заказы в orders_archive")
+    p.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help="Возраст заказа в днях")
+    p.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    p.add_argument('--pause', type=float, default=ARCHIVE_BATCH_PAUSE, help="Пауза между пачками, сек")
+    p.add_argument('--max-batches', type=int, default=None)
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser('stats', help="Размер горячей и архивной таблиц заказов")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser('backfill_items', help="Заполнить order_items для старых заказов")
+    p.add_argument('--batch-size', type=int, default=1000)
+    p.set_defaults(func=cmd_backfill_items)
+
+    p = sub.add_parser('backfill_stats', help="Пересобрать агрегаты продаж по всей истории заказов")
+    p.set_defaults(func=cmd_backfill_stats)
+
+    p = sub.add_parser('sync_menu', help="Загрузить меню филиала из CSV/JSON (без --restaurant — основной филиал)")
+    p.add_argument('file')
+    p.add_argument('--format', choices=['csv', 'json'], default=None, help="По умолчанию — по расширению файла")
+    p.add_argument('--images-dir', default=None, help="Откуда брать картинки (по умолчанию — папка каталога)")
+    p.add_argument('--delete-missing', action='store_true', help="Удалить блюда, которых нет в каталоге")
+    p.add_argument('--dry-run', action='store_true', help="Только показать изменения")
+    p.set_defaults(func=cmd_sync_menu, per_restaurant=True)
+
+    p = sub.add_parser('admin_branch', help="Закрепить админа за филиалом (админ без филиалов управляет всеми)")
+    p.add_argument('telegram_id', type=int)
+    p.add_argument('--remove', action='store_true', help="Забрать доступ к филиалу")
+    p.set_defaults(func=cmd_admin_branch, per_restaurant=True)
+
+    args = parser.parse_args()
+    from logs import setup_logging
+    setup_logging()
+    from database import shard_restaurant_ids
+    from tenants import use_restaurant
+    if getattr(args, 'per_restaurant', False):
+        # Команда про данные одного филиала, а не про базу целиком
+        restaurant_ids = [args.restaurant or DEFAULT_RESTAURANT_ID]
+    else:
+        restaurant_ids = [args.restaurant] if args.restaurant else shard_restaurant_ids()
+    for restaurant_id in restaurant_ids:
+        with use_restaurant(restaurant_id):
+            args.func(args)
+
+
+if __name__ == '__main__':
+    main()
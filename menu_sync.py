@@ -0,0 +1,213 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from config import MENU_IMAGE_WORKERS, MENU_IMAGE_MAX_BYTES
+from database import get_menu_for_sync, apply_menu_changes
+
+# Массовая загрузка меню филиала из CSV/JSON: POST /api/admin/menu/sync или
+# python manage.py sync_menu menu.csv --images-dir photos/ --restaurant 1
+# Каталог сравнивается с dishes по id (если он указан) или по названию: новые блюда
+# вставляются, изменённые обновляются, а при delete_missing отсутствующие в каталоге
+# удаляются — одной транзакцией через executemany. Поле, которого нет в каталоге
+# (описание, картинка, размеры), у существующего блюда не меняется.
+# Картинки копируются в uploads пулом потоков под именем из хеша содержимого,
+# поэтому повторная загрузка того же каталога не даёт изменений.
+#
+# CSV: name,price,category,description,image,sizes — sizes вида "S=10;M=12.5" или JSON.
+# JSON: [{"name": ..., "price": ..., "sizes": [{"name": "S", "price": 10}], ...}] или {"dishes": [...]}.
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXT = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+FIELDS = ('name', 'price', 'description', 'image_url', 'category', 'sizes')
+
+
+class MenuSyncError(ValueError):
+    """Каталог не прошёл проверку; errors — ошибки по строкам."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors[:10]))
+        self.errors = errors
+
+
+def _parse_sizes(value):
+    """[{'name', 'price'}] из списка, словаря {"S": 10}, JSON-строки или "S=10;M=12.5"."""
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value[:1] in '[{':
+            value = json.loads(value)
+        else:
+            value = dict(part.split('=', 1) for part in value.split(';') if part.strip())
+    if isinstance(value, dict):
+        value = [{'name': k, 'price': v} for k, v in value.items()]
+    return [{'name': str(s['name']).strip(), 'price': round(float(s['price']), 2)} for s in value] or None
+
+
+def _parse_row(raw, line):
+    name = str(raw.get('name') or '').strip()
+    if not name or len(name) > 200:
+        raise ValueError("name обязателен (до 200 символов)")
+    price = round(float(raw.get('price')), 2)
+    if price < 0:
+        raise ValueError("price не может быть отрицательной")
+    dish_id = raw.get('id')
+    row = {
+        'id': int(dish_id) if dish_id not in (None, '') else None,
+        'name': name,
+        'price': price,
+        'category': str(raw.get('category') or '').strip() or None,
+        # None — поля нет в каталоге, у существующего блюда оно не меняется
+        'description': raw.get('description'),
+        'image': str(raw.get('image') or raw.get('image_url') or '').strip() or None,
+        'sizes': _parse_sizes(raw.get('sizes')) if 'sizes' in raw else None,
+        'line': line,
+    }
+    if 'sizes' in raw and row['sizes'] is None:
+        row['sizes'] = []  # явно пустые размеры — убрать у блюда
+    return row
+
+
+def parse_catalogue(content, fmt):
+    """Строки каталога (fmt: csv или json). MenuSyncError со всеми ошибками сразу."""
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if fmt == 'json':
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise MenuSyncError([f"JSON: {e}"])
+        raws = data.get('dishes') if isinstance(data, dict) else data
+        if not isinstance(raws, list):
+            raise MenuSyncError(["JSON: ожидается список блюд или {\"dishes\": [...]}"])
+        numbered = enumerate(raws, 1)
+    elif fmt == 'csv':
+        # Первая строка — заголовок, поэтому данные начинаются со второй
+        numbered = enumerate(csv.DictReader(io.StringIO(content)), 2)
+    else:
+        raise MenuSyncError([f"Неизвестный формат: {fmt} (csv или json)"])
+
+    rows, errors, seen = [], [], {}
+    for line, raw in numbered:
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("ожидается объект")
+            row = _parse_row(raw, line)
+        except (ValueError, TypeError, KeyError) as e:
+            errors.append(f"строка {line}: {e}")
+            continue
+        key = row['name'].lower()
+        if key in seen:
+            errors.append(f"строка {line}: блюдо «{row['name']}» уже есть в строке {seen[key]}")
+            continue
+        seen[key] = line
+        rows.append(row)
+    if errors:
+        raise MenuSyncError(errors)
+    return rows
+
+
+def _is_url(ref):
+    return ref.startswith(('/uploads/', 'http://', 'https://'))
+
+
+def _store_image(ref, read, upload_folder, write=True):
+    """Копирует картинку в uploads под именем из хеша содержимого и возвращает её URL
+    (write=False — только проверяет и считает URL)."""
+    ext = ref.rsplit('.', 1)[-1].lower() if '.' in ref else ''
+    if ext not in IMAGE_EXT:
+        raise ValueError(f"картинка {ref}: недопустимое расширение")
+    data = read(ref)
+    if data is None:
+        raise ValueError(f"картинка {ref} не найдена")
+    if len(data) > MENU_IMAGE_MAX_BYTES:
+        raise ValueError(f"картинка {ref} больше {MENU_IMAGE_MAX_BYTES // 1024} КБ")
+    fname = f"menu_{hashlib.sha256(data).hexdigest()[:20]}.{ext}"
+    path = os.path.join(upload_folder, fname)
+    if write and not os.path.exists(path):
+        # Пишем во временный файл: параллельная загрузка той же картинки не увидит его недописанным
+        tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return f"/uploads/{fname}"
+
+
+def process_images(rows, read, upload_folder, write=True, workers=MENU_IMAGE_WORKERS):
+    """Заменяет у строк ссылки на локальные картинки (read(ref) -> bytes или None) на URL в uploads.
+    write=False (dry run) — файлы не копируются, но URL те же, что будут после загрузки."""
+    local = sorted({row['image'] for row in rows if row['image'] and not _is_url(row['image'])})
+    if not local:
+        return
+    urls, errors = {}, []
+    with ThreadPoolExecutor(max_workers=min(workers, len(local))) as pool:
+        futures = {ref: pool.submit(_store_image, ref, read, upload_folder, write) for ref in local}
+        for ref, future in futures.items():
+            try:
+                urls[ref] = future.result()
+            except (OSError, ValueError) as e:
+                errors.append(str(e))
+    if errors:
+        raise MenuSyncError(errors)
+    for row in rows:
+        if row['image'] in urls:
+            row['image'] = urls[row['image']]
+
+
+def diff_menu(current, rows, delete_missing=False):
+    """(inserts, updates, deletes, unchanged) — что нужно изменить в dishes, чтобы меню совпало с каталогом."""
+    by_id = {d['id']: d for d in current}
+    by_name = {d['name'].strip().lower(): d for d in current}
+    inserts, updates, matched = [], [], set()
+    unchanged = 0
+    for row in rows:
+        dish = by_id.get(row['id']) if row['id'] is not None else by_name.get(row['name'].lower())
+        if dish is None or dish['id'] in matched:
+            inserts.append({
+                'name': row['name'], 'price': row['price'], 'description': row['description'] or '',
+                'image_url': row['image'] or '', 'category': row['category'] or 'other', 'sizes': row['sizes'] or None,
+            })
+            continue
+        matched.add(dish['id'])
+        wanted = {
+            'id': dish['id'], 'name': row['name'], 'price': row['price'],
+            'description': dish['description'] if row['description'] is None else row['description'],
+            'image_url': dish['image_url'] if row['image'] is None else row['image'],
+            'category': row['category'] or dish['category'],
+            'sizes': dish['sizes'] if row['sizes'] is None else (row['sizes'] or None),
+        }
+        if any(wanted[f] != dish[f] for f in FIELDS):
+            updates.append(wanted)
+        else:
+            unchanged += 1
+    deletes = [d['id'] for d in current if d['id'] not in matched] if delete_missing else []
+    return inserts, updates, deletes, unchanged
+
+
+def sync_menu(rows, delete_missing=False, dry_run=False):
+    """Приводит меню текущего филиала к каталогу. Возвращает сводку изменений;
+    None — ошибка БД (ничего не изменено)."""
+    current = get_menu_for_sync()
+    if current is None:
+        return None
+    inserts, updates, deletes, unchanged = diff_menu(current, rows, delete_missing)
+    names = {d['id']: d['name'] for d in current}
+    summary = {
+        'inserted': [d['name'] for d in inserts],
+        'updated': [d['name'] for d in updates],
+        'deleted': [names[i] for i in deletes],
+        'unchanged': unchanged,
+        'dry_run': dry_run,
+    }
+    if dry_run or not (inserts or updates or deletes):
+        return summary
+    if not apply_menu_changes(inserts, updates, deletes):
+        return None
+    logger.info(f"Меню синхронизировано: +{len(inserts)} ~{len(updates)} -{len(deletes)}, без изменений {unchanged}")
+    return summary
@@ -0,0 +1,115 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from config import RESTAURANTS, DEFAULT_RESTAURANT_ID
+from logs import bind
+from rate_limit import limiter
+from tenants import use_restaurant, parse_restaurant_id
+
+# Outer-middleware бота. Живут отдельно от rate_limit.py и tenants.py, чтобы API
+# (а с ним и каждый воркер gunicorn) не импортировал aiogram.
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer-middleware aiogram: лишние сообщения и нажатия отбрасываются до хендлеров
+    (отказ по локальному бакету — без обращения к БД). Предупреждение отправляется один раз за серию отказов."""
+
+    def __init__(self, scope='bot_message', rate_limiter=limiter):
+        self.scope = scope
+        self.limiter = rate_limiter
+        self._warned = set()
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+        retry_after = self.limiter.hit_local(self.scope, user.id)
+        if not retry_after and self.limiter.shared:
+            # Общий счётчик — запрос к БД: не держим им цикл событий
+            retry_after = await asyncio.to_thread(self.limiter.hit_shared, self.scope, user.id)
+        if not retry_after:
+            self._warned.discard(user.id)
+            return await handler(event, data)
+        if user.id not in self._warned:
+            self._warned.add(user.id)
+            text = f"Слишком много запросов, попробуйте через {int(retry_after) + 1} с."
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, Message):
+                await event.answer(text, parse_mode=None)
+        elif isinstance(event, CallbackQuery):
+            await event.answer()
+        return None
+
+
+class TenantMiddleware(BaseMiddleware):
+    """Outer-middleware aiogram: выставляет филиал апдейта. Филиал берётся из /start r<id>
+    или restaurantId в данных WebApp (и запоминается), иначе — последний выбранный пользователем."""
+
+    def __init__(self, max_users=100000):
+        self.max_users = max_users
+        self._users = OrderedDict()  # telegram_id -> restaurant_id
+
+    def _remember(self, telegram_id, restaurant_id):
+        self._users[telegram_id] = restaurant_id
+        self._users.move_to_end(telegram_id)
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def _chosen(self, event):
+        text = getattr(event, 'text', None) or ''
+        if text.startswith('/start '):
+            return parse_restaurant_id(text.split(maxsplit=1)[1])
+        web_app_data = getattr(event, 'web_app_data', None)
+        if web_app_data:
+            try:
+                return parse_restaurant_id(json.loads(web_app_data.data).get('restaurantId'))
+            except (ValueError, AttributeError):
+                return None
+        return None
+
+    async def resolve(self, telegram_id, event):
+        """Филиал апдейта. Известный пользователь берётся из памяти; запросы к основной базе
+        (запомнить выбор, прочитать прошлый) идут в потоке, не задерживая цикл событий."""
+        from database import get_user_restaurants, set_user_restaurant
+        chosen = self._chosen(event)
+        if chosen is not None:
+            if self._users.get(telegram_id) != chosen:
+                await asyncio.to_thread(set_user_restaurant, telegram_id, chosen)
+            self._remember(telegram_id, chosen)
+            return chosen
+        if telegram_id not in self._users:
+            stored = (await asyncio.to_thread(get_user_restaurants, [telegram_id])).get(telegram_id)
+            self._remember(telegram_id, stored if stored in RESTAURANTS else DEFAULT_RESTAURANT_ID)
+        return self._users[telegram_id]
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, 'from_user', None)
+        if user is None or len(RESTAURANTS) == 1:
+            return await handler(event, data)
+        with use_restaurant(await self.resolve(user.id, event)):
+            return await handler(event, data)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer-middleware на апдейты: update_id попадает во все записи лога при их обработке."""
+
+    async def __call__(self, handler, event, data):
+        with bind(update_id=event.update_id):
+            return await handler(event, data)
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """Outer-middleware на апдейты: обработчик регистрируется в supervisor, и при остановке
+    бота его дожидаются, а не обрывают посреди отправки."""
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+
+    async def __call__(self, handler, event, data):
+        with self.supervisor.track():
+            return await handler(event, data)
@@ -0,0 +1,143 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+from config import ORDER_GROUP_COMMIT, ORDER_BATCH_MAX, ORDER_BATCH_WAIT
+from database import prepare_order, add_orders, OutOfStock, restaurant_shards, restaurants_in_shard
+from tenants import current_restaurant_id, use_restaurant
+
+# Групповая запись заказов (group commit). API и бот создают заказы через add_order() отсюда:
+# заказ готовится в потоке запроса, кладётся в очередь писателя своей базы, и запрос ждёт ответа.
+# Поток-писатель забирает всё, что накопилось за ORDER_BATCH_WAIT (не больше ORDER_BATCH_MAX),
+# и пишет пачку одной транзакцией (database.add_orders) — на всплеске после промо-рассылки
+# сотни заказов дают несколько commit вместо сотен.
+# Ответ (id заказа) приходит только после commit. Ошибки у каждого заказа свои: нехватка
+# остатков откатывает только этот заказ (OutOfStock), ошибка БД — пачка переписывается по одному.
+# Ждать попутные заказы писатель начинает, только когда они были: если прошлая пачка состояла
+# из одного заказа, одиночный заказ пишется сразу, без задержки ORDER_BATCH_WAIT.
+# Писатели свои в каждом процессе: пачки собираются из потоков одного процесса, поэтому API
+# запускается с потоковыми воркерами (gunicorn.conf.py, gthread), а бот пишет из to_thread своего цикла.
+# ORDER_GROUP_COMMIT=0 — каждый заказ пишется сразу (database.add_order).
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class OrderWriter:
+    """Очередь заказов одной базы и поток, который пишет их пачками."""
+
+    def __init__(self, shard_id, max_batch=ORDER_BATCH_MAX, wait=ORDER_BATCH_WAIT):
+        self.shard_id = shard_id  # филиал, через который поток получает соединение с базой
+        self.max_batch = max_batch
+        self.wait = wait
+        self.queue = queue.Queue()
+        self.closed = False
+        self.last_batch = 1  # размер прошлой пачки: 1 — попутных заказов не было, не ждём
+        self._lock = threading.Lock()  # после _STOP в очередь ничего не попадает
+        self.thread = threading.Thread(target=self._run, name=f"order-writer-{shard_id}", daemon=True)
+        self.thread.start()
+
+    def submit(self, order):
+        future = Future()
+        with self._lock:
+            if not self.closed:
+                self.queue.put((order, future))
+                return future
+        # Писатель уже остановлен (выход процесса) — пишем сами
+        future.set_result(add_orders([order])[0])
+        return future
+
+    def stop(self, timeout=None):
+        """Дописывает уже принятые заказы и останавливает поток."""
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        wait = self.wait if self.last_batch > 1 else 0
+        deadline = time.monotonic() + wait
+        while len(batch) < self.max_batch:
+            try:
+                # Сначала забираем всё, что уже в очереди, потом ждём попутные заказы до deadline
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0)) if wait else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        with use_restaurant(self.shard_id):
+            stopping = False
+            while not stopping:
+                first = self.queue.get()
+                if first is _STOP:
+                    break
+                batch, stopping = self._collect(first)
+                self.last_batch = len(batch)
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            results = add_orders([order for order, _ in batch])
+        except Exception as e:
+            # Что-то кроме ошибки БД: ответим каждому ожидающему, а не оставим запросы висеть
+            logger.exception(f"Ошибка записи пачки заказов: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_writers = {}  # ключ базы -> OrderWriter
+_writers_lock = threading.Lock()
+
+
+def _writer():
+    key = restaurant_shards[current_restaurant_id()]
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = _writers[key] = OrderWriter(restaurants_in_shard()[0])
+    return writer
+
+
+def add_order(user_id, dishes, address, total, order_type='delivery', payment_provider=None, payment_id=None):
+    """Как database.add_order (id заказа, None при ошибке, OutOfStock), но через групповую запись.
+    Блокирует поток до commit: из корутин бота вызывать через asyncio.to_thread."""
+    if not ORDER_GROUP_COMMIT:
+        return database.add_order(user_id, dishes, address, total, order_type, payment_provider, payment_id)
+    try:
+        order = prepare_order(user_id, dishes, address, total, order_type, payment_provider, payment_id)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ошибка добавления заказа: {e}")
+        return None
+    # Без таймаута: заказ уже в очереди и будет записан, ответ «ошибка» привёл бы к дублю при повторе
+    result = _writer().submit(order).result()
+    if isinstance(result, OutOfStock):
+        raise result
+    return result
+
+
+def stop_writers(timeout=None):
+    """Дописывает очереди всех писателей (при выходе из процесса вызывается сам)."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop(timeout)
+
+
+atexit.register(stop_writers)
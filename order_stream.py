@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from aiohttp.abc import AbstractAccessLogger
+
+from config import (ORDER_STREAM_HOST, ORDER_STREAM_PORT, ORDER_STREAM_POLL_INTERVAL,
+                    ORDER_STREAM_HEARTBEAT, ORDER_STREAM_QUEUE_SIZE, DEFAULT_RESTAURANT_ID, RESTAURANTS, WEB_APP_URL)
+from database import init_db, get_order_events_cursor, get_order_events_since
+from tenants import use_restaurant, parse_restaurant_id
+from logs import setup_logging
+from webapp_auth import verify_init_data
+
+# Живой статус заказов для WebApp (Server-Sent Events): python order_stream.py
+# Один фоновый цикл читает новые строки order_events (их пишут и бот, и API при любой
+# смене статуса) и раздаёт их подписчикам через OrderEventHub. Клиент — корутина с
+# очередью, а не поток Flask, поэтому тысячи простаивающих соединений почти ничего не стоят.
+# У каждого филиала свой цикл (события пишутся с restaurant_id), поэтому подписка — на пару
+# (филиал, user_id); id событий растут в пределах базы филиала, Last-Event-ID они не мешают.
+# Поток отдаётся только владельцу: initData мини-аппа (EventSource не умеет заголовки, поэтому
+# его можно передать и параметром init_data) должен быть подписан и принадлежать этому user_id.
+
+logger = logging.getLogger(__name__)
+
+# Сколько пропущенных событий досылаем по Last-Event-ID
+REPLAY_LIMIT = 200
+
+# Без прокси поток живёт на своём адресе (ORDER_STREAM_URL): читать его разрешаем только странице WebApp
+WEB_APP_ORIGIN = '{0.scheme}://{0.netloc}'.format(urlsplit(WEB_APP_URL)) if WEB_APP_URL else None
+
+HUB = web.AppKey('hub', 'OrderEventHub')
+PUMPS = web.AppKey('pumps', list)
+
+
+class OrderEventHub:
+    """Раздаёт события заказов очередям подписчиков по (филиал, user_id)."""
+
+    def __init__(self, queue_size=ORDER_STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}  # (restaurant_id, user_id) -> set(asyncio.Queue)
+
+    def subscribe(self, key):
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key, queue):
+        queues = self.subscribers.get(key)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[key]
+
+    def publish(self, restaurant_id, event):
+        for queue in self.subscribers.get((restaurant_id, event['user_id']), ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: закрываем поток, он переподключится с Last-Event-ID
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def connections(self):
+        return sum(len(q) for q in self.subscribers.values())
+
+
+async def pump_events(hub, restaurant_id):
+    """Читает order_events филиала с текущего конца и публикует новые события в hub."""
+    with use_restaurant(restaurant_id):
+        cursor = await asyncio.to_thread(get_order_events_cursor)
+        while cursor is None:
+            await asyncio.sleep(ORDER_STREAM_POLL_INTERVAL)
+            cursor = await asyncio.to_thread(get_order_events_cursor)
+        while True:
+            await asyncio.sleep(ORDER_STREAM_POLL_INTERVAL)
+            try:
+                events = await asyncio.to_thread(get_order_events_since, cursor)
+                for event in events or ():
+                    hub.publish(restaurant_id, event)
+                    cursor = event['id']
+            except Exception as e:
+                logger.error(f"Ошибка чтения order_events (филиал {restaurant_id}): {e}")
+
+
+def format_event(event):
+    data = {k: event[k] for k in ('order_id', 'status', 'order_type', 'total', 'created_at')}
+    return f"id: {event['id']}\nevent: status\ndata: {json.dumps(data)}\n\n".encode()
+
+
+async def stream_orders(request):
+    user_id = int(request.match_info['user_id'])
+    user = verify_init_data(request.headers.get('X-Telegram-Init-Data') or request.query.get('init_data'))
+    if user is None:
+        return web.json_response({'status': 'error', 'error': 'Unauthorized'}, status=401)
+    if user['id'] != user_id:
+        return web.json_response({'status': 'error', 'error': 'Forbidden'}, status=403)
+    restaurant_id = parse_restaurant_id(request.query.get('restaurant_id') or DEFAULT_RESTAURANT_ID)
+    if restaurant_id is None:
+        return web.json_response({'status': 'error', 'error': 'Unknown restaurant'}, status=400)
+    last_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+
+    headers = {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx не должен буферизовать поток
+    }
+    if WEB_APP_ORIGIN and request.headers.get('Origin') == WEB_APP_ORIGIN:
+        headers.update({'Access-Control-Allow-Origin': WEB_APP_ORIGIN, 'Vary': 'Origin'})
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+    hub = request.app[HUB]
+    # Подписываемся до досылки, чтобы не потерять события между ними (повторы отсекаются по id)
+    queue = hub.subscribe((restaurant_id, user_id))
+    try:
+        await response.write(b"retry: 3000\n\n")
+        if last_id is not None:
+            with use_restaurant(restaurant_id):
+                replay = await asyncio.to_thread(get_order_events_since, last_id, REPLAY_LIMIT, user_id)
+            for event in replay or ():
+                await response.write(format_event(event))
+                last_id = event['id']
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), ORDER_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await response.write(b": ping\n\n")
+                continue
+            if event is None:
+                break
+            if last_id is not None and event['id'] <= last_id:
+                continue
+            await response.write(format_event(event))
+            last_id = event['id']
+    except ConnectionResetError:
+        pass
+    finally:
+        hub.unsubscribe((restaurant_id, user_id), queue)
+    return response
+
+
+class AccessLogger(AbstractAccessLogger):
+    """Журнал запросов без строки запроса: в ней может быть initData пользователя."""
+
+    def log(self, request, response, time):
+        self.logger.info(f'{request.remote} "{request.method} {request.path}" {response.status} {time:.3f}s')
+
+
+async def health(request):
+    return web.json_response({'connections': request.app[HUB].connections()})
+
+
+async def _start_pump(app):
+    app[PUMPS] = [asyncio.create_task(pump_events(app[HUB], restaurant_id)) for restaurant_id in RESTAURANTS]
+
+
+async def _stop_pump(app):
+    for task in app[PUMPS]:
+        task.cancel()
+
+
+def create_app():
+    app = web.Application()
+    app[HUB] = OrderEventHub()
+    app.router.add_get('/api/user/{user_id:\\d+}/orders/stream', stream_orders)
+    app.router.add_get('/healthz', health)
+    app.on_startup.append(_start_pump)
+    app.on_cleanup.append(_stop_pump)
+    return app
+
+
+if __name__ == '__main__':
+    setup_logging()
+    init_db()
+    web.run_app(create_app(), host=ORDER_STREAM_HOST, port=ORDER_STREAM_PORT, access_log_class=AccessLogger)
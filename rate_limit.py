@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import RATE_LIMIT_BACKEND, RATE_LIMITS
+
+# Ограничение частоты для бота и API.
+# Лимит задаётся в config.RATE_LIMITS как (N, секунд) на область (scope) и ключ
+# (telegram_id, IP, ...). Проверка идёт по токен-бакету в памяти процесса; при
+# RATE_LIMIT_BACKEND=db разрешённые локально запросы дополнительно считаются в общей
+# таблице, чтобы лимит держался на несколько инстансов. Отказ по локальному бакету
+# не ходит в БД вовсе. hit() делает обе проверки сразу (потоки Flask); из цикла событий бота
+# вызывается hit_local(), а общая проверка hit_shared() — через asyncio.to_thread.
+
+logger = logging.getLogger(__name__)
+
+# Счётчики в БД старше суток удаляются (раз в PRUNE_EVERY попаданий)
+PRUNE_EVERY = 1000
+
+
+class RateLimiter:
+    def __init__(self, limits=RATE_LIMITS, shared=RATE_LIMIT_BACKEND == 'db', max_keys=100000):
+        self.limits = limits
+        self.shared = shared
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # (scope, key) -> [tokens, updated]
+        self._lock = threading.Lock()
+        self._shared_hits = 0
+
+    def hit(self, scope, key):
+        """Учитывает запрос. Возвращает 0, если он разрешён, иначе через сколько секунд повторить."""
+        retry_after = self.hit_local(scope, key)
+        if retry_after or not self.shared:
+            return retry_after
+        return self.hit_shared(scope, key)
+
+    def hit_local(self, scope, key):
+        """Проверка по бакету в памяти процесса (без БД): 0 или через сколько секунд повторить."""
+        count, period = self.limits[scope]
+        rate = count / period
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((scope, key))
+            if bucket is None:
+                bucket = self._buckets[(scope, key)] = [count, now]
+                # Вытесняем давно неактивные ключи, чтобы словарь не рос от перебора IP
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((scope, key))
+                bucket[0] = min(count, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                return (1 - bucket[0]) / rate
+            bucket[0] -= 1
+        return 0
+
+    def hit_shared(self, scope, key):
+        """Проверка по общему счётчику в БД (блокирует поток: запрос к базе)."""
+        from database import incr_rate_counter, prune_rate_counters
+        count, period = self.limits[scope]
+        now = time.time()
+        window_start = int(now // period * period)
+        hits = incr_rate_counter(f"{scope}:{key}", window_start)
+        self._shared_hits += 1
+        if self._shared_hits % PRUNE_EVERY == 0:
+            prune_rate_counters(int(now) - 86400)
+        if hits is None:
+            return 0  # БД недоступна — не блокируем пользователей
+        if hits > count:
+            return window_start + period - now
+        return 0
+
+
+limiter = RateLimiter()
@@ -0,0 +1,295 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+
+from config import SEARCH_REFRESH
+from database import get_menu_for_sync
+from tenants import current_restaurant_id, use_restaurant
+
+# Поиск по меню: GET /api/dishes/search?q=
+# У каждого филиала в памяти процесса обратный индекс по названию, категории и описанию блюд:
+# слово -> {dish_id: вес поля}. Слова сравниваются без учёта регистра (casefold, ё = е);
+# последнее и любое другое слово запроса может быть началом слова из меню (пицц -> пицца),
+# а слово от 4 букв — с опечаткой (1 правка, от 8 букв — 2): кандидаты ищутся по словарю
+# удалений (symmetric delete), поэтому словарь не перебирается целиком.
+# Слова запроса пересекаются начиная с самого узкого; самое широкое перебирается от лучших
+# совпадений к худшим и останавливается, как только limit блюд гарантированно не обгонит
+# никакое ещё не просмотренное.
+# Индекс не перестраивается с нуля: раз в SEARCH_REFRESH секунд (и сразу после изменений меню
+# из этого процесса, см. invalidate) меню перечитывается в фоновом потоке и переиндексируются
+# только добавленные, изменённые и удалённые блюда; поиск тем временем идёт по прежнему индексу.
+
+FIELD_WEIGHTS = {'name': 3.0, 'category': 2.0, 'description': 1.0}
+MAX_WEIGHT = max(FIELD_WEIGHTS.values())
+EXACT, PREFIX, TYPO = 1.0, 0.7, {1: 0.5, 2: 0.3}
+MAX_PREFIX_TOKENS = 200  # сколько слов словаря разворачивать для короткого префикса
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD.findall((text or '').casefold().replace('ё', 'е'))
+
+
+def max_typos(token):
+    return 0 if len(token) < 4 else 1 if len(token) < 8 else 2
+
+
+def _deletes(token, depth):
+    """Варианты слова, в которых удалено не больше depth букв (включая само слово)."""
+    variants, frontier = {token}, {token}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a, b, limit):
+    """Расстояние Дамерау-Левенштейна (с перестановкой соседних букв); больше limit — limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _signature(dish):
+    return (dish['name'], dish['category'], dish['description'])
+
+
+class DishIndex:
+    """Обратный индекс меню одного филиала."""
+
+    def __init__(self):
+        self.dishes = {}     # dish_id -> блюдо
+        self.terms = {}      # dish_id -> {слово: вес}
+        self.postings = {}   # слово -> {dish_id: вес}
+        self.vocabulary = []  # слова по алфавиту — для поиска по префиксу
+        self.deletes = {}    # вариант с удалёнными буквами -> слова словаря
+        self.loaded_at = float('-inf')
+        self.lock = threading.Lock()
+
+    def _add_token(self, token):
+        bisect.insort(self.vocabulary, token)
+        for variant in _deletes(token, max_typos(token)):
+            self.deletes.setdefault(variant, set()).add(token)
+
+    def _drop_token(self, token):
+        del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+        for variant in _deletes(token, max_typos(token)):
+            tokens = self.deletes[variant]
+            tokens.discard(token)
+            if not tokens:
+                del self.deletes[variant]
+
+    def add(self, dish):
+        self.remove(dish['id'])
+        terms = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(dish.get(field)):
+                terms[token] = max(terms.get(token, 0), weight)
+        for token, weight in terms.items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                self._add_token(token)
+            self.postings[token][dish['id']] = weight
+        self.dishes[dish['id']] = dish
+        self.terms[dish['id']] = terms
+
+    def remove(self, dish_id):
+        self.dishes.pop(dish_id, None)
+        for token in self.terms.pop(dish_id, ()):
+            postings = self.postings[token]
+            del postings[dish_id]
+            if not postings:
+                del self.postings[token]
+                self._drop_token(token)
+
+    def update(self, menu):
+        """Приводит индекс к меню, трогая только изменившиеся блюда. Возвращает число изменений."""
+        current = {dish['id']: dish for dish in menu}
+        changed = 0
+        with self.lock:
+            for dish_id in [i for i in self.dishes if i not in current]:
+                self.remove(dish_id)
+                changed += 1
+            for dish_id, dish in current.items():
+                old = self.dishes.get(dish_id)
+                if old is None or _signature(old) != _signature(dish):
+                    self.add(dish)
+                    changed += 1
+                else:
+                    # Цена, картинка и размеры на поиск не влияют — только обновляем выдачу
+                    self.dishes[dish_id] = dish
+        return changed
+
+    def _matches(self, term):
+        """{слово словаря: вес совпадения} для слова запроса."""
+        matches = {term: EXACT} if term in self.postings else {}
+        start = bisect.bisect_left(self.vocabulary, term)
+        for token in self.vocabulary[start:start + MAX_PREFIX_TOKENS]:
+            if not token.startswith(term):
+                break
+            if token != term:
+                # Чем больше слова уже набрано, тем выше совпадение
+                matches[token] = PREFIX * (0.5 + 0.5 * len(term) / len(token))
+        limit = max_typos(term)
+        if limit:
+            candidates = set()
+            for variant in _deletes(term, limit):
+                candidates |= self.deletes.get(variant, set())
+            for token in candidates - matches.keys():
+                distance = edit_distance(term, token, limit)
+                if distance <= limit:
+                    matches[token] = TYPO[distance]
+        return matches
+
+    def _intersect(self, scores, matches, category):
+        """Оценки блюд, где есть и прежние слова (scores; None — это первое слово), и это слово."""
+        if scores is None:
+            scores = {}
+            for token, match in matches:
+                for dish_id, weight in self.postings[token].items():
+                    if scores.get(dish_id, 0) < match * weight and (
+                            category is None or self.dishes[dish_id]['category'] == category):
+                        scores[dish_id] = match * weight
+            return scores
+        # Блюд осталось мало — проверяем их слова, а не списки блюд по каждому слову словаря
+        matched = dict(matches)
+        result = {}
+        for dish_id, score in scores.items():
+            best = max((matched[t] * w for t, w in self.terms[dish_id].items() if t in matched), default=0)
+            if best:
+                result[dish_id] = score + best
+        return result
+
+    def _top(self, scores, matches, limit, category):
+        """limit лучших блюд с учётом последнего (самого широкого) слова; matches — по убыванию веса.
+        Перебор останавливается, когда limit блюд уже набрали больше, чем может получить
+        любое блюдо на оставшихся словах словаря."""
+        base_max = max(scores.values()) if scores else 0.0
+        current = {}
+        for i, (token, match) in enumerate(matches):
+            for dish_id, weight in self.postings[token].items():
+                base = scores.get(dish_id) if scores is not None else 0.0
+                if base is None or current.get(dish_id, 0) >= base + match * weight:
+                    continue
+                if scores is None and category is not None and self.dishes[dish_id]['category'] != category:
+                    continue
+                current[dish_id] = base + match * weight
+            # Проверяем на границе групп с одинаковым весом совпадения
+            if len(current) >= limit and i + 1 < len(matches) and matches[i + 1][1] < match:
+                bound = base_max + matches[i + 1][1] * MAX_WEIGHT
+                leaders = [dish_id for dish_id, score in current.items() if score > bound]
+                if len(leaders) >= limit:
+                    # У лидеров досчитываем последнее слово по их собственным словам
+                    matched = dict(matches)
+                    current = {dish_id: (scores[dish_id] if scores is not None else 0.0) + max(
+                        matched[t] * w for t, w in self.terms[dish_id].items() if t in matched) for dish_id in leaders}
+                    break
+        return heapq.nsmallest(limit, (self.dishes[dish_id] for dish_id in current),
+                               key=lambda dish: (-current[dish['id']], len(dish['name']), dish['name']))
+
+    def search(self, query, limit=20, category=None):
+        """Блюда, в которых нашлось каждое слово запроса, по убыванию релевантности."""
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            terms = []
+            for word in dict.fromkeys(words):
+                matches = sorted(self._matches(word).items(), key=lambda m: -m[1])
+                if not matches:
+                    return []
+                terms.append((sum(len(self.postings[token]) for token, _ in matches), matches))
+            # От самого узкого слова к самому широкому: промежуточные множества блюд минимальны
+            terms.sort(key=lambda t: t[0])
+            scores = None
+            for _, matches in terms[:-1]:
+                scores = self._intersect(scores, matches, category)
+                if not scores:
+                    return []
+            found = self._top(scores, terms[-1][1], limit, category)
+        # Копии: выдачу дополняют флагами наличия (inventory.annotate_menu)
+        return [{**dish, 'sizes': [dict(s) for s in dish['sizes']] if dish['sizes'] else dish['sizes']}
+                for dish in found]
+
+
+_indexes = {}  # restaurant_id -> DishIndex
+_load_lock = threading.Lock()     # первая загрузка индекса филиала
+_refresh_lock = threading.Lock()
+_refreshing = set()               # филиалы, меню которых сейчас перечитывается в фоне
+_stale = set()                    # меню изменилось во время перечитывания — нужен ещё проход
+
+
+def _refresh(restaurant_id, index):
+    try:
+        with use_restaurant(restaurant_id):
+            menu = get_menu_for_sync()
+        if menu is not None:
+            index.update(menu)
+        # БД недоступна — ищем по старому индексу и пробуем снова через SEARCH_REFRESH
+        index.loaded_at = time.monotonic()
+    finally:
+        with _refresh_lock:
+            rerun = restaurant_id in _stale
+            _stale.discard(restaurant_id)
+            if not rerun:
+                _refreshing.discard(restaurant_id)
+        if rerun:
+            _refresh(restaurant_id, index)
+
+
+def _start_refresh(restaurant_id, index, changed=False):
+    with _refresh_lock:
+        if restaurant_id in _refreshing:
+            if changed:
+                _stale.add(restaurant_id)  # идущее чтение могло не увидеть изменение
+            return
+        _refreshing.add(restaurant_id)
+    threading.Thread(target=_refresh, args=(restaurant_id, index), name=f"search-refresh-{restaurant_id}",
+                     daemon=True).start()
+
+
+def dish_index():
+    """Индекс текущего филиала. Устаревший (старше SEARCH_REFRESH) перечитывается в фоне,
+    а запрос получает его сразу; ждать приходится только первой загрузки."""
+    restaurant_id = current_restaurant_id()
+    index = _indexes.get(restaurant_id)
+    if index is None:
+        with _load_lock:
+            index = _indexes.get(restaurant_id)
+            if index is None:
+                index = DishIndex()
+                menu = get_menu_for_sync()
+                if menu is None:
+                    return index  # пустой; следующий поиск попробует загрузить снова
+                index.update(menu)
+                index.loaded_at = time.monotonic()
+                _indexes[restaurant_id] = index
+    elif time.monotonic() - index.loaded_at >= SEARCH_REFRESH:
+        _start_refresh(restaurant_id, index)
+    return index
+
+
+def invalidate(restaurant_id=None):
+    """Перечитывает меню в фоне сейчас же (restaurant_id=None — всех филиалов)."""
+    for rid, index in list(_indexes.items()):
+        if restaurant_id is None or rid == restaurant_id:
+            index.loaded_at = float('-inf')
+            _start_refresh(rid, index, changed=True)
+
+
+def search_dishes(query, limit=20, category=None):
+    return dish_index().search(query, limit, category)
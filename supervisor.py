@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+from config import SHUTDOWN_TIMEOUT, TASK_RESTART_BACKOFF, TASK_RESTART_BACKOFF_MAX
+
+# Фоновые задачи бота и их остановка при деплое.
+# runtime.start(name, factory) запускает долгую корутину под присмотром: если она упала,
+# через паузу (TASK_RESTART_BACKOFF, удваивается до TASK_RESTART_BACKOFF_MAX) запускается снова.
+# Задачи не отменяются посреди работы: вместо asyncio.sleep они ждут через runtime.sleep(),
+# а между строками проверяют runtime.stopping и выходят в безопасной точке — отправленное
+# сообщение всегда успевает попасть во флаг notified, прогресс рассылки — в базу.
+# runtime.shutdown() (бот вызывает его, когда поллинг уже остановлен, а сессия ещё открыта)
+# просит задачи завершиться, ждёт их и обработчики апдейтов (track) до SHUTDOWN_TIMEOUT
+# и только потом отменяет оставшееся. Всё несделанное лежит в базе и подхватится новым процессом.
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """Реестр фоновых задач процесса: перезапуск после падения и согласованная остановка."""
+
+    def __init__(self, backoff=TASK_RESTART_BACKOFF, backoff_max=TASK_RESTART_BACKOFF_MAX):
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.tasks = {}        # имя -> asyncio.Task
+        self.restarts = {}     # имя -> сколько раз перезапускалась
+        self.inflight = set()  # задачи, обрабатывающие апдейты
+        self._stop = asyncio.Event()
+
+    @property
+    def stopping(self):
+        return self._stop.is_set()
+
+    def start(self, name, factory):
+        """Запускает factory() под присмотром; factory — функция, возвращающая корутину."""
+        self.restarts.setdefault(name, 0)
+        self.tasks[name] = asyncio.create_task(self._supervise(name, factory), name=name)
+
+    async def _supervise(self, name, factory):
+        failures = 0
+        while not self.stopping:
+            started = time.monotonic()
+            try:
+                await factory()
+                if self.stopping:
+                    return
+                logger.warning(f"Задача {name} завершилась сама, перезапускаем")
+            except Exception as e:
+                logger.exception(f"Задача {name} упала: {e}")
+            # Долго проработала — значит, это новое падение, а не серия подряд
+            if time.monotonic() - started > self.backoff_max:
+                failures = 0
+            delay = min(self.backoff * 2 ** failures, self.backoff_max)
+            failures += 1
+            self.restarts[name] += 1
+            if await self.sleep(delay):
+                return
+
+    async def sleep(self, seconds):
+        """Пауза, которую прерывает остановка. True — пора завершаться."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        return self.stopping
+
+    @contextmanager
+    def track(self):
+        """Текущая задача (обработка апдейта) будет дождана при остановке."""
+        task = asyncio.current_task()
+        self.inflight.add(task)
+        try:
+            yield
+        finally:
+            self.inflight.discard(task)
+
+    def status(self):
+        return {name: {'running': not task.done(), 'restarts': self.restarts[name]}
+                for name, task in self.tasks.items()}
+
+    async def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Останавливает задачи и дожидается обработчиков не дольше timeout; что не успело — отменяется.
+        Возвращает имена отменённых задач."""
+        self._stop.set()
+        current = asyncio.current_task()
+        waiting = [t for t in self.inflight | set(self.tasks.values()) if t is not current and not t.done()]
+        logger.info(f"Остановка: ждём {len(waiting)} задач и обработчиков до {timeout} с")
+        started = time.monotonic()
+        if waiting:
+            _, pending = await asyncio.wait(waiting, timeout=timeout)
+        else:
+            pending = set()
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"Не успели завершиться и отменены: {sorted(t.get_name() for t in pending)}")
+        logger.info(f"Остановка заняла {time.monotonic() - started:.1f} с")
+        return [t.get_name() for t in pending]
+
+
+runtime = Supervisor()
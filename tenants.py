@@ -0,0 +1,48 @@
+import contextvars
+from contextlib import contextmanager
+
+from config import RESTAURANTS, DEFAULT_RESTAURANT_ID
+
+# Филиал (tenant), от имени которого выполняется запрос API или апдейт бота.
+# Значение живёт в ContextVar: у каждого запроса Flask и каждой задачи asyncio оно своё,
+# asyncio.to_thread переносит его в поток. database.py по нему выбирает базу филиала
+# и ограничивает dishes, orders, promotions и promo_codes его restaurant_id.
+
+_current = contextvars.ContextVar('restaurant_id', default=DEFAULT_RESTAURANT_ID)
+
+
+def current_restaurant_id():
+    return _current.get()
+
+
+def set_current_restaurant(restaurant_id):
+    """Филиал до конца текущего запроса или задачи."""
+    _current.set(restaurant_id)
+
+
+@contextmanager
+def use_restaurant(restaurant_id):
+    token = _current.set(restaurant_id)
+    try:
+        yield restaurant_id
+    finally:
+        _current.reset(token)
+
+
+def parse_restaurant_id(value):
+    """Id филиала из заголовка, параметра или start-payload ('2' или 'r2'); None — такого филиала нет."""
+    value = str(value or '').strip().lower().removeprefix('r')
+    if not value.isdigit() or int(value) not in RESTAURANTS:
+        return None
+    return int(value)
+
+
+def get_restaurant(restaurant_id=None):
+    return RESTAURANTS[restaurant_id or current_restaurant_id()]
+
+
+def public_restaurant(restaurant_id):
+    """Данные филиала для WebApp (без настроек базы)."""
+    r = RESTAURANTS[restaurant_id]
+    return {'id': restaurant_id, 'name': r['name'], 'address': r['address'], 'currency': r['currency'],
+            'lat': r['lat'], 'lon': r['lon']}
@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+# Один набор тестов для обоих бэкендов хранения. По умолчанию — встроенная SQLite во временном
+# файле (MySQL и Telegram не нужны); TEST_DB_BACKEND=mysql гоняет те же тесты на MySQL из MYSQL_*
+# (база должна быть отдельной тестовой: перед каждым тестом все её таблицы очищаются). Геокодер — заглушка,
+# зоны доставки — встроенные по умолчанию.
+# Настройки читаются config.py при импорте, поэтому задаются до импорта модулей проекта.
+# Запуск из корня репозитория: python -m pytest
+_tmp = tempfile.mkdtemp(prefix='restaurant-tests-')
+os.environ.update({
+    'DB_BACKEND': os.getenv('TEST_DB_BACKEND', 'sqlite'),
+    'SQLITE_PATH': os.path.join(_tmp, 'test.db'),
+    'BOT_TOKEN': '123456:TEST-token',
+    'GEOCODER': 'stub',
+    'LOG_FORMAT': 'text',
+    'LOG_LEVEL': 'WARNING',
+    'RATE_LIMIT_BACKEND': 'memory',
+    # Два филиала в одной базе: основной (1) и второй — для проверок разделения по restaurant_id
+    'RESTAURANTS': '{"1": {}, "2": {"name": "Second"}}',
+    'DEFAULT_RESTAURANT_ID': '1',
+})
+os.environ.pop('DELIVERY_ZONES', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import database
+import inventory
+import search
+from config import BOT_TOKEN
+from tenants import use_restaurant
+
+KEEP_TABLES = {'schema_version', 'sqlite_sequence'}
+
+
+def _tables(cursor):
+    if database.backend.name == 'sqlite':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    else:
+        cursor.execute("SHOW TABLES")
+    return [r[0] for r in cursor.fetchall() if r[0] not in KEEP_TABLES]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    database.init_db()
+    yield
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def clean_db(schema):
+    """Каждый тест начинает с пустых таблиц в основном филиале и без кешей процесса."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    for table in _tables(cursor):
+        cursor.execute(f"DELETE FROM {table}")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    inventory.invalidate()
+    # Запросы тестового клиента Flask выставляют филиал в том же контексте — возвращаем основной
+    with use_restaurant(database.DEFAULT_RESTAURANT_ID):
+        yield
+
+
+def execute(sql, params=()):
+    """Прямой запрос к базе теста (подготовка данных в обход API модуля)."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if sql.lstrip().upper().startswith('SELECT') else None
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def new_dish(name, price, category='other', description=None, sizes=None):
+    """Добавляет блюдо и возвращает его id."""
+    assert database.add_dish(name, price, description, None, category, sizes)
+    return execute("SELECT MAX(id) FROM dishes WHERE name = %s", (name,))[0][0]
+
+
+def cart(*items):
+    """Корзина WebApp из (dish_id, qty, price[, size])."""
+    return [{'id': dish_id, 'name': f"dish {dish_id}", 'qty': qty, 'price': price, **({'size': s[0]} if s else {})}
+            for dish_id, qty, price, *s in items]
+
+
+def wait_for_refresh(timeout=5):
+    """Ждёт, пока фоновое перечитывание индекса поиска закончится."""
+    deadline = time.monotonic() + timeout
+    while search._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not search._refreshing
+
+
+def init_data(user_id, age=0, token=BOT_TOKEN):
+    """initData, подписанный так же, как его подписывает Telegram для мини-аппа."""
+    fields = {'auth_date': str(int(time.time()) - age), 'query_id': 'AAE', 'user': json.dumps({'id': user_id})}
+    data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', token.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
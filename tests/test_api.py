@@ -0,0 +1,132 @@
+import json
+
+import pytest
+
+import api
+import database
+import rate_limit
+import search
+from conftest import cart, init_data, new_dish, wait_for_refresh
+
+ADMIN_ID = 1
+
+
+@pytest.fixture
+def client():
+    database.add_user(ADMIN_ID, 'admin')
+    database.add_user(2)
+    rate_limit.limiter._buckets.clear()
+    return api.create_app(warm=False).test_client()
+
+
+def admin_headers(user_id=ADMIN_ID, **kwargs):
+    return {'X-Telegram-Init-Data': init_data(user_id, **kwargs)}
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({}, 401),
+    ({'X-Telegram-Id': str(ADMIN_ID)}, 401),                  # голый id не принимается
+    (admin_headers(), 200),
+    (admin_headers(2), 403),                                  # подпись верна, но не админ
+    (admin_headers(age=2 * 86400), 401),                      # устаревшая подпись
+    (admin_headers(token='654321:other-bot'), 401),           # подписано другим ботом
+    ({'X-Telegram-Init-Data': 'user=%7B%22id%22%3A1%7D&hash=00'}, 401),
+])
+def test_admin_endpoints_require_signed_init_data(client, headers, status):
+    assert client.get('/api/admin/stats', headers=headers).status_code == status
+
+
+def test_order_status_endpoint_requires_admin(client):
+    order_id = database.add_order(7, cart((new_dish('Пицца', 10), 1, 10)), 'addr', 0)
+    assert client.post(f"/api/order/{order_id}/status", json={'status': 'accepted'},
+                       headers={'X-Telegram-Id': str(ADMIN_ID)}).status_code == 401
+    response = client.post(f"/api/order/{order_id}/status", json={'status': 'accepted'}, headers=admin_headers())
+    assert response.get_json() == {'status': 'success'}
+
+
+def test_bulk_status_reports_skipped(client):
+    dish = new_dish('Суп', 5)
+    ids = [database.add_order(7, cart((dish, 1, 5)), 'addr', 0) for _ in range(2)]
+    database.update_order_status(ids[0], 'cooking')
+    response = client.post('/api/admin/orders/status', json={'ids': ids, 'status': 'cooking'}, headers=admin_headers())
+    assert response.get_json() == {'status': 'success', 'updated': [ids[1]], 'skipped': [ids[0]]}
+
+
+def test_admin_stats(client):
+    dish = new_dish('Чай', 2)
+    database.add_order(7, cart((dish, 3, 2)), 'addr', 0)
+    stats = client.get('/api/admin/stats?days=7', headers=admin_headers()).get_json()
+    assert (stats['orders'], stats['revenue']) == (1, 6.0)
+
+
+def test_export_streams_csv_and_jsonl(client):
+    dish = new_dish('Чай', 2)
+    ids = [database.add_order(7, cart((dish, 1, 2)), 'addr', 0) for _ in range(3)]
+    csv_lines = client.get('/api/admin/export/orders', headers=admin_headers()).get_data(as_text=True).splitlines()
+    assert csv_lines[0].startswith('id,user_id,') and len(csv_lines) == 4
+    response = client.get('/api/admin/export/orders?format=jsonl', headers=admin_headers())
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()] == ids
+    assert client.get('/api/admin/export/orders?from=yesterday', headers=admin_headers()).status_code == 400
+    assert client.get('/api/admin/export/dishes').status_code == 401
+
+
+def test_validate_promo_applies_once(client):
+    database.create_promo('once', 20, max_uses=1)
+    assert client.post('/api/validate_promo', json={'code': 'once'}).get_json() == {'status': 'success', 'discount': 20.0}
+    assert client.post('/api/validate_promo', json={'code': 'once'}).status_code == 400
+
+
+def test_validate_promo_is_rate_limited_per_ip(client, monkeypatch):
+    monkeypatch.setitem(rate_limit.limiter.limits, 'promo', (2, 60))
+    statuses = [client.post('/api/validate_promo', json={'code': 'nope'}).status_code for _ in range(3)]
+    assert statuses == [400, 400, 429]
+    response = client.post('/api/validate_promo', json={'code': 'nope'}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert response.status_code == 400
+
+
+def test_restaurant_is_taken_from_header_or_query(client):
+    new_dish('Суп', 5)
+    assert [d['name'] for d in client.get('/api/dishes').get_json()] == ['Суп']
+    assert client.get('/api/dishes', headers={'X-Restaurant-Id': '2'}).get_json() == []
+    assert client.get('/api/dishes?restaurant_id=2').get_json() == []
+    assert client.get('/api/dishes', headers={'X-Restaurant-Id': '9'}).status_code == 400
+
+
+def test_health_and_readiness(client):
+    assert client.get('/healthz').get_json()['status'] == 'ok'
+    ready = client.get('/readyz')
+    assert ready.status_code == 200 and ready.get_json()['status'] == 'ready'
+    assert ready.get_json()['schema_version'] == database.SCHEMA_VERSION
+
+
+def test_not_ready_until_warm():
+    app = api.create_app(warm=False)
+    app.extensions['readiness']['warm'] = False
+    assert app.test_client().get('/readyz').status_code == 503
+
+
+def test_admin_stock_set_and_list(client):
+    dish = new_dish('Пицца', 10)
+    response = client.post('/api/admin/stock', json={'items': [{'dish_id': dish, 'available': 0}]}, headers=admin_headers())
+    assert response.get_json() == {'status': 'success', 'updated': 1}
+    assert client.get('/api/admin/stock', headers=admin_headers()).get_json() == [
+        {'dish_id': dish, 'size': None, 'name': 'Пицца', 'available': 0}]
+    assert client.post('/api/admin/stock', json={'items': [{'available': 1}]}, headers=admin_headers()).status_code == 400
+
+
+def test_dish_search_sees_menu_changes(client):
+    search._indexes.clear()
+    new_dish('Борщ', 6, category='soups')
+    assert [d['name'] for d in client.get('/api/dishes/search?q=борш').get_json()] == ['Борщ']
+    response = client.post('/api/admin/menu/sync', json={'dishes': [{'name': 'Борщ', 'price': 6}, {'name': 'Борщ зелёный', 'price': 7}]},
+                           headers=admin_headers())
+    assert response.get_json()['inserted'] == ['Борщ зелёный']
+    wait_for_refresh()  # индекс перечитывается в фоне
+    assert [d['name'] for d in client.get('/api/dishes/search?q=борщ').get_json()] == ['Борщ', 'Борщ зелёный']
+
+
+def test_admin_bound_to_branch_cannot_manage_others(client):
+    assert database.set_admin_restaurant(ADMIN_ID, 2)
+    assert client.get('/api/admin/stats', headers=admin_headers()).status_code == 403
+    assert client.get('/api/admin/stats', headers={**admin_headers(), 'X-Restaurant-Id': '2'}).status_code == 200
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+from aiogram.exceptions import TelegramForbiddenError
+
+import broadcast
+import database
+
+
+class FakeBot:
+    """Бот для тестов: запоминает получателей, заблокировавшие бота отвечают 403."""
+
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.sent = []
+
+    async def send_message(self, user_id, text, parse_mode=None):
+        if user_id in self.blocked:
+            raise TelegramForbiddenError(method=None, message='Forbidden: bot was blocked by the user')
+        self.sent.append(user_id)
+
+
+def run(bot):
+    claimed = database.claim_broadcast()
+    bucket = broadcast.TokenBucket(1000)
+    return claimed, asyncio.run(broadcast.run_broadcast(bot, claimed, bucket))
+
+
+def test_broadcast_sends_to_everyone_and_marks_blocked(monkeypatch):
+    monkeypatch.setattr(broadcast, 'BROADCAST_BATCH_SIZE', 2)
+    monkeypatch.setattr(broadcast, 'BROADCAST_FLUSH_EVERY', 1)
+    for user_id in (1, 2, 3):
+        database.add_user(user_id)
+    broadcast_id = database.create_broadcast('Акция!', created_by=1)
+    bot = FakeBot(blocked={2})
+    claimed, ok = run(bot)
+    assert ok and claimed['id'] == broadcast_id and claimed['total'] == 3
+    assert bot.sent == [1, 3]
+    b = database.get_broadcast(broadcast_id)
+    assert (b['status'], b['sent'], b['blocked'], b['progress']) == ('done', 2, 1, 1.0)
+    # Заблокировавший бота в следующие рассылки не попадает
+    assert database.get_broadcast_recipients(0, 10) == [1, 3]
+    assert database.claim_broadcast() is None
+
+
+def test_paused_broadcast_resumes_from_saved_position(monkeypatch):
+    monkeypatch.setattr(broadcast, 'BROADCAST_FLUSH_EVERY', 1)
+    for user_id in (1, 2, 3):
+        database.add_user(user_id)
+    broadcast_id = database.create_broadcast('Акция!')
+    # Прогресс сохранён после первого получателя, затем админ поставил паузу
+    database.claim_broadcast()
+    database.save_broadcast_progress(broadcast_id, [(1, 'sent', None)], 1, 10)
+    assert database.set_broadcast_status(broadcast_id, 'pause')
+    assert database.claim_broadcast() is None
+    assert database.set_broadcast_status(broadcast_id, 'resume')
+    bot = FakeBot()
+    run(bot)
+    assert bot.sent == [2, 3]
+    assert database.get_broadcast(broadcast_id)['sent'] == 3
+
+
+def test_database_calls_run_off_the_event_loop(monkeypatch):
+    threads = []
+    for name in ('get_broadcast_recipients', 'save_broadcast_progress', 'finish_broadcast'):
+        original = getattr(broadcast, name)
+        monkeypatch.setattr(broadcast, name, lambda *args, f=original: threads.append(threading.get_ident()) or f(*args))
+    database.add_user(1)
+    database.create_broadcast('Акция!')
+    bot = FakeBot()
+    loop_threads = []
+    send_message = bot.send_message
+
+    async def send_and_note(*args, **kwargs):
+        loop_threads.append(threading.get_ident())
+        return await send_message(*args, **kwargs)
+
+    bot.send_message = send_and_note
+    _, ok = run(bot)
+    assert ok and bot.sent == [1]
+    assert len(threads) == 4 and not set(threads) & set(loop_threads)
@@ -0,0 +1,60 @@
+import pytest
+
+import courier_board
+import database
+from conftest import cart, new_dish
+
+
+@pytest.fixture(autouse=True)
+def page_size(monkeypatch):
+    monkeypatch.setattr(courier_board, 'COURIER_BOARD_PAGE_SIZE', 2)
+    courier_board.invalidate()
+    yield
+    courier_board.invalidate()
+
+
+def buttons(markup):
+    return [b.callback_data for row in markup.inline_keyboard for b in row]
+
+
+def test_next_action():
+    assert courier_board.next_action('pending', 'delivery') == 'accept'
+    assert courier_board.next_action('cooking', 'delivery') == 'deliver'
+    assert courier_board.next_action('cooking', 'restaurant') == 'complete'
+    assert courier_board.next_action('delivered', 'delivery') is None
+
+
+def test_board_pages_show_pending_and_own_orders():
+    dish = new_dish('Суп', 5)
+    ids = [database.add_order(7, cart((dish, 1, 5)), 'addr', 0) for _ in range(4)]
+    database.update_order_status(ids[0], 'accepted', courier_id=42)
+    database.update_order_status(ids[1], 'accepted', courier_id=43)  # чужой заказ
+    assert [r[0] for r in database.get_courier_board_page(42, 0, 10)] == [ids[0], ids[2], ids[3]]
+
+    text, markup, last_id = courier_board.render_page(42, 0)
+    assert last_id == ids[2]
+    assert buttons(markup) == [f"cb:act:cook:{ids[0]}", f"cb:act:accept:{ids[2]}", 'cb:refresh', 'cb:next']
+    text, markup, last_id = courier_board.render_page(42, last_id, 2)
+    assert text.startswith('📋 Заказы — стр. 2') and last_id == ids[3]
+    assert buttons(markup) == [f"cb:act:accept:{ids[3]}", 'cb:prev', 'cb:refresh']
+
+
+def test_pages_are_cached_until_invalidated():
+    dish = new_dish('Чай', 2)
+    database.add_order(7, cart((dish, 1, 2)), 'addr', 0)
+    first = courier_board.render_page(42, 0)
+    database.add_order(8, cart((dish, 1, 2)), 'addr', 0)
+    assert courier_board.render_page(42, 0) is first
+    courier_board.invalidate()
+    assert courier_board.render_page(42, 0) != first
+
+
+def test_emptied_page_falls_back_to_previous():
+    dish = new_dish('Хлеб', 1)
+    ids = [database.add_order(7, cart((dish, 1, 1)), 'addr', 0) for _ in range(3)]
+    board = courier_board.Board(42, 1)
+    board.starts = [0, ids[1]]
+    database.update_order_status(ids[2], 'delivered')
+    courier_board.invalidate()
+    text, _, _ = courier_board.render_board(42, board)
+    assert board.starts == [0] and text.startswith('📋 Заказы — стр. 1')
@@ -0,0 +1,211 @@
+import json
+from datetime import date, datetime, timedelta
+
+import database
+from conftest import cart, execute, new_dish
+
+
+def order(user_id, *items, **kwargs):
+    return database.add_order(user_id, cart(*items), 'ул. Ленина, 1', 0, **kwargs)
+
+
+def test_users_and_roles():
+    assert database.add_user(1, 'admin', 'boss')
+    assert database.add_user(2, username='anna')
+    assert database.add_user(2, 'admin')  # уже есть — роль не меняется
+    assert database.get_user_role(1) == 'admin'
+    assert database.get_user_role(username='anna') == 'user'
+    assert database.get_user_role(999) == 'user'
+    assert database.set_user_role_by_username('anna', json.dumps(['courier']))
+    assert not database.set_user_role_by_username('nobody', 'admin')
+    assert database.get_user_by_username('anna') == {'telegram_id': 2, 'role': '["courier"]'}
+    assert database.get_admin_username() == 'boss'
+    assert database.set_user_username(1, 'chief')
+    assert database.get_admin_username() == 'chief'
+
+
+def test_courier_ids_accept_json_and_plain_roles():
+    database.add_user(1, json.dumps(['courier', 'admin']))
+    database.add_user(2, 'courier')
+    database.add_user(3, json.dumps(['admin']))
+    database.add_user(4)
+    assert sorted(database.get_courier_ids()) == [1, 2]
+
+
+def test_dishes():
+    pizza = new_dish('Пицца', 10.5, 'pizza', 'с сыром', [{'name': 'L', 'price': 12}])
+    new_dish('Суп', 5, 'soups')
+    assert [d['name'] for d in database.get_dishes()] == ['Пицца', 'Суп']
+    assert database.get_dishes('pizza') == [{'id': pizza, 'name': 'Пицца', 'price': 10.5, 'description': 'с сыром',
+                                             'image_url': None, 'category': 'pizza',
+                                             'sizes': [{'name': 'L', 'price': 12}]}]
+    assert database.remove_dish(pizza)
+    assert not database.remove_dish(pizza)
+    assert [d['name'] for d in database.get_dishes()] == ['Суп']
+
+
+def test_add_order_counts_total_and_returns_id():
+    dish = new_dish('Пицца', 10)
+    order_id = order(7, (dish, 2, 10), order_type='restaurant')
+    assert order_id
+    assert execute("SELECT user_id, total, status FROM orders WHERE id = %s", (order_id,)) == [(7, 20, 'pending')]
+    assert database.get_user_id_by_order_id(order_id) == 7
+    assert database.get_order_type(order_id) == 'restaurant'
+    assert database.get_user_id_by_order_id(order_id + 1) is None
+
+
+def test_order_lines_snapshot_name_and_price():
+    pizza, soup = new_dish('Пицца', 10), new_dish('Суп', 5)
+    order_id = order(7, (pizza, 2, 10, 'L'), (soup, 1, 5))
+    # Позиции не зависят от последующих правок меню
+    execute("UPDATE dishes SET price = 99 WHERE id = %s", (pizza,))
+    assert database.get_items_for_orders([order_id]) == {order_id: [
+        {'dish_id': pizza, 'size': 'L', 'qty': 2, 'unit_price': 10.0, 'name': f"dish {pizza}"},
+        {'dish_id': soup, 'size': None, 'qty': 1, 'unit_price': 5.0, 'name': f"dish {soup}"},
+    ]}
+    # Старый формат: корзина JSON-строкой
+    legacy = database.add_order(8, json.dumps(cart((soup, 3, 5))), 'addr', 0)
+    assert [i['qty'] for i in database.get_items_for_orders([legacy])[legacy]] == [3]
+
+
+def test_broken_cart_is_rejected():
+    assert database.add_order(7, 'not json', 'addr', 0) is None
+    assert execute("SELECT COUNT(*) FROM orders") == [(0,)]
+
+
+def test_backfill_order_items_for_old_orders():
+    dish = new_dish('Чай', 2)
+    execute("INSERT INTO orders (user_id, dishes, address, total) VALUES (%s, %s, %s, %s)",
+            (7, json.dumps(cart((dish, 2, 2))), 'addr', 4))
+    execute("INSERT INTO orders (user_id, dishes, address, total) VALUES (%s, %s, %s, %s)", (8, 'broken', 'addr', 0))
+    assert database.backfill_order_items(batch_size=1) == 2
+    assert execute("SELECT dish_id, qty FROM order_items") == [(dish, 2)]
+    assert database.backfill_order_items() == 1  # заказ с битой корзиной так и остаётся без позиций
+
+
+def test_status_changes_and_new_orders():
+    dish = new_dish('Суп', 5)
+    first, second = order(7, (dish, 1, 5)), order(8, (dish, 1, 5))
+    assert database.update_order_status(first, 'on_delivery', courier_id=42)
+    assert not database.update_order_status(first + second, 'accepted')
+    assert [o[0] for o in database.get_new_orders()] == [second]
+    assert execute("SELECT status, courier_id FROM orders WHERE id = %s", (first,)) == [('on_delivery', 42)]
+
+
+def test_status_notifications_are_sent_once():
+    dish = new_dish('Чай', 2)
+    delivery, pickup = order(7, (dish, 1, 2)), order(8, (dish, 1, 2), order_type='restaurant')
+    database.update_order_status(delivery, 'accepted')
+    database.update_order_status(pickup, 'cooking')
+    assert sorted(r[0] for r in database.get_orders_to_notify()) == [delivery, pickup]
+    assert database.mark_order_notified(delivery)
+    assert [r[0] for r in database.get_orders_to_notify()] == [pickup]
+    assert [r[0] for r in database.get_pickup_orders_to_notify()] == [pickup]
+    assert database.mark_pickup_notified(pickup)
+    assert database.get_pickup_orders_to_notify() == []
+    # Напоминание повторяется, если прошлое уведомление старше суток
+    execute("UPDATE orders SET notified = %s WHERE id = %s", (datetime.now() - timedelta(days=2), delivery))
+    assert delivery in [r[0] for r in database.get_orders_to_notify()]
+
+
+def test_promo_validate_and_use():
+    assert database.create_promo('sale10', 10, max_uses=2)
+    assert not database.create_promo('SALE10', 5)  # код уникален без учёта регистра
+    assert database.validate_promo('SALE10') == {'discount': 10.0, 'valid': True}
+    assert database.use_promo('sale10')
+    assert database.use_promo('sale10')
+    assert database.validate_promo('sale10') == {'discount': 10.0, 'valid': False}
+    assert database.validate_promo('missing') == {'valid': False}
+    assert not database.use_promo('missing')
+    assert [(p['code'], p['uses']) for p in database.get_all_promocodes()] == [('SALE10', 2)]
+
+
+def test_expired_promo_is_invalid():
+    database.create_promo('old', 5, max_uses=10, expires_at=date.today() - timedelta(days=1))
+    database.create_promo('today', 5, max_uses=10, expires_at=date.today())
+    assert database.validate_promo('old')['valid'] is False
+    assert database.validate_promo('today')['valid'] is True
+
+
+def test_archive_moves_finished_old_orders():
+    dish = new_dish('Хлеб', 1)
+    done, active, recent = (order(7, (dish, 1, 1)) for _ in range(3))
+    database.update_order_status(done, 'delivered')
+    database.update_order_status(recent, 'delivered')
+    old = datetime.now() - timedelta(days=60)
+    execute("UPDATE orders SET created_at = %s WHERE id IN (%s, %s)", (old, done, active))
+    assert database.archive_orders(older_than_days=30, batch_size=1, pause=0) == 1
+    assert [r[0] for r in execute("SELECT id FROM orders ORDER BY id")] == [active, recent]
+    assert execute("SELECT id, status FROM orders_archive") == [(done, 'delivered')]
+    stats = database.get_orders_table_stats()
+    assert (stats['orders_hot_rows'], stats['orders_active_rows']) == (2, 1)  # архив у MySQL — оценка
+    # История пользователя видит и архив
+    assert [o['id'] for o in database.get_user_orders(7)] == [done, active, recent]
+
+
+def test_export_orders_filters_and_includes_archive():
+    dish = new_dish('Сок', 4)
+    archived, first, second = (order(7, (dish, 1, 4)) for _ in range(3))
+    database.update_order_status(archived, 'delivered')
+    database.update_order_status(second, 'delivered')
+    execute("UPDATE orders SET created_at = %s WHERE id = %s", (datetime.now() - timedelta(days=60), archived))
+    assert database.archive_orders(older_than_days=30, pause=0) == 1
+    columns, rows = database.export_orders()
+    assert [r[columns.index('id')] for r in rows] == [archived, first, second]
+    columns, rows = database.export_orders(status='delivered', date_from=date.today())
+    assert [r[columns.index('id')] for r in rows] == [second]
+    _, rows = database.export_orders(date_to=date.today() - timedelta(days=90))
+    assert list(rows) == []
+
+
+def test_export_dishes_and_promocodes():
+    new_dish('Салат', 7, category='salads')
+    database.create_promo('hello', 15)
+    columns, rows = database.export_dishes()
+    assert [dict(zip(columns, r))['name'] for r in rows] == ['Салат']
+    columns, rows = database.export_promocodes()
+    assert [dict(zip(columns, r))['code'] for r in rows] == ['HELLO']
+
+
+def test_bulk_status_change_returns_changed_ids():
+    dish = new_dish('Чай', 2)
+    ids = [order(7, (dish, 1, 2)) for _ in range(3)]
+    database.update_order_status(ids[0], 'cooking')
+    assert sorted(database.update_orders_status(ids, 'cooking')) == ids[1:]
+    assert database.update_orders_status([], 'cooking') == []
+    assert [r[0] for r in execute("SELECT status FROM order_events WHERE order_id = %s ORDER BY id", (ids[0],))] == \
+        ['pending', 'cooking']
+
+
+def test_admin_orders_page_and_change_feed():
+    dish = new_dish('Суп', 5)
+    ids = [order(7, (dish, 1, 5)) for _ in range(3)]
+    page = database.get_admin_orders(limit=2)
+    assert [o['id'] for o in page['orders']] == [ids[2], ids[1]] and page['next_before_id'] == ids[1]
+    assert [o['id'] for o in database.get_admin_orders(before_id=ids[1])['orders']] == [ids[0]]
+    database.update_order_status(ids[0], 'accepted')
+    changes = database.get_order_changes(page['cursor'])
+    assert [(o['id'], o['status']) for o in changes['orders']] == [(ids[0], 'accepted')]
+    assert database.get_order_changes(changes['cursor'])['orders'] == []
+
+
+def test_mark_order_paid_only_from_pending_or_failed():
+    dish = new_dish('Кофе', 3)
+    order_id = order(7, (dish, 1, 3), payment_provider='crypto', payment_id='inv_1')
+    assert database.mark_order_paid('inv_1') == 7
+    database.update_order_status(order_id, 'accepted')
+    # Повторное уведомление об оплате не откатывает заказ назад в paid
+    assert database.mark_order_paid('inv_1') is None
+    assert execute("SELECT status FROM orders WHERE id = %s", (order_id,)) == [('accepted',)]
+
+
+def test_expire_unpaid_orders():
+    dish = new_dish('Морс', 1)
+    stale = order(7, (dish, 1, 1), payment_provider='crypto', payment_id='inv_old')
+    fresh = order(7, (dish, 1, 1), payment_provider='crypto', payment_id='inv_new')
+    cash = order(7, (dish, 1, 1))
+    old = datetime.now() - timedelta(hours=2)
+    execute("UPDATE orders SET created_at = %s WHERE id IN (%s, %s)", (old, stale, cash))
+    assert database.expire_unpaid_orders(30) == [stale]
+    assert database.get_order_by_payment_id('inv_old', 7) == (stale, 'failed')
+    assert database.get_order_by_payment_id('inv_new', 7) == (fresh, 'pending')
@@ -0,0 +1,90 @@
+import random
+
+import database
+import geo
+from conftest import cart, new_dish
+from geo import CourierGrid, GeocodeCache, StubGeocoder, Zone, haversine_km, zones_for_points
+
+# Г-образная зона: вырез в правом верхнем углу проверяет чётность пересечений, а не только bbox
+L_SHAPE = Zone('l', [[0, 0], [0, 2], [1, 2], [1, 1], [2, 1], [2, 0]])
+
+
+def test_point_in_concave_polygon():
+    points = [(0.5, 0.5), (0.5, 1.5), (1.5, 0.5), (1.5, 1.5), (3, 3), (-0.1, 0.5)]
+    assert L_SHAPE.contains_many(points) == [True, True, True, False, False, False]
+
+
+def test_first_matching_zone_wins():
+    inner = Zone('center', [[0, 0], [0, 1], [1, 1], [1, 0]])
+    outer = Zone('city', [[-1, -1], [-1, 3], [3, 3], [3, -1]], base_fee=3)
+    zones = zones_for_points([(0.5, 0.5), (2, 2), (5, 5)], [inner, outer])
+    assert [z.name if z else None for z in zones] == ['center', 'city', None]
+
+
+def test_grid_nearest_matches_brute_force():
+    rng = random.Random(1)
+    couriers = {i: (52.4 + rng.uniform(-0.1, 0.1), 30.98 + rng.uniform(-0.15, 0.15)) for i in range(200)}
+    grid = CourierGrid(cell_km=0.5, origin_lat=52.4)
+    for courier_id, (lat, lon) in couriers.items():
+        grid.update(courier_id, lat, lon)
+    for _ in range(100):
+        lat, lon = 52.4 + rng.uniform(-0.2, 0.2), 30.98 + rng.uniform(-0.3, 0.3)
+        expected = min(couriers, key=lambda c: haversine_km(lat, lon, *couriers[c]))
+        assert grid.nearest(lat, lon)[0] == expected
+
+
+def test_grid_update_remove_and_max_distance():
+    grid = CourierGrid(cell_km=1, origin_lat=52.4)
+    assert grid.nearest(52.4, 30.98) is None
+    grid.update(1, 52.40, 30.98)
+    grid.update(2, 52.45, 30.98)
+    grid.update(1, 52.60, 30.98)  # курьер переехал: старая ячейка освобождается
+    assert len(grid) == 2 and grid.nearest(52.40, 30.98)[0] == 2
+    assert grid.nearest(52.40, 30.98, max_km=1) is None
+    grid.remove(2)
+    assert grid.nearest(52.40, 30.98)[0] == 1
+
+
+def test_quote_point_fee_and_eta():
+    restaurant = geo.get_restaurant()
+    grid = CourierGrid(origin_lat=restaurant['lat'])
+    # Точка в зоне city (базовая 3 + 0.5 за км), но за пределами center
+    quote = geo.quote_point(52.49, 31.05, grid)
+    assert quote['zone'] == 'city'
+    assert quote['fee'] == round(3 + 0.5 * quote['distance_km'], 2)
+    assert quote['courier_id'] is None
+    assert geo.quote_point(60.0, 30.0, grid) is None
+    grid.update(5, restaurant['lat'], restaurant['lon'])
+    assert geo.quote_point(52.49, 31.05, grid)['courier_id'] == 5
+
+
+def test_free_couriers_come_from_db():
+    dish = new_dish('Пицца', 10)
+    for courier_id in (1, 2):
+        database.add_user(courier_id, 'courier')
+        database.save_courier_location(courier_id, 52.44, 30.98)
+    order_id = database.add_order(7, cart((dish, 1, 10)), 'addr', 0)
+    database.update_order_status(order_id, 'on_delivery', courier_id=2)
+    geo._grids.clear()
+    assert list(geo.courier_grid().positions) == [1]
+
+
+def test_geocode_cache_memory_then_db():
+    geocoder = StubGeocoder({'ул. Советская, 1': (52.44, 30.98)})
+    cache = GeocodeCache(geocoder)
+    # Сокращения, регистр и пунктуация не влияют на ключ кеша
+    assert cache.lookup('улица Советская 1') == (52.44, 30.98)
+    assert cache.lookup_many(['ул. Советская, 1', 'ул.  советская 1']) == {
+        'ул. Советская, 1': (52.44, 30.98), 'ул.  советская 1': (52.44, 30.98)}
+    calls = geocoder.calls
+    # Другой процесс (новый кеш в памяти) берёт адрес из geocode_cache, а не у геокодера
+    other = GeocodeCache(geocoder)
+    assert other.lookup('ул. Советская, 1') == (52.44, 30.98)
+    assert geocoder.calls == calls and other.stats['db'] == 1
+
+
+def test_delivery_quote_results():
+    cache = GeocodeCache(StubGeocoder({'центр': (52.44, 30.98), 'москва': (55.75, 37.61)}))
+    assert geo.delivery_quote('центр', cache)['result'] == 'ok'
+    assert geo.delivery_quote('москва', cache)['result'] == 'outside'
+    assert geo.delivery_quote('нигде', cache) == {'result': 'not_found'}
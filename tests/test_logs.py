@@ -0,0 +1,75 @@
+import json
+import logging
+import queue
+
+import logs
+from logs import REDACTED, JsonFormatter, NonBlockingQueueHandler, log_event, redact, redact_text
+
+VISA = '4111 1111 1111 1111'  # проходит проверку Луна
+
+
+def test_card_numbers_masked_only_when_luhn_valid():
+    assert redact_text(f"оплата картой {VISA}") == f"оплата картой {REDACTED}1111"
+    assert redact_text('4111-1111-1111-1111') == f"{REDACTED}1111"
+    # Похоже на карту, но не проходит Луна (телефон, номер заказа) — не трогаем
+    assert redact_text('заказ 4111 1111 1111 1112') == 'заказ 4111 1111 1111 1112'
+    assert redact_text('+375 29 123 45 67') == '+375 29 123 45 67'
+    assert redact_text('без цифр') == 'без цифр'
+
+
+def test_luhn():
+    assert logs._luhn_ok('79927398713')
+    assert not logs._luhn_ok('79927398710')
+
+
+def test_redact_payment_fields_recursively():
+    value = {'order_id': 5, 'Payment_URL': 'https://pay/x', 'items': [{'card': '1'}, f"card {VISA}"], 'total': 9.5}
+    assert redact(value) == {'order_id': 5, 'Payment_URL': REDACTED,
+                             'items': [{'card': REDACTED}, f"card {REDACTED}1111"], 'total': 9.5}
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _logger(name):
+    logger = logging.getLogger(name)
+    logger.handlers[:] = [_Collect()]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger, logger.handlers[0].records
+
+
+def test_log_event_fields_are_redacted_by_formatter():
+    logger, records = _logger('tests.event')
+    log_event(logger, 'payment.created', payment_url='https://pay/secret', note=f"card {VISA}", order_id=3)
+    data = json.loads(JsonFormatter().format(records[0]))
+    assert (data['msg'], data['payment_url'], data['note'], data['order_id']) == (
+        'payment.created', REDACTED, f"card {REDACTED}1111", 3)
+
+
+def test_log_event_sampling():
+    logger, records = _logger('tests.sampling')
+    for _ in range(50):
+        log_event(logger, 'hot.path', sample=0)
+    assert records == []
+    log_event(logger, 'hot.path', sample=1.0)
+    log_event(logger, 'rare', level=logging.DEBUG)  # ниже уровня логгера — не собирается вовсе
+    assert [r.msg for r in records] == ['hot.path']
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    for i in range(3):
+        handler.handle(logging.makeLogRecord({'msg': 'x %s', 'args': (i,)}))
+    assert handler.dropped == 2
+    assert handler.queue.get_nowait().getMessage() == 'x 0'
+    # Число потерянных приходит со следующей записью, попавшей в очередь
+    handler.handle(logging.makeLogRecord({'msg': 'next'}))
+    assert handler.dropped == 0
+    assert handler.queue.get_nowait().dropped == 2
@@ -0,0 +1,45 @@
+import pytest
+
+import database
+from conftest import new_dish
+from menu_sync import MenuSyncError, parse_catalogue, sync_menu
+
+CSV = """name,price,category,sizes
+Пицца,12.5,pizza,S=10;L=15
+Суп,5,soups,
+"""
+
+
+def test_parse_csv_and_json():
+    rows = parse_catalogue(CSV.encode('utf-8-sig'), 'csv')
+    assert [(r['name'], r['price'], r['line']) for r in rows] == [('Пицца', 12.5, 2), ('Суп', 5.0, 3)]
+    assert rows[0]['sizes'] == [{'name': 'S', 'price': 10.0}, {'name': 'L', 'price': 15.0}]
+    assert rows[1]['sizes'] == []  # колонка есть, но пустая — размеры убрать
+    rows = parse_catalogue('{"dishes": [{"name": "Чай", "price": 2, "sizes": {"M": 2.5}}]}', 'json')
+    assert [(r['name'], r['sizes'], r['line']) for r in rows] == [('Чай', [{'name': 'M', 'price': 2.5}], 1)]
+
+
+def test_parse_reports_all_errors_at_once():
+    with pytest.raises(MenuSyncError) as e:
+        parse_catalogue('name,price\n,1\nЧай,-2\nКофе,3\nкофе,4\n', 'csv')
+    assert [err.split(':')[0] for err in e.value.errors] == ['строка 2', 'строка 3', 'строка 5']
+    with pytest.raises(MenuSyncError):
+        parse_catalogue('[]', 'xml')
+
+
+def test_sync_inserts_updates_and_deletes():
+    soup = new_dish('Суп', 4, 'soups', 'домашний')
+    tea = new_dish('Чай', 2, 'drinks')
+    old = new_dish('Старое', 1)
+    rows = parse_catalogue(CSV + 'Чай,2,drinks,\n', 'csv')
+    preview = sync_menu(rows, delete_missing=True, dry_run=True)
+    assert preview == {'inserted': ['Пицца'], 'updated': ['Суп'], 'deleted': ['Старое'], 'unchanged': 1, 'dry_run': True}
+    assert len(database.get_dishes()) == 3  # dry_run ничего не меняет
+
+    assert sync_menu(rows, delete_missing=True)['inserted'] == ['Пицца']
+    dishes = {d['name']: d for d in database.get_dishes()}
+    assert sorted(dishes) == ['Пицца', 'Суп', 'Чай']
+    # Поля, которых нет в каталоге, у существующих блюд не меняются
+    assert (dishes['Суп']['id'], dishes['Суп']['price'], dishes['Суп']['description']) == (soup, 5.0, 'домашний')
+    assert dishes['Чай']['id'] == tea and old not in [d['id'] for d in dishes.values()]
+    assert sync_menu(rows) == {'inserted': [], 'updated': [], 'deleted': [], 'unchanged': 3, 'dry_run': False}
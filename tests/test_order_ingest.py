@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+import database
+import order_ingest
+from conftest import cart, execute, new_dish
+
+
+def order_owners():
+    return dict(execute("SELECT id, user_id FROM orders"))
+
+
+def test_batch_results_follow_order_of_submission():
+    pizza, soup = new_dish('Пицца', 10), new_dish('Суп', 5)
+    database.set_dish_stock([(soup, None, 1)])
+    orders = [database.prepare_order(1, cart((pizza, 1, 10)), 'addr', 0),
+              database.prepare_order(2, cart((soup, 2, 5)), 'addr', 0),
+              database.prepare_order(3, cart((soup, 1, 5)), 'addr', 0)]
+    first, short, third = database.add_orders(orders)
+    assert isinstance(short, database.OutOfStock)
+    assert order_owners() == {first: 1, third: 3}
+    # Откатился только заказ без остатков: события и агрегаты — у двух записанных
+    assert execute("SELECT COUNT(*) FROM order_events") == [(2,)]
+    assert execute("SELECT SUM(order_count) FROM sales_daily") == [(2,)]
+
+
+def test_failed_batch_is_retried_one_by_one():
+    dish = new_dish('Чай', 2)
+    orders = [database.prepare_order(1, cart((dish, 1, 2)), 'addr', 0),
+              database.prepare_order(2, cart((dish, 1, 2)), None, 0),  # address NOT NULL — ошибка БД
+              database.prepare_order(3, cart((dish, 1, 2)), 'addr', 0)]
+    first, broken, third = database.add_orders(orders)
+    assert broken is None
+    assert order_owners() == {first: 1, third: 3}
+
+
+def test_writer_answers_each_concurrent_order():
+    dish = new_dish('Кофе', 3)
+    database.set_dish_stock([(dish, None, 5)])
+    writer = order_ingest.OrderWriter(database.DEFAULT_RESTAURANT_ID, wait=0.05)
+    writer.last_batch = 2  # как после всплеска: писатель ждёт попутные заказы
+    results = {}
+
+    def submit(user_id):
+        results[user_id] = writer.submit(database.prepare_order(user_id, cart((dish, 1, 3)), 'addr', 0)).result()
+
+    threads = [threading.Thread(target=submit, args=(user_id,)) for user_id in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.stop()
+    written = {user_id: r for user_id, r in results.items() if not isinstance(r, database.OutOfStock)}
+    assert len(written) == 5 and len(results) == 8
+    assert order_owners() == {order_id: user_id for user_id, order_id in written.items()}
+    assert writer.last_batch > 1
+
+
+def test_lone_order_is_not_delayed():
+    writer = order_ingest.OrderWriter(database.DEFAULT_RESTAURANT_ID, wait=60)
+    order_id = writer.submit(database.prepare_order(1, cart((new_dish('Сок', 4), 1, 4)), 'addr', 0)).result(timeout=5)
+    writer.stop()
+    assert order_owners() == {order_id: 1}
+
+
+def test_add_order_raises_out_of_stock():
+    dish = new_dish('Морс', 1)
+    database.set_dish_stock([(dish, None, 0)])
+    with pytest.raises(database.OutOfStock):
+        order_ingest.add_order(1, cart((dish, 1, 1)), 'addr', 0)
+    assert order_ingest.add_order(1, 'not json', 'addr', 0) is None
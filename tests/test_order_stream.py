@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import database
+import order_stream
+from conftest import cart, init_data, new_dish
+
+
+def test_hub_routes_events_by_user_and_drops_slow_clients():
+    async def scenario():
+        hub = order_stream.OrderEventHub(queue_size=2)
+        mine, other = hub.subscribe((1, 7)), hub.subscribe((1, 8))
+        for i in (1, 2, 3):
+            hub.publish(1, {'id': i, 'user_id': 7})
+        assert other.empty()
+        # Очередь переполнилась: клиент получает None и переподключится с Last-Event-ID
+        assert mine.get_nowait() is None and mine.empty()
+        hub.unsubscribe((1, 7), mine)
+        assert hub.connections() == 1
+    asyncio.run(scenario())
+
+
+async def read_events(response, count):
+    events, buffer = [], ''
+    while len(events) < count:
+        buffer += (await asyncio.wait_for(response.content.readany(), 5)).decode()
+        *blocks, buffer = buffer.split('\n\n')
+        events += [json.loads(line[6:]) for block in blocks for line in block.split('\n') if line.startswith('data: ')]
+    return events
+
+
+def test_stream_replays_missed_events_and_sends_new_ones(monkeypatch):
+    monkeypatch.setattr(order_stream, 'ORDER_STREAM_POLL_INTERVAL', 0.05)
+    dish = new_dish('Суп', 5)
+    mine = database.add_order(7, cart((dish, 1, 5)), 'addr', 0)
+    database.add_order(8, cart((dish, 1, 5)), 'addr', 0)
+    database.update_order_status(mine, 'accepted')
+
+    async def scenario():
+        async with TestClient(TestServer(order_stream.create_app())) as client:
+            response = await client.get('/api/user/7/orders/stream', params={'init_data': init_data(7)},
+                                        headers={'Last-Event-ID': '0'})
+            assert response.headers['Content-Type'] == 'text/event-stream'
+            replayed = await read_events(response, 2)
+            assert [(e['order_id'], e['status']) for e in replayed] == [(mine, 'pending'), (mine, 'accepted')]
+            await asyncio.sleep(0.1)  # фоновый цикл запомнил текущий конец order_events
+            await asyncio.to_thread(database.update_order_status, mine, 'cooking')
+            assert [e['status'] for e in await read_events(response, 1)] == ['cooking']
+            response.close()
+    asyncio.run(scenario())
+
+
+def test_stream_is_only_for_its_owner():
+    async def scenario():
+        async with TestClient(TestServer(order_stream.create_app())) as client:
+            url = '/api/user/7/orders/stream'
+            assert (await client.get(url)).status == 401
+            assert (await client.get(url, params={'init_data': init_data(7, token='1:other')})).status == 401
+            assert (await client.get(url, headers={'X-Telegram-Init-Data': init_data(8)})).status == 403
+            # Чужой сайт поток не читает: CORS-заголовок получает только WebApp
+            response = await client.get(url, headers={'X-Telegram-Init-Data': init_data(7), 'Origin': 'https://evil.example'})
+            assert response.status == 200 and 'Access-Control-Allow-Origin' not in response.headers
+            response.close()
+            response = await client.get(url, params={'init_data': init_data(7)},
+                                        headers={'Origin': order_stream.WEB_APP_ORIGIN})
+            assert response.headers['Access-Control-Allow-Origin'] == order_stream.WEB_APP_ORIGIN
+            response.close()
+    asyncio.run(scenario())
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from conftest import execute
+from middlewares import ThrottlingMiddleware
+from rate_limit import RateLimiter
+
+
+def test_local_bucket_allows_burst_then_rejects():
+    limiter = RateLimiter({'s': (2, 60)}, shared=False)
+    assert [limiter.hit('s', 'a') for _ in range(2)] == [0, 0]
+    assert 29 < limiter.hit('s', 'a') <= 30
+    assert limiter.hit('s', 'b') == 0  # у другого ключа свой бакет
+
+
+def test_idle_keys_are_evicted():
+    limiter = RateLimiter({'s': (1, 60)}, shared=False, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        limiter.hit('s', key)
+    assert limiter.hit('s', 'a') == 0  # бакет 'a' вытеснен и создан заново
+
+
+def test_shared_counter_limits_across_instances():
+    first, second = (RateLimiter({'s': (2, 3600)}, shared=True) for _ in range(2))
+    assert first.hit('s', 'a') == 0
+    assert second.hit('s', 'a') == 0
+    assert first.hit('s', 'a') > 0  # локально разрешено, но общий счётчик уже исчерпан
+    assert execute("SELECT bucket_key, hits FROM rate_limit_counters") == [('s:a', 3)]
+
+
+def test_bot_middleware_checks_shared_counter_off_the_loop():
+    limiter = RateLimiter({'s': (1, 3600)}, shared=True)
+    threads = []
+    hit_shared = limiter.hit_shared
+    limiter.hit_shared = lambda scope, key: threads.append(threading.get_ident()) or hit_shared(scope, key)
+    middleware = ThrottlingMiddleware('s', limiter)
+    event = SimpleNamespace(from_user=SimpleNamespace(id=7))
+
+    async def handler(event, data):
+        return 'handled'
+
+    async def run():
+        return [await middleware(handler, event, {}) for _ in range(2)], threading.get_ident()
+
+    results, loop_thread = asyncio.run(run())
+    assert results == ['handled', None]
+    # Второй апдейт отбит локальным бакетом — до общего счётчика не дошёл
+    assert len(threads) == 1 and threads[0] != loop_thread
@@ -0,0 +1,100 @@
+import pytest
+
+import database
+from conftest import cart, execute, new_dish
+
+
+class FakeReplica:
+    """Реплика для тестов: та же база, но считает свои соединения и отдаёт заданное отставание."""
+
+    def __init__(self, lag=0):
+        self.lag = lag
+        self.reads = 0
+
+    def connect(self):
+        self.reads += 1
+        return database.backend.connect()
+
+    def replica_lag(self, conn):
+        self.reads -= 1  # проверка отставания — не чтение данных
+        if self.lag is None:
+            raise database.Error('replica is down')
+        return self.lag
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    fake = FakeReplica()
+    monkeypatch.setattr(database, 'replica_backend', fake)
+    monkeypatch.setattr(database, 'REPLICA_LAG_CHECK_INTERVAL', 0)
+    monkeypatch.setitem(database._replica_state, 'checked_at', 0.0)
+    monkeypatch.setitem(database._replica_state, 'healthy', False)
+    monkeypatch.setitem(database._replica_state, 'lag', None)
+    monkeypatch.setattr(database, '_recent_writes', {})
+    monkeypatch.setattr(database, '_shared_checked', {})
+    return fake
+
+
+def read(key=None):
+    database.get_read_connection(key).close()
+
+
+def test_reads_go_to_fresh_replica(replica):
+    read()
+    read(7)
+    assert replica.reads == 2
+    assert database.get_replica_status() == {'configured': True, 'healthy': True, 'lag': 0}
+
+
+def test_lagging_or_failed_replica_falls_back_to_primary(replica):
+    replica.lag = database.REPLICA_MAX_LAG_SECONDS + 1
+    read()
+    replica.lag = None
+    read()
+    assert replica.reads == 0
+    assert database.get_replica_status()['healthy'] is False
+
+
+def test_read_your_writes(replica, monkeypatch):
+    database.mark_write(7)
+    read(7)
+    read(8)
+    assert replica.reads == 1
+    # Через REPLICA_STICKY_SECONDS ключ снова читается с реплики
+    monkeypatch.setattr(database, 'REPLICA_STICKY_SECONDS', 0)
+    read(7)
+    assert replica.reads == 2
+
+
+def test_without_replica_everything_reads_primary():
+    assert database.replica_backend is None
+    database.mark_write(7)
+    assert database._recent_writes == {}
+    read(7)
+
+
+def test_order_made_by_another_process_is_sticky(replica):
+    database.add_order(7, cart((new_dish('Чай', 2), 1, 2)), 'addr', 0)
+    assert [r[0] for r in execute("SELECT write_key FROM recent_writes")] == ['1:7']
+    database._recent_writes.clear()  # отметки в памяти нет: заказ создал другой процесс
+    read(7)
+    read(8)
+    assert replica.reads == 1
+
+
+def test_shared_markers_are_checked_rarely(replica, monkeypatch):
+    checks = []
+    monkeypatch.setattr(database, '_shared_write_age', lambda key: checks.append(key))
+    database.mark_write('menu')  # отметки меню, промокодов и т. п. — только в памяти процесса
+    assert execute("SELECT COUNT(*) FROM recent_writes") == [(0,)]
+    database._recent_writes.clear()
+    read('menu')
+    read(8)
+    read(8)
+    assert checks == [8] and replica.reads == 3
+
+
+def test_primary_error_does_not_force_primary_read(replica, monkeypatch):
+    monkeypatch.setattr(database, 'get_main_connection', lambda: None)
+    read(7)
+    assert replica.reads == 1
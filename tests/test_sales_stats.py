@@ -0,0 +1,71 @@
+import database
+from conftest import cart, execute, new_dish
+
+
+def rollups():
+    """Ненулевые строки агрегатов (после вычитаний остаются строки с нулями — они не в счёт)."""
+    return {
+        'daily': sorted(r[:4] + (round(float(r[4]), 2),) for r in execute(
+            "SELECT sales_date, order_type, status, order_count, revenue FROM sales_daily WHERE order_count <> 0")),
+        'hourly': sorted(r[:4] + (round(float(r[4]), 2),) for r in execute(
+            "SELECT sales_hour, order_type, status, order_count, revenue FROM sales_hourly WHERE order_count <> 0")),
+        'dishes': sorted(r[:2] + (round(float(r[2]), 2),) for r in execute(
+            "SELECT dish_id, qty, revenue FROM dish_sales_daily WHERE qty <> 0")),
+        'promo': sorted(execute("SELECT code, uses FROM promo_redemptions_daily WHERE uses <> 0")),
+    }
+
+
+def test_status_changes_move_order_between_rollups():
+    dish = new_dish('Пицца', 10)
+    order_id = database.add_order(7, cart((dish, 2, 10)), 'addr', 0)
+    assert [r[2:] for r in rollups()['daily']] == [('pending', 1, 20.0)]
+    database.update_order_status(order_id, 'accepted')
+    assert [r[2:] for r in rollups()['daily']] == [('accepted', 1, 20.0)]
+    assert [r[2:] for r in rollups()['hourly']] == [('accepted', 1, 20.0)]
+
+
+def test_mark_order_paid_moves_order_once():
+    dish = new_dish('Кофе', 3)
+    database.add_order(7, cart((dish, 1, 3)), 'addr', 0, payment_provider='crypto', payment_id='inv_1')
+    assert database.mark_order_paid('inv_1') == 7
+    assert database.mark_order_paid('inv_1') is None  # повторное уведомление ничего не меняет
+    assert database.mark_order_paid('missing') is None
+    assert [r[2:] for r in rollups()['daily']] == [('paid', 1, 3.0)]
+
+
+def test_failed_order_leaves_dish_sales_and_comes_back():
+    dish = new_dish('Суп', 5)
+    order_id = database.add_order(7, cart((dish, 3, 5)), 'addr', 0)
+    assert rollups()['dishes'] == [(dish, 3, 15.0)]
+    database.update_order_status(order_id, 'failed')
+    assert rollups()['dishes'] == []
+    database.update_order_status(order_id, 'accepted')
+    assert rollups()['dishes'] == [(dish, 3, 15.0)]
+
+
+def test_incremental_rollups_match_rebuild():
+    pizza, soup = new_dish('Пицца', 10), new_dish('Суп', 5)
+    ids = [database.add_order(7, cart((pizza, 1, 10), (soup, 2, 5)), 'addr', 0),
+           database.add_order(8, cart((soup, 1, 5)), 'addr', 0, order_type='pickup'),
+           database.add_order(9, cart((pizza, 3, 10)), 'addr', 0)]
+    database.update_order_status(ids[0], 'cooking')
+    database.update_order_status(ids[2], 'failed')
+    database.update_order_status(ids[1], 'delivered')
+    database.create_promo('sale', 10, max_uses=5)
+    database.use_promo('sale')
+    incremental = rollups()
+    assert database.rebuild_sales_rollups()
+    assert rollups() == incremental
+
+
+def test_sales_stats_exclude_failed_orders():
+    pizza = new_dish('Пицца', 10)
+    kept = database.add_order(7, cart((pizza, 2, 10)), 'addr', 0)
+    lost = database.add_order(8, cart((pizza, 1, 10)), 'addr', 0, order_type='pickup')
+    database.update_order_status(kept, 'delivered')
+    database.update_order_status(lost, 'failed')
+    stats = database.get_sales_stats(days=7, hours=24)
+    assert (stats['orders'], stats['revenue'], stats['avg_ticket']) == (1, 20.0, 20.0)
+    assert stats['by_status'] == {'delivered': 1, 'failed': 1}
+    assert stats['by_type'] == {'delivery': {'orders': 1, 'revenue': 20.0}}
+    assert [(d['dish_id'], d['qty'], d['revenue']) for d in stats['top_dishes']] == [(pizza, 2, 20.0)]
@@ -0,0 +1,119 @@
+import threading
+
+import search
+from conftest import new_dish, wait_for_refresh
+from search import DishIndex, edit_distance, tokenize
+
+
+def dish(dish_id, name, category='other', description=None):
+    return {'id': dish_id, 'name': name, 'category': category, 'description': description, 'sizes': None}
+
+
+MENU = [
+    dish(1, 'Пицца Маргарита', 'pizza', 'томаты, моцарелла, базилик'),
+    dish(2, 'Пицца Пепперони', 'pizza', 'колбаса пепперони, моцарелла'),
+    dish(3, 'Салат Цезарь', 'salads', 'курица, пармезан, соус цезарь'),
+    dish(4, 'Ёжики с курицей', 'hot', 'тефтели из курицы'),
+    dish(5, 'Чизкейк', 'desserts', 'сливочный сыр'),
+]
+
+
+def index(menu=MENU):
+    idx = DishIndex()
+    idx.update(menu)
+    return idx
+
+
+def ids(found):
+    return [d['id'] for d in found]
+
+
+def test_tokenize_ignores_case_and_yo():
+    assert tokenize('Ёжики, С КУРИЦЕЙ!') == ['ежики', 'с', 'курицей']
+
+
+def test_edit_distance_counts_transposition_as_one():
+    assert edit_distance('пицца', 'пицца', 2) == 0
+    assert edit_distance('пицца', 'ипцца', 2) == 1
+    assert edit_distance('пицца', 'пиц', 1) == 2  # больше limit — limit + 1
+
+
+def test_prefix_matching_for_every_word():
+    assert ids(index().search('пиц')) == [1, 2]
+    assert ids(index().search('пиц марг')) == [1]
+    assert ids(index().search('ежик')) == [4]
+
+
+def test_typo_tolerance_depends_on_word_length():
+    assert ids(index().search('пеперони')) == [2]     # 1 правка
+    assert ids(index().search('маргаритта')) == [1]   # 1 правка в длинном слове
+    assert index().search('сок') == []                # короткие слова без опечаток
+
+
+def test_every_word_must_match_and_name_outranks_description():
+    assert ids(index().search('пицца моцарелла')) == [1, 2]
+    assert index().search('пицца курица') == []
+    # Точное совпадение выше опечатки (курицы), совпадение в названии — выше, чем в описании
+    assert ids(index().search('курица')) == [3, 4]
+    assert ids(index([dish(1, 'Суп', 'soups', 'грибы, сметана'), dish(2, 'Грибы жареные', 'hot')]).search('грибы')) == [2, 1]
+
+
+def test_category_filter_and_limit():
+    assert ids(index().search('моцарелла', category='salads')) == []
+    assert len(index().search('пицца', limit=1)) == 1
+
+
+def test_update_reindexes_only_changes():
+    idx = index()
+    assert idx.update(MENU) == 0
+    changed = [dish(1, 'Пицца Четыре сыра', 'pizza')] + MENU[1:4]
+    assert idx.update(changed) == 2  # переименовано одно блюдо, удалено одно
+    assert idx.search('маргарита') == []
+    assert ids(idx.search('сыра')) == [1]
+    assert idx.search('чизкейк') == []
+    assert 'маргарита' not in idx.vocabulary
+
+
+def test_early_stop_returns_same_top_as_full_scan():
+    menu = [dish(i, f"Ролл {word}{i}", 'rolls', 'рис нори') for i, word in
+            enumerate(['лосось', 'лосо', 'лососевый', 'угорь', 'лось', 'лосс'] * 20, start=1)]
+    idx = index(menu)
+    for query in ('лос', 'ролл лосо', 'рис', 'ролл'):
+        full = idx.search(query, limit=len(menu))
+        assert idx.search(query, limit=3) == full[:3]
+
+
+def test_results_are_copies():
+    idx = index([{**dish(1, 'Пицца', 'pizza'), 'sizes': [{'name': 'L', 'price': 10}]}])
+    found = idx.search('пицца')
+    found[0]['sizes'][0]['available'] = False
+    assert 'available' not in idx.dishes[1]['sizes'][0]
+
+
+def test_search_dishes_uses_current_restaurant_menu():
+    search._indexes.clear()
+    new_dish('Борщ', 6, category='soups')
+    assert [d['name'] for d in search.search_dishes('борщ')] == ['Борщ']
+
+
+def test_change_during_background_refresh_is_not_lost(monkeypatch):
+    search._indexes.clear()
+    new_dish('Борщ', 6, category='soups')
+    assert [d['name'] for d in search.search_dishes('борщ')] == ['Борщ']
+    reading, release = threading.Event(), threading.Event()
+    get_menu = search.get_menu_for_sync
+
+    def slow_menu():
+        menu = get_menu()  # снимок до изменения меню
+        reading.set()
+        release.wait(5)
+        return menu
+
+    monkeypatch.setattr(search, 'get_menu_for_sync', slow_menu)
+    search.invalidate()
+    assert reading.wait(5)
+    new_dish('Борщ зелёный', 7, category='soups')
+    search.invalidate()  # перечитывание уже идёт и изменения не видит — нужен ещё проход
+    release.set()
+    wait_for_refresh()
+    assert [d['name'] for d in search.search_dishes('борщ')] == ['Борщ', 'Борщ зелёный']
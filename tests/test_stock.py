@@ -0,0 +1,114 @@
+import pytest
+
+import database
+import inventory
+from conftest import cart, execute, new_dish
+
+
+def stock(dish_id, size=''):
+    """(quantity, reserved) строки остатка."""
+    rows = execute("SELECT quantity, reserved FROM dish_stock WHERE dish_id = %s AND size = %s", (dish_id, size))
+    return rows[0] if rows else None
+
+
+def test_order_reserves_and_kitchen_consumes():
+    dish = new_dish('Пицца', 10)
+    database.set_dish_stock([(dish, None, 5)])
+    order_id = database.add_order(7, cart((dish, 2, 10)), 'addr', 0)
+    assert stock(dish) == (5, 2)
+    # paid — блюда всё ещё в резерве, accepted — кухня взяла, списываем
+    database.update_order_status(order_id, 'paid')
+    assert stock(dish) == (5, 2)
+    database.update_order_status(order_id, 'accepted')
+    assert stock(dish) == (3, 0)
+    assert execute("SELECT COUNT(*) FROM stock_reservations") == [(0,)]
+
+
+def test_cancel_releases_reservation():
+    dish = new_dish('Суп', 5)
+    database.set_dish_stock([(dish, None, 3)])
+    order_id = database.add_order(7, cart((dish, 3, 5)), 'addr', 0)
+    assert stock(dish) == (3, 3)
+    database.update_order_status(order_id, 'failed')
+    assert stock(dish) == (3, 0)
+
+
+def test_out_of_stock_rolls_back_whole_order():
+    pizza, soup = new_dish('Пицца', 10), new_dish('Суп', 5)
+    database.set_dish_stock([(pizza, None, 5), (soup, None, 1)])
+    with pytest.raises(database.OutOfStock) as e:
+        database.add_order(7, cart((pizza, 1, 10), (soup, 2, 5)), 'addr', 0)
+    assert e.value.items == [{'dish_id': soup, 'size': None, 'name': f"dish {soup}", 'available': 1}]
+    assert stock(pizza) == (5, 0)
+    assert database.get_user_orders(7) == []
+
+
+def test_size_without_own_row_uses_dish_stock():
+    dish = new_dish('Пицца', 10, sizes=[{'name': 'S', 'price': 8}, {'name': 'L', 'price': 12}])
+    database.set_dish_stock([(dish, None, 3), (dish, 'L', 1)])
+    database.add_order(7, cart((dish, 2, 8, 'S'), (dish, 1, 12, 'L')), 'addr', 0)
+    assert (stock(dish), stock(dish, 'L')) == ((3, 2), (1, 1))
+    with pytest.raises(database.OutOfStock):
+        database.add_order(7, cart((dish, 1, 12, 'L')), 'addr', 0)
+
+
+def test_set_stock_keeps_reserved_and_untracks():
+    dish = new_dish('Чай', 2)
+    database.set_dish_stock([(dish, None, 4)])
+    database.add_order(7, cart((dish, 1, 2)), 'addr', 0)
+    # available — сверх уже зарезервированного
+    assert database.set_dish_stock([(dish, None, 0)]) == 1
+    assert stock(dish) == (1, 1)
+    assert database.set_dish_stock([(dish, None, None)]) == 1
+    assert stock(dish) is None
+    assert execute("SELECT COUNT(*) FROM stock_reservations") == [(0,)]
+    # Без учёта остатков блюдо продаётся без ограничений
+    assert database.add_order(7, cart((dish, 100, 2)), 'addr', 0)
+
+
+def test_leaving_failed_reserves_again():
+    dish = new_dish('Кофе', 3)
+    database.set_dish_stock([(dish, None, 1)])
+    order_id = database.add_order(7, cart((dish, 1, 3)), 'addr', 0, payment_provider='crypto', payment_id='inv_1')
+    database.update_order_status(order_id, 'failed')
+    assert database.mark_order_paid('inv_1') == 7
+    assert stock(dish) == (1, 1)
+    database.update_order_status(order_id, 'accepted')
+    assert stock(dish) == (0, 0)
+
+
+def test_leaving_failed_rejected_when_sold_out():
+    dish = new_dish('Кофе', 3)
+    database.set_dish_stock([(dish, None, 1)])
+    first = database.add_order(7, cart((dish, 1, 3)), 'addr', 0)
+    database.update_order_status(first, 'failed')
+    database.add_order(8, cart((dish, 1, 3)), 'addr', 0)
+    assert not database.update_order_status(first, 'accepted')
+    assert execute("SELECT status FROM orders WHERE id = %s", (first,)) == [('failed',)]
+    assert stock(dish) == (1, 1)
+
+
+def test_reviving_consumed_order_does_not_consume_again():
+    dish = new_dish('Кофе', 3)
+    database.set_dish_stock([(dish, None, 2)])
+    order_id = database.add_order(7, cart((dish, 1, 3)), 'addr', 0)
+    database.update_order_status(order_id, 'accepted')
+    assert stock(dish) == (1, 0)
+    # Блюдо уже списано кухней: ни отмена, ни возврат заказа в работу остаток не меняют
+    database.update_order_status(order_id, 'failed')
+    assert stock(dish) == (1, 0)
+    assert database.update_order_status(order_id, 'accepted')
+    assert stock(dish) == (1, 0)
+    database.update_order_status(order_id, 'failed')
+    database.update_order_status(order_id, 'pending')
+    database.update_order_status(order_id, 'accepted')
+    assert stock(dish) == (1, 0)
+
+
+def test_inventory_flags_menu_and_cart():
+    pizza, soup = new_dish('Пицца', 10), new_dish('Суп', 5)
+    database.set_dish_stock([(pizza, None, 0)])
+    inventory.invalidate()
+    menu = inventory.annotate_menu(database.get_menu_for_sync())
+    assert {d['id']: d['available'] for d in menu} == {pizza: False, soup: True}
+    assert [i['dish_id'] for i in inventory.unavailable_items(cart((pizza, 1, 10), (soup, 1, 5)))] == [pizza]
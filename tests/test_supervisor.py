@@ -0,0 +1,49 @@
+import asyncio
+
+from supervisor import Supervisor
+
+
+def test_crashed_task_is_restarted_with_backoff():
+    async def scenario():
+        runtime = Supervisor(backoff=0.01, backoff_max=0.05)
+        runs = []
+
+        async def flaky():
+            runs.append(len(runs))
+            if len(runs) < 3:
+                raise RuntimeError('boom')
+            await runtime.sleep(60)
+
+        runtime.start('flaky', flaky)
+        await asyncio.sleep(0.2)
+        assert runtime.status() == {'flaky': {'running': True, 'restarts': 2}}
+        assert await runtime.shutdown(timeout=1) == []
+        assert runtime.status()['flaky']['running'] is False
+    asyncio.run(scenario())
+
+
+def test_shutdown_waits_for_handlers_and_cancels_stuck_tasks():
+    async def scenario():
+        runtime = Supervisor()
+        done = []
+
+        async def handler():
+            with runtime.track():
+                await asyncio.sleep(0.05)
+                done.append('handler')
+
+        async def stuck():
+            await asyncio.sleep(60)  # не смотрит на runtime.stopping
+
+        async def polite():
+            while not runtime.stopping:
+                await runtime.sleep(60)
+            done.append('polite')
+
+        asyncio.create_task(handler(), name='handler')
+        runtime.start('stuck', stuck)
+        runtime.start('polite', polite)
+        await asyncio.sleep(0)
+        assert await runtime.shutdown(timeout=0.2) == ['stuck']
+        assert sorted(done) == ['handler', 'polite']
+    asyncio.run(scenario())
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import database
+from conftest import cart, new_dish
+from middlewares import TenantMiddleware
+from tenants import current_restaurant_id, parse_restaurant_id, use_restaurant
+
+
+def test_parse_restaurant_id():
+    assert parse_restaurant_id('2') == 2
+    assert parse_restaurant_id('r2') == 2
+    assert parse_restaurant_id('R1 ') == 1
+    assert parse_restaurant_id('3') is None
+    assert parse_restaurant_id('abc') is None
+
+
+def test_menu_orders_and_promos_are_scoped_to_branch():
+    soup = new_dish('Суп', 5)
+    database.create_promo('main', 10)
+    main_order = database.add_order(7, cart((soup, 1, 5)), 'addr', 0)
+    with use_restaurant(2):
+        assert database.get_dishes() == []
+        pizza = new_dish('Пицца', 10)
+        branch_order = database.add_order(7, cart((pizza, 1, 10)), 'addr', 0)
+        assert [d['id'] for d in database.get_dishes()] == [pizza]
+        assert [o['id'] for o in database.get_user_orders(7)] == [branch_order]
+        assert database.validate_promo('main') == {'valid': False}
+    assert [d['id'] for d in database.get_dishes()] == [soup]
+    assert [o['id'] for o in database.get_user_orders(7)] == [main_order]
+    assert [o[0] for o in database.get_new_orders()] == [main_order]
+
+
+def test_order_lookups_and_events_are_scoped_to_branch():
+    dish = new_dish('Суп', 5)
+    main_order = database.add_order(7, cart((dish, 1, 5)), 'addr', 0, payment_provider='crypto', payment_id='inv_1')
+    cursor = database.get_order_events_cursor()
+    with use_restaurant(2):
+        branch_cursor = database.get_order_events_cursor()
+        assert database.get_user_id_by_order_id(main_order) is None
+        assert database.get_order_type(main_order) is None
+        assert database.mark_order_paid('inv_1') is None
+        branch_order = database.add_order(8, cart((dish, 1, 5)), 'addr', 0)
+        assert [e['order_id'] for e in database.get_order_events_since(branch_cursor)] == [branch_order]
+    database.update_order_status(main_order, 'accepted')
+    assert [e['order_id'] for e in database.get_order_events_since(cursor)] == [main_order]
+    assert [o['id'] for o in database.get_order_changes(cursor)['orders']] == [main_order]
+
+
+def test_sales_stats_are_per_branch():
+    dish = new_dish('Пицца', 10)
+    database.add_order(7, cart((dish, 2, 10)), 'addr', 0)
+    with use_restaurant(2):
+        database.add_order(8, cart((dish, 1, 10)), 'addr', 0)
+        assert database.get_sales_stats(days=1)['revenue'] == 10.0
+        assert database.rebuild_sales_rollups()
+    assert database.get_sales_stats(days=1)['revenue'] == 20.0
+
+
+def test_broadcasts_go_to_users_of_their_branch():
+    for user_id in (1, 2, 3):
+        database.add_user(user_id)
+    database.set_user_restaurant(2, 2)
+    main = database.create_broadcast('main')
+    with use_restaurant(2):
+        branch = database.create_broadcast('branch')
+        assert [b['id'] for b in database.get_broadcasts()] == [branch]
+        assert database.claim_broadcast()['id'] == branch
+        assert database.get_broadcast_recipients(0, 10) == [2]
+    assert database.claim_broadcast()['id'] == main
+    assert database.get_broadcast_recipients(0, 10) == [1, 3]
+
+
+def test_bot_middleware_remembers_branch_without_blocking_loop(monkeypatch):
+    threads = []
+    for name in ('get_user_restaurants', 'set_user_restaurant'):
+        original = getattr(database, name)
+        monkeypatch.setattr(database, name, lambda *args, f=original: threads.append(threading.get_ident()) or f(*args))
+    middleware = TenantMiddleware()
+
+    def update(user_id, text=''):
+        return SimpleNamespace(from_user=SimpleNamespace(id=user_id), text=text, web_app_data=None)
+
+    async def handler(event, data):
+        return current_restaurant_id()
+
+    async def run():
+        seen = [await middleware(handler, update(7, '/start r2'), {}),
+                await middleware(handler, update(7, 'меню'), {})]
+        # Новый процесс бота: выбор читается из базы, дальше — из памяти
+        fresh = TenantMiddleware()
+        seen += [await fresh(handler, update(7), {}), await fresh(handler, update(7), {})]
+        return seen, threading.get_ident()
+
+    seen, loop_thread = asyncio.run(run())
+    assert seen == [2, 2, 2, 2]
+    assert len(threads) == 2 and loop_thread not in threads
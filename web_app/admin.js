@@ -1,5 +1,15 @@
 const API_BASE = (location.origin.includes('http') ? location.origin : '') + '/api';
 
+// Подписанный initData мини-аппа приходит во фрагменте ссылки (#init_data=...) и нужен для /api/admin/*:
+// сервер проверяет подпись и берёт из него Telegram ID админа. Фрагмент сразу убираем из адресной строки.
+const ADMIN_INIT_DATA = new URLSearchParams(location.hash.slice(1)).get('init_data') || localStorage.getItem('admin_init_data') || '';
+if (ADMIN_INIT_DATA) localStorage.setItem('admin_init_data', ADMIN_INIT_DATA);
+if (location.hash) history.replaceState(null, '', location.pathname + location.search);
+// Филиал, которым управляет админка (?restaurant_id=...), уходит с каждым запросом
+const RESTAURANT_ID = new URLSearchParams(location.search).get('restaurant_id') || localStorage.getItem('admin_restaurant_id') || '1';
+localStorage.setItem('admin_restaurant_id', RESTAURANT_ID);
+const ADMIN_HEADERS = { 'X-Telegram-Init-Data': ADMIN_INIT_DATA, 'X-Restaurant-Id': RESTAURANT_ID };
+
 document.addEventListener('DOMContentLoaded', () => {
     const form = document.getElementById('add-dish-form');
     const result = document.getElementById('add-result');
@@ -19,7 +29,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const fd = new FormData(form);
 
         try {
-            const res = await fetch(`${API_BASE}/dishes`, { method: 'POST', body: fd });
+            const res = await fetch(`${API_BASE}/dishes`, { method: 'POST', body: fd, headers: ADMIN_HEADERS });
             const data = await res.json();
             if (data.status === 'success') {
                 result.textContent = 'Блюдо добавлено';
@@ -38,6 +48,33 @@ document.addEventListener('DOMContentLoaded', () => {
     // Обновление списка блюд
     refresh.addEventListener('click', loadDishesAdmin);
 
+    // Загрузка меню из файла: «Проверить» показывает изменения, «Загрузить» применяет их
+    const menuSyncForm = document.getElementById('menu-sync-form');
+    const menuSyncResult = document.getElementById('menu-sync-result');
+    menuSyncForm.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        const fd = new FormData(menuSyncForm);
+        if (e.submitter && e.submitter.name === 'dry_run') fd.set('dry_run', '1');
+        menuSyncResult.textContent = 'Загрузка...';
+        try {
+            const res = await fetch(`${API_BASE}/admin/menu/sync`, { method: 'POST', body: fd, headers: ADMIN_HEADERS });
+            const data = await res.json();
+            if (data.status !== 'success') {
+                menuSyncResult.innerHTML = `Ошибка: ${escapeHtml(data.error || 'неизвестная')}` +
+                    (data.errors ? '<br>' + data.errors.map(escapeHtml).join('<br>') : '');
+                return;
+            }
+            const list = (title, names) => names.length ? `<br>${title} (${names.length}): ${names.map(escapeHtml).join(', ')}` : '';
+            menuSyncResult.innerHTML = (data.dry_run ? 'Будет изменено:' : 'Меню обновлено:') +
+                list('добавить', data.inserted) + list('изменить', data.updated) + list('удалить', data.deleted) +
+                `<br>без изменений: ${data.unchanged}`;
+            if (!data.dry_run) loadDishesAdmin();
+        } catch (err) {
+            console.error(err);
+            menuSyncResult.textContent = 'Ошибка при запросе';
+        }
+    });
+
     // Добавление нового админа
     addAdminForm.addEventListener('submit', async (e) => {
         e.preventDefault();
@@ -48,7 +85,7 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const res = await fetch(`${API_BASE}/add_admin`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', ...ADMIN_HEADERS },
                 body: JSON.stringify({ username })
             });
             const data = await res.json();
@@ -83,7 +120,7 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const res = await fetch(`${API_BASE}/promocodes`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', ...ADMIN_HEADERS },
                 body: JSON.stringify({ code, discount, max_uses: maxUses, expires_at: expiresAt || null })
             });
             const data = await res.json();
@@ -104,16 +141,290 @@ document.addEventListener('DOMContentLoaded', () => {
     // Обновление списка промокодов
     refreshPromos.addEventListener('click', loadPromosAdmin);
 
+    // Активные заказы: фильтры перезагружают список, дальше подтягиваются только изменения
+    document.getElementById('orders-filter').addEventListener('change', loadOrdersAdmin);
+    document.getElementById('orders-more').addEventListener('click', () => loadOrdersAdmin(true));
+    document.getElementById('bulk-apply').addEventListener('click', applyBulkStatus);
+    setInterval(pollOrderChanges, 5000);
+
+    // Рассылки
+    const broadcastForm = document.getElementById('broadcast-form');
+    const broadcastResult = document.getElementById('broadcast-result');
+    broadcastForm.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        if (!confirm('Отправить сообщение всем пользователям бота?')) return;
+        broadcastResult.textContent = 'Загрузка...';
+        try {
+            const res = await fetch(`${API_BASE}/admin/broadcasts`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', ...ADMIN_HEADERS },
+                body: JSON.stringify({ text: broadcastForm.text.value, image_url: broadcastForm.image_url.value.trim() })
+            });
+            const data = await res.json();
+            if (data.status === 'success') {
+                broadcastResult.textContent = `Рассылка #${data.id} поставлена в очередь`;
+                broadcastForm.reset();
+                loadBroadcastsAdmin();
+            } else {
+                broadcastResult.textContent = 'Ошибка: ' + (data.error || 'неизвестная');
+            }
+        } catch (err) {
+            console.error(err);
+            broadcastResult.textContent = 'Ошибка при запросе';
+        }
+        setTimeout(() => broadcastResult.textContent = '', 2500);
+    });
+    document.getElementById('refresh-broadcasts').addEventListener('click', loadBroadcastsAdmin);
+
+    // Выгрузка CSV/JSONL (заголовок X-Telegram-Init-Data не передать обычной ссылкой, поэтому через fetch)
+    const exportForm = document.getElementById('export-form');
+    const exportResult = document.getElementById('export-result');
+    exportForm.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        const what = exportForm.what.value;
+        const params = new URLSearchParams({ format: exportForm.format.value });
+        if (what === 'orders') {
+            if (exportForm.from.value) params.set('from', exportForm.from.value);
+            if (exportForm.to.value) params.set('to', exportForm.to.value);
+            if (exportForm.status.value) params.set('status', exportForm.status.value);
+        }
+        exportResult.textContent = 'Загрузка...';
+        try {
+            const res = await fetch(`${API_BASE}/admin/export/${what}?${params}`, { headers: ADMIN_HEADERS });
+            if (!res.ok) {
+                const data = await res.json();
+                exportResult.textContent = 'Ошибка: ' + (data.error || res.status);
+                return;
+            }
+            const a = document.createElement('a');
+            a.href = URL.createObjectURL(await res.blob());
+            a.download = `${what}.${exportForm.format.value}`;
+            a.click();
+            URL.revokeObjectURL(a.href);
+            exportResult.textContent = '';
+        } catch (err) {
+            console.error(err);
+            exportResult.textContent = 'Ошибка при запросе';
+        }
+    });
+
+    // Статистика за выбранный период
+    document.getElementById('stats-days').addEventListener('change', loadStatsAdmin);
+
     loadDishesAdmin();
     loadPromosAdmin();
+    loadStatsAdmin();
+    loadBroadcastsAdmin();
+    loadOrdersAdmin();
 });
 
+// Доска заказов админа
+const ACTIVE_STATUSES = ['pending', 'paid', 'accepted', 'cooking', 'on_delivery'];
+const ordersState = { orders: new Map(), cursor: null, before: null };
+
+function orderFilters() {
+    const f = document.getElementById('orders-filter');
+    const params = new URLSearchParams();
+    ['status', 'type', 'courier', 'max_age'].forEach(name => {
+        if (f[name].value) params.set(name, f[name].value);
+    });
+    return params;
+}
+
+function orderMatchesFilters(o) {
+    const f = document.getElementById('orders-filter');
+    if (f.status.value ? o.status !== f.status.value : !ACTIVE_STATUSES.includes(o.status)) return false;
+    if (f.type.value && o.order_type !== f.type.value) return false;
+    if (f.courier.value && String(o.courier_id) !== f.courier.value) return false;
+    if (f.max_age.value && Date.now() - new Date(o.created_at).getTime() > f.max_age.value * 60000) return false;
+    return true;
+}
+
+async function loadOrdersAdmin(more = false) {
+    const params = orderFilters();
+    if (more === true && ordersState.before) params.set('before', ordersState.before);
+    try {
+        const res = await fetch(`${API_BASE}/admin/orders?${params}`, { headers: ADMIN_HEADERS });
+        const data = await res.json();
+        if (!res.ok) {
+            document.getElementById('orders-board').innerHTML = `<div class="text-red-500">Ошибка: ${escapeHtml(data.error || res.status)}</div>`;
+            return;
+        }
+        if (more !== true) {
+            ordersState.orders.clear();
+            ordersState.cursor = data.cursor;
+        }
+        data.orders.forEach(o => ordersState.orders.set(o.id, o));
+        ordersState.before = data.next_before_id;
+        renderOrdersBoard();
+    } catch (err) {
+        console.error(err);
+    }
+}
+
+async function pollOrderChanges() {
+    if (ordersState.cursor === null) return;
+    try {
+        let more = true;
+        while (more) {
+            const res = await fetch(`${API_BASE}/admin/orders/changes?since=${ordersState.cursor}`, { headers: ADMIN_HEADERS });
+            if (!res.ok) return;
+            const data = await res.json();
+            if (data.cursor === ordersState.cursor) return;
+            data.orders.forEach(o => {
+                if (orderMatchesFilters(o)) ordersState.orders.set(o.id, o);
+                else ordersState.orders.delete(o.id);
+            });
+            data.removed.forEach(id => ordersState.orders.delete(id));
+            ordersState.cursor = data.cursor;
+            more = data.more;
+        }
+        renderOrdersBoard();
+    } catch (err) {
+        console.error(err);
+    }
+}
+
+function renderOrdersBoard() {
+    const board = document.getElementById('orders-board');
+    const checked = new Set([...board.querySelectorAll('.order-check:checked')].map(c => Number(c.value)));
+    const orders = [...ordersState.orders.values()].sort((a, b) => b.id - a.id);
+    document.getElementById('orders-more').style.display = ordersState.before ? '' : 'none';
+    if (!orders.length) {
+        board.innerHTML = '<div class="text-gray-500">Активных заказов нет</div>';
+        return;
+    }
+    const rows = orders.map(o => `
+        <tr>
+            <td><input type="checkbox" class="order-check" value="${o.id}" style="width: auto" ${checked.has(o.id) ? 'checked' : ''}></td>
+            <td>#${o.id}</td>
+            <td>${escapeHtml(o.status)}</td>
+            <td>${escapeHtml(o.order_type)}</td>
+            <td>${escapeHtml(o.address)}</td>
+            <td>${o.total.toFixed(2)}</td>
+            <td>${o.courier_id || '—'}</td>
+            <td>${escapeHtml((o.created_at || '').replace('T', ' ').slice(0, 16))}</td>
+        </tr>`).join('');
+    board.innerHTML = `<table class="promo-table"><thead><tr><th></th><th>#</th><th>Статус</th><th>Тип</th><th>Адрес</th><th>Сумма</th><th>Курьер</th><th>Создан</th></tr></thead><tbody>${rows}</tbody></table>`;
+}
+
+async function applyBulkStatus() {
+    const result = document.getElementById('orders-result');
+    const ids = [...document.querySelectorAll('.order-check:checked')].map(c => Number(c.value));
+    if (!ids.length) return;
+    const status = document.getElementById('bulk-status').value;
+    try {
+        const res = await fetch(`${API_BASE}/admin/orders/status`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', ...ADMIN_HEADERS },
+            body: JSON.stringify({ ids, status })
+        });
+        const data = await res.json();
+        if (data.status === 'success') {
+            result.textContent = `Обновлено: ${data.updated.length}` + (data.skipped.length ? `, пропущено: ${data.skipped.length}` : '');
+            document.querySelectorAll('.order-check:checked').forEach(c => c.checked = false);
+            pollOrderChanges();
+        } else {
+            result.textContent = 'Ошибка: ' + (data.error || 'неизвестная');
+        }
+    } catch (err) {
+        console.error(err);
+        result.textContent = 'Ошибка при запросе';
+    }
+    setTimeout(() => result.textContent = '', 2500);
+}
+
+// Загрузка списка рассылок с прогрессом
+async function loadBroadcastsAdmin() {
+    const list = document.getElementById('broadcast-list');
+    try {
+        const res = await fetch(`${API_BASE}/admin/broadcasts`, { headers: ADMIN_HEADERS });
+        const data = await res.json();
+        if (!res.ok) {
+            list.innerHTML = `<div class="text-red-500">Ошибка: ${escapeHtml(data.error || res.status)}</div>`;
+            return;
+        }
+        if (!data.length) {
+            list.innerHTML = '<div class="text-gray-500">Рассылок нет</div>';
+            return;
+        }
+        const actions = { queued: ['pause', 'cancel'], running: ['pause', 'cancel'], paused: ['resume', 'cancel'] };
+        const labels = { pause: 'Пауза', resume: 'Продолжить', cancel: 'Отменить' };
+        list.innerHTML = '<table class="promo-table"><thead><tr><th>#</th><th>Текст</th><th>Статус</th><th>Прогресс</th><th>Заблок.</th><th>Ошибки</th><th>Скорость</th><th>Осталось</th><th></th></tr></thead><tbody></tbody></table>';
+        const tbody = list.querySelector('tbody');
+        data.forEach(b => {
+            const row = document.createElement('tr');
+            const buttons = (actions[b.status] || [])
+                .map(a => `<button class="bcast-btn bg-gray-500 text-white px-2 py-1 rounded" data-id="${b.id}" data-action="${a}">${labels[a]}</button>`).join(' ');
+            row.innerHTML = `
+                <td>${b.id}</td>
+                <td>${escapeHtml(b.text.slice(0, 40))}</td>
+                <td>${b.status}</td>
+                <td>${b.processed} / ${b.total ?? '—'} (${Math.round(b.progress * 100)}%)</td>
+                <td>${b.blocked}</td>
+                <td>${b.failed}</td>
+                <td>${b.rate ? b.rate.toFixed(1) + '/с' : '—'}</td>
+                <td>${b.eta_seconds != null ? Math.ceil(b.eta_seconds / 60) + ' мин' : '—'}</td>
+                <td>${buttons}</td>
+            `;
+            tbody.appendChild(row);
+        });
+        list.querySelectorAll('.bcast-btn').forEach(btn => {
+            btn.addEventListener('click', async () => {
+                try {
+                    await fetch(`${API_BASE}/admin/broadcasts/${btn.dataset.id}/${btn.dataset.action}`, { method: 'POST', headers: ADMIN_HEADERS });
+                } catch (err) { console.error(err); }
+                loadBroadcastsAdmin();
+            });
+        });
+    } catch (err) {
+        console.error(err);
+        list.innerHTML = '<div class="text-red-500">Ошибка загрузки</div>';
+    }
+}
+
+// Загрузка статистики продаж
+async function loadStatsAdmin() {
+    const view = document.getElementById('stats-view');
+    const days = document.getElementById('stats-days').value;
+    view.innerHTML = 'Загрузка...';
+    try {
+        const res = await fetch(`${API_BASE}/admin/stats?days=${days}`, { headers: ADMIN_HEADERS });
+        const data = await res.json();
+        if (!res.ok) {
+            view.innerHTML = `<div class="text-red-500">Ошибка: ${escapeHtml(data.error || res.status)}</div>`;
+            return;
+        }
+        const byType = Object.entries(data.by_type)
+            .map(([type, t]) => `<tr><td>${escapeHtml(type)}</td><td>${t.orders}</td><td>${t.revenue.toFixed(2)}</td></tr>`).join('');
+        const byStatus = Object.entries(data.by_status)
+            .map(([status, n]) => `<tr><td>${escapeHtml(status)}</td><td>${n}</td></tr>`).join('');
+        const dishes = data.top_dishes
+            .map(d => `<tr><td>${escapeHtml(d.name)}</td><td>${d.qty}</td><td>${d.revenue.toFixed(2)}</td></tr>`).join('');
+        const promos = data.promo_usage
+            .map(p => `<tr><td>${escapeHtml(p.code)}</td><td>${p.uses}</td></tr>`).join('');
+        const hourly = data.hourly
+            .map(h => `<tr><td>${escapeHtml(h.hour.slice(11, 16))}</td><td>${h.orders}</td><td>${h.revenue.toFixed(2)}</td></tr>`).join('');
+        view.innerHTML = `
+            <p>Заказов: <b>${data.orders}</b>, выручка: <b>${data.revenue.toFixed(2)}</b>, средний чек: <b>${data.avg_ticket.toFixed(2)}</b></p>
+            <table class="promo-table"><thead><tr><th>Тип</th><th>Заказов</th><th>Выручка</th></tr></thead><tbody>${byType}</tbody></table>
+            <table class="promo-table"><thead><tr><th>Статус</th><th>Заказов</th></tr></thead><tbody>${byStatus}</tbody></table>
+            <table class="promo-table"><thead><tr><th>Блюдо</th><th>Продано</th><th>Выручка</th></tr></thead><tbody>${dishes}</tbody></table>
+            <table class="promo-table"><thead><tr><th>Промокод</th><th>Применений</th></tr></thead><tbody>${promos}</tbody></table>
+            <table class="promo-table"><thead><tr><th>Час (24ч)</th><th>Заказов</th><th>Выручка</th></tr></thead><tbody>${hourly}</tbody></table>
+        `;
+    } catch (err) {
+        console.error(err);
+        view.innerHTML = '<div class="text-red-500">Ошибка загрузки</div>';
+    }
+}
+
 // Загрузка списка блюд
 async function loadDishesAdmin() {
     const list = document.getElementById('dish-list');
     list.innerHTML = 'Загрузка...';
     try {
-        const res = await fetch(`${API_BASE}/dishes`);
+        const res = await fetch(`${API_BASE}/dishes`, { headers: ADMIN_HEADERS });
         const data = await res.json();
         if (!data || !data.length) {
             list.innerHTML = '<div class="text-gray-500">Блюд нет</div>';
@@ -129,20 +440,51 @@ async function loadDishesAdmin() {
                     <div class="font-semibold">${escapeHtml(d.name)}</div>
                     <div class="text-sm text-gray-500">${escapeHtml(d.description || '')}</div>
                     <div class="text-xs text-gray-700 mt-2">${d.price ? d.price + ' ₽' : ''} • ${escapeHtml(d.category || '')}</div>
+                    <div class="text-xs mt-1 ${d.available === false ? 'text-red-500' : 'text-gray-500'}">
+                        ${d.stock == null ? 'Остаток не учитывается' : (d.stock > 0 ? `Осталось: ${d.stock}` : 'В стоп-листе')}
+                    </div>
                 </div>
                 <div class="flex flex-col gap-2">
+                    <div class="flex gap-1">
+                        <input type="number" min="0" class="stock-input border rounded px-2 py-1 w-20" placeholder="Остаток" value="${d.stock == null ? '' : d.stock}" />
+                        <button class="stock-btn bg-blue-500 text-white px-2 py-1 rounded" data-id="${d.id}">OK</button>
+                    </div>
+                    <button class="stock-btn bg-yellow-500 text-white px-3 py-1 rounded" data-id="${d.id}" data-available="0">Стоп</button>
+                    ${d.stock == null ? '' : `<button class="stock-btn bg-gray-400 text-white px-3 py-1 rounded" data-id="${d.id}" data-available="">Снять учёт</button>`}
                     <button class="delete-btn bg-red-500 text-white px-3 py-1 rounded" data-id="${d.id}">Удалить</button>
                 </div>
             `;
             list.appendChild(card);
         });
 
+        // Остатки: число из поля, «Стоп» — 0, «Снять учёт» — без ограничений
+        list.querySelectorAll('.stock-btn').forEach(btn => {
+            btn.addEventListener('click', async () => {
+                let available = btn.dataset.available;
+                if (available === undefined) {
+                    available = btn.closest('.flex').querySelector('.stock-input').value;
+                    if (available === '' || parseInt(available) < 0) { alert('Укажите остаток'); return; }
+                }
+                const item = { dish_id: parseInt(btn.dataset.id), available: available === '' ? null : parseInt(available) };
+                try {
+                    const r = await fetch(`${API_BASE}/admin/stock`, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json', ...ADMIN_HEADERS },
+                        body: JSON.stringify({ items: [item] })
+                    });
+                    const j = await r.json();
+                    if (j.status === 'success') loadDishesAdmin();
+                    else alert('Ошибка: ' + (j.error || 'неизвестная'));
+                } catch (err) { console.error(err); alert('Ошибка при запросе'); }
+            });
+        });
+
         // Удаление блюд
         list.querySelectorAll('.delete-btn').forEach(btn => {
             btn.addEventListener('click', async () => {
                 if (!confirm('Удалить блюдо?')) return;
                 try {
-                    const r = await fetch(`${API_BASE}/dishes/${btn.dataset.id}`, { method: 'DELETE' });
+                    const r = await fetch(`${API_BASE}/dishes/${btn.dataset.id}`, { method: 'DELETE', headers: ADMIN_HEADERS });
                     const j = await r.json();
                     if (j.status === 'success') loadDishesAdmin();
                     else alert('Ошибка удаления');
@@ -161,7 +503,7 @@ async function loadPromosAdmin() {
     const list = document.getElementById('promo-list');
     list.innerHTML = 'Загрузка...';
     try {
-        const res = await fetch(`${API_BASE}/promocodes`);
+        const res = await fetch(`${API_BASE}/promocodes`, { headers: ADMIN_HEADERS });
         const data = await res.json();
         if (!data || !data.length) {
             list.innerHTML = '<div class="text-gray-500">Промокодов нет</div>';
@@ -190,7 +532,7 @@ async function loadPromosAdmin() {
                 try {
                     const r = await fetch(`${API_BASE}/promocodes`, {
                         method: 'DELETE',
-                        headers: { 'Content-Type': 'application/json' },
+                        headers: { 'Content-Type': 'application/json', ...ADMIN_HEADERS },
                         body: JSON.stringify({ id: btn.dataset.id })
                     });
                     const j = await r.json();
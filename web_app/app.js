@@ -47,7 +47,14 @@ logToFile('isAdmin:', isAdmin);
 const API_BASE = (location.protocol === 'https:' || location.hostname === 'localhost')
     ? (location.origin + '/api')
     : '/api';
-const RESTAURANT_ADDRESS = 'ул. Советская, 1, Гомель, 246000';
+// Филиал: из ссылки бота (?restaurant_id=), start_param (r2) или прошлого визита
+const RESTAURANT_ID = new URLSearchParams(location.search).get('restaurant_id')
+    || (tg?.initDataUnsafe?.start_param || '').replace(/^r/, '')
+    || localStorage.getItem('restaurant_id') || '1';
+localStorage.setItem('restaurant_id', RESTAURANT_ID);
+const RESTAURANT_HEADERS = { 'X-Restaurant-Id': RESTAURANT_ID };
+// Данные филиала подгружаются из /api/restaurants, до ответа — значения по умолчанию
+let restaurant = { address: 'ул. Советская, 1, Гомель, 246000', currency: 'BYN', lat: 52.4414, lon: 30.9829 };
 
 let cart = JSON.parse(localStorage.getItem('cart')) || [];
 let orderType = localStorage.getItem('orderType') || 'delivery';
@@ -129,12 +136,20 @@ function updateNavigation(activeTab) {
 }
 
 // --- Загрузка блюд ---
+let currentCategory = '';
+let dishesRequest = 0; // ответ на устаревший запрос (поиск набирается быстрее, чем отвечает API) не рисуем
+
 async function loadDishes(category = '') {
+    currentCategory = category;
+    const search = $('dish-search')?.value.trim();
+    if (search) return searchDishes(search);
+    const seq = ++dishesRequest;
     try {
         const url = `${API_BASE}/dishes${category ? '?category=' + encodeURIComponent(category) : ''}`;
-        const res = await fetch(url);
+        const res = await fetch(url, { headers: RESTAURANT_HEADERS });
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
         const dishes = await res.json();
+        if (seq !== dishesRequest) return;
         renderDishes(Array.isArray(dishes) ? dishes : []);
     } catch (e) {
         console.error('loadDishes error', e);
@@ -143,6 +158,22 @@ async function loadDishes(category = '') {
     }
 }
 
+// Поиск по меню: префиксы слов и опечатки разбирает API, категория сужает выдачу
+async function searchDishes(query) {
+    const seq = ++dishesRequest;
+    try {
+        const params = new URLSearchParams({ q: query });
+        if (currentCategory) params.set('category', currentCategory);
+        const res = await fetch(`${API_BASE}/dishes/search?${params}`, { headers: RESTAURANT_HEADERS });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const dishes = await res.json();
+        if (seq !== dishesRequest) return;
+        renderDishes(Array.isArray(dishes) ? dishes : []);
+    } catch (e) {
+        console.error('searchDishes error', e);
+    }
+}
+
 function renderDishes(dishes) {
     const grid = $('dishes-grid');
     const empty = $('empty');
@@ -157,7 +188,7 @@ function renderDishes(dishes) {
 
     dishes.forEach(dish => {
         const card = document.createElement('div');
-        card.className = 'dish-card cursor-pointer';
+        card.className = 'dish-card cursor-pointer' + (dish.available === false ? ' opacity-50' : '');
         card.innerHTML = `
             <div class="dish-image">
                 <img src="${dish.image_url || '/web_app/assets/placeholder.png'}" alt="${escapeHtml(dish.name)}" class="w-full h-full object-cover">
@@ -165,7 +196,8 @@ function renderDishes(dishes) {
             <div class="p-3">
                 <h3 class="font-semibold text-sm">${escapeHtml(dish.name)}</h3>
                 <p class="text-xs text-gray-500 mt-1">${escapeHtml(dish.description || '')}</p>
-                <div class="mt-2 text-orange-500 font-bold">${dish.price ? dish.price + ' BYN' : '—'}</div>
+                <div class="mt-2 text-orange-500 font-bold">${dish.price ? dish.price + ' ' + restaurant.currency : '—'}</div>
+                ${dish.available === false ? '<div class="text-xs text-red-500 mt-1">Нет в наличии</div>' : ''}
             </div>
         `;
         addClickHandler(card, () => openDishDetails(dish));
@@ -178,8 +210,10 @@ function openDishDetails(dish) {
         <h2 class="text-xl font-bold mb-3">${escapeHtml(dish.name)}</h2>
         <img src="${dish.image_url || '/web_app/assets/placeholder.png'}" class="w-full h-48 object-cover rounded mb-3">
         <p class="text-gray-700 mb-3">${escapeHtml(dish.description || 'Описание отсутствует')}</p>
-        <div class="text-orange-600 font-bold text-lg mb-4">${dish.price ? dish.price + ' BYN' : '—'}</div>
-        <button id="add-to-cart-btn" class="w-full bg-orange-500 text-white py-2 rounded-lg font-medium">Добавить в корзину</button>
+        <div class="text-orange-600 font-bold text-lg mb-4">${dish.price ? dish.price + ' ' + restaurant.currency : '—'}</div>
+        ${dish.available === false
+            ? '<button class="w-full bg-gray-300 text-gray-600 py-2 rounded-lg font-medium" disabled>Нет в наличии</button>'
+            : '<button id="add-to-cart-btn" class="w-full bg-orange-500 text-white py-2 rounded-lg font-medium">Добавить в корзину</button>'}
     `);
     setTimeout(() => {
         const btn = $('add-to-cart-btn');
@@ -193,6 +227,14 @@ function openDishDetails(dish) {
 // --- Корзина ---
 function addToCart(dish) {
     const idx = cart.findIndex(i => i.id === dish.id);
+    if (dish.available === false) {
+        showToast(`${dish.name}: нет в наличии`);
+        return;
+    }
+    if (dish.stock != null && idx >= 0 && (cart[idx].qty || 1) >= dish.stock) {
+        showToast(`${dish.name}: осталось только ${dish.stock}`);
+        return;
+    }
     if (idx >= 0) {
         cart[idx].qty = (cart[idx].qty || 1) + 1;
     } else {
@@ -227,7 +269,7 @@ function openCart() {
             <div class="flex justify-between items-start bg-gray-50 p-3 rounded">
                 <div>
                     <div class="font-medium">${escapeHtml(item.name)}</div>
-                    <div class="text-sm text-gray-500">${item.qty} × ${item.price} BYN</div>
+                    <div class="text-sm text-gray-500">${item.qty} × ${item.price} ${restaurant.currency}</div>
                 </div>
                 <button class="text-red-500 text-sm remove-item" data-index="${idx}">Удалить</button>
             </div>
@@ -242,10 +284,10 @@ function openCart() {
         <div class="mt-3">
             <input id="promo-code" class="w-full p-2 border rounded mb-2" placeholder="Введите промокод">
             <button id="apply-promo" class="w-full bg-blue-500 text-white py-2 rounded mb-3">Применить</button>
-            ${currentDiscount > 0 ? `<p class="text-green-600 text-sm">Скидка: ${currentDiscount}% (экономия ${(subtotal * currentDiscount / 100).toFixed(2)} BYN)</p>` : ''}
+            ${currentDiscount > 0 ? `<p class="text-green-600 text-sm">Скидка: ${currentDiscount}% (экономия ${(subtotal * currentDiscount / 100).toFixed(2)} ${restaurant.currency})</p>` : ''}
         </div>
         <div class="mt-4 pt-3 border-t border-gray-200 flex justify-between items-center">
-            <div class="font-bold text-lg">Итого: <span id="cart-total">${total.toFixed(2)} BYN</span></div>
+            <div class="font-bold text-lg">Итого: <span id="cart-total">${total.toFixed(2)} ${restaurant.currency}</span></div>
             <div class="flex gap-2">
                 <button id="clear-cart" class="px-3 py-1 bg-gray-200 rounded text-sm">Очистить</button>
                 <button id="pay-btn" class="px-4 py-2 bg-green-600 text-white rounded font-medium">Оплатить</button>
@@ -289,7 +331,7 @@ function openCart() {
                     try {
                         const res = await fetch(`${API_BASE}/validate_promo`, {
                             method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
+                            headers: { 'Content-Type': 'application/json', ...RESTAURANT_HEADERS },
                             body: JSON.stringify({ code: promoCode })
                         });
                         const data = await res.json();
@@ -298,19 +340,19 @@ function openCart() {
                             currentDiscount = parseFloat(data.discount) || 0;
                             const newTotal = subtotal * (1 - currentDiscount / 100);
                             const totalElement = $('cart-total');
-                            if (totalElement) totalElement.textContent = `${newTotal.toFixed(2)} BYN`;
+                            if (totalElement) totalElement.textContent = `${newTotal.toFixed(2)} ${restaurant.currency}`;
                             showToast(`Промокод применён! Скидка ${currentDiscount}%`);
                         } else {
                             currentDiscount = 0;
                             const totalElement = $('cart-total');
-                            if (totalElement) totalElement.textContent = `${subtotal.toFixed(2)} BYN`;
+                            if (totalElement) totalElement.textContent = `${subtotal.toFixed(2)} ${restaurant.currency}`;
                             showToast(data.error || 'Неверный или истёкший промокод');
                         }
                     } catch (e) {
                         console.error('Fetch error:', e);
                         currentDiscount = 0;
                         const totalElement = $('cart-total');
-                        if (totalElement) totalElement.textContent = `${subtotal.toFixed(2)} BYN`;
+                        if (totalElement) totalElement.textContent = `${subtotal.toFixed(2)} ${restaurant.currency}`;
                         showToast('Ошибка при проверке промокода');
                     }
                 } else {
@@ -329,7 +371,7 @@ async function createPayment(amount) {
     }
 
     const order_id = Date.now().toString();
-    const delivery_addr = localStorage.getItem('delivery_addr') || RESTAURANT_ADDRESS;
+    const delivery_addr = localStorage.getItem('delivery_addr') || restaurant.address;
 
     // Формируем данные заказа в формате, ожидаемом API
     const paymentData = {
@@ -345,10 +387,11 @@ async function createPayment(amount) {
             qty: item.qty || 1,
             price: item.price || 0
         })),
-        address: orderType === 'delivery' ? delivery_addr : RESTAURANT_ADDRESS,
+        address: orderType === 'delivery' ? delivery_addr : restaurant.address,
         total: amount.toFixed(2),
         order_id: order_id,
         orderType: orderType,
+        restaurantId: RESTAURANT_ID,
         user: {
             id: user?.id,
             first_name: user?.first_name,
@@ -360,10 +403,18 @@ async function createPayment(amount) {
     try {
         const res = await fetch(`${API_BASE}/create_payment`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', ...RESTAURANT_HEADERS },
             body: JSON.stringify({ payment: paymentData, orderData: orderData })
         });
 
+        if (res.status === 409) {
+            // Пока корзина собиралась, часть блюд закончилась — меню перечитываем
+            const data = await res.json();
+            const names = (data.items || []).map(i => `${i.name || i.dish_id} (осталось ${i.available})`).join(', ');
+            showToast(`Нет в наличии: ${names}`, 4000);
+            loadDishes();
+            return;
+        }
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
         const data = await res.json();
 
@@ -398,9 +449,40 @@ async function createPayment(amount) {
 }
 
 // --- Доставка и карта ---
+const QUOTE_ERRORS = {
+    outside: 'Адрес вне зоны доставки',
+    not_found: 'Адрес не найден, уточните его'
+};
+
+// Зона, стоимость и время доставки по адресу; false — доставить нельзя
+async function quoteDelivery(addr) {
+    const box = $('delivery-quote');
+    try {
+        const res = await fetch(`${API_BASE}/delivery/quote`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', ...RESTAURANT_HEADERS },
+            body: JSON.stringify({ address: addr })
+        });
+        const data = await res.json();
+        if (data.status !== 'success') throw new Error(data.error || `HTTP ${res.status}`);
+        const quote = data.quote;
+        if (box) {
+            box.textContent = quote.result === 'ok'
+                ? `Доставка: ${quote.fee > 0 ? quote.fee.toFixed(2) + ' ' + restaurant.currency : 'бесплатно'}, ~${quote.eta_minutes} мин`
+                : (QUOTE_ERRORS[quote.result] || '');
+        }
+        return !(quote.result in QUOTE_ERRORS);
+    } catch (e) {
+        // Проверка недоступна — адрес не блокируем, сервер проверит его при оформлении
+        console.error('Delivery quote error', e);
+        if (box) box.textContent = '';
+        return true;
+    }
+}
+
 function openDelivery() {
     updateNavigation('delivery');
-    const savedAddr = localStorage.getItem('delivery_addr') || RESTAURANT_ADDRESS;
+    const savedAddr = localStorage.getItem('delivery_addr') || restaurant.address;
 
     let htmlContent = `
         <h2 class="text-xl font-bold mb-3">📍 ${orderType === 'delivery' ? 'Доставка' : 'Самовывоз'}</h2>
@@ -409,14 +491,15 @@ function openDelivery() {
     if (orderType === 'delivery') {
         htmlContent += `
             <div id="map-container"></div>
-            <p class="text-sm text-gray-600 mb-2">Адрес ресторана: <strong>${escapeHtml(RESTAURANT_ADDRESS)}</strong></p>
+            <p class="text-sm text-gray-600 mb-2">Адрес ресторана: <strong>${escapeHtml(restaurant.address)}</strong></p>
             <input id="delivery-addr" type="text" class="w-full p-3 border rounded mb-3" placeholder="Ваш адрес (для доставки)" value="${escapeHtml(savedAddr)}">
+            <p id="delivery-quote" class="text-sm text-gray-600 mb-3"></p>
             <button id="geo-btn" class="w-full bg-blue-500 text-white py-2 rounded mb-3">📍 Определить мою локацию</button>
             <button id="save-delivery" class="w-full bg-green-600 text-white py-3 rounded font-medium">Сохранить адрес</button>
         `;
     } else {
         htmlContent += `
-            <p class="text-sm text-gray-600 mb-2">Адрес ресторана: <strong>${escapeHtml(RESTAURANT_ADDRESS)}</strong></p>
+            <p class="text-sm text-gray-600 mb-2">Адрес ресторана: <strong>${escapeHtml(restaurant.address)}</strong></p>
             <p class="text-gray-700 mb-3">Среднее время готовки: ~30 минут</p>
             <p class="text-gray-500 mb-3">Пожалуйста, приезжайте после получения уведомления о готовности.</p>
             <button id="confirm-pickup" class="w-full bg-green-600 text-white py-3 rounded font-medium">Подтвердить самовывоз</button>
@@ -429,11 +512,11 @@ function openDelivery() {
         if (orderType === 'delivery' && window.ymaps) {
             ymaps.ready(() => {
                 const map = new ymaps.Map($('map-container'), {
-                    center: [52.4414, 30.9829], // Гомель
+                    center: [restaurant.lat, restaurant.lon],
                     zoom: 15
                 });
-                map.geoObjects.add(new ymaps.Placemark([52.4414, 30.9829], {
-                    balloonContent: 'La Tavola, Гомель'
+                map.geoObjects.add(new ymaps.Placemark([restaurant.lat, restaurant.lon], {
+                    balloonContent: escapeHtml(restaurant.name || 'La Tavola')
                 }));
 
                 const geoBtn = $('geo-btn');
@@ -461,6 +544,7 @@ function openDelivery() {
                                     addrInput.value = addr;
                                     localStorage.setItem('delivery_addr', addr);
                                     showToast('Локация и адрес сохранены!');
+                                    quoteDelivery(addr);
                                 }
                             }).catch(e => {
                                 console.error('Geocode error', e);
@@ -478,10 +562,20 @@ function openDelivery() {
                     });
                 }
 
+                const addrInput = $('delivery-addr');
+                if (addrInput) {
+                    addrInput.addEventListener('change', () => {
+                        const addr = addrInput.value.trim();
+                        if (addr) quoteDelivery(addr);
+                    });
+                    if (addrInput.value.trim()) quoteDelivery(addrInput.value.trim());
+                }
+
                 const saveBtn = $('save-delivery');
-                if (saveBtn) addClickHandler(saveBtn, () => {
+                if (saveBtn) addClickHandler(saveBtn, async () => {
                     const addr = $('delivery-addr')?.value.trim() || '';
                     if (!addr) return showToast('Введите адрес');
+                    if (!(await quoteDelivery(addr))) return showToast($('delivery-quote')?.textContent || 'Адрес недоступен для доставки');
                     localStorage.setItem('delivery_addr', addr);
                     tg?.sendData?.(JSON.stringify({ action: 'set_delivery_address', address: addr }));
                     showToast('Адрес сохранён');
@@ -502,7 +596,7 @@ function openDelivery() {
 async function fetchUserOrders() {
     try {
         const userId = user?.id || 0;
-        const res = await fetch(`${API_BASE}/user/${userId}/orders`);
+        const res = await fetch(`${API_BASE}/user/${userId}/orders`, { headers: RESTAURANT_HEADERS });
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
         const orders = await res.json();
         return Array.isArray(orders) ? orders : [];
@@ -512,19 +606,60 @@ async function fetchUserOrders() {
     }
 }
 
+// --- Живой статус заказов (SSE) ---
+// История грузится один раз, дальше обновляется событиями из /orders/stream
+let userOrders = null;
+const STATUS_CLASSES = {
+    delivered: 'text-green-600',
+    on_delivery: 'text-yellow-600',
+    cooking: 'text-blue-600',
+    accepted: 'text-purple-600',
+    pending: 'text-gray-600',
+    failed: 'text-gray-600'
+};
+
+async function getUserOrders() {
+    if (userOrders === null) userOrders = await fetchUserOrders();
+    return userOrders;
+}
+
+function startOrderStream() {
+    if (!user?.id || !window.EventSource) return;
+    if (!tg?.initData) return;  // поток отдаётся только по подписанному initData
+    // EventSource сам переподключается и присылает Last-Event-ID; заголовков он не шлёт — initData идёт параметром
+    const source = new EventSource(`${API_BASE}/user/${user.id}/orders/stream?restaurant_id=${RESTAURANT_ID}&init_data=${encodeURIComponent(tg.initData)}`);
+    source.addEventListener('status', (e) => {
+        const event = JSON.parse(e.data);
+        if (userOrders !== null) {
+            const order = userOrders.find(o => o.id === event.order_id);
+            if (order) {
+                order.status = event.status;
+            } else {
+                userOrders.unshift({ id: event.order_id, total: event.total, status: event.status, created_at: event.created_at, order_type: event.order_type });
+            }
+        }
+        const statusEl = $(`order-status-${event.order_id}`);
+        if (statusEl) {
+            statusEl.className = `${STATUS_CLASSES[event.status] || ''} font-medium`;
+            statusEl.textContent = `Статус: ${event.status}`;
+        }
+        if (event.status !== 'pending') showToast(`Заказ #${event.order_id}: ${event.status}`);
+    });
+}
+
 // --- Обновление статуса заказа ---
 async function updateOrderStatus(orderId, newStatus) {
     try {
         const res = await fetch(`${API_BASE}/order/${orderId}/status`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'X-Telegram-Id': user?.id },
+            headers: { 'Content-Type': 'application/json', 'X-Telegram-Init-Data': tg?.initData || '', ...RESTAURANT_HEADERS },
             body: JSON.stringify({ status: newStatus })
         });
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
         const data = await res.json();
         if (data.status === 'success') {
             showToast(`Статус заказа #${orderId} обновлён на ${newStatus}`);
-            openProfile(); // Перезагружаем профиль для отображения нового статуса
+            // Новый статус в профиле обновит событие из потока заказов
         } else {
             showToast(data.error || 'Ошибка обновления статуса');
         }
@@ -539,34 +674,16 @@ async function openProfile() {
     const savedAddr = localStorage.getItem('delivery_addr') || '';
     const name = user ? (user.first_name || user.username || 'Пользователь') : 'Гость';
 
-    const orders = await fetchUserOrders();
+    const orders = await getUserOrders();
     let ordersHtml = orders.length
         ? '<div class="space-y-2 mt-2">' +
             orders.map(order => {
-                let statusClass = '';
-                switch (order.status) {
-                    case 'delivered':
-                        statusClass = 'text-green-600';
-                        break;
-                    case 'on_delivery':
-                        statusClass = 'text-yellow-600';
-                        break;
-                    case 'cooking':
-                        statusClass = 'text-blue-600';
-                        break;
-                    case 'accepted':
-                        statusClass = 'text-purple-600';
-                        break;
-                    case 'pending':
-                    case 'failed':
-                        statusClass = 'text-gray-600';
-                        break;
-                }
+                const statusClass = STATUS_CLASSES[order.status] || '';
                 return `
                     <div class="p-2 bg-gray-50 rounded text-sm">
                         <div><strong>Заказ #${order.id}</strong></div>
-                        <div>Сумма: ${order.total} BYN</div>
-                        <div><span class="${statusClass} font-medium">Статус: ${escapeHtml(order.status || '—')}</span></div>
+                        <div>Сумма: ${order.total} ${restaurant.currency}</div>
+                        <div><span id="order-status-${order.id}" class="${statusClass} font-medium">Статус: ${escapeHtml(order.status || '—')}</span></div>
                         <div>${new Date(order.created_at).toLocaleDateString()}</div>
                         ${isAdmin ? `
                             <select id="status-select-${order.id}" class="mt-2 w-full p-1 border rounded">
@@ -624,7 +741,8 @@ async function openProfile() {
             const openAdminBtn = $('open-admin-panel-btn');
             if (openAdminBtn) {
                 addClickHandler(openAdminBtn, () => {
-                    const adminUrl = location.origin + '/web_app/admin.html';
+                    // initData во фрагменте: на сервер с адресом он не уходит, админка сама шлёт его в заголовке
+                    const adminUrl = `${location.origin}/web_app/admin.html?restaurant_id=${RESTAURANT_ID}#init_data=${encodeURIComponent(tg?.initData || '')}`;
                     if (tg?.openLink) {
                         tg.openLink(adminUrl);
                     } else {
@@ -713,6 +831,16 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
 
+    // Поиск: запрос уходит после паузы в наборе
+    const searchInput = $('dish-search');
+    if (searchInput) {
+        let searchTimer;
+        searchInput.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => loadDishes(currentCategory), 250);
+        });
+    }
+
     // Горизонтальный скролл категорий
     const catContainer = $('category-container');
     if (catContainer) {
@@ -735,12 +863,20 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Загрузка данных
+    fetch(`${API_BASE}/restaurants`)
+        .then(r => r.json())
+        .then(list => {
+            const found = Array.isArray(list) && list.find(r => String(r.id) === RESTAURANT_ID);
+            if (found) restaurant = found;
+        })
+        .catch(e => console.error('restaurants error', e));
     updateNavigation('menu');
     loadDishes();
     updateCartCount();
+    startOrderStream();
 
     // Промо
-    fetch(`${API_BASE}/promotions`)
+    fetch(`${API_BASE}/promotions`, { headers: RESTAURANT_HEADERS })
         .then(r => r.json())
         .then(promos => {
             const list = $('promotion-list');
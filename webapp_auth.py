@@ -0,0 +1,32 @@
+from config import BOT_TOKEN, WEBAPP_INIT_DATA_MAX_AGE
+from urllib.parse import parse_qsl
+import hashlib
+import hmac
+import json
+import time
+
+# Проверка initData мини-аппа Telegram (https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app).
+# Отдельный модуль без Flask: им пользуются и API, и поток заказов.
+
+
+def verify_init_data(init_data, max_age=WEBAPP_INIT_DATA_MAX_AGE):
+    """Пользователь Telegram из initData мини-аппа, если подпись (HMAC-SHA256 с ключом от токена бота)
+    верна и не старше max_age секунд; иначе None."""
+    try:
+        fields = dict(parse_qsl(init_data or '', keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+    received = fields.pop('hash', '')
+    data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', BOT_TOKEN.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        return None
+    auth_date = fields.get('auth_date', '')
+    if not auth_date.isdigit() or time.time() - int(auth_date) > max_age:
+        return None
+    try:
+        user = json.loads(fields.get('user', ''))
+    except ValueError:
+        return None
+    return user if isinstance(user, dict) and isinstance(user.get('id'), int) else None